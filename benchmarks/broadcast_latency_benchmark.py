@@ -0,0 +1,125 @@
+"""
+Measures broadcast latency against local stub providers that inject latency and failures, comparing the concurrent
+first-success broadcast with calling the providers one after the other, and reports latency percentiles.
+
+Each stub provider answers after an exponentially distributed delay with the given mean, and fails with the given
+probability. Broadcasts that fail on every provider are counted as failures rather than retried.
+
+Usage:
+    python benchmarks/broadcast_latency_benchmark.py --broadcasts 200 --provider 0.3 0 --provider 1 0.2 --provider 3 0.5
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cert_issuer import connectors
+from cert_issuer.connectors import BlockExplorerBroadcaster
+
+DEFAULT_PROVIDERS = [(0.3, 0.0), (1.0, 0.2), (3.0, 0.5)]
+
+
+class StubBroadcastHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(random.expovariate(1.0 / self.server.mean_latency))
+        failed = random.random() < self.server.failure_rate
+        body = json.dumps({'txid': 'txid'}).encode('utf-8')
+        self.send_response(500 if failed else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubBroadcastServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, mean_latency, failure_rate):
+        super().__init__(('127.0.0.1', 0), StubBroadcastHandler)
+        self.mean_latency = mean_latency
+        self.failure_rate = failure_rate
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class StubTx(object):
+    def stream(self, f):
+        f.write(b'tx')
+
+
+def broadcast_sequentially(tx, method_providers):
+    # what broadcasting did before it was concurrent: every provider is tried in turn
+    tx_id = None
+    for method_provider in method_providers:
+        try:
+            tx_id = method_provider(tx) or tx_id
+        except Exception:
+            pass
+    return tx_id
+
+
+def broadcast_concurrently(tx, method_providers):
+    return connectors.broadcast_to_all(tx, method_providers)[0]
+
+
+def measure(broadcast, method_providers, count):
+    latencies = []
+    failures = 0
+    for _ in range(0, count):
+        start = time.perf_counter()
+        tx_id = broadcast(StubTx(), method_providers)
+        if tx_id:
+            latencies.append(time.perf_counter() - start)
+        else:
+            failures += 1
+    return sorted(latencies), failures
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broadcasts', type=int, default=100)
+    parser.add_argument('--provider', nargs=2, type=float, action='append', metavar=('MEAN_LATENCY', 'FAILURE_RATE'),
+                        help='add a stub provider; defaults to {}'.format(DEFAULT_PROVIDERS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    # failing stub providers are expected; keep their errors out of the report
+    logging.disable(logging.CRITICAL)
+
+    servers = [StubBroadcastServer(mean_latency, failure_rate)
+               for mean_latency, failure_rate in args.provider or DEFAULT_PROVIDERS]
+    method_providers = [BlockExplorerBroadcaster('http://127.0.0.1:{}'.format(server.server_address[1])).broadcast_tx
+                        for server in servers]
+    try:
+        print('{:>12} {:>9} {:>9} {:>9} {:>9} {:>9}'.format('mode', 'p50', 'p90', 'p99', 'max', 'failures'))
+        for name, broadcast in [('sequential', broadcast_sequentially), ('concurrent', broadcast_concurrently)]:
+            latencies, failures = measure(broadcast, method_providers, args.broadcasts)
+            if not latencies:
+                print('{:>12} every broadcast failed'.format(name))
+                continue
+            print('{:>12} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9}'.format(
+                name, percentile(latencies, 0.5), percentile(latencies, 0.9), percentile(latencies, 0.99),
+                latencies[-1], failures))
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures certificate signatures per second with CertificateSigner, which signs each Merkle leaf as a detached ES256K
+JWS, for a batch of --certificates leaves:
+
+native     SigningKey with coincurve (libsecp256k1), per number of worker processes in --workers
+python     SigningKey with pycoin's ECDSA, on --python_certificates leaves, since it is much slower
+message    BitcoinSigner.sign_message, the signer's only message signing path, one certificate at a time, on
+           --python_certificates leaves, for comparison
+
+A sample of the signatures is verified with verify_jws.
+
+Usage:
+    python benchmarks/certificate_signature_benchmark.py --certificates 100000 --workers 1,2,4
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bitcoin import SelectParams
+from cert_schema import Chain
+from pycoin.key import Key
+from pycoin.serialize import b2h
+
+from cert_issuer.certificate_signer import CertificateSigner, SigningKey, load_native_backend, verify_jws
+from cert_issuer.signer import BitcoinSigner
+
+SECRET_EXPONENT = 0x1234567
+
+VERIFIED_SAMPLE = 100
+
+
+def create_leaf_digests(count):
+    return [hashlib.sha256(str(number).encode('utf-8')).digest() for number in range(0, count)]
+
+
+def sign_batch(key, leaf_digests, workers):
+    start = time.perf_counter()
+    signatures = CertificateSigner(workers=workers).sign_batch(key, leaf_digests)
+    return signatures, time.perf_counter() - start
+
+
+def verify_sample(signatures, leaf_digests, address):
+    step = max(1, len(leaf_digests) // VERIFIED_SAMPLE)
+    for index in range(0, len(leaf_digests), step):
+        verify_jws(signatures.get_jws(index), b2h(leaf_digests[index]), address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--certificates', type=int, default=100000, help='leaves signed per native run')
+    parser.add_argument('--python_certificates', type=int, default=1000,
+                        help='leaves signed by the python and message runs')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated numbers of worker processes')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    SelectParams('testnet')
+    address = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN').address()
+    worker_counts = [int(workers) for workers in args.workers.split(',')]
+
+    runs = [('python', SigningKey(SECRET_EXPONENT, native=False), create_leaf_digests(args.python_certificates),
+             worker_counts)]
+    if load_native_backend():
+        runs.insert(0, ('native', SigningKey(SECRET_EXPONENT, native=True), create_leaf_digests(args.certificates),
+                        worker_counts))
+    else:
+        print('coincurve is not installed; skipping native runs')
+
+    print('{:>8} {:>8} {:>12} {:>10} {:>12}'.format('backend', 'workers', 'certificates', 'seconds', 'sig/s'))
+    for name, key, leaf_digests, workers_list in runs:
+        for workers in workers_list:
+            signatures, seconds = sign_batch(key, leaf_digests, workers)
+            verify_sample(signatures, leaf_digests, address)
+            print('{:>8} {:>8} {:>12} {:>10.2f} {:>12.0f}'.format(name, workers, len(leaf_digests), seconds,
+                                                                 len(leaf_digests) / seconds))
+
+    signer = BitcoinSigner(Chain.bitcoin_testnet)
+    wif = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN').wif()
+    leaf_digests = create_leaf_digests(args.python_certificates)
+    start = time.perf_counter()
+    for digest in leaf_digests:
+        signer.sign_message(wif, b2h(digest))
+    seconds = time.perf_counter() - start
+    print('{:>8} {:>8} {:>12} {:>10.2f} {:>12.0f}'.format('message', 1, len(leaf_digests), seconds,
+                                                         len(leaf_digests) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares the coin selection algorithms over a synthetic UTXO set: the fees they pay, the cost of the change outputs
+they create, how long selection takes, and how many unspent outputs are left.
+
+Each algorithm issues the same number of transactions one after the other from its own copy of the UTXO set, whose
+values are drawn from a log-normal distribution. Spent outputs are removed and change outputs added, like the UTXO
+cache does. 'random' is the selection used before: shuffle the outputs and add them until they exceed the cost
+estimated for 3 inputs.
+
+Waste is measured like Bitcoin Core does, assuming the fee rate stays the same: the fee, less what the inputs would
+cost to spend later anyway, plus what spending the change output later will cost. Saved is the fee saved compared
+with 'random'.
+
+Usage:
+    python benchmarks/coin_selection_benchmark.py --utxos 10000 --transactions 50 --satoshi_per_byte 50
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pycoin.tx.Spendable import Spendable
+
+from cert_issuer import coin_selection
+from cert_issuer.coin_selection import Selection, create_coin_selector, get_fee, get_input_fee
+from cert_issuer.transaction_handler import ESTIMATE_NUM_INPUTS
+from cert_issuer.tx_utils import BitcoinTransactionCostConstants, COIN
+
+SCRIPT = b'\x76\xa9\x14' + b'\x01' * 20 + b'\x88\xac'
+
+
+class RandomSelector(object):
+    def select(self, spendables, tx_cost_constants):
+        # what create_transaction did before coin selection
+        cost = get_fee(tx_cost_constants, ESTIMATE_NUM_INPUTS, True)
+        shuffled = list(spendables)
+        random.shuffle(shuffled)
+        inputs = []
+        total = 0
+        for s in shuffled:
+            inputs.append(s)
+            total += s.coin_value
+            if total > cost:
+                break
+        if not inputs:
+            return None
+        # the change was sent back however small, and if there was none the transaction paid what it could
+        fee = min(get_fee(tx_cost_constants, len(inputs), True), total)
+        return Selection(inputs, fee, total - fee)
+
+
+def create_utxos(count, rng):
+    return [Spendable(int(rng.lognormvariate(12, 2)) + 1, SCRIPT, rng.getrandbits(256).to_bytes(32, 'big'), 0)
+            for _ in range(0, count)]
+
+
+def run(selector, utxos, transactions, tx_cost_constants):
+    utxos = list(utxos)
+    fees = []
+    wastes = []
+    times = []
+    num_inputs = []
+    for number in range(0, transactions):
+        start = time.perf_counter()
+        selection = selector.select(utxos, tx_cost_constants)
+        times.append(time.perf_counter() - start)
+        if selection is None:
+            break
+        spent = set(id(s) for s in selection.inputs)
+        utxos = [s for s in utxos if id(s) not in spent]
+        if selection.change:
+            utxos.append(Spendable(selection.change, SCRIPT, number.to_bytes(32, 'big'), 1))
+        fees.append(selection.fee)
+        input_fee = get_input_fee(tx_cost_constants)
+        wastes.append(selection.fee - input_fee * len(selection.inputs) + (input_fee if selection.change else 0))
+        num_inputs.append(len(selection.inputs))
+    return fees, wastes, sorted(times), num_inputs, len(utxos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--utxos', type=int, default=10000)
+    parser.add_argument('--transactions', type=int, default=50)
+    parser.add_argument('--satoshi_per_byte', type=int, default=250)
+    parser.add_argument('--tx_fee', type=float, default=0.0006, help='recommended fee floor, in BTC')
+    parser.add_argument('--max_consolidation_inputs', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    utxos = create_utxos(args.utxos, rng)
+    tx_cost_constants = BitcoinTransactionCostConstants(recommended_tx_fee=args.tx_fee,
+                                                        satoshi_per_byte=args.satoshi_per_byte)
+    print('{} UTXOs worth {:.4f} BTC, {} transactions at {} satoshi/byte with a {} BTC floor'.format(
+        len(utxos), sum(s.coin_value for s in utxos) / COIN, args.transactions, args.satoshi_per_byte, args.tx_fee))
+
+    selectors = [('random', RandomSelector())]
+    selectors.extend((name, create_coin_selector(name, args.max_consolidation_inputs))
+                     for name in sorted(coin_selection.COIN_SELECTORS))
+    print('{:>17} {:>12} {:>12} {:>12} {:>8} {:>10} {:>10} {:>7}'.format(
+        'selector', 'fees', 'waste', 'saved', 'inputs', 'p50 ms', 'max ms', 'utxos'))
+    random_fees = None
+    for name, selector in selectors:
+        random.seed(args.seed)
+        fees, wastes, times, num_inputs, utxos_left = run(selector, utxos, args.transactions, tx_cost_constants)
+        if random_fees is None:
+            random_fees = sum(fees)
+        print('{:>17} {:>12} {:>12} {:>12} {:>8.2f} {:>10.2f} {:>10.2f} {:>7}'.format(
+            name, sum(fees), sum(wastes), random_fees - sum(fees), sum(num_inputs) / max(len(num_inputs), 1),
+            times[len(times) // 2] * 1000, times[-1] * 1000, utxos_left))
+        if len(fees) < args.transactions:
+            print('{:>17} ran out of funds after {} transactions'.format('', len(fees)))
+
+
+if __name__ == '__main__':
+    main()
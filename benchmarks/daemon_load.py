@@ -0,0 +1,176 @@
+"""
+Load test for the issuance daemon: client threads POST certificates to the HTTP API and poll for their blockchain
+certificates, and the test reports throughput and time-to-proof (from POST until the blockchain certificate is served).
+
+By default the daemon runs in-process on mockchain, with certificates generated from one of the example testnet
+certificates. Use --url to load an already running daemon instead. JSON schema validation resolves remote $refs, so use
+--skip_schema_validation on machines without network access when running in-process.
+
+Usage:
+    python benchmarks/daemon_load.py --certificates 5000 --concurrency 16 --batch_size 500 \
+        --batch_window_seconds 1 --workers 4 --skip_schema_validation
+"""
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cert_schema import Chain
+
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateV2Handler
+from cert_issuer.daemon import DaemonHTTPServer, IssuanceDaemon
+from cert_issuer.document_loader import CachingDocumentLoader
+from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+from cert_issuer.transaction_handler import MockTransactionHandler
+
+EXAMPLE_CERTIFICATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples',
+                                   'data-testnet', 'unsigned_certificates',
+                                   '3bc1a96a-3501-46ed-8f75-49612bbac257.json')
+POLL_SECONDS = 0.05
+
+
+class NoKeySecretManager(object):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class UnvalidatedCertificateHandler(CertificateV2Handler):
+    """
+    Skips JSON schema validation, which resolves remote $refs. A class rather than a patch of the module, since worker
+    processes import the module afresh
+    """
+
+    def _validate_schema(self, certificate_json):
+        pass
+
+
+def start_daemon(base_dir, args):
+    handler_class = UnvalidatedCertificateHandler if args.skip_schema_validation else CertificateV2Handler
+    app_config = argparse.Namespace(
+        blockchain_certificates_dir=os.path.join(base_dir, 'blockchain'),
+        work_dir=os.path.join(base_dir, 'work'),
+        staging='copy',
+        max_retry=1,
+        safe_mode=False,
+        chain=Chain.mockchain)
+    certificate_batch_handler = CertificateBatchHandler(secret_manager=NoKeySecretManager(),
+                                                        certificate_handler=handler_class(CachingDocumentLoader()),
+                                                        merkle_tree=MerkleTreeGenerator(),
+                                                        workers=args.workers)
+    issuance_daemon = IssuanceDaemon(app_config, certificate_batch_handler, MockTransactionHandler(),
+                                     batch_size=args.batch_size, window_seconds=args.batch_window_seconds)
+    issuance_daemon.start()
+    server = DaemonHTTPServer(('127.0.0.1', 0), issuance_daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return issuance_daemon, server
+
+
+def issue_certificate(url, template, num):
+    certificate = copy.deepcopy(template)
+    certificate['id'] = 'urn:uuid:' + str(uuid.uuid4())
+    certificate['recipient']['identity'] = 'recipient{}@example.org'.format(num)
+    start = time.perf_counter()
+    request = Request(url, data=json.dumps(certificate).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    with urlopen(request) as response:
+        certificate_id = json.loads(response.read().decode('utf-8'))['id']
+    while True:
+        try:
+            with urlopen('{}/{}'.format(url, certificate_id)) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except HTTPError as e:
+            raise Exception('Issuing certificate {} failed: {}'.format(certificate_id, e.read().decode('utf-8')))
+        time.sleep(POLL_SECONDS)
+
+
+def run_clients(url, template, certificates, concurrency):
+    latencies = []
+    errors = []
+    counter = iter(range(0, certificates))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                num = next(counter, None)
+            if num is None:
+                return
+            try:
+                latency = issue_certificate(url, template, num)
+            except Exception as e:
+                errors.append(e)
+                return
+            with lock:
+                latencies.append(latency)
+
+    threads = [threading.Thread(target=client) for _ in range(0, concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--certificates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--batch_size', type=int, default=250)
+    parser.add_argument('--batch_window_seconds', type=float, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--url', default=None, help='certificates endpoint of a running daemon')
+    parser.add_argument('--skip_schema_validation', action='store_true')
+    args = parser.parse_args()
+
+    with open(EXAMPLE_CERTIFICATE) as template_file:
+        template = json.load(template_file)
+
+    base_dir = tempfile.mkdtemp()
+    issuance_daemon = server = None
+    try:
+        url = args.url
+        if url is None:
+            issuance_daemon, server = start_daemon(base_dir, args)
+            url = 'http://127.0.0.1:{}/certificates'.format(server.server_address[1])
+
+        start = time.perf_counter()
+        latencies, errors = run_clients(url, template, args.certificates, args.concurrency)
+        elapsed = time.perf_counter() - start
+        if errors:
+            print('{} certificates failed, e.g. {}'.format(len(errors), errors[0]))
+            sys.exit(1)
+
+        latencies.sort()
+        print('{:>12} {:>10} {:>14} {:>10} {:>10} {:>10}'.format('certificates', 'seconds', 'certs/second',
+                                                                 'p50', 'p99', 'max'))
+        print('{:>12} {:>10.2f} {:>14.1f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            len(latencies), elapsed, len(latencies) / elapsed, percentile(latencies, 0.5),
+            percentile(latencies, 0.99), latencies[-1]))
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        if issuance_daemon:
+            issuance_daemon.stop()
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
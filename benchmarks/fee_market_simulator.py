@@ -0,0 +1,150 @@
+"""
+Simulates issuing into a mocked Bitcoin fee market, comparing the configured satoshi_per_byte with fee rates estimated
+by the fee oracle for several confirmation targets: what the transactions cost, and how many blocks they wait.
+
+Each block has a clearing rate, the lowest fee rate it includes. It follows a random walk around --median_rate, with a
+daily cycle and occasional spikes that decay over a few hours. A transaction is confirmed by the first block whose
+clearing rate it pays; one still waiting after --max_wait_blocks is counted as stuck. The mocked estimatesmartfee
+returns the rate that would have been confirmed within the target in 85% of the last 144 blocks, and is queried
+through BitcoinFeeOracle and BitcoinTransactionCostConstants.update_fee_rate, as ensure_balance does.
+
+Usage:
+    python benchmarks/fee_market_simulator.py --days 30 --interval_blocks 6 --static_rates 250 50 10
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cert_issuer import tx_utils
+from cert_issuer.fee_oracle import BitcoinFeeOracle
+from cert_issuer.tx_utils import BitcoinTransactionCostConstants, COIN
+
+BLOCK_SECONDS = 600
+BLOCKS_PER_DAY = 144
+HISTORY_BLOCKS = 144
+SUCCESS_THRESHOLD = 0.85
+
+
+def create_market(num_blocks, median_rate, rng):
+    """
+    :return: clearing rate of each block, in satoshis per byte
+    """
+    rates = []
+    noise = 0
+    spike = 0
+    for block in range(0, num_blocks):
+        noise = 0.95 * noise + rng.gauss(0, 0.15)
+        if rng.random() < 1 / (3 * BLOCKS_PER_DAY):
+            spike = rng.uniform(1, 2.5)
+        spike *= 0.97
+        daily = 0.5 * math.sin(2 * math.pi * block / BLOCKS_PER_DAY)
+        rates.append(max(1, median_rate * math.exp(daily + noise + spike)))
+    return rates
+
+
+class MarketConnector(object):
+    """
+    Stands in for estimatesmartfee, from the clearing rates of the blocks before the current one
+    """
+
+    def __init__(self, rates):
+        self.rates = rates
+        self.block = 0
+
+    def estimate_fee(self, target_blocks):
+        start = max(0, self.block - HISTORY_BLOCKS)
+        history = self.rates[start:self.block]
+        if len(history) <= target_blocks:
+            raise ValueError('Insufficient data or no feerate found')
+        # the lowest rate confirmed within target_blocks, from each block of the history
+        needed = sorted(min(history[i + 1:i + 1 + target_blocks]) for i in range(0, len(history) - target_blocks))
+        return needed[min(len(needed) - 1, int(SUCCESS_THRESHOLD * len(needed)))]
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(rates, first_block, interval_blocks, tx_cost_constants, max_wait_blocks, connector=None, clock=None):
+    """
+    :return: (fees in satoshis, blocks waited by each confirmed transaction, number of stuck transactions)
+    """
+    fees = []
+    waits = []
+    stuck = 0
+    for block in range(first_block, len(rates) - max_wait_blocks, interval_blocks):
+        if connector:
+            connector.block = block
+            clock.now = block * BLOCK_SECONDS
+        tx_cost_constants.update_fee_rate()
+        fee = tx_utils.calculate_tx_fee(tx_cost_constants, 1, 1)
+        rate = fee / tx_utils.calculate_raw_tx_size_with_op_return(1, 1)
+        for wait in range(1, max_wait_blocks + 1):
+            if rates[block + wait] <= rate:
+                fees.append(fee)
+                waits.append(wait)
+                break
+        else:
+            stuck += 1
+    return fees, sorted(waits), stuck
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--interval_blocks', type=int, default=6, help='blocks between transactions')
+    parser.add_argument('--median_rate', type=float, default=20, help='median clearing rate, in satoshi/byte')
+    parser.add_argument('--static_rates', type=int, nargs='+', default=[250, 50, 10],
+                        help='configured satoshi_per_byte values to compare')
+    parser.add_argument('--targets', type=int, nargs='+', default=[1, 3, 6, 12, 24],
+                        help='confirmation targets of the fee oracle, in blocks')
+    parser.add_argument('--cache_seconds', type=int, default=300)
+    parser.add_argument('--max_satoshi_per_byte', type=int, default=0)
+    parser.add_argument('--tx_fee', type=float, default=0, help='fee floor in BTC, as tx_fee')
+    parser.add_argument('--max_wait_blocks', type=int, default=BLOCKS_PER_DAY)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    rates = create_market((args.days + 2) * BLOCKS_PER_DAY, args.median_rate, random.Random(args.seed))
+    # the first day is the oracle's history
+    first_block = BLOCKS_PER_DAY
+    print('{} days, a transaction every {} blocks, clearing rates p50 {:.1f} p90 {:.1f} max {:.1f} satoshi/byte'.format(
+        args.days, args.interval_blocks, sorted(rates)[len(rates) // 2], sorted(rates)[int(len(rates) * 0.9)],
+        max(rates)))
+    print('{:>12} {:>10} {:>12} {:>10} {:>10} {:>10} {:>7}'.format(
+        'strategy', 'txs', 'fees BTC', 'mean sat', 'mean wait', 'p95 wait', 'stuck'))
+
+    strategies = []
+    for rate in args.static_rates:
+        strategies.append(('static {}'.format(rate), BitcoinTransactionCostConstants(args.tx_fee, satoshi_per_byte=rate),
+                           None, None))
+    for target in args.targets:
+        connector = MarketConnector(rates)
+        clock = FakeClock()
+        oracle = BitcoinFeeOracle(connector, args.static_rates[0], target, max_rate=args.max_satoshi_per_byte,
+                                  cache_seconds=args.cache_seconds, clock=clock)
+        strategies.append(('target {}'.format(target),
+                           BitcoinTransactionCostConstants(args.tx_fee, satoshi_per_byte=args.static_rates[0],
+                                                           fee_oracle=oracle),
+                           connector, clock))
+
+    for name, tx_cost_constants, connector, clock in strategies:
+        fees, waits, stuck = simulate(rates, first_block, args.interval_blocks, tx_cost_constants,
+                                      args.max_wait_blocks, connector, clock)
+        print('{:>12} {:>10} {:>12.6f} {:>10.0f} {:>10.2f} {:>10} {:>7}'.format(
+            name, len(fees) + stuck, sum(fees) / COIN, sum(fees) / max(len(fees), 1), sum(waits) / max(len(waits), 1),
+            waits[int(len(waits) * 0.95)] if waits else '-', stuck))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Measures the import cost of starting the issuer on each chain, with `python -X importtime`, and fails if it regresses.
+
+For each chain, a fresh interpreter imports cert_issuer.issue_certificates, creates the handlers for the chain and its
+broadcast providers, as a run does before issuing. The total import time is the sum of the per-module times reported
+by -X importtime, and the best of --repeat runs is kept.
+
+The benchmark fails if
+- a chain loads another chain's libraries (e.g. a mockchain run importing ethereum), or
+- a chain's import time exceeds the baseline in --baseline by more than --tolerance. Baselines depend on the machine,
+  so record them with --update_baseline on the machine the benchmark is tracked on.
+
+Usage:
+    python benchmarks/import_time_benchmark.py --update_baseline
+    python benchmarks/import_time_benchmark.py --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, 'benchmarks', 'import_time_baseline.json')
+
+CHAINS = ['mockchain', 'bitcoin_testnet', 'bitcoin_mainnet', 'ethereum_ropsten']
+
+# modules only some chains may load at startup
+BITCOIN_MODULES = ['bitcoin.rpc', 'bitcoin.signmessage', 'pycoin.services', 'pycoin.tx.Tx']
+ETHEREUM_MODULES = ['ethereum', 'rlp']
+FORBIDDEN_MODULES = {
+    'mockchain': BITCOIN_MODULES + ETHEREUM_MODULES,
+    'bitcoin_testnet': ETHEREUM_MODULES,
+    'bitcoin_mainnet': ETHEREUM_MODULES,
+    'ethereum_ropsten': BITCOIN_MODULES,
+}
+
+START_ISSUER = """
+import argparse
+import json
+import sys
+
+from cert_schema import Chain
+from cert_issuer import connectors
+from cert_issuer.issue_certificates import create_handlers
+
+chain = Chain.parse_from_chain(sys.argv[1])
+app_config = argparse.Namespace(chain=chain, issuing_address='', usb_name='', key_file='', safe_mode=False,
+                                secret_manager='file', certificate_signatures=False, merkle_tree='array',
+                                jsonld_cache_dir=None, jsonld_preload_dir=None, jsonld_offline=False, workers=1,
+                                gas_price=20000000000, gas_limit=25000, api_token=None, tx_fee=0.0006,
+                                dust_threshold=0.0000275, satoshi_per_byte=250, bitcoind=False,
+                                http_pool_size=10, http_max_retries=3, http_backoff_factor=0.5,
+                                coin_selection='branch_and_bound', max_consolidation_inputs=0,
+                                utxo_pool_size=0, utxo_pool_output_value=0, utxo_pool_refill_threshold=0,
+                                ethereum_rpc_url=None, fee_target_blocks=0, fee_cache_seconds=300,
+                                max_satoshi_per_byte=0, max_gas_price=0)
+create_handlers(app_config)
+if chain != Chain.mockchain:
+    connectors.get_providers_for_chain(chain)
+print(json.dumps(sorted(sys.modules)))
+"""
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|')
+
+
+def measure(chain):
+    """
+    :param chain: chain name
+    :return: (total import time in microseconds, names of the loaded modules)
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', START_ISSUER, chain],
+                            cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            total += int(match.group(1))
+    return total, json.loads(result.stdout.splitlines()[-1])
+
+
+def get_forbidden_modules(chain, modules):
+    return sorted(module for module in modules
+                  if any(module == forbidden or module.startswith(forbidden + '.')
+                         for forbidden in FORBIDDEN_MODULES[chain]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chains', nargs='+', default=CHAINS, choices=CHAINS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed increase over the baseline, as a fraction of it')
+    parser.add_argument('--update_baseline', action='store_true')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    elif not args.update_baseline:
+        print('No baseline at {}; only checking which modules are loaded'.format(args.baseline))
+
+    failures = []
+    results = {}
+    print('{:>18} {:>10} {:>12} {:>10}'.format('chain', 'ms', 'baseline ms', 'modules'))
+    for chain in args.chains:
+        runs = [measure(chain) for _ in range(0, args.repeat)]
+        total = min(total for total, _ in runs)
+        modules = runs[0][1]
+        results[chain] = total
+        chain_baseline = baseline.get(chain)
+        print('{:>18} {:>10.1f} {:>12} {:>10}'.format(chain, total / 1000.0,
+                                                      '{:.1f}'.format(chain_baseline / 1000.0) if chain_baseline
+                                                      else '-', len(modules)))
+
+        forbidden = get_forbidden_modules(chain, modules)
+        if forbidden:
+            failures.append('{} loads {}'.format(chain, ', '.join(forbidden)))
+        if chain_baseline and not args.update_baseline and total > chain_baseline * (1 + args.tolerance):
+            failures.append('{} import time regressed from {:.1f}ms to {:.1f}ms'.format(
+                chain, chain_baseline / 1000.0, total / 1000.0))
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print('Updated {}'.format(args.baseline))
+
+    if failures:
+        for failure in failures:
+            print('FAIL: ' + failure)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
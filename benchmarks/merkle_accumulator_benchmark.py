@@ -0,0 +1,105 @@
+"""
+Compares MerkleAccumulator, the append-only tree behind merkle_tree=accumulator, with rebuilding a MerkleTree, for
+continuous issuance: --leaves leaves are added, and the root is anchored every --checkpoint leaves.
+
+append      leaves per second added to the accumulator, with a snapshot every checkpoint
+rebuild     leaves per second when the MerkleTree is rebuilt from all the leaves at every checkpoint, as
+            MerkleTreeGenerator.get_blockchain_data does
+proofs      proofs per second, for every leaf of the first snapshot once all the leaves are added (iter_proofs), and
+            for single leaves (get_proof)
+
+Roots and a sample of proofs are checked to be identical to MerkleTree's.
+
+Usage:
+    python benchmarks/merkle_accumulator_benchmark.py --leaves 100000 --checkpoint 1000
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pycoin.serialize import b2h
+
+from cert_issuer.merkle_accumulator import MerkleAccumulator
+from cert_issuer.merkle_tree import MerkleTree
+
+SAMPLED_PROOFS = 1000
+
+
+def get_leaves(leaf_count):
+    return [hashlib.sha256(str(num).encode('utf-8')).digest() for num in range(0, leaf_count)]
+
+
+def run_accumulator(leaves, checkpoint):
+    start = time.perf_counter()
+    accumulator = MerkleAccumulator()
+    snapshots = []
+    for index, leaf in enumerate(leaves, 1):
+        accumulator.add_leaf(leaf)
+        if index % checkpoint == 0:
+            snapshots.append(accumulator.snapshot())
+    return accumulator, snapshots, time.perf_counter() - start
+
+
+def run_rebuild(leaves, checkpoint):
+    start = time.perf_counter()
+    roots = []
+    for end in range(checkpoint, len(leaves) + 1, checkpoint):
+        tree = MerkleTree()
+        for leaf in leaves[:end]:
+            tree.add_leaf(leaf)
+        tree.make_tree()
+        roots.append(tree.get_merkle_root())
+    return roots, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--leaves', type=int, default=100000, help='leaves added')
+    parser.add_argument('--checkpoint', type=int, default=1000, help='leaves added between anchored snapshots')
+    parser.add_argument('--skip_rebuild', default=False, action='store_true',
+                        help='skip rebuilding, which is quadratic in the number of checkpoints')
+    args = parser.parse_args()
+
+    leaves = get_leaves(args.leaves)
+    accumulator, snapshots, append_seconds = run_accumulator(leaves, args.checkpoint)
+    print('{:>10} {:>10} {:>10} {:>14}'.format('run', 'items', 'seconds', 'per second'))
+    print('{:>10} {:>10} {:>10.2f} {:>14.0f}'.format('append', args.leaves, append_seconds,
+                                                     args.leaves / append_seconds))
+
+    if not args.skip_rebuild:
+        roots, rebuild_seconds = run_rebuild(leaves, args.checkpoint)
+        if roots != [snapshot.root for snapshot in snapshots]:
+            raise AssertionError('Roots differ')
+        print('{:>10} {:>10} {:>10.2f} {:>14.0f}'.format('rebuild', args.leaves, rebuild_seconds,
+                                                         args.leaves / rebuild_seconds))
+
+    if not snapshots:
+        return
+    snapshot = snapshots[0]
+    start = time.perf_counter()
+    proofs = list(accumulator.iter_proofs(snapshot.leaf_count, encode=b2h))
+    seconds = time.perf_counter() - start
+    print('{:>10} {:>10} {:>10.2f} {:>14.0f}'.format('iter_proofs', len(proofs), seconds, len(proofs) / seconds))
+
+    last = snapshots[-1]
+    step = max(1, last.leaf_count // SAMPLED_PROOFS)
+    indexes = range(0, last.leaf_count, step)
+    start = time.perf_counter()
+    sampled = [accumulator.get_proof(index, last.leaf_count) for index in indexes]
+    seconds = time.perf_counter() - start
+    print('{:>10} {:>10} {:>10.2f} {:>14.0f}'.format('get_proof', len(sampled), seconds, len(sampled) / seconds))
+
+    tree = MerkleTree()
+    for leaf in leaves[:last.leaf_count]:
+        tree.add_leaf(leaf)
+    tree.make_tree()
+    if tree.get_merkle_root() != last.root or sampled != [tree.get_proof(index) for index in indexes]:
+        raise AssertionError('Proofs differ')
+
+
+if __name__ == '__main__':
+    main()
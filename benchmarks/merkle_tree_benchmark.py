@@ -0,0 +1,97 @@
+"""
+Compares the array-backed MerkleTree engine against chainpoint's MerkleTools (the engine MerkleTreeGenerator used
+previously) for building the tree and generating every proof.
+
+The legacy engine is only benchmarked if chainpoint is installed (pip install chainpoint==0.0.2). When it is, roots and
+a sample of proofs are checked to be identical.
+
+Usage:
+    python benchmarks/merkle_tree_benchmark.py --sizes 1000 100000 1000000
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pycoin.serialize import b2h
+
+from cert_issuer.merkle_tree import MerkleTree
+
+
+def get_data(leaf_count):
+    for num in range(0, leaf_count):
+        yield str(num).encode('utf-8')
+
+
+def run_native(leaf_count):
+    start = time.perf_counter()
+    tree = MerkleTree()
+    for data in get_data(leaf_count):
+        tree.add_leaf(hashlib.sha256(data).digest())
+    tree.make_tree()
+    built = time.perf_counter()
+    root = b2h(tree.get_merkle_root())
+    proofs = []
+    for index, proof in enumerate(tree.iter_proofs(encode=b2h)):
+        proof = [{position: sibling} for position, sibling in proof]
+        if index % 1000 == 0:
+            proofs.append(proof)
+    done = time.perf_counter()
+    return built - start, done - built, root, proofs
+
+
+def run_chainpoint(leaf_count):
+    from chainpoint.chainpoint import MerkleTools
+
+    start = time.perf_counter()
+    tree = MerkleTools(hash_type='sha256')
+    for data in get_data(leaf_count):
+        tree.add_leaf(hashlib.sha256(data).hexdigest())
+    tree.make_tree()
+    built = time.perf_counter()
+    root = tree.get_merkle_root()
+    proofs = []
+    for index in range(0, leaf_count):
+        proof = tree.get_proof(index)
+        if index % 1000 == 0:
+            proofs.append(proof)
+    done = time.perf_counter()
+    return built - start, done - built, root, proofs
+
+
+def has_chainpoint():
+    try:
+        import chainpoint.chainpoint  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 100000, 1000000])
+    parser.add_argument('--skip_legacy', action='store_true', help='only benchmark the native engine')
+    args = parser.parse_args()
+
+    compare = not args.skip_legacy and has_chainpoint()
+    if not args.skip_legacy and not compare:
+        print('chainpoint is not installed; only benchmarking the native engine')
+
+    print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format('leaves', 'engine', 'build (s)', 'proofs (s)', 'total (s)'))
+    for leaf_count in args.sizes:
+        build, proofs, root, sample = run_native(leaf_count)
+        print('{:>10} {:>12} {:>12.3f} {:>12.3f} {:>12.3f}'.format(leaf_count, 'native', build, proofs, build + proofs))
+        if compare:
+            legacy_build, legacy_proofs, legacy_root, legacy_sample = run_chainpoint(leaf_count)
+            print('{:>10} {:>12} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+                leaf_count, 'chainpoint', legacy_build, legacy_proofs, legacy_build + legacy_proofs))
+            if root != legacy_root or sample != legacy_sample:
+                print('Engines disagree for {} leaves'.format(leaf_count))
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
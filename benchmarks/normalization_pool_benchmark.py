@@ -0,0 +1,101 @@
+"""
+Measures how CertificateBatchHandler.prepare_batch scales with the number of worker processes on a synthetic batch.
+
+The batch is generated from one of the example testnet certificates, with a distinct recipient and id per
+certificate. JSON schema validation resolves remote $refs, so use --skip_schema_validation on machines without network
+access; the unmapped-field check and normalization still run.
+
+Usage:
+    python benchmarks/normalization_pool_benchmark.py --certificates 10000 --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cert_issuer import helpers
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateV2Handler
+from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+
+EXAMPLE_CERTIFICATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples',
+                                   'data-testnet', 'unsigned_certificates',
+                                   '3bc1a96a-3501-46ed-8f75-49612bbac257.json')
+
+
+class NoKeySecretManager(object):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class UnvalidatedCertificateHandler(CertificateV2Handler):
+    """
+    Skips JSON schema validation, which resolves remote $refs. A class rather than a patch of the module, since worker
+    processes import the module afresh
+    """
+
+    def _validate_schema(self, certificate_json):
+        pass
+
+
+def generate_certificates(unsigned_certs_dir, count):
+    with open(EXAMPLE_CERTIFICATE) as template_file:
+        template = json.load(template_file)
+    for num in range(0, count):
+        uid = str(uuid.UUID(int=num))
+        template['id'] = 'urn:uuid:' + uid
+        template['recipient']['identity'] = 'recipient{}@example.org'.format(num)
+        with open(os.path.join(unsigned_certs_dir, uid + helpers.JSON_EXT), 'w') as cert_file:
+            json.dump(template, cert_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--certificates', type=int, default=10000)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--skip_schema_validation', action='store_true')
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        unsigned_certs_dir = os.path.join(base_dir, helpers.UNSIGNED_CERTIFICATES_DIR)
+        os.makedirs(unsigned_certs_dir)
+        generate_certificates(unsigned_certs_dir, args.certificates)
+        certificates_metadata = helpers.prepare_issuance_batch(unsigned_certs_dir,
+                                                               os.path.join(base_dir, 'signed'),
+                                                               os.path.join(base_dir, 'blockchain'),
+                                                               os.path.join(base_dir, 'work'))
+        handler_class = UnvalidatedCertificateHandler if args.skip_schema_validation else CertificateV2Handler
+        print('{:>8} {:>12} {:>14} {:>10}'.format('workers', 'seconds', 'certs/second', 'speedup'))
+        baseline = None
+        merkle_root = None
+        for workers in args.workers:
+            certificate_batch_handler = CertificateBatchHandler(secret_manager=NoKeySecretManager(),
+                                                                certificate_handler=handler_class(),
+                                                                merkle_tree=MerkleTreeGenerator(),
+                                                                workers=workers)
+            certificate_batch_handler.set_certificates_in_batch(certificates_metadata)
+            start = time.perf_counter()
+            root = certificate_batch_handler.prepare_batch()
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print('{:>8} {:>12.2f} {:>14.1f} {:>10.2f}'.format(workers, elapsed, args.certificates / elapsed,
+                                                              baseline / elapsed))
+            if merkle_root and root != merkle_root:
+                print('Merkle root changed with {} workers'.format(workers))
+                sys.exit(1)
+            merkle_root = root
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
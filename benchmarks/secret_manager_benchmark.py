@@ -0,0 +1,131 @@
+"""
+Measures Bitcoin transaction signatures per second with each secret manager backend, signing one transaction per key
+window as the issuer does for each batch, and all the transactions in one window as sign_ahead does.
+
+file       FileSecretManager without safe mode: the key file is read for every window
+memory     InMemorySecretManager
+agent      SigningAgentSecretManager, to a SigningAgent running in this process on a temporary Unix socket
+external   ExternalKeySecretManager signing digests with a software key: the signing path of the PKCS#11 backend,
+           without the token
+pkcs11     Pkcs11SecretManager, if --pkcs11_module, --pkcs11_token_label and --pkcs11_key_label are given
+
+Usage:
+    python benchmarks/secret_manager_benchmark.py --signatures 200 --inputs 1
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bitcoin import SelectParams
+from cert_schema import Chain
+from pycoin import ecdsa
+from pycoin.key import Key
+from pycoin.serialize import b2h
+from pycoin.tx.Spendable import Spendable
+
+from cert_issuer import tx_utils
+from cert_issuer.secret_managers import ExternalKeySecretManager, InMemorySecretManager, Pkcs11SecretManager, \
+    SigningAgent, SigningAgentSecretManager
+from cert_issuer.signer import BitcoinSigner, FileSecretManager, FinalizableSigner
+
+SECRET_EXPONENT = 0x1234567
+
+
+class SoftwareKey(ExternalKeySecretManager):
+    def __init__(self, signer, secret_exponent):
+        super().__init__(signer)
+        self.secret_exponent = secret_exponent
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def sign_digest(self, digest):
+        return ecdsa.sign(ecdsa.generator_secp256k1, self.secret_exponent, int.from_bytes(digest, 'big'))
+
+    def get_public_pair(self):
+        return ecdsa.public_pair_for_secret_exponent(ecdsa.generator_secp256k1, self.secret_exponent)
+
+
+def create_transactions(address, count, num_inputs):
+    script = bytes(tx_utils.create_transaction_output(address, 0).scriptPubKey)
+    transactions = []
+    for number in range(0, count):
+        inputs = [Spendable(100000, script, (number + 1).to_bytes(4, 'big') + bytes([index]) * 28, 0)
+                  for index in range(0, num_inputs)]
+        tx = tx_utils.create_trx(number.to_bytes(32, 'big'), 10000, address, [], inputs)
+        transactions.append(tx_utils.prepare_tx_for_signing(b2h(tx.serialize()), inputs))
+    return transactions
+
+
+def sign_per_window(secret_manager, transactions):
+    for transaction in transactions:
+        with FinalizableSigner(secret_manager) as signer:
+            signer.sign_transaction(transaction)
+
+
+def sign_in_one_window(secret_manager, transactions):
+    with FinalizableSigner(secret_manager) as signer:
+        for _ in signer.sign_transactions(transactions):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--signatures', type=int, default=200, help='transactions signed per backend and mode')
+    parser.add_argument('--inputs', type=int, default=1, help='inputs per transaction')
+    parser.add_argument('--pkcs11_module', default=None)
+    parser.add_argument('--pkcs11_token_label', default=None)
+    parser.add_argument('--pkcs11_key_label', default=None)
+    parser.add_argument('--pkcs11_pin', default=None)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    SelectParams('testnet')
+    signer = BitcoinSigner(Chain.bitcoin_testnet)
+    key = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN')
+    base_dir = tempfile.mkdtemp()
+    key_file = os.path.join(base_dir, 'pk_issuer.txt')
+    with open(key_file, 'w') as f:
+        f.write(key.wif())
+    agent = SigningAgent(InMemorySecretManager(signer, key.wif()), os.path.join(base_dir, 'agent.sock'))
+    agent.start()
+
+    backends = [('file', FileSecretManager(signer, key_file, safe_mode=False), key.address()),
+                ('memory', InMemorySecretManager(signer, key.wif()), key.address()),
+                ('agent', SigningAgentSecretManager(signer, agent.socket_path), key.address()),
+                ('external', SoftwareKey(signer, SECRET_EXPONENT), key.address())]
+    if args.pkcs11_module:
+        secret_manager = Pkcs11SecretManager(signer, args.pkcs11_module, args.pkcs11_token_label,
+                                             args.pkcs11_key_label, pin=args.pkcs11_pin)
+        secret_manager.start()
+        backends.append(('pkcs11', secret_manager,
+                         Key(public_pair=secret_manager.get_public_pair(), netcode='XTN').address()))
+        secret_manager.stop()
+
+    print('{} transactions of {} inputs per run'.format(args.signatures, args.inputs))
+    print('{:>10} {:>18} {:>18}'.format('backend', 'per window sig/s', 'one window sig/s'))
+    try:
+        for name, secret_manager, address in backends:
+            rates = []
+            for sign in [sign_per_window, sign_in_one_window]:
+                transactions = create_transactions(address, args.signatures, args.inputs)
+                start = time.perf_counter()
+                sign(secret_manager, transactions)
+                rates.append(args.signatures / (time.perf_counter() - start))
+            print('{:>10} {:>18.1f} {:>18.1f}'.format(name, rates[0], rates[1]))
+    finally:
+        agent.stop()
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
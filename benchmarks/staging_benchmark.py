@@ -0,0 +1,92 @@
+"""
+Compares staging strategies for moving certificates through the work dir: the time prepare_issuance_batch takes to
+stage the inputs, and the time copy_output takes to publish the outputs.
+
+Strategies the filesystem does not support are reported and skipped (reflink needs e.g. btrfs or xfs, hardlink needs the
+directories on one filesystem). Use --base_dir to run on the storage used for issuing, e.g. a network mount.
+
+Usage:
+    python benchmarks/staging_benchmark.py --certificates 100000 --base_dir /mnt/certs
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cert_issuer import helpers
+
+
+def generate_certificates(unsigned_certs_dir, count, size):
+    content = '{"padding": "' + 'x' * max(0, size - 16) + '"}'
+    for num in range(0, count):
+        with open(os.path.join(unsigned_certs_dir, str(uuid.UUID(int=num)) + helpers.JSON_EXT), 'w') as cert_file:
+            cert_file.write(content)
+
+
+def write_outputs(certificates_metadata):
+    # stands in for add_proof; outputs are new files in the work dir
+    for _, metadata in certificates_metadata.items():
+        shutil.copyfile(metadata.unsigned_cert_file_name, metadata.blockchain_cert_file_name)
+
+
+def is_supported(base_dir, unsigned_certs_dir, staging):
+    src = os.path.join(unsigned_certs_dir, os.listdir(unsigned_certs_dir)[0])
+    dst = os.path.join(base_dir, 'probe_' + staging)
+    try:
+        helpers.FileStager(staging)(src, dst)
+    except OSError as e:
+        print('{:>10} not supported here: {}'.format(staging, e))
+        return False
+    os.remove(dst)
+    return True
+
+
+def run(base_dir, unsigned_certs_dir, staging):
+    blockchain_certs_dir = os.path.join(base_dir, 'blockchain_' + staging)
+    start = time.perf_counter()
+    certificates_metadata = helpers.prepare_issuance_batch(unsigned_certs_dir,
+                                                           os.path.join(base_dir, 'signed_' + staging),
+                                                           blockchain_certs_dir,
+                                                           os.path.join(base_dir, 'work'),
+                                                           staging=staging)
+    staged = time.perf_counter()
+    write_outputs(certificates_metadata)
+    written = time.perf_counter()
+    helpers.copy_output(certificates_metadata, staging=staging)
+    published = time.perf_counter()
+    shutil.rmtree(blockchain_certs_dir)
+    return staged - start, published - written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--certificates', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=4096, help='bytes per certificate')
+    parser.add_argument('--strategies', nargs='+', default=helpers.STAGING_STRATEGIES,
+                        choices=helpers.STAGING_STRATEGIES)
+    parser.add_argument('--base_dir', default=None, help='directory to run in; defaults to a temporary directory')
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(dir=args.base_dir)
+    try:
+        unsigned_certs_dir = os.path.join(base_dir, helpers.UNSIGNED_CERTIFICATES_DIR)
+        os.makedirs(unsigned_certs_dir)
+        generate_certificates(unsigned_certs_dir, args.certificates, args.size)
+
+        print('{:>10} {:>12} {:>12} {:>12}'.format('strategy', 'stage (s)', 'publish (s)', 'total (s)'))
+        for staging in args.strategies:
+            if not is_supported(base_dir, unsigned_certs_dir, staging):
+                continue
+            stage, publish = run(base_dir, unsigned_certs_dir, staging)
+            print('{:>10} {:>12.3f} {:>12.3f} {:>12.3f}'.format(staging, stage, publish, stage + publish))
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Issues a synthetic batch in streaming mode (or, with --batch, in the default mode for comparison) and checks that the
+peak resident set size of the process stays under a ceiling.
+
+Certificates are tiny JSON documents, schema validation is skipped and JSON-LD normalization is replaced by sorted JSON
+serialization, so the measurement reflects the memory held per certificate by the batch pipeline rather than the cost
+of normalizing a certificate. Run each mode in its own process, since the peak RSS of a process never goes down.
+
+Usage:
+    python benchmarks/streaming_memory_benchmark.py --certificates 1000000 --max_rss_mb 256
+    python benchmarks/streaming_memory_benchmark.py --certificates 1000000 --batch
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cert_schema import Chain
+from cert_issuer import helpers
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateV2Handler
+from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+
+
+class NoKeySecretManager(object):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class SortedJsonCertificateHandler(CertificateV2Handler):
+    def _validate_schema(self, certificate_json):
+        pass
+
+    def _normalize(self, certificate_metadata, certificate_json, detect_unmapped_fields):
+        certificate_metadata.normalize_count += 1
+        return json.dumps(certificate_json, sort_keys=True)
+
+
+def generate_certificates(unsigned_certs_dir, count):
+    for num in range(0, count):
+        uid = str(uuid.UUID(int=num))
+        with open(os.path.join(unsigned_certs_dir, uid + helpers.JSON_EXT), 'w') as cert_file:
+            json.dump({'id': 'urn:uuid:' + uid, 'recipient': {'identity': 'recipient{}@example.org'.format(num)}},
+                      cert_file)
+
+
+def get_max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss / (1024 * 1024)
+    return max_rss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--certificates', type=int, default=100000)
+    parser.add_argument('--max_rss_mb', type=float, default=256, help='fail if peak RSS exceeds this')
+    parser.add_argument('--batch', action='store_true', help='use the default (in memory) mode instead of streaming')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        unsigned_certs_dir = os.path.join(base_dir, helpers.UNSIGNED_CERTIFICATES_DIR)
+        os.makedirs(unsigned_certs_dir)
+        generate_certificates(unsigned_certs_dir, args.certificates)
+        baseline_rss = get_max_rss_mb()
+
+        start = time.perf_counter()
+        prepare = helpers.prepare_issuance_batch if args.batch else helpers.prepare_streaming_issuance_batch
+        certificates_metadata = prepare(unsigned_certs_dir, os.path.join(base_dir, 'signed'),
+                                        os.path.join(base_dir, 'blockchain'), os.path.join(base_dir, 'work'))
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=NoKeySecretManager(),
+                                                            certificate_handler=SortedJsonCertificateHandler(),
+                                                            merkle_tree=MerkleTreeGenerator(),
+                                                            workers=args.workers)
+        certificate_batch_handler.set_certificates_in_batch(certificates_metadata)
+        certificate_batch_handler.prepare_batch()
+        certificate_batch_handler.finish_batch('0' * 64, Chain.bitcoin_testnet)
+        helpers.copy_output(certificates_metadata)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(base_dir)
+
+    max_rss = get_max_rss_mb()
+    print('{:>12} {:>10} {:>12} {:>18} {:>14}'.format('certificates', 'mode', 'seconds', 'baseline RSS (MB)',
+                                                      'peak RSS (MB)'))
+    print('{:>12} {:>10} {:>12.2f} {:>18.1f} {:>14.1f}'.format(args.certificates, 'batch' if args.batch else 'streaming',
+                                                               elapsed, baseline_rss, max_rss))
+    if max_rss > args.max_rss_mb:
+        print('Peak RSS {:.1f} MB exceeds the ceiling of {:.1f} MB'.format(max_rss, args.max_rss_mb))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Durable record of a run's progress through issuance, kept in a SQLite database in the work dir, so an interrupted run
+can be resumed without normalizing the certificates or paying for a transaction again.
+
+A run issues one or more batches. For each batch, the journal records as each step completes:
+1. the uid and Merkle leaf digest of every certificate, in batch order, and the Merkle root
+2. the signed transaction, before it is broadcast
+3. the transaction id the signed transaction will have, before it is first broadcast
+4. the transaction id, once the broadcast succeeds
+5. the number of certificates whose proofs have been written, at each of finish_batch's checkpoints
+6. that the outputs were copied and the batch is complete
+and, once every batch is complete, that the run is.
+"""
+import collections
+import sqlite3
+
+JOURNAL_FILE_NAME = 'batch_journal.db'
+
+BatchState = collections.namedtuple('BatchState', ['chain', 'merkle_root', 'signed_tx', 'expected_txid', 'txid',
+                                                   'proofs_written', 'completed'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS run (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    completed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS batch (
+    id INTEGER PRIMARY KEY,
+    chain TEXT NOT NULL,
+    merkle_root TEXT NOT NULL,
+    signed_tx TEXT,
+    expected_txid TEXT,
+    txid TEXT,
+    proofs_written INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leaves (
+    batch_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    uid TEXT NOT NULL,
+    leaf_hash BLOB NOT NULL,
+    PRIMARY KEY (batch_id, position)
+);
+"""
+
+
+class BatchJournal(object):
+    def __init__(self, path, batch_index=0, connection=None):
+        """
+        :param path: journal file
+        :param batch_index: batch that the batch level methods read and record
+        :param connection: shared with the journal this one is created from by for_batch
+        """
+        self.path = path
+        self.batch_index = batch_index
+        if connection is None:
+            connection = sqlite3.connect(path)
+            # every update is committed before the step it records is acted on
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            _add_missing_columns(connection)
+        self.connection = connection
+
+    def for_batch(self, batch_index):
+        return BatchJournal(self.path, batch_index, self.connection)
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self):
+        """
+        Discards any recorded run and starts a new one
+        :return:
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM run')
+            self.connection.execute('DELETE FROM batch')
+            self.connection.execute('DELETE FROM leaves')
+            self.connection.execute('INSERT INTO run (id) VALUES (0)')
+
+    def can_resume(self):
+        """
+        :return: True if a run was interrupted after recording at least one batch
+        """
+        row = self.connection.execute('SELECT completed FROM run WHERE id = 0').fetchone()
+        if row is None or row[0]:
+            return False
+        return self.connection.execute('SELECT COUNT(*) FROM batch').fetchone()[0] > 0
+
+    def mark_completed(self):
+        with self.connection:
+            self.connection.execute('UPDATE run SET completed = 1 WHERE id = 0')
+
+    def get_batch_sizes(self):
+        """
+        :return: number of certificates in each recorded batch, in batch order
+        """
+        return [count for _, count in self.connection.execute(
+            'SELECT batch_id, COUNT(*) FROM leaves GROUP BY batch_id ORDER BY batch_id')]
+
+    def get_batch(self):
+        """
+        :return: BatchState, or None if the batch has not been recorded
+        """
+        row = self.connection.execute('SELECT chain, merkle_root, signed_tx, expected_txid, txid, proofs_written, '
+                                      'completed FROM batch WHERE id = ?', (self.batch_index,)).fetchone()
+        if row is None:
+            return None
+        return BatchState(row[0], row[1], row[2], row[3], row[4], row[5], bool(row[6]))
+
+    def record_batch(self, chain_name, leaves, merkle_root):
+        """
+        Records the prepared batch, replacing any previous record of it.
+        :param chain_name: name of the Chain the batch is issued on
+        :param leaves: iterable of (uid, leaf digest) in batch order
+        :param merkle_root: hex encoded Merkle root
+        :return:
+        """
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO run (id) VALUES (0)')
+            self.connection.execute('DELETE FROM batch WHERE id = ?', (self.batch_index,))
+            self.connection.execute('DELETE FROM leaves WHERE batch_id = ?', (self.batch_index,))
+            self.connection.executemany('INSERT INTO leaves (batch_id, position, uid, leaf_hash) VALUES (?, ?, ?, ?)',
+                                        ((self.batch_index, position, uid, digest)
+                                         for position, (uid, digest) in enumerate(leaves)))
+            self.connection.execute('INSERT INTO batch (id, chain, merkle_root) VALUES (?, ?, ?)',
+                                    (self.batch_index, chain_name, merkle_root))
+
+    def iter_leaves(self):
+        """
+        Returns a generator of (uid, leaf digest) in batch order
+        :return:
+        """
+        for uid, leaf_hash in self.connection.execute('SELECT uid, leaf_hash FROM leaves WHERE batch_id = ? '
+                                                      'ORDER BY position', (self.batch_index,)):
+            yield uid, bytes(leaf_hash)
+
+    def record_signed_transaction(self, signed_tx):
+        """
+        Records the transaction signed for the batch, replacing any signed before it, which has not been broadcast
+        """
+        with self.connection:
+            self.connection.execute('UPDATE batch SET signed_tx = ?, expected_txid = NULL WHERE id = ?',
+                                    (signed_tx, self.batch_index))
+
+    def record_expected_txid(self, txid):
+        """
+        Records the txid of the signed transaction before it is broadcast, after which it may be on the network even if
+        the broadcast seems to fail
+        """
+        self._update('expected_txid', txid)
+
+    def record_txid(self, txid):
+        self._update('txid', txid)
+
+    def record_proofs_written(self, count):
+        self._update('proofs_written', count)
+
+    def mark_batch_completed(self):
+        self._update('completed', 1)
+
+    def _update(self, column, value):
+        with self.connection:
+            self.connection.execute('UPDATE batch SET {} = ? WHERE id = ?'.format(column), (value, self.batch_index))
+
+
+def _add_missing_columns(connection):
+    # journals written before expected_txid was recorded are resumed as if their transaction was never broadcast
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(batch)')]
+    if 'expected_txid' not in columns:
+        with connection:
+            connection.execute('ALTER TABLE batch ADD COLUMN expected_txid TEXT')
@@ -1,14 +1,34 @@
+import collections
+import copy
+import itertools
 import json
 from abc import abstractmethod
 import logging
 
+import jsonschema
 from pycoin.serialize import b2h
 
+from cert_schema import BlockcertValidationError
 from cert_schema import normalize_jsonld
 from cert_schema import validate_v2
 
+from cert_issuer.errors import JournalMismatchError
+from cert_issuer.helpers import get_process_context
+from cert_issuer.merkle_tree_generator import SuperRootGenerator
 from cert_issuer.signer import FinalizableSigner
 
+# Upper bound on the number of certificates handed to a worker process at a time
+MAX_CHUNK_SIZE = 100
+
+# Number of chunks per worker queued on the pool at a time
+WINDOW_CHUNKS = 4
+
+# Number of certificates between calls to finish_batch's checkpoint
+CHECKPOINT_INTERVAL = 1000
+
+# Errors showing that a certificate is invalid, as opposed to failing to validate it, e.g. for lack of a JSON-LD context
+INVALID_CERTIFICATE_ERRORS = (BlockcertValidationError, jsonschema.ValidationError)
+
 
 class CertificateHandler(object):
     @abstractmethod
@@ -19,6 +39,12 @@ class CertificateHandler(object):
     def sign_certificate(self, signer, certificate_metadata):
         pass
 
+    def needs_signer(self):
+        """
+        :return: False if sign_certificate does not use the signer, so the secret manager need not be started for it
+        """
+        return True
+
     @abstractmethod
     def get_byte_array_to_issue(self, certificate_metadata):
         pass
@@ -27,23 +53,58 @@ class CertificateHandler(object):
     def add_proof(self, certificate_metadata, merkle_proof):
         pass
 
+    def prepare_certificate(self, certificate_metadata):
+        """
+        Validates the certificate and returns the byte array to issue. Handlers that can do both from a single parse
+        of the certificate should override this.
+        :param certificate_metadata:
+        :return: byte array to issue
+        """
+        self.validate_certificate(certificate_metadata)
+        return self.get_byte_array_to_issue(certificate_metadata)
+
 
 class CertificateV2Handler(CertificateHandler):
+    def __init__(self, document_loader=None):
+        """
+        :param document_loader: JSON-LD document loader used for normalization, e.g. a CachingDocumentLoader. Defaults
+        to cert_schema's loader.
+        """
+        self.document_loader = document_loader
+
     def validate_certificate(self, certificate_metadata):
-        with open(certificate_metadata.unsigned_cert_file_name) as cert:
-            certificate_json = json.load(cert)
-            # Both tests raise exception on failure
-            # 1. json schema validation
-            validate_v2(certificate_json)
-            # 2. detect if there are any unmapped fields
-            normalize_jsonld(certificate_json, detect_unmapped_fields=True)
+        certificate_json = self._get_certificate_to_issue(certificate_metadata)
+        # Both tests raise exception on failure
+        # 1. json schema validation
+        self._validate_schema(certificate_json)
+        # 2. detect if there are any unmapped fields
+        self._normalize(certificate_metadata, certificate_json, detect_unmapped_fields=True)
 
     def sign_certificate(self, signer, certificate_metadata):
         pass
 
+    def needs_signer(self):
+        return False
+
     def get_byte_array_to_issue(self, certificate_metadata):
         certificate_json = self._get_certificate_to_issue(certificate_metadata)
-        normalized = normalize_jsonld(certificate_json, detect_unmapped_fields=False)
+        normalized = self._normalize(certificate_metadata, certificate_json, detect_unmapped_fields=False)
+        return normalized.encode('utf-8')
+
+    def prepare_certificate(self, certificate_metadata):
+        """
+        Single pass equivalent of validate_certificate followed by get_byte_array_to_issue. The certificate is read and
+        normalized once, and the parsed certificate is kept on the metadata for add_proof.
+
+        The unmapped field check only adds a fallback @vocab to the context, which changes the normalized form only if
+        there are unmapped fields, and that raises. So the normalization done for the check is also the one to issue.
+        The check adds the @vocab to the JSON it is given, so it normalizes a copy, and the certificate kept for
+        add_proof is issued as it was read.
+        """
+        certificate_json = self._get_certificate_to_issue(certificate_metadata)
+        self._validate_schema(certificate_json)
+        normalized = self._normalize(certificate_metadata, certificate_json, detect_unmapped_fields=True)
+        certificate_metadata.certificate_json = certificate_json
         return normalized.encode('utf-8')
 
     def add_proof(self, certificate_metadata, merkle_proof):
@@ -52,7 +113,12 @@ class CertificateV2Handler(CertificateHandler):
         :param merkle_proof:
         :return:
         """
-        certificate_json = self._get_certificate_to_issue(certificate_metadata)
+        certificate_json = certificate_metadata.certificate_json
+        if certificate_json is None:
+            certificate_json = self._get_certificate_to_issue(certificate_metadata)
+        else:
+            # release the parsed certificate once its proof is written
+            certificate_metadata.certificate_json = None
         certificate_json['signature'] = merkle_proof
 
         with open(certificate_metadata.blockchain_cert_file_name, 'w') as out_file:
@@ -61,23 +127,104 @@ class CertificateV2Handler(CertificateHandler):
     def _get_certificate_to_issue(self, certificate_metadata):
         with open(certificate_metadata.unsigned_cert_file_name, 'r') as unsigned_cert_file:
             certificate_json = json.load(unsigned_cert_file)
+        certificate_metadata.read_count += 1
         return certificate_json
 
+    def _validate_schema(self, certificate_json):
+        validate_v2(certificate_json)
+
+    def _normalize(self, certificate_metadata, certificate_json, detect_unmapped_fields):
+        if detect_unmapped_fields:
+            # the check appends a fallback @vocab to the certificate's @context in place
+            certificate_json = copy.deepcopy(certificate_json)
+        if self.document_loader:
+            normalized = normalize_jsonld(certificate_json, document_loader=self.document_loader,
+                                          detect_unmapped_fields=detect_unmapped_fields)
+        else:
+            normalized = normalize_jsonld(certificate_json, detect_unmapped_fields=detect_unmapped_fields)
+        certificate_metadata.normalize_count += 1
+        return normalized
+
 
 class CertificateBatchHandler(object):
     """
     Manages a batch of certificates. Responsible for iterating certificates in a consistent order.
 
-    In this case, certificates are initialized as an Ordered Dictionary, and we iterate in insertion order.
+    In this case, certificates are initialized as an Ordered Dictionary (or a helpers.CertificateMetadataStream, for
+    batches too large to hold in memory), and we iterate in insertion order.
+
+    With workers > 1, validation and normalization are fanned out across a process pool. Results are consumed in
+    insertion order, so the Merkle leaves and proofs are the same as in a serial run.
+
+    With a certificate_signer, each certificate's Merkle leaf is also signed with the issuer's key, and the signature
+    is added to its proof.
     """
 
-    def __init__(self, secret_manager, certificate_handler, merkle_tree):
+    def __init__(self, secret_manager, certificate_handler, merkle_tree, workers=1, certificate_signer=None):
         self.certificate_handler = certificate_handler
         self.secret_manager = secret_manager
         self.merkle_tree = merkle_tree
+        self.workers = workers
+        self.certificate_signer = certificate_signer
+        self.certificate_signatures = None
+        self.pool = None
+        self.batch_hashed = False
 
     def set_certificates_in_batch(self, certificates_to_issue):
         self.certificates_to_issue = certificates_to_issue
+        self.batch_hashed = False
+
+    def new_batch(self, certificates_to_issue):
+        """
+        Returns a handler for another batch, sharing this handler's configuration but not its Merkle tree, so batches
+        can be prepared while another is being issued
+        :param certificates_to_issue:
+        :return: CertificateBatchHandler
+        """
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=self.secret_manager,
+                                                            certificate_handler=self.certificate_handler,
+                                                            merkle_tree=type(self.merkle_tree)(),
+                                                            workers=self.workers,
+                                                            certificate_signer=self.certificate_signer)
+        certificate_batch_handler.set_certificates_in_batch(certificates_to_issue)
+        return certificate_batch_handler
+
+    def hash_batch(self):
+        """
+        Validates and hashes the batch, the part of prepare_batch that doesn't need the secret manager. Propagates
+        exception on failure
+        :return:
+        """
+        if self.workers > 1:
+            self.pool = get_process_context().Pool(self.workers, initializer=_init_worker,
+                                                   initargs=(self.certificate_handler,))
+        try:
+            # each certificate is validated and normalized in the same pass
+            self.merkle_tree.populate(self.get_certificate_generator())
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        self.batch_hashed = True
+
+    def get_validation_errors(self):
+        """
+        Validates every certificate in the batch, rather than stopping at the first invalid one as hash_batch does,
+        e.g. to set aside the invalid certificates of a batch that failed. Uses a process pool if workers > 1. Errors
+        that do not show a certificate to be invalid, e.g. a JSON-LD context that could not be fetched, propagate.
+        :return: dict of uid -> error message, for the certificates that are invalid
+        """
+        metadatas = [metadata for _, metadata in self.certificates_to_issue.items()]
+        if self.workers > 1 and len(metadatas) > 1:
+            chunk_size = max(1, min(MAX_CHUNK_SIZE, len(metadatas) // (self.workers * 4)))
+            with get_process_context().Pool(self.workers, initializer=_init_worker,
+                                            initargs=(self.certificate_handler,)) as pool:
+                errors = pool.map(_get_validation_error, metadatas, chunk_size)
+        else:
+            errors = [get_validation_error(self.certificate_handler, metadata) for metadata in metadatas]
+        return collections.OrderedDict((metadata.uid, error) for metadata, error in zip(metadatas, errors)
+                                       if error is not None)
 
     def prepare_batch(self):
         """
@@ -85,30 +232,196 @@ class CertificateBatchHandler(object):
         :return: byte array to put on the blockchain
         """
 
-        # validate batch
-        for _, metadata in self.certificates_to_issue.items():
-            self.certificate_handler.validate_certificate(metadata)
+        # validate and hash batch, unless hash_batch already has
+        if not self.batch_hashed:
+            self.hash_batch()
 
-        # sign batch
-        with FinalizableSigner(self.secret_manager) as signer:
-            for _, metadata in self.certificates_to_issue.items():
-                self.certificate_handler.sign_certificate(signer, metadata)
+        # sign batch, if signing certificates needs the key
+        if self.certificate_handler.needs_signer():
+            with FinalizableSigner(self.secret_manager) as signer:
+                for _, metadata in self.certificates_to_issue.items():
+                    self.certificate_handler.sign_certificate(signer, metadata)
+        if self.certificate_signer:
+            self.sign_certificates()
 
-        self.merkle_tree.populate(self.get_certificate_generator())
         logging.info('here is the op_return_code data: %s', b2h(self.merkle_tree.get_blockchain_data()))
         return self.merkle_tree.get_blockchain_data()
 
+    def sign_certificates(self):
+        """
+        Signs the Merkle leaf of each certificate with the issuer's key, for finish_batch to add to its proof
+        :return:
+        """
+        with FinalizableSigner(self.secret_manager) as secret_manager:
+            self.certificate_signatures = self.certificate_signer.sign_batch(secret_manager.get_signing_key(),
+                                                                             self.merkle_tree.get_leaf_digests())
+
     def get_certificate_generator(self):
         """
-        Returns a generator (1-time iterator) of certificates in the batch
+        Returns a generator (1-time iterator) of certificates in the batch. Certificates are validated as they are
+        generated.
         :return:
         """
-        for uid, metadata in self.certificates_to_issue.items():
-            data_to_issue = self.certificate_handler.get_byte_array_to_issue(metadata)
-            yield data_to_issue
+        if not self.pool:
+            for _, metadata in self.certificates_to_issue.items():
+                yield self.certificate_handler.prepare_certificate(metadata)
+            return
 
-    def finish_batch(self, tx_id, chain):
+        # Certificates are handed to the pool a window at a time, since the pool would otherwise queue the whole batch
+        # at once. Worker processes prepare copies of the metadata, so the returned copies replace the originals.
+        window_size = self.workers * MAX_CHUNK_SIZE * WINDOW_CHUNKS
+        items = iter(self.certificates_to_issue.items())
+        while True:
+            window = list(itertools.islice(items, window_size))
+            if not window:
+                break
+            chunk_size = max(1, min(MAX_CHUNK_SIZE, len(window) // (self.workers * 4)))
+            results = self.pool.imap(_prepare_certificate, [metadata for _, metadata in window], chunk_size)
+            for (uid, _), (data_to_issue, metadata) in zip(window, results):
+                self.certificates_to_issue[uid] = metadata
+                yield data_to_issue
+
+    def get_leaves(self):
+        """
+        Returns a generator of (uid, Merkle leaf digest) for each certificate in the batch, once it is prepared
+        :return:
+        """
+        uids = (uid for uid, _ in self.certificates_to_issue.items())
+        return zip(uids, self.merkle_tree.get_leaf_digests())
+
+    def resume_batch(self, leaves):
+        """
+        Rebuilds the Merkle tree from leaves recorded by get_leaves in an earlier run, instead of validating and
+        normalizing the certificates again. Propagates exception on failure
+        :param leaves: iterable of (uid, Merkle leaf digest)
+        :return: byte array to put on the blockchain
+        """
+        items = iter(self.certificates_to_issue.items())
+
+        def get_digests():
+            for uid, digest in leaves:
+                expected_uid, _ = next(items, (None, None))
+                if uid != expected_uid:
+                    raise JournalMismatchError('Recorded certificate {} does not match certificate {} in the batch'
+                                               .format(uid, expected_uid))
+                yield digest
+            if next(items, None) is not None:
+                raise JournalMismatchError('The batch has more certificates than were recorded')
+
+        self.merkle_tree.populate_leaf_digests(get_digests())
+        if self.certificate_signer:
+            # signatures are not recorded; signing the same leaves again gives the same signatures
+            self.sign_certificates()
+        return self.merkle_tree.get_blockchain_data()
+
+    def finish_batch(self, tx_id, chain, start_index=0, checkpoint=None):
+        """
+        Adds proofs to the certificates in the batch.
+        :param tx_id:
+        :param chain:
+        :param start_index: number of certificates whose proofs were already added, e.g. by an interrupted run
+        :param checkpoint: optional function called with the number of certificates whose proofs have been added,
+        every CHECKPOINT_INTERVAL certificates and once all are added
+        :return:
+        """
         proof_generator = self.merkle_tree.get_proof_generator(tx_id, chain)
+        count = 0
         for uid, metadata in self.certificates_to_issue.items():
             proof = next(proof_generator)
+            count += 1
+            if count <= start_index:
+                continue
+            if self.certificate_signatures:
+                proof['jws'] = self.certificate_signatures.get_jws(count - 1)
             self.certificate_handler.add_proof(metadata, proof)
+            if checkpoint and count % CHECKPOINT_INTERVAL == 0:
+                checkpoint(count)
+        if checkpoint:
+            checkpoint(count)
+
+
+class SuperRootBatchHandler(object):
+    """
+    Issues the batches of several CertificateBatchHandlers, e.g. one per tenant, in one transaction. Each batch's
+    Merkle tree is built independently, and their roots are combined under a super-root, which is what is anchored.
+    Each certificate's proof goes through its batch's root to the super-root.
+
+    Stands in for a CertificateBatchHandler in Issuer. Certificates are numbered across batches, in the order of the
+    batch handlers, for the journal and for finish_batch's start_index and checkpoint.
+    """
+
+    def __init__(self, batch_handlers):
+        self.batch_handlers = batch_handlers
+        self.super_root = SuperRootGenerator([batch_handler.merkle_tree for batch_handler in batch_handlers])
+
+    def get_validation_errors(self):
+        errors = collections.OrderedDict()
+        for batch_handler in self.batch_handlers:
+            errors.update(batch_handler.get_validation_errors())
+        return errors
+
+    def prepare_batch(self):
+        """
+        Propagates exception on failure
+        :return: super-root to put on the blockchain
+        """
+        for batch_handler in self.batch_handlers:
+            batch_handler.prepare_batch()
+        super_root = self.super_root.get_blockchain_data()
+        logging.info('Anchoring %d batches under super-root %s', len(self.batch_handlers), b2h(super_root))
+        return super_root
+
+    def get_leaves(self):
+        return itertools.chain.from_iterable(batch_handler.get_leaves() for batch_handler in self.batch_handlers)
+
+    def resume_batch(self, leaves):
+        leaves = iter(leaves)
+        for batch_handler in self.batch_handlers:
+            batch_handler.resume_batch(itertools.islice(leaves, len(batch_handler.certificates_to_issue)))
+        if next(leaves, None) is not None:
+            raise JournalMismatchError('More certificates were recorded than are in the batches')
+        return self.super_root.get_blockchain_data()
+
+    def finish_batch(self, tx_id, chain, start_index=0, checkpoint=None):
+        offset = 0
+        for batch_handler in self.batch_handlers:
+            count = len(batch_handler.certificates_to_issue)
+            batch_checkpoint = None
+            if checkpoint:
+                batch_checkpoint = _offset_checkpoint(checkpoint, offset)
+            batch_handler.finish_batch(tx_id, chain, start_index=min(max(start_index - offset, 0), count),
+                                       checkpoint=batch_checkpoint)
+            offset += count
+
+
+def get_validation_error(certificate_handler, certificate_metadata):
+    """
+    :return: why the certificate is invalid, or None if it is valid
+    """
+    try:
+        certificate_handler.prepare_certificate(certificate_metadata)
+    except INVALID_CERTIFICATE_ERRORS as e:
+        return str(e)
+    return None
+
+
+def _offset_checkpoint(checkpoint, offset):
+    return lambda count: checkpoint(offset + count)
+
+
+# The certificate handler is sent to each worker process once, when the pool starts
+_worker_certificate_handler = None
+
+
+def _init_worker(certificate_handler):
+    global _worker_certificate_handler
+    _worker_certificate_handler = certificate_handler
+
+
+def _get_validation_error(certificate_metadata):
+    return get_validation_error(_worker_certificate_handler, certificate_metadata)
+
+
+def _prepare_certificate(certificate_metadata):
+    data_to_issue = _worker_certificate_handler.prepare_certificate(certificate_metadata)
+    return data_to_issue, certificate_metadata
@@ -0,0 +1,290 @@
+"""
+Issuer signatures on each certificate, in addition to the Merkle anchor.
+
+Each certificate's proof gets a detached JWS (RFC 7515), "jws", signed with ES256K, i.e. ECDSA on secp256k1 with the
+issuing address's key. Its unencoded payload (RFC 7797) is the proof's targetHash, the SHA-256 of the certificate's
+normalized form, so the certificate is signed without being normalized again. The protected header carries the public
+key as a JWK, which verification checks against the issuing address:
+
+    BASE64URL(header) + '..' + BASE64URL(r || s)
+
+signed over SHA-256(BASE64URL(header) + '.' + targetHash), with low S.
+
+Signing uses libsecp256k1 through coincurve if it is installed, with the key loaded into its precomputed context once
+per process, and pycoin's ECDSA otherwise. With workers > 1, the leaves are signed in a process pool, started from
+helpers.get_process_context.
+"""
+import base64
+import hashlib
+import json
+import logging
+
+from pycoin.serialize import b2h
+
+from cert_issuer.errors import UnverifiedSignatureError
+from cert_issuer.helpers import get_process_context
+
+JWS_ALGORITHM = 'ES256K'
+
+SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+# Upper bound on the number of leaves handed to a worker process at a time
+MAX_CHUNK_SIZE = 1000
+
+
+def load_native_backend():
+    """
+    :return: the coincurve module, or None if it is not installed
+    """
+    try:
+        import coincurve
+    except ImportError:
+        return None
+    return coincurve
+
+
+class SigningKey(object):
+    """
+    A secp256k1 private key that signs digests, as ExternalKeySecretManager does, so either can sign certificates.
+    Unlike keys outside the issuer, it can be sent to worker processes.
+    """
+
+    def __init__(self, secret_exponent, native=None):
+        """
+        :param secret_exponent:
+        :param native: whether to sign with coincurve. Default is to use it if it is installed
+        """
+        self.secret_exponent = secret_exponent
+        self.native = native
+        self.public_pair = None
+        self._private_key = None
+
+    def __getstate__(self):
+        # the native key is rebuilt in the process that unpickles it
+        state = self.__dict__.copy()
+        state['_private_key'] = None
+        return state
+
+    def sign_digest(self, digest):
+        """
+        :param digest: 32 bytes
+        :return: ECDSA signature (r, s)
+        """
+        private_key = self._get_private_key()
+        if private_key is not None:
+            signature = private_key.sign_recoverable(digest, hasher=None)
+            return int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:64], 'big')
+
+        from pycoin import ecdsa
+
+        return ecdsa.sign(ecdsa.generator_secp256k1, self.secret_exponent, int.from_bytes(digest, 'big'))
+
+    def get_public_pair(self):
+        if self.public_pair is None:
+            from pycoin import ecdsa
+
+            self.public_pair = ecdsa.public_pair_for_secret_exponent(ecdsa.generator_secp256k1, self.secret_exponent)
+        return self.public_pair
+
+    def _get_private_key(self):
+        if self._private_key is None and self.native is not False:
+            coincurve = load_native_backend()
+            if coincurve is None:
+                if self.native:
+                    raise ImportError('coincurve is required to sign with libsecp256k1')
+                self.native = False
+                return None
+            self._private_key = coincurve.PrivateKey(self.secret_exponent.to_bytes(32, 'big'))
+        return self._private_key
+
+
+class BatchSignatures(object):
+    """
+    The signatures of a batch's certificates, in insertion order. The header is shared, so only each certificate's
+    64-byte signature is held.
+    """
+
+    def __init__(self, encoded_header, signatures):
+        self.encoded_header = encoded_header
+        self.signatures = signatures
+
+    def get_jws(self, index):
+        return self.encoded_header + '..' + encode_base64url(self.signatures[index])
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+class CertificateSigner(object):
+    """
+    Signs the Merkle leaves of a batch with the issuer's key. Keys that can be sent to worker processes, i.e.
+    SigningKeys, are used in a pool of worker processes if workers > 1; other keys, e.g. on a token or behind a
+    signing agent, sign in this process.
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def sign_batch(self, key, leaf_digests):
+        """
+        :param key: provides sign_digest(digest), returning (r, s), and get_public_pair(), returning (x, y)
+        :param leaf_digests: iterable of Merkle leaf digests, in insertion order
+        :return: BatchSignatures
+        """
+        encoded_header = encode_header(key.get_public_pair())
+        target_hashes = [b2h(digest) for digest in leaf_digests]
+        if self.workers > 1 and isinstance(key, SigningKey) and len(target_hashes) > 1:
+            chunk_size = max(1, min(MAX_CHUNK_SIZE, len(target_hashes) // (self.workers * 4)))
+            with get_process_context().Pool(self.workers, initializer=_init_worker,
+                                            initargs=(key, encoded_header)) as pool:
+                signatures = pool.map(_sign_target_hash, target_hashes, chunk_size)
+        else:
+            signatures = [sign_target_hash(key, encoded_header, target_hash) for target_hash in target_hashes]
+        logging.info('Signed %d certificates', len(signatures))
+        return BatchSignatures(encoded_header, signatures)
+
+
+def encode_base64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def decode_base64url(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def encode_header(public_pair):
+    """
+    :param public_pair: the issuer's public key as (x, y)
+    :return: the base64url encoded JWS protected header
+    """
+    x, y = public_pair
+    header = {
+        'alg': JWS_ALGORITHM,
+        'b64': False,
+        'crit': ['b64'],
+        'jwk': {
+            'kty': 'EC',
+            'crv': 'secp256k1',
+            'x': encode_base64url(x.to_bytes(32, 'big')),
+            'y': encode_base64url(y.to_bytes(32, 'big'))
+        }
+    }
+    return encode_base64url(json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+
+def get_signing_input_digest(encoded_header, target_hash):
+    return hashlib.sha256((encoded_header + '.' + target_hash).encode('ascii')).digest()
+
+
+def sign_target_hash(key, encoded_header, target_hash):
+    """
+    :return: the JWS signature, r || s, on target_hash
+    """
+    r, s = key.sign_digest(get_signing_input_digest(encoded_header, target_hash))
+    # low S, so each certificate has one valid signature
+    if s + s > SECP256K1_ORDER:
+        s = SECP256K1_ORDER - s
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+
+def verify_jws(jws, target_hash, issuing_address):
+    """
+    Verify the JWS was signed over target_hash by the key of the issuing address. Raises UnverifiedSignatureError if
+    it was not
+    :param jws: detached JWS, as in a certificate's proof
+    :param target_hash: the proof's targetHash
+    :param issuing_address: Bitcoin address, or 0x-prefixed Ethereum address
+    :return:
+    """
+    try:
+        encoded_header, payload, encoded_signature = jws.split('.')
+        header = json.loads(decode_base64url(encoded_header).decode('utf-8'))
+        signature = decode_base64url(encoded_signature)
+        jwk = header['jwk']
+        public_pair = (int.from_bytes(decode_base64url(jwk['x']), 'big'),
+                       int.from_bytes(decode_base64url(jwk['y']), 'big'))
+    except (ValueError, KeyError, TypeError) as e:
+        raise UnverifiedSignatureError('Malformed certificate signature: {}'.format(e))
+    if payload or header.get('alg') != JWS_ALGORITHM or header.get('b64') is not False or len(signature) != 64:
+        raise UnverifiedSignatureError('Unsupported certificate signature')
+    if not public_key_matches_address(public_pair, issuing_address):
+        raise UnverifiedSignatureError('The certificate was not signed by the key of {}'.format(issuing_address))
+    r = int.from_bytes(signature[:32], 'big')
+    s = int.from_bytes(signature[32:], 'big')
+    if not verify_digest(public_pair, get_signing_input_digest(encoded_header, target_hash), r, s):
+        raise UnverifiedSignatureError('The certificate signature is not valid')
+
+
+def verify_digest(public_pair, digest, r, s):
+    """
+    :return: True if (r, s) is a signature on digest by the public key, with low S
+    """
+    from pycoin import ecdsa
+
+    generator = ecdsa.generator_secp256k1
+    if s + s > SECP256K1_ORDER or not ecdsa.is_public_pair_valid(generator, public_pair):
+        return False
+    coincurve = load_native_backend()
+    if coincurve is None:
+        return ecdsa.verify(generator, public_pair, int.from_bytes(digest, 'big'), (r, s))
+
+    from coincurve.ecdsa import cdata_to_der, deserialize_compact
+
+    x, y = public_pair
+    public_key = coincurve.PublicKey(b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big'))
+    der = cdata_to_der(deserialize_compact(r.to_bytes(32, 'big') + s.to_bytes(32, 'big')))
+    return public_key.verify(der, digest, hasher=None)
+
+
+def public_key_matches_address(public_pair, issuing_address):
+    if issuing_address.startswith('0x'):
+        import sha3
+
+        x, y = public_pair
+        address = sha3.keccak_256(x.to_bytes(32, 'big') + y.to_bytes(32, 'big')).digest()[-20:]
+        return '0x' + b2h(address) == issuing_address.lower()
+
+    from pycoin.encoding import EncodingError, bitcoin_address_to_hash160_sec_with_prefix, public_pair_to_hash160_sec
+
+    try:
+        # mainnet or testnet
+        hash160, _ = bitcoin_address_to_hash160_sec_with_prefix(issuing_address)
+    except EncodingError:
+        return False
+    return hash160 in [public_pair_to_hash160_sec(public_pair, compressed=compressed) for compressed in [True, False]]
+
+
+def verify_certificate_signature(uid, signed_cert_file_name, issuing_address):
+    """
+    Verify the issuer signature in the certificate's proof is over the proof's targetHash, by the key of the
+    issuing_address.
+
+    Raises UnverifiedSignatureError if signature is missing or invalid
+
+    :param uid:
+    :param signed_cert_file_name:
+    :param issuing_address:
+    :return:
+    """
+    logging.info('verifying issuer signature for certificate with uid=%s:', uid)
+    with open(signed_cert_file_name) as in_file:
+        proof = json.load(in_file).get('signature', {})
+    if 'jws' not in proof:
+        raise UnverifiedSignatureError('Certificate uid={} has no issuer signature'.format(uid))
+    verify_jws(proof['jws'], proof['targetHash'], issuing_address)
+    logging.info('verified issuer signature')
+
+
+# The key is sent to each worker process once, when the pool starts
+_worker_key = None
+_worker_header = None
+
+
+def _init_worker(key, encoded_header):
+    global _worker_key, _worker_header
+    _worker_key = key
+    _worker_header = encoded_header
+
+
+def _sign_target_hash(target_hash):
+    return sign_target_hash(_worker_key, _worker_header, target_hash)
@@ -0,0 +1,300 @@
+"""
+Selection of the unspent outputs a Bitcoin transaction spends.
+
+Selectors pick the inputs and decide the fee and whether there is a change output. The fee is tx_utils.calculate_tx_fee
+of the selected inputs, so it follows the size from tx_utils.calculate_raw_tx_size_with_op_return and the recommended
+fee floor. Change below the minimum output value is not created; it is left to the miners instead.
+
+- BranchAndBoundSelector searches for inputs that need no change output, paying at most what a change output would
+  cost to create and later spend
+- KnapsackSelector looks for the smallest total that covers the fee and a change output, by random approximation
+- LargestFirstSelector spends the largest outputs first, and finds a selection whenever one exists
+
+create_coin_selector combines them so that a selector that finds nothing falls back to the next one.
+"""
+import logging
+import math
+import random
+from abc import abstractmethod
+
+from cert_issuer import tx_utils
+
+BNB_MAX_TRIES = 100000
+KNAPSACK_ITERATIONS = 1000
+# the knapsack only combines this many of the largest outputs below its target
+KNAPSACK_MAX_CANDIDATES = 200
+
+
+class Selection(object):
+    def __init__(self, inputs, fee, change):
+        """
+        :param inputs: Spendables to spend
+        :param fee: satoshis paid to the miners
+        :param change: satoshis sent back to the issuing address; 0 if there is no change output
+        """
+        self.inputs = inputs
+        self.fee = fee
+        self.change = change
+
+    def get_value(self):
+        return sum(s.coin_value for s in self.inputs)
+
+
+def get_fee(tx_cost_constants, num_inputs, with_change):
+    return int(math.ceil(tx_utils.calculate_tx_fee(tx_cost_constants, num_inputs, 1 if with_change else 0)))
+
+
+def get_input_fee(tx_cost_constants):
+    """
+    :return: what one more input adds to the fee, leaving the recommended fee floor aside
+    """
+    return tx_cost_constants.satoshi_per_byte * (tx_utils.BYTES_PER_INPUT + 1)
+
+
+def get_cost_of_change(tx_cost_constants, num_inputs):
+    """
+    :return: what a change output costs: the fee for its bytes now, and for spending it later
+    """
+    return (get_fee(tx_cost_constants, num_inputs, True) - get_fee(tx_cost_constants, num_inputs, False) +
+            get_input_fee(tx_cost_constants))
+
+
+def create_selection(tx_cost_constants, inputs):
+    """
+    :param inputs:
+    :return: Selection spending the inputs, with a change output if the change is at least the minimum output value,
+    or None if the inputs do not cover the fee
+    """
+    if not inputs:
+        return None
+    value = sum(s.coin_value for s in inputs)
+    fee = get_fee(tx_cost_constants, len(inputs), True)
+    if value - fee >= tx_cost_constants.get_minimum_output_coin():
+        return Selection(inputs, fee, value - fee)
+    if value >= get_fee(tx_cost_constants, len(inputs), False):
+        return Selection(inputs, value, 0)
+    return None
+
+
+class CoinSelector(object):
+    def __init__(self, max_consolidation_inputs=0):
+        """
+        :param max_consolidation_inputs: up to this many of the smallest unselected outputs are added to a selection
+        with change, if each adds at least as much as it costs, so that small outputs are consolidated while it is cheap
+        """
+        self.max_consolidation_inputs = max_consolidation_inputs
+
+    def select(self, spendables, tx_cost_constants):
+        """
+        :param spendables: Spendables that may be spent
+        :param tx_cost_constants: BitcoinTransactionCostConstants
+        :return: Selection, or None if this selector finds no inputs covering the fee
+        """
+        selection = self.select_inputs(spendables, tx_cost_constants)
+        if selection and selection.change and self.max_consolidation_inputs:
+            selection = self.consolidate(selection, spendables, tx_cost_constants)
+        return selection
+
+    @abstractmethod
+    def select_inputs(self, spendables, tx_cost_constants):
+        pass
+
+    def consolidate(self, selection, spendables, tx_cost_constants):
+        selected = set(id(s) for s in selection.inputs)
+        inputs = list(selection.inputs)
+        fee = selection.fee
+        for s in sorted((s for s in spendables if id(s) not in selected), key=lambda s: s.coin_value):
+            if len(inputs) - len(selection.inputs) >= self.max_consolidation_inputs:
+                break
+            next_fee = get_fee(tx_cost_constants, len(inputs) + 1, True)
+            if s.coin_value < next_fee - fee:
+                # the rest are larger, but only the smallest outputs are worth consolidating
+                break
+            inputs.append(s)
+            fee = next_fee
+        if len(inputs) > len(selection.inputs):
+            logging.info('Consolidating %d small outputs', len(inputs) - len(selection.inputs))
+        return create_selection(tx_cost_constants, inputs)
+
+
+class BranchAndBoundSelector(CoinSelector):
+    def select_inputs(self, spendables, tx_cost_constants):
+        """
+        Depth-first search, largest outputs first, for the inputs whose total exceeds the fee without a change output
+        by the least, and by at most the cost of change. Outputs worth less than the fee for spending them are left out,
+        so adding an input always increases the excess and a branch can be cut as soon as its excess is too large.
+        """
+        input_fee = get_input_fee(tx_cost_constants)
+        candidates = sorted((s for s in spendables if s.coin_value > input_fee), key=lambda s: s.coin_value,
+                            reverse=True)
+        values = [s.coin_value for s in candidates]
+        count = len(values)
+        remaining = [0] * (count + 1)
+        for index in range(count - 1, -1, -1):
+            remaining[index] = remaining[index + 1] + values[index]
+        max_cost_of_change = tx_cost_constants.satoshi_per_byte * tx_utils.BYTES_PER_OUTPUT + input_fee
+
+        selected = []
+        value = 0
+        index = 0
+        best = None
+        best_excess = None
+        for _ in range(0, BNB_MAX_TRIES):
+            backtrack = False
+            num_inputs = len(selected)
+            if value + remaining[index] < get_fee(tx_cost_constants, num_inputs + count - index, False):
+                # even spending everything left does not cover the fee
+                backtrack = True
+            elif num_inputs:
+                excess = value - get_fee(tx_cost_constants, num_inputs, False)
+                if excess > max_cost_of_change:
+                    backtrack = True
+                elif excess >= 0 and excess <= get_cost_of_change(tx_cost_constants, num_inputs):
+                    if best_excess is None or excess < best_excess:
+                        best = list(selected)
+                        best_excess = excess
+                        if excess == 0:
+                            break
+                    backtrack = True
+            if not backtrack and index == count:
+                backtrack = True
+
+            if backtrack:
+                if not selected:
+                    break
+                # leave out the last included output, and the outputs of the same value after it, which would only
+                # repeat the totals already searched
+                last = selected.pop()
+                value -= values[last]
+                index = last + 1
+                while index < count and values[index] == values[last]:
+                    index += 1
+            else:
+                selected.append(index)
+                value += values[index]
+                index += 1
+
+        if best is None:
+            return None
+        inputs = [candidates[index] for index in best]
+        return Selection(inputs, sum(s.coin_value for s in inputs), 0)
+
+
+class KnapsackSelector(CoinSelector):
+    def __init__(self, max_consolidation_inputs=0, rng=None):
+        super(KnapsackSelector, self).__init__(max_consolidation_inputs)
+        self.rng = rng or random.Random()
+
+    def select_inputs(self, spendables, tx_cost_constants):
+        """
+        Looks for the smallest total that covers the fee and the minimum change, like Bitcoin Core's knapsack: the
+        smallest single output that does, or a combination of smaller outputs found by random approximation. The fee
+        depends on how many inputs there are, so the search is repeated until it agrees with the number found.
+        """
+        num_inputs = 1
+        selection = None
+        for _ in range(0, 3):
+            target = get_fee(tx_cost_constants, num_inputs, True) + int(tx_cost_constants.get_minimum_output_coin())
+            inputs = self.select_total(spendables, target, get_input_fee(tx_cost_constants))
+            if not inputs:
+                return None
+            selection = create_selection(tx_cost_constants, inputs)
+            if selection and selection.change:
+                return selection
+            num_inputs = len(inputs)
+        return selection
+
+    def select_total(self, spendables, target, input_fee):
+        smaller = []
+        lowest_larger = None
+        for s in spendables:
+            if s.coin_value == target:
+                return [s]
+            if s.coin_value < target:
+                if s.coin_value > input_fee:
+                    smaller.append(s)
+            elif lowest_larger is None or s.coin_value < lowest_larger.coin_value:
+                lowest_larger = s
+        smaller.sort(key=lambda s: s.coin_value, reverse=True)
+        smaller = smaller[:KNAPSACK_MAX_CANDIDATES]
+        total = sum(s.coin_value for s in smaller)
+        if total == target:
+            return smaller
+        if total < target:
+            return [lowest_larger] if lowest_larger else None
+
+        values = [s.coin_value for s in smaller]
+        best_included, best_total = self.approximate_best_subset(values, target)
+        if lowest_larger and (best_total != target and lowest_larger.coin_value <= best_total):
+            return [lowest_larger]
+        return [s for s, included in zip(smaller, best_included) if included]
+
+    def approximate_best_subset(self, values, target):
+        best_included = [True] * len(values)
+        best_total = sum(values)
+        for _ in range(0, KNAPSACK_ITERATIONS):
+            if best_total == target:
+                break
+            included = [False] * len(values)
+            total = 0
+            reached_target = False
+            for iteration_pass in range(0, 2):
+                if reached_target:
+                    break
+                for index, value in enumerate(values):
+                    # on the first pass include outputs at random, on the second the ones left out
+                    if (self.rng.random() < 0.5) if iteration_pass == 0 else not included[index]:
+                        total += value
+                        included[index] = True
+                        if total >= target:
+                            reached_target = True
+                            if total < best_total:
+                                best_total = total
+                                best_included = list(included)
+                            total -= value
+                            included[index] = False
+        return best_included, best_total
+
+
+class LargestFirstSelector(CoinSelector):
+    def select_inputs(self, spendables, tx_cost_constants):
+        inputs = []
+        for s in sorted(spendables, key=lambda s: s.coin_value, reverse=True):
+            inputs.append(s)
+            selection = create_selection(tx_cost_constants, inputs)
+            if selection:
+                return selection
+        return None
+
+
+class FallbackCoinSelector(CoinSelector):
+    def __init__(self, selectors):
+        super(FallbackCoinSelector, self).__init__()
+        self.selectors = selectors
+
+    def select_inputs(self, spendables, tx_cost_constants):
+        for selector in self.selectors:
+            selection = selector.select(spendables, tx_cost_constants)
+            if selection:
+                logging.info('%s selected %d inputs; fee is %d satoshis, change is %d satoshis',
+                             type(selector).__name__, len(selection.inputs), selection.fee, selection.change)
+                return selection
+        return None
+
+
+COIN_SELECTORS = {
+    'branch_and_bound': [BranchAndBoundSelector, KnapsackSelector],
+    'knapsack': [KnapsackSelector],
+    'largest_first': [],
+}
+
+
+def create_coin_selector(name='branch_and_bound', max_consolidation_inputs=0):
+    """
+    :param name: key of COIN_SELECTORS
+    :param max_consolidation_inputs: see CoinSelector
+    :return: selector that tries the named algorithm, and falls back to spending the largest outputs first
+    """
+    selector_classes = COIN_SELECTORS[name] + [LargestFirstSelector]
+    return FallbackCoinSelector([selector_class(max_consolidation_inputs=max_consolidation_inputs)
+                                 for selector_class in selector_classes])
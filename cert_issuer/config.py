@@ -38,6 +38,30 @@ def add_arguments(p):
     p.add_argument('--work_dir', default=WORK_PATH,
                    help='Default path to work directory, storing intermediate outputs. This gets deleted in between runs.')
     p.add_argument('--max_retry', default=10, type=int, help='Maximum attempts to retry transaction on failure')
+    p.add_argument('--workers', default=1, type=int,
+                   help='Number of processes used to validate and normalize certificates. Default is 1 (no process pool)')
+    p.add_argument('--certificate_signatures', dest='certificate_signatures', default=False, action='store_true',
+                   help='Sign each certificate with the issuing address\'s key, in addition to anchoring it, as a '
+                        'detached JWS in its proof. Uses workers processes, and coincurve if it is installed')
+    p.add_argument('--merkle_tree', default='array', choices=['array', 'accumulator'],
+                   help='How each batch\'s Merkle tree is built: array builds it once all the certificates are hashed; '
+                        'accumulator adds each certificate to an append-only tree as it is hashed, and anchors a '
+                        'snapshot of it. Both give the same roots and proofs. Default is array')
+    p.add_argument('--streaming', dest='streaming', default=False, action='store_true',
+                   help='Stream certificates through issuance instead of holding the batch in memory. Certificates are '
+                        'read in place rather than copied to the work dir, in directory listing order.')
+    p.add_argument('--tenants', dest='tenants', default=False, action='store_true',
+                   help='Treat each subdirectory of unsigned_certificates_dir as a tenant. Every tenant gets its own '
+                        'Merkle tree, and the trees are anchored together under a super-root in one transaction')
+    p.add_argument('--staging', default=helpers.STAGING_COPY, choices=helpers.STAGING_STRATEGIES,
+                   help='How certificates are staged in the work dir and published to the output dir: copy, hardlink, '
+                        'reflink, or auto (reflink, falling back to hardlink and then copy). Default is copy')
+    p.add_argument('--jsonld_cache_dir', default=None,
+                   help='Directory caching the JSON-LD contexts used to normalize certificates. Default is in-memory only')
+    p.add_argument('--jsonld_preload_dir', default=None,
+                   help='Directory of JSON-LD contexts, listed in its manifest.json, to load into the cache at startup')
+    p.add_argument('--jsonld_offline', dest='jsonld_offline', default=False, action='store_true',
+                   help='Fail instead of fetching JSON-LD contexts that are not cached or bundled with cert-schema')
     p.add_argument('--chain', default='bitcoin_regtest',
                    help='Which chain to use. Default is bitcoin_regtest (which is how the docker container is configured). Other options are bitcoin_testnet bitcoin_mainnet, mockchain, ethereum_mainnet, ethereum_ropsten, ethereum_testnet')
 
@@ -45,15 +69,81 @@ def add_arguments(p):
                    help='Used to make sure your private key is not plugged in with the wifi.')
     p.add_argument('--no_safe_mode', dest='safe_mode', default=False, action='store_false',
                    help='Turns off safe mode. Only change this option for testing or unit testing.')
+    p.add_argument('--secret_manager', default='file', choices=['file', 'memory', 'agent', 'pkcs11'],
+                   help='Where the signing key is: file reads key_file each time a batch is signed; memory reads it '
+                        'once, when the issuer starts; agent asks the signing agent at signing_agent_socket to sign; '
+                        'pkcs11 signs with a key on a PKCS#11 token. Default is file')
+    p.add_argument('--signing_agent_socket', default=None, type=str,
+                   help='Unix socket of the signing agent, started with cert-issuer-signing-agent')
+    p.add_argument('--pkcs11_library', default=None, type=str,
+                   help='PKCS#11 module of the token holding the key, e.g. /usr/lib/softhsm/libsofthsm2.so')
+    p.add_argument('--pkcs11_token_label', default=None, type=str, help='label of the PKCS#11 token')
+    p.add_argument('--pkcs11_key_label', default=None, type=str,
+                   help='label of the secp256k1 key pair on the PKCS#11 token')
+    p.add_argument('--pkcs11_pin', default=None, type=str, env_var='PKCS11_PIN',
+                   help='user PIN of the PKCS#11 token. Can be set with the PKCS11_PIN environment variable instead')
     #bitcoin arguments
     p.add_argument('--dust_threshold', default=0.0000275, type=float,
                    help='blockchain dust threshold (in BTC) -- below this 1/3 is fees.')
     p.add_argument('--tx_fee', default=0.0006, type=float,
                    help='recommended tx fee (in BTC) for inclusion in next block. http://bitcoinexchangerate.org/fees')
-    p.add_argument('--batch_size', default=10, type=int,
-                   help='Certificate batch size')
+    p.add_argument('--batch_size', default=0, type=int,
+                   help='Maximum number of certificates issued in one transaction. The certificates are split into '
+                        'as many batches as needed. Default is 0 (no limit)')
+    p.add_argument('--batch_max_bytes', default=0, type=int,
+                   help='Maximum total size in bytes of the unsigned certificates in a batch. Default is 0 (no limit)')
+    p.add_argument('--batch_max_seconds', default=0, type=float,
+                   help='Maximum time spent preparing a batch; the remaining certificates go in the next batch. '
+                        'Default is 0 (no limit)')
+    p.add_argument('--sign_ahead', dest='sign_ahead', default=False, action='store_true',
+                   help='Prepare every batch, then sign all their transactions in one key window before broadcasting '
+                        'any, so that in safe mode the network is turned off and on once per run instead of once per '
+                        'batch. The batches are held in memory until they are broadcast')
+    p.add_argument('--http_pool_size', default=10, type=int,
+                   help='Connections kept alive per blockchain API host. Default is 10')
+    p.add_argument('--http_max_retries', default=3, type=int,
+                   help='Retries of blockchain API requests that fail to connect or are throttled. Default is 3')
+    p.add_argument('--http_backoff_factor', default=0.5, type=float,
+                   help='Blockchain API retries wait backoff_factor * 2 ** (retry - 1) seconds. Default is 0.5')
+    p.add_argument('--batch_window_seconds', default=60, type=float,
+                   help='Daemon only: longest time a certificate waits for its batch to fill up before the batch is '
+                        'issued. Batches are issued once they have batch_size certificates (default 1000 in the daemon)')
+    p.add_argument('--daemon_host', default='127.0.0.1', type=str,
+                   help='Daemon only: address the HTTP intake API listens on. Default is localhost')
+    p.add_argument('--daemon_port', default=8040, type=int,
+                   help='Daemon only: port the HTTP intake API listens on')
+    p.add_argument('--spool_dir', default=None, type=str,
+                   help='Daemon only: directory polled for certificates to issue, as <id>.json files')
+    p.add_argument('--anchor_workers', default=1, type=int,
+                   help='Daemon only: number of batches issued at the same time. On Bitcoin chains this requires '
+                        'utxo_pool_size, so that concurrent transactions spend different outputs; on Ethereum chains '
+                        'each transaction reserves its own nonce. Default is 1')
     p.add_argument('--satoshi_per_byte', default=250,
                    type=int, help='Satoshi per byte')
+    p.add_argument('--fee_target_blocks', default=0, type=int,
+                   help='Estimate the fee rate (satoshi_per_byte, or gas_price on Ethereum chains) for confirmation '
+                        'within this many blocks, instead of using the configured one. The configured rate is used '
+                        'while no estimate is available. Default is 0 (no estimation)')
+    p.add_argument('--fee_cache_seconds', default=300, type=int,
+                   help='How long an estimated fee rate is used before it is estimated again. Default is 300')
+    p.add_argument('--max_satoshi_per_byte', default=0, type=int,
+                   help='Cap on the estimated satoshi_per_byte. Default is 0 (no cap)')
+    p.add_argument('--coin_selection', default='branch_and_bound',
+                   choices=['branch_and_bound', 'knapsack', 'largest_first'],
+                   help='How the unspent outputs a transaction spends are chosen. If the chosen algorithm finds none, '
+                        'the largest outputs are spent first. Default is branch_and_bound, which prefers outputs '
+                        'that need no change output, then falls back to knapsack')
+    p.add_argument('--max_consolidation_inputs', default=0, type=int,
+                   help='Up to this many small unspent outputs are added to a transaction with change, while each '
+                        'adds at least as much as it costs in fees. Default is 0 (no consolidation)')
+    p.add_argument('--utxo_pool_size', default=0, type=int,
+                   help='Keep a pool of this many equal unspent outputs, and spend one of them alone in each '
+                        'transaction, so that transactions do not spend each other\'s change and can be broadcast '
+                        'concurrently. Default is 0 (no pool)')
+    p.add_argument('--utxo_pool_output_value', default=0, type=int,
+                   help='Value in satoshis of each pool output. Default is twice the fee of a one input transaction')
+    p.add_argument('--utxo_pool_refill_threshold', default=0, type=int,
+                   help='Refill the pool once fewer outputs are left. Default is a quarter of utxo_pool_size')
     p.add_argument('--bitcoind', dest='bitcoind', default=False, action='store_true',
                    help='Use bitcoind connectors.')
     p.add_argument('--no_bitcoind', dest='bitcoind', default=True, action='store_false',
@@ -63,8 +153,12 @@ def add_arguments(p):
                    help='decide the price per gas spent (in wei (smallest ETH unit))')
     p.add_argument('--gas_limit', default=25000, type=int,
                    help='decide on the maximum spendable gas. gas_limit < 25000 might not be sufficient')
+    p.add_argument('--max_gas_price', default=0, type=int,
+                   help='Cap in wei on the estimated gas price. Default is 0 (no cap)')
     p.add_argument('--api_token', default=None, type=str,
                    help='the API token of the blockchain broadcaster you are using. Currently Etherscan only supported.')
+    p.add_argument('--ethereum_rpc_url', default=None, type=str,
+                   help='JSON-RPC endpoint of an Ethereum node, e.g. http://localhost:8545, used instead of Etherscan')
     
 
 def get_config():
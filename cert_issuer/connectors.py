@@ -1,26 +1,26 @@
 """
 Connectors wrap the details of communicating with different Bitcoin clients and implementations.
 """
+import collections
+import functools
 import io
+import itertools
 import logging
 import time
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
 
-import bitcoin.rpc
-import requests
-from bitcoin.core import CTransaction
 from cert_schema import Chain
-from pycoin.serialize import b2h, b2h_rev, h2b
-from pycoin.services import providers
-from pycoin.services.chain_so import ChainSoProvider
-from pycoin.services.insight import InsightProvider
-from pycoin.services.providers import service_provider_methods
-from pycoin.tx.Spendable import Spendable
+from pycoin.serialize import b2h, b2h_rev, h2b, h2b_rev
 
-from cert_issuer import helpers
-from cert_issuer.errors import ConnectorError, BroadcastError
+from cert_issuer import helpers, http_session, tx_utils
+from cert_issuer.errors import ConnectorError, BroadcastError, JsonRpcError, TransactionRejectedError
+from cert_issuer.provider_health import health_registry
 
 BROADCAST_RETRY_INTERVAL = 30
+# seconds a broadcast waits for any provider to succeed, and the timeout of each provider's request
+BROADCAST_TIMEOUT = 60
+PROVIDER_TIMEOUT = 30
 
 try:
     from urllib2 import urlopen, HTTPError
@@ -31,10 +31,16 @@ except ImportError:
 
 MAX_BROADCAST_ATTEMPTS = 3
 
+# HTTP status the broadcast APIs answer with when they refuse a transaction as invalid
+REJECTED_STATUS_CODE = 400
 
-def try_get(url):
+# what an Ethereum issuing transaction needs to know about its address, looked up together
+AccountState = collections.namedtuple('AccountState', ['balance', 'nonce', 'pending_nonce', 'gas_price'])
+
+
+def try_get(url, session=None):
     """throw error if call fails"""
-    response = requests.get(url)
+    response = (session or http_session.get_session()).get(url)
     if int(response.status_code) != 200:
         error_message = 'Error! status_code={}, error={}'.format(
             response.status_code, response.json()['error'])
@@ -49,23 +55,54 @@ def to_hex(transaction):
     tx_as_hex = b2h(s.getvalue())
     return tx_as_hex
 
-class EtherscanBroadcaster(object):
-    def __init__(self, base_url):
+
+class HttpProvider(object):
+    """
+    Base of the providers calling HTTP APIs. Requests go through the given session, by default the shared pooled one,
+    so calls to the same API reuse connections.
+    """
+
+    def __init__(self, base_url, session=None):
         self.base_url = base_url
-    
+        self._session = session
+
+    @property
+    def session(self):
+        return self._session or http_session.get_session()
+
+
+class EtherscanBroadcaster(HttpProvider):
     def broadcast_tx(self, tx, api_token):
         tx_hex = tx
 
         broadcast_url = self.base_url + '?module=proxy&action=eth_sendRawTransaction'
         if api_token:
-            '&apikey=%s' % api_token
-        response = requests.post(broadcast_url, data={'hex': tx_hex})
+            broadcast_url += '&apikey=%s' % api_token
+        response = self.session.post(broadcast_url, data={'hex': tx_hex})
         if int(response.status_code) == 200:
             tx_id = response.json().get('result', None)
+            if tx_id is None:
+                # a rejected transaction, e.g. for a nonce already used, is reported as a JSON-RPC error
+                raise TransactionRejectedError(response.text)
             logging.info("Transaction ID obtained from broadcast through Etherscan: %s", tx_id)
             return tx_id
         logging.error('Error broadcasting the transaction through the Etherscan API. Error msg: %s', response.text)
         raise BroadcastError(response.text)
+
+    def get_transaction(self, tx_id, api_token):
+        """
+        :return: the transaction, as returned by eth_getTransactionByHash, or None if it is not known
+        """
+        url = self.base_url + '?module=proxy&action=eth_getTransactionByHash&txhash=%s' % tx_id
+        if api_token:
+            url += '&apikey=%s' % api_token
+        response = self.session.get(url)
+        if int(response.status_code) == 200:
+            # an API error, e.g. for a bad token, is reported as a message in place of the result
+            result = response.json().get('result', '')
+            if result is None or isinstance(result, dict):
+                return result
+        raise ConnectorError(response.text)
     
     def get_balance(self, address, api_token):
         """
@@ -76,25 +113,26 @@ class EtherscanBroadcaster(object):
         broadcast_url += '&address=%s' % address
         broadcast_url += '&tag=latest'
         if api_token:
-            '&apikey=%s' % api_token
-        response = requests.get(broadcast_url)
+            broadcast_url += '&apikey=%s' % api_token
+        response = self.session.get(broadcast_url)
         if int(response.status_code) ==  200:
             balance = int(response.json().get('result', None))
             logging.info('Balance check went correct: %s', response.json())
             return balance
         raise BroadcastError(response.text)
     
-    def get_address_nonce(self, address, api_token):
+    def get_address_nonce(self, address, api_token, tag='latest'):
         """
         Looks up the address nonce of this address
         Neccesary for the transaction creation
+        :param tag: 'latest' counts mined transactions, 'pending' also those waiting to be mined
         """
         broadcast_url = self.base_url + '?module=proxy&action=eth_getTransactionCount'
         broadcast_url += '&address=%s' % address
-        broadcast_url += '&tag=latest'
+        broadcast_url += '&tag=%s' % tag
         if api_token:
-            '&apikey=%s' % api_token
-        response = requests.get(broadcast_url)
+            broadcast_url += '&apikey=%s' % api_token
+        response = self.session.get(broadcast_url)
         if int(response.status_code) == 200:
             #the int(res, 0) transforms the hex nonce to int
             nonce = int(response.json().get('result', None), 0)
@@ -103,75 +141,224 @@ class EtherscanBroadcaster(object):
         else:
             logging.info('response error checking nonce')
         raise BroadcastError('Error checking the nonce through the Etherscan API. Error msg: %s', response.text)
-        
-        
-class BlockExplorerBroadcaster(object):
-    def __init__(self, base_url):
-        self.base_url = base_url
 
+    def get_gas_price(self, api_token):
+        """
+        returns the current gas price in wei
+        """
+        broadcast_url = self.base_url + '?module=proxy&action=eth_gasPrice'
+        if api_token:
+            broadcast_url += '&apikey=%s' % api_token
+        response = self.session.get(broadcast_url)
+        if int(response.status_code) == 200:
+            return int(response.json().get('result', None), 0)
+        raise ConnectorError(response.text)
+
+    def get_account_state(self, address, api_token):
+        """
+        The Etherscan API has no batch requests, so these are looked up one after another
+        :return: AccountState
+        """
+        return AccountState(balance=self.get_balance(address, api_token),
+                            nonce=self.get_address_nonce(address, api_token),
+                            pending_nonce=self.get_address_nonce(address, api_token, 'pending'),
+                            gas_price=self.get_gas_price(api_token))
+
+
+class EthereumJsonRpcProvider(HttpProvider):
+    """
+    Talks JSON-RPC to an Ethereum node. The lookups a transaction needs are sent together as one batch request, over a
+    kept-alive connection of the pooled session.
+    """
+
+    def __init__(self, base_url, session=None):
+        super().__init__(base_url, session)
+        self.request_ids = itertools.count(1)
+
+    def call_batch(self, calls):
+        """
+        :param calls: (method, params) tuples
+        :return: the results of the calls, in the same order
+        """
+        batch = [{'jsonrpc': '2.0', 'id': next(self.request_ids), 'method': method, 'params': params}
+                 for method, params in calls]
+        response = self.session.post(self.base_url, json=batch, timeout=PROVIDER_TIMEOUT)
+        if int(response.status_code) != 200:
+            raise ConnectorError('Error! status_code={}, error={}'.format(response.status_code, response.text))
+        # a node may answer the calls of a batch in any order
+        responses = dict((r.get('id'), r) for r in response.json())
+        results = []
+        for call in batch:
+            r = responses.get(call['id'])
+            if r is None:
+                raise ConnectorError('{} was not answered'.format(call['method']))
+            if 'error' in r:
+                raise JsonRpcError('{} failed: {}'.format(call['method'], r['error']))
+            results.append(r['result'])
+        return results
+
+    def broadcast_tx(self, tx, api_token=None):
+        tx_hex = tx if tx.startswith('0x') else '0x' + tx
+        try:
+            tx_id = self.call_batch([('eth_sendRawTransaction', [tx_hex])])[0]
+        except JsonRpcError as e:
+            # the node refused the transaction, e.g. for a nonce already used
+            raise TransactionRejectedError(str(e))
+        except ConnectorError as e:
+            raise BroadcastError(str(e))
+        logging.info('Transaction ID obtained from broadcast through %s: %s', self.base_url, tx_id)
+        return tx_id
+
+    def get_transaction(self, tx_id, api_token=None):
+        return self.call_batch([('eth_getTransactionByHash', [tx_id])])[0]
+
+    def get_balance(self, address, api_token=None):
+        return int(self.call_batch([('eth_getBalance', [address, 'latest'])])[0], 0)
+
+    def get_address_nonce(self, address, api_token=None, tag='latest'):
+        return int(self.call_batch([('eth_getTransactionCount', [address, tag])])[0], 0)
+
+    def get_gas_price(self, api_token=None):
+        return int(self.call_batch([('eth_gasPrice', [])])[0], 0)
+
+    def get_account_state(self, address, api_token=None):
+        """
+        :return: AccountState, from one batch request
+        """
+        results = self.call_batch([('eth_getBalance', [address, 'latest']),
+                                   ('eth_getTransactionCount', [address, 'latest']),
+                                   ('eth_getTransactionCount', [address, 'pending']),
+                                   ('eth_gasPrice', [])])
+        return AccountState(*[int(result, 0) for result in results])
+
+
+class BlockExplorerBroadcaster(HttpProvider):
     def broadcast_tx(self, tx):
         hextx = to_hex(tx)
         broadcast_url = self.base_url + '/tx/send'
-        response = requests.post(broadcast_url, json={'rawtx': hextx})
+        response = self.session.post(broadcast_url, json={'rawtx': hextx}, timeout=PROVIDER_TIMEOUT)
         if int(response.status_code) == 200:
             tx_id = response.json().get('txid', None)
             return tx_id
         logging.error('Error broadcasting the transaction through the BlockExplorer API. Error msg: %s', response.text)
+        if int(response.status_code) == REJECTED_STATUS_CODE:
+            raise TransactionRejectedError(response.text)
         raise BroadcastError(response.text)
 
 
-class BlockcypherBroadcaster(object):
+class BlockcypherBroadcaster(HttpProvider):
     """
     Note that this needs an API token
     """
 
-    def __init__(self, base_url, api_token):
-        self.base_url = base_url
+    def __init__(self, base_url, api_token, session=None):
+        super().__init__(base_url, session)
         self.api_token = api_token
 
     def broadcast_tx(self, tx):
         hextx = to_hex(tx)
         broadcast_url = self.base_url + '/txs/push?token=' + self.api_token
-        response = requests.post(broadcast_url, json={'tx': hextx})
+        response = self.session.post(broadcast_url, json={'tx': hextx}, timeout=PROVIDER_TIMEOUT)
         if int(response.status_code) == 200:
             tx_id = response.json().get('txid', None)
             return tx_id
         logging.error('Error broadcasting the transaction through the Blockcypher API. Error msg: %s', response.text)
+        if int(response.status_code) == REJECTED_STATUS_CODE:
+            raise TransactionRejectedError(response.text)
         raise BroadcastError(response.text)
 
 
-class BlockrIOBroadcaster(object):
-    def __init__(self, base_url):
-        self.base_url = base_url
-
+class BlockrIOBroadcaster(HttpProvider):
     def broadcast_tx(self, tx):
         hextx = to_hex(tx)
         url = self.base_url + '/tx/push'
-        response = requests.post(url, json={'hex': hextx})
+        response = self.session.post(url, json={'hex': hextx}, timeout=PROVIDER_TIMEOUT)
         if int(response.status_code) == 200:
             tx_id = response.json().get('data', None)
             return tx_id
         logging.error('Error broadcasting the transaction through the Blockr.IO API. Error msg: %s', response.text)
+        if int(response.status_code) == REJECTED_STATUS_CODE:
+            raise TransactionRejectedError(response.text)
         raise BroadcastError(response.text)
 
 
+class MempoolSpaceFeeEstimator(HttpProvider):
+    """
+    Fee rates recommended by the mempool.space API, in satoshis per virtual byte
+    """
+
+    # the recommended rate used for confirmation targets up to the given number of blocks
+    TARGETS = ((1, 'fastestFee'), (3, 'halfHourFee'), (6, 'hourFee'), (None, 'economyFee'))
+
+    def estimate_fee(self, target_blocks):
+        response = try_get(self.base_url + '/v1/fees/recommended', self.session)
+        fees = response.json()
+        for max_target_blocks, key in self.TARGETS:
+            if max_target_blocks is None or target_blocks <= max_target_blocks:
+                return fees[key]
+
+
+# sendrawtransaction error codes
+RPC_VERIFY_ERROR = -25
+RPC_VERIFY_REJECTED = -26
+RPC_VERIFY_ALREADY_IN_CHAIN = -27
+
+
 class BitcoindConnector(object):
     def __init__(self, netcode):
         self.netcode = netcode
 
+    def estimate_fee(self, target_blocks):
+        """
+        :return: estimatesmartfee's fee rate for confirmation within target_blocks, in satoshis per byte
+        """
+        import bitcoin.rpc
+
+        estimate = bitcoin.rpc.Proxy().call('estimatesmartfee', target_blocks)
+        if 'feerate' not in estimate:
+            raise ConnectorError('estimatesmartfee failed: {}'.format(estimate.get('errors')))
+        # BTC per kilobyte
+        return estimate['feerate'] * tx_utils.COIN / 1000
+
     def broadcast_tx(self, transaction):
+        import bitcoin.rpc
+        from bitcoin.core import CTransaction
+
         as_hex = transaction.as_hex()
-        transaction = CTransaction.deserialize(h2b(as_hex))
-        tx_id = bitcoin.rpc.Proxy().sendrawtransaction(transaction)
+        try:
+            tx_id = bitcoin.rpc.Proxy().sendrawtransaction(CTransaction.deserialize(h2b(as_hex)))
+        except bitcoin.rpc.JSONRPCError as e:
+            code = e.error.get('code')
+            if code == RPC_VERIFY_ALREADY_IN_CHAIN:
+                return transaction.id()
+            if code in (RPC_VERIFY_ERROR, RPC_VERIFY_REJECTED):
+                raise TransactionRejectedError(e.error.get('message'))
+            raise
         # reverse endianness for bitcoind
         return b2h_rev(tx_id)
 
+    def tx_for_tx_hash(self, tx_hash):
+        """
+        :return: pycoin Tx, or None if bitcoind does not know the transaction
+        """
+        import bitcoin.rpc
+        from pycoin.tx.Tx import Tx
+
+        try:
+            transaction = bitcoin.rpc.Proxy().getrawtransaction(tx_hash)
+        except IndexError:
+            return None
+        return Tx.from_bin(transaction.serialize())
+
     def spendables_for_address(self, address):
         """
         Converts to pycoin Spendable type
         :param address:
         :return: list of Spendables
         """
+        import bitcoin.rpc
+        from pycoin.tx.Spendable import Spendable
+
         unspent_outputs = bitcoin.rpc.Proxy().listunspent(addrs=[address])
         logging.debug('spendables_for_address %s', address)
 
@@ -195,31 +382,63 @@ class ServiceProviderConnector(object):
         pass
 
 class EthereumServiceProviderConnector(ServiceProviderConnector):
-    #param local_node indicates if a local node is running or if the tx should be broadcast to external providers 
-    def __init__(self, ethereum_chain, api_key, local_node=False):
+    #param rpc_url: JSON-RPC endpoint of an Ethereum node, used instead of the external providers if set
+    #param health: ProviderHealthRegistry routing reads to the healthiest provider; defaults to the shared one
+    def __init__(self, ethereum_chain, api_key, rpc_url=None, health=None):
         self.ethereum_chain = ethereum_chain
         self.api_key = api_key
-        self.local_node = local_node
-    
+        self.rpc_url = rpc_url
+        self.health = health or health_registry
+
+    def get_providers(self):
+        return get_providers_for_chain(self.ethereum_chain, ethereum_rpc_url=self.rpc_url)
+
     def get_balance(self, address):
-        for m in get_providers_for_chain(self.ethereum_chain, self.local_node):
-            if isinstance(m, BitcoindConnector):
+        for m in self.health.rank(self.get_providers()):
+            try:
+                logging.debug('m=%s', m)
+                balance = self.health.call(m, m.get_balance, address, self.api_key)
+                return balance
+            except Exception as e:
+                logging.warning(e)
                 pass
-            else:    
-                try:
-                    logging.debug('m=%s', m)
-                    balance = m.get_balance(address, self.api_key)
-                    return balance
-                except Exception as e:
-                    logging.warning(e)
-                    pass            
         return 0
 
-    def get_address_nonce(self, address):
-        for m in get_providers_for_chain(self.ethereum_chain, self.local_node):
+    def get_account_state(self, address):
+        """
+        :return: AccountState of the address, in one request to providers that support it
+        """
+        last_exception = None
+        for m in self.health.rank(self.get_providers()):
+            try:
+                logging.debug('m=%s', m)
+                return self.health.call(m, m.get_account_state, address, self.api_key)
+            except Exception as e:
+                logging.warning(e)
+                last_exception = e
+        raise ConnectorError('Failed to look up the state of {} through any provider: {}'.format(
+            address, last_exception))
+
+    def get_gas_price(self):
+        last_exception = None
+        for m in self.health.rank(self.get_providers()):
+            try:
+                logging.debug('m=%s', m)
+                return self.health.call(m, m.get_gas_price, self.api_key)
+            except Exception as e:
+                logging.warning(e)
+                last_exception = e
+        raise ConnectorError('Failed to look up the gas price through any provider: {}'.format(last_exception))
+
+    def get_address_nonce(self, address, pending=False):
+        """
+        :param pending: count the address's transactions waiting to be mined, not only the mined ones
+        """
+        tag = 'pending' if pending else 'latest'
+        for m in self.health.rank(self.get_providers()):
             try:
                 logging.debug('m=%s', m)
-                nonce = m.get_address_nonce(address, self.api_key)
+                nonce = self.health.call(m, m.get_address_nonce, address, self.api_key, tag)
                 return nonce
             except Exception as e:
                 logging.warning(e)
@@ -227,28 +446,57 @@ class EthereumServiceProviderConnector(ServiceProviderConnector):
         return 0
 
     def broadcast_tx(self, tx):
-        for m in get_providers_for_chain(self.ethereum_chain, self.local_node):
+        last_exception = None
+        rejected = True
+        for m in self.get_providers():
             try:
                 logging.debug('m=%s', m)
                 txid = m.broadcast_tx(tx, self.api_key)
                 return txid
             except Exception as e:
                 logging.warning(e)
-                pass
-        ##in case of failure:
-        return '0xfail'
+                last_exception = e
+                rejected = rejected and isinstance(e, TransactionRejectedError)
+        if rejected and last_exception:
+            # every provider refused it, so it cannot have been sent
+            raise TransactionRejectedError('Every provider rejected the transaction: {}'.format(last_exception))
+        raise BroadcastError('Failed to broadcast the transaction through any provider: {}'.format(last_exception))
+
+    def is_transaction_known(self, tx_id):
+        """
+        :return: True if the transaction is pending or mined, False if it is not known
+        """
+        last_exception = None
+        for m in self.health.rank(self.get_providers()):
+            try:
+                logging.debug('m=%s', m)
+                return self.health.call(m, m.get_transaction, tx_id, self.api_key) is not None
+            except Exception as e:
+                logging.warning(e)
+                last_exception = e
+        raise ConnectorError('Failed to look up transaction {} through any provider: {}'.format(
+            tx_id, last_exception))
          
 
 class BitcoinServiceProviderConnector(ServiceProviderConnector):
-    def __init__(self, bitcoin_chain, bitcoind=False):
+    def __init__(self, bitcoin_chain, bitcoind=False, health=None):
+        """
+        :param bitcoin_chain:
+        :param bitcoind: use the local bitcoind instead of the API providers
+        :param health: ProviderHealthRegistry routing reads to the healthiest provider; defaults to the shared one
+        """
         self.bitcoin_chain = bitcoin_chain
         self.bitcoind = bitcoind
+        self.health = health or health_registry
 
     def spendables_for_address(self, bitcoin_address):
-        for m in service_provider_methods('spendables_for_address', get_providers_for_chain(self.bitcoin_chain, self.bitcoind)):
+        from pycoin.services.providers import service_provider_methods
+
+        providers = get_providers_for_chain(self.bitcoin_chain, self.bitcoind)
+        for m in service_provider_methods('spendables_for_address', self.health.rank(providers)):
             try:
                 logging.debug('m=%s', m)
-                spendables = m(bitcoin_address)
+                spendables = self.health.call(m.__self__, m, bitcoin_address)
                 return spendables
             except Exception as e:
                 logging.warning(e)
@@ -281,6 +529,21 @@ class BitcoinServiceProviderConnector(ServiceProviderConnector):
         balance = sum(s.coin_value for s in spendables)
         return balance
 
+    def estimate_fee(self, target_blocks):
+        """
+        :param target_blocks: number of blocks the transaction should be confirmed within
+        :return: fee rate in satoshis per byte
+        """
+        last_exception = None
+        for m in self.health.rank(get_fee_estimators_for_chain(self.bitcoin_chain, self.bitcoind)):
+            try:
+                logging.debug('m=%s', m)
+                return self.health.call(m, m.estimate_fee, target_blocks)
+            except Exception as e:
+                logging.warning(e)
+                last_exception = e
+        raise ConnectorError('Failed to estimate the fee through any provider: {}'.format(last_exception))
+
     def broadcast_tx(self, tx):
         """
         Broadcast the transaction through the configured set of providers
@@ -290,6 +553,36 @@ class BitcoinServiceProviderConnector(ServiceProviderConnector):
         """
         return BitcoinServiceProviderConnector.broadcast_tx_with_chain(tx, self.bitcoin_chain, self.bitcoind)
 
+    def is_transaction_known(self, tx_id):
+        """
+        :return: True if the transaction is in the mempool or mined, False if the providers that could be asked do not
+        know it
+        """
+        from pycoin.services.providers import service_provider_methods
+
+        providers = get_providers_for_chain(self.bitcoin_chain, self.bitcoind)
+        answered = False
+        last_exception = None
+        for m in service_provider_methods('tx_for_tx_hash', self.health.rank(providers)):
+            try:
+                logging.debug('m=%s', m)
+                if self.health.call(m.__self__, m, h2b_rev(tx_id)) is not None:
+                    return True
+                answered = True
+            except HTTPError as e:
+                if e.code != 404:
+                    logging.warning(e)
+                    last_exception = e
+                    continue
+                answered = True
+            except Exception as e:
+                logging.warning(e)
+                last_exception = e
+        if answered:
+            return False
+        raise ConnectorError('Failed to look up transaction {} through any provider: {}'.format(
+            tx_id, last_exception))
+
     @staticmethod
     def broadcast_tx_with_chain(tx, bitcoin_chain, bitcoind=False):
         """
@@ -299,32 +592,22 @@ class BitcoinServiceProviderConnector(ServiceProviderConnector):
         :param bitcoin_chain:
         :return:
         """
+        from pycoin.services.providers import service_provider_methods
+
         last_exception = None
-        final_tx_id = None
 
         # Unlike other providers, we want to broadcast to all available apis
         for attempt_number in range(0, MAX_BROADCAST_ATTEMPTS):
-            for method_provider in service_provider_methods('broadcast_tx',
-                                                            get_providers_for_chain(bitcoin_chain, bitcoind)):
-                try:
-                    tx_id = method_provider(tx)
-                    if tx_id:
-                        logging.info('Broadcasting succeeded with method_provider=%s, txid=%s', str(method_provider),
-                                     tx_id)
-                        if final_tx_id and final_tx_id != tx_id:
-                            logging.error(
-                                'This should never happen; fail and investigate if it does. Got conflicting tx_ids=%s and %s. Hextx=%s',
-                                final_tx_id, tx_id, tx.as_hex())
-                            raise Exception('Got conflicting tx_ids.')
-                        final_tx_id = tx_id
-                except Exception as e:
-                    logging.warning('Caught exception trying provider %s. Trying another. Exception=%s',
-                                    str(method_provider), e)
-                    last_exception = e
+            method_providers = service_provider_methods('broadcast_tx', get_providers_for_chain(bitcoin_chain, bitcoind))
+            tx_id, exception = broadcast_to_all(tx, method_providers)
             # At least 1 provider succeeded, so return
-            if final_tx_id:
-                return final_tx_id
-            else:
+            if tx_id:
+                return tx_id
+            if isinstance(exception, TransactionRejectedError):
+                # retrying cannot change the providers' minds
+                raise exception
+            last_exception = exception or last_exception
+            if attempt_number + 1 < MAX_BROADCAST_ATTEMPTS:
                 logging.warning('Broadcasting failed. Waiting before retrying. This is attempt number %d',
                                 attempt_number)
                 time.sleep(BROADCAST_RETRY_INTERVAL)
@@ -333,43 +616,130 @@ class BitcoinServiceProviderConnector(ServiceProviderConnector):
         raise BroadcastError(last_exception)
 
 
+def broadcast_to_all(tx, method_providers, timeout=None):
+    """
+    Broadcasts the transaction through all providers at once, and returns as soon as one of them succeeds. The txids
+    returned by the other providers are still checked for conflicts as they come in.
+
+    :param tx:
+    :param method_providers: broadcast_tx methods of the providers
+    :param timeout: seconds to wait for a provider to succeed; defaults to BROADCAST_TIMEOUT
+    :return: (txid, or None if no provider succeeded; the last exception raised by a provider, which is a
+    TransactionRejectedError only if every provider rejected the transaction)
+    """
+    if not method_providers:
+        return None, None
+    timeout = BROADCAST_TIMEOUT if timeout is None else timeout
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=len(method_providers))
+    futures = collections.OrderedDict((executor.submit(method_provider, tx), method_provider)
+                                      for method_provider in method_providers)
+    # a provider that is slow to respond must not hold up the caller
+    executor.shutdown(wait=False)
+
+    tx_id = None
+    last_exception = None
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            try:
+                tx_id = future.result()
+            except Exception as e:
+                logging.warning('Caught exception trying provider %s. Trying another. Exception=%s',
+                                str(futures[future]), e)
+                # unless every provider rejected it, the transaction may have been sent whatever the others say
+                if last_exception is None or isinstance(last_exception, TransactionRejectedError):
+                    last_exception = e
+                continue
+            if tx_id:
+                logging.info('Broadcasting succeeded with method_provider=%s, txid=%s in %.2fs',
+                             str(futures[future]), tx_id, time.perf_counter() - start)
+                break
+            if last_exception is None or isinstance(last_exception, TransactionRejectedError):
+                last_exception = BroadcastError('{} returned no txid'.format(futures[future]))
+    except TimeoutError:
+        logging.warning('No provider broadcast the transaction within %ss', timeout)
+        last_exception = BroadcastError('Broadcast timed out after {}s'.format(timeout))
+
+    if tx_id:
+        for future, method_provider in futures.items():
+            future.add_done_callback(functools.partial(_check_txid_conflict, tx, tx_id, method_provider))
+    return tx_id, last_exception
+
+
+def _check_txid_conflict(tx, tx_id, method_provider, future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    other_tx_id = future.result()
+    if other_tx_id and other_tx_id != tx_id:
+        logging.error('This should never happen; fail and investigate if it does. Got conflicting tx_ids=%s and %s '
+                      'from method_provider=%s. Hextx=%s', tx_id, other_tx_id, str(method_provider), to_hex(tx))
+
+
 PYCOIN_BTC_PROVIDERS = "blockchain.info blockexplorer.com blockcypher.com chain.so"
 PYCOIN_XTN_PROVIDERS = "blockexplorer.com"  # chain.so
 
-# initialize connectors
-connectors = {}
+
+def create_bitcoin_mainnet_providers():
+    from pycoin.services import providers
+    from pycoin.services.chain_so import ChainSoProvider
+    from pycoin.services.insight import InsightProvider
+
+    provider_list = providers.providers_for_config_string(PYCOIN_BTC_PROVIDERS,
+                                                          helpers.to_pycoin_chain(Chain.bitcoin_mainnet))
+    provider_list.append(BlockrIOBroadcaster('https://btc.blockr.io/api/v1'))
+    provider_list.append(BlockExplorerBroadcaster('https://blockexplorer.com/api'))
+    provider_list.append(InsightProvider(netcode=helpers.to_pycoin_chain(Chain.bitcoin_mainnet)))
+    provider_list.append(ChainSoProvider(netcode=helpers.to_pycoin_chain(Chain.bitcoin_mainnet)))
+    return provider_list
 
 
-# configure mainnet providers
-provider_list = providers.providers_for_config_string(PYCOIN_BTC_PROVIDERS, helpers.to_pycoin_chain(Chain.bitcoin_mainnet))
-provider_list.append(BlockrIOBroadcaster('https://btc.blockr.io/api/v1'))
-provider_list.append(BlockExplorerBroadcaster('https://blockexplorer.com/api'))
-provider_list.append(InsightProvider(netcode=helpers.to_pycoin_chain(Chain.bitcoin_mainnet)))
-provider_list.append(ChainSoProvider(netcode=helpers.to_pycoin_chain(Chain.bitcoin_mainnet)))
-connectors[Chain.bitcoin_mainnet] = provider_list
+def create_bitcoin_testnet_providers():
+    from pycoin.services import providers
+    from pycoin.services.chain_so import ChainSoProvider
 
+    xtn_provider_list = providers.providers_for_config_string(PYCOIN_XTN_PROVIDERS,
+                                                              helpers.to_pycoin_chain(Chain.bitcoin_testnet))
+    xtn_provider_list.append(ChainSoProvider(netcode=helpers.to_pycoin_chain(Chain.bitcoin_testnet)))
+    xtn_provider_list.append(BlockrIOBroadcaster('https://tbtc.blockr.io/api/v1'))
+    xtn_provider_list.append(BlockExplorerBroadcaster('https://testnet.blockexplorer.com/api'))
+    return xtn_provider_list
 
-# configure testnet providers
-xtn_provider_list = providers.providers_for_config_string(PYCOIN_XTN_PROVIDERS, helpers.to_pycoin_chain(Chain.bitcoin_testnet))
-xtn_provider_list.append(ChainSoProvider(netcode=helpers.to_pycoin_chain(Chain.bitcoin_testnet)))
-xtn_provider_list.append(BlockrIOBroadcaster('https://tbtc.blockr.io/api/v1'))
-xtn_provider_list.append(BlockExplorerBroadcaster('https://testnet.blockexplorer.com/api'))
-connectors[Chain.bitcoin_testnet] = xtn_provider_list
 
-#Configure Ethereum mainnet connectors 
-eth_provider_list = []
-eth_provider_list.append(EtherscanBroadcaster('https://api.etherscan.io/api'))
-connectors[Chain.ethereum_mainnet] = eth_provider_list
+# Providers are created the first time a chain is used, so a run only pays for the selected chain's
+provider_factories = {
+    Chain.bitcoin_mainnet: create_bitcoin_mainnet_providers,
+    Chain.bitcoin_testnet: create_bitcoin_testnet_providers,
+    Chain.ethereum_mainnet: lambda: [EtherscanBroadcaster('https://api.etherscan.io/api')],
+    Chain.ethereum_ropsten: lambda: [EtherscanBroadcaster('https://ropsten.etherscan.io/api')],
+}
 
-#Configure Ethereum Ropsten testnet connectors
-rop_provider_list = []
-rop_provider_list.append(EtherscanBroadcaster('https://ropsten.etherscan.io/api'))
-connectors[Chain.ethereum_ropsten] = rop_provider_list
+fee_estimator_factories = {
+    Chain.bitcoin_mainnet: lambda: [MempoolSpaceFeeEstimator('https://mempool.space/api')],
+    Chain.bitcoin_testnet: lambda: [MempoolSpaceFeeEstimator('https://mempool.space/testnet/api')],
+}
+
+# initialized connectors, by chain
+connectors = {}
 
 
-def get_providers_for_chain(chain, bitcoind=False):
+def get_providers_for_chain(chain, bitcoind=False, ethereum_rpc_url=None):
+    if ethereum_rpc_url:
+        if (chain, ethereum_rpc_url) not in connectors:
+            connectors[(chain, ethereum_rpc_url)] = [EthereumJsonRpcProvider(ethereum_rpc_url)]
+        return connectors[(chain, ethereum_rpc_url)]
     if bitcoind:
-        return [BitcoindConnector(helpers.to_pycoin_chain(chain))]
-    else:
-        return connectors[chain]
+        # kept, like the provider lists, so its health is tracked across calls
+        if (chain, 'bitcoind') not in connectors:
+            connectors[(chain, 'bitcoind')] = [BitcoindConnector(helpers.to_pycoin_chain(chain))]
+        return connectors[(chain, 'bitcoind')]
+    if chain not in connectors:
+        connectors[chain] = provider_factories[chain]()
+    return connectors[chain]
 
+
+def get_fee_estimators_for_chain(chain, bitcoind=False):
+    if bitcoind:
+        return get_providers_for_chain(chain, bitcoind)
+    if (chain, 'fees') not in connectors:
+        connectors[(chain, 'fees')] = fee_estimator_factories[chain]()
+    return connectors[(chain, 'fees')]
@@ -0,0 +1,447 @@
+"""
+Long-running issuer. Certificates are accepted over a local HTTP endpoint or from a spool directory, accumulated into
+batches, and issued with the same handlers, JSON-LD caches and connectors for the life of the process, instead of
+paying for the CLI's startup on every batch.
+
+HTTP API:
+    POST /certificates          body: an unsigned certificate. Responds 202 with {"id": <id>}. The id can be chosen by
+                                adding ?id=<id>; ids may contain letters, digits, '.', '_' and '-'.
+    GET /certificates/<id>      200 with the blockchain certificate once it is issued, 202 with {"status": "pending"}
+                                until then, 500 with {"status": "failed", "error": ...} if issuing it failed, or 404.
+    GET /providers              latency and error rate averages of the blockchain API providers, and whether their
+                                circuit breaker is open.
+
+Spool directory: each <id>.json file put in spool_dir is submitted with that id. Write files under another name (e.g.
+starting with '.') and rename them into place, so partially written files are not picked up.
+
+A batch is issued once it has batch_size certificates, or batch_window_seconds after its first certificate arrived.
+With anchor_workers above 1, that many batches are issued at the same time, if the transaction handler supports it
+(on Ethereum chains, or on Bitcoin chains with a UTXO pool).
+Without safe mode, the key is loaded when the first batch is signed, and kept loaded until the daemon stops.
+Blockchain certificates are written to blockchain_certificates_dir as <id>.json. Batches interrupted by a restart are
+resumed from their journal by the batching threads, ahead of new batches, while new certificates are accepted. A
+certificate is only set aside in failed_dir if it fails schema validation or has unmapped fields. A batch that fails
+before it is broadcast for any other reason, e.g. because a provider or a JSON-LD context timed out, is kept and
+retried with exponential backoff.
+"""
+import collections
+import copy
+import json
+import logging
+import os
+import re
+import shutil
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cert_issuer import helpers
+from cert_issuer.batch_journal import BatchJournal, JOURNAL_FILE_NAME
+from cert_issuer.provider_health import health_registry
+
+DAEMON_DIR = 'daemon'
+INTAKE_DIR = 'intake'
+FAILED_DIR = 'failed'
+BATCH_DIR_PREFIX = 'batch_'
+BATCH_WORK_DIR = 'work'
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_WINDOW_SECONDS = 60
+SPOOL_POLL_SECONDS = 1
+# backoff between attempts at a batch that failed before it was broadcast
+RETRY_INITIAL_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+STATUS_PENDING = 'pending'
+STATUS_FAILED = 'failed'
+
+VALID_ID = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class IssuanceDaemon(object):
+    def __init__(self, app_config, certificate_batch_handler, transaction_handler, batch_size=DEFAULT_BATCH_SIZE,
+                 window_seconds=DEFAULT_WINDOW_SECONDS, spool_dir=None, anchor_workers=1):
+        """
+        :param app_config: configuration for issue_certificates.issue; each batch is issued with a copy pointing at
+        the batch's own directories
+        :param certificate_batch_handler:
+        :param transaction_handler:
+        :param batch_size: maximum number of certificates per batch
+        :param window_seconds: maximum time a certificate waits for its batch to fill up
+        :param spool_dir: optional directory polled for certificates
+        :param anchor_workers: number of batches issued at the same time
+        """
+        self.app_config = app_config
+        self.certificate_batch_handler = certificate_batch_handler
+        self.transaction_handler = transaction_handler
+        self.batch_size = batch_size
+        self.window_seconds = window_seconds
+        self.spool_dir = spool_dir
+        self.anchor_workers = anchor_workers
+
+        self.daemon_dir = os.path.join(app_config.work_dir, DAEMON_DIR)
+        self.intake_dir = os.path.join(self.daemon_dir, INTAKE_DIR)
+        self.failed_dir = os.path.join(self.daemon_dir, FAILED_DIR)
+        self.blockchain_certificates_dir = app_config.blockchain_certificates_dir
+
+        self.condition = threading.Condition()
+        # id -> time the certificate was accepted, for certificates waiting for a batch
+        self.pending = collections.OrderedDict()
+        # ids in the batches being issued
+        self.issuing = set()
+        # (batch dir, ids) of the batches interrupted by a restart, waiting to be resumed
+        self.resuming = collections.deque()
+        # id -> error message
+        self.failed = {}
+        self.stopping = False
+        self.threads = []
+
+    def start(self):
+        """
+        Queues interrupted batches to be resumed, re-queues accepted certificates, and starts the batching and spool
+        threads. Returns without waiting for the interrupted batches, so certificates can be accepted meanwhile.
+        :return:
+        """
+        for directory in [self.intake_dir, self.failed_dir, self.blockchain_certificates_dir]:
+            os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(self.daemon_dir)):
+            if name.startswith(BATCH_DIR_PREFIX):
+                batch_dir = os.path.join(self.daemon_dir, name)
+                ids = [file_name[:-len(helpers.JSON_EXT)]
+                       for file_name in os.listdir(os.path.join(batch_dir, helpers.UNSIGNED_CERTIFICATES_DIR))]
+                self.resuming.append((batch_dir, ids))
+                self.issuing.update(ids)
+        for name in sorted(os.listdir(self.intake_dir)):
+            if name.endswith(helpers.JSON_EXT):
+                self.pending[name[:-len(helpers.JSON_EXT)]] = time.monotonic()
+
+        for number in range(0, self.anchor_workers):
+            self.threads.append(threading.Thread(target=self.run_batches, name='batcher-{}'.format(number),
+                                                 daemon=True))
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self.threads.append(threading.Thread(target=self.run_spool, name='spool', daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Issues the certificates already accepted, then stops the threads
+        :return:
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def submit(self, certificate, certificate_id=None):
+        """
+        Accepts a certificate for the next batch.
+        :param certificate: unsigned certificate, as bytes of JSON or parsed
+        :param certificate_id: optional id; one is generated otherwise
+        :return: the certificate's id
+        """
+        if isinstance(certificate, bytes):
+            certificate = json.loads(certificate.decode('utf-8'))
+        if not isinstance(certificate, dict):
+            raise ValueError('A certificate must be a JSON object')
+        certificate_id = certificate_id or str(uuid.uuid4())
+        if not VALID_ID.match(certificate_id):
+            raise ValueError('Invalid certificate id {}'.format(certificate_id))
+
+        with self.condition:
+            # a certificate that failed can be submitted again
+            if self.get_status(certificate_id)[0] not in (404, 500):
+                raise KeyError('Certificate {} was already submitted'.format(certificate_id))
+            self.failed.pop(certificate_id, None)
+            _write_atomically(os.path.join(self.intake_dir, certificate_id + helpers.JSON_EXT),
+                              json.dumps(certificate))
+            self.pending[certificate_id] = time.monotonic()
+            self.condition.notify_all()
+        return certificate_id
+
+    def get_status(self, certificate_id):
+        """
+        :param certificate_id:
+        :return: (HTTP status, response document)
+        """
+        if not VALID_ID.match(certificate_id):
+            return 404, None
+        try:
+            with open(os.path.join(self.blockchain_certificates_dir, certificate_id + helpers.JSON_EXT)) as cert_file:
+                return 200, json.load(cert_file)
+        except FileNotFoundError:
+            pass
+        if certificate_id in self.pending or certificate_id in self.issuing:
+            return 202, {'status': STATUS_PENDING}
+        if certificate_id in self.failed:
+            return 500, {'status': STATUS_FAILED, 'error': self.failed[certificate_id]}
+        return 404, None
+
+    def run_batches(self):
+        while True:
+            with self.condition:
+                while not self.resuming and not self._is_batch_ready():
+                    if self.stopping and not self.pending:
+                        return
+                    self.condition.wait(self._get_wait_seconds())
+                if self.resuming:
+                    batch_dir, ids = self.resuming.popleft()
+                else:
+                    batch_dir, ids = None, []
+                    while self.pending and len(ids) < self.batch_size:
+                        ids.append(self.pending.popitem(last=False)[0])
+                    self.issuing.update(ids)
+            try:
+                if batch_dir:
+                    logging.info('Resuming interrupted batch %s', batch_dir)
+                    self._issue_batch_dir(batch_dir)
+                else:
+                    self.issue_batch(ids)
+            finally:
+                with self.condition:
+                    self.issuing.difference_update(ids)
+
+    def run_spool(self):
+        while True:
+            with self.condition:
+                if self.stopping:
+                    return
+            for entry in sorted(os.listdir(self.spool_dir)):
+                if entry.startswith('.') or not entry.endswith(helpers.JSON_EXT):
+                    continue
+                file_name = os.path.join(self.spool_dir, entry)
+                try:
+                    with open(file_name, 'rb') as spool_file:
+                        self.submit(spool_file.read(), entry[:-len(helpers.JSON_EXT)])
+                except (ValueError, KeyError) as e:
+                    logging.error('Rejected spooled certificate %s: %s', entry, e)
+                    os.replace(file_name, os.path.join(self.failed_dir, entry))
+                    continue
+                os.remove(file_name)
+            with self.condition:
+                self.condition.wait(SPOOL_POLL_SECONDS)
+
+    def issue_batch(self, ids):
+        """
+        Issues the certificates in a batch of their own. If the batch fails before it is broadcast, the certificates
+        that fail to validate are set aside and the others are issued again, after a backoff if none were invalid.
+        :param ids:
+        :return:
+        """
+        batch_dir = os.path.join(self.daemon_dir, '{}{}'.format(BATCH_DIR_PREFIX, uuid.uuid4().hex))
+        unsigned_certs_dir = os.path.join(batch_dir, helpers.UNSIGNED_CERTIFICATES_DIR)
+        os.makedirs(unsigned_certs_dir)
+        for certificate_id in ids:
+            file_name = certificate_id + helpers.JSON_EXT
+            os.replace(os.path.join(self.intake_dir, file_name), os.path.join(unsigned_certs_dir, file_name))
+        self._issue_batch_dir(batch_dir)
+
+    def _issue_batch_dir(self, batch_dir):
+        unsigned_certs_dir = os.path.join(batch_dir, helpers.UNSIGNED_CERTIFICATES_DIR)
+        ids = [name[:-len(helpers.JSON_EXT)] for name in os.listdir(unsigned_certs_dir)]
+        start = time.perf_counter()
+        retry_seconds = RETRY_INITIAL_SECONDS
+        while True:
+            try:
+                tx_id = self._issue_directory(batch_dir)
+                break
+            except Exception as e:
+                logging.error('Issuing batch %s failed: %s', batch_dir, e, exc_info=True)
+                if self._was_broadcast(batch_dir):
+                    # the certificates are paid for; keep the batch to resume when the daemon restarts
+                    self._mark_failed(ids, 'Issuing failed after broadcast; the batch resumes when the daemon '
+                                           'restarts')
+                    return
+                try:
+                    invalid_ids = self._set_aside_invalid(unsigned_certs_dir, ids)
+                except Exception as validation_error:
+                    # the certificates could not be validated, which does not make them invalid
+                    logging.error('Validating the certificates of batch %s failed: %s', batch_dir, validation_error)
+                    invalid_ids = []
+                ids = [certificate_id for certificate_id in ids if certificate_id not in invalid_ids]
+                if not ids:
+                    shutil.rmtree(batch_dir)
+                    return
+                # nothing was paid for, so the journaled batch is discarded rather than resumed
+                shutil.rmtree(os.path.join(batch_dir, BATCH_WORK_DIR), ignore_errors=True)
+                if invalid_ids:
+                    # the valid certificates are issued again straight away
+                    continue
+                # the failure was not the certificates', e.g. a provider timed out, so the batch is kept and retried
+                with self.condition:
+                    if not self.stopping:
+                        logging.warning('Retrying batch %s in %ds', batch_dir, retry_seconds)
+                        self.condition.wait(retry_seconds)
+                    if self.stopping:
+                        self._mark_failed(ids, 'Issuing failed: {}; the batch is retried when the daemon restarts'
+                                          .format(e))
+                        return
+                retry_seconds = min(retry_seconds * 2, RETRY_MAX_SECONDS)
+        logging.info('Issued %d certificates in %.2fs with txid %s', len(ids), time.perf_counter() - start, tx_id)
+        shutil.rmtree(batch_dir)
+
+    def _issue_directory(self, batch_dir):
+        # imported here, since issue_certificates imports the modules that the daemon keeps warm
+        from cert_issuer.issue_certificates import issue
+
+        batch_config = copy.copy(self.app_config)
+        batch_config.unsigned_certificates_dir = os.path.join(batch_dir, helpers.UNSIGNED_CERTIFICATES_DIR)
+        batch_config.signed_certificates_dir = os.path.join(batch_dir, helpers.SIGNED_CERTIFICATES_DIR)
+        batch_config.work_dir = os.path.join(batch_dir, BATCH_WORK_DIR)
+        batch_config.streaming = False
+        batch_config.tenants = False
+        batch_config.sign_ahead = False
+        batch_config.batch_size = 0
+        batch_config.batch_max_bytes = 0
+        batch_config.batch_max_seconds = 0
+        return issue(batch_config, self.certificate_batch_handler, self.transaction_handler)
+
+    def _was_broadcast(self, batch_dir):
+        journal_path = os.path.join(batch_dir, BATCH_WORK_DIR, JOURNAL_FILE_NAME)
+        if not os.path.exists(journal_path):
+            return False
+        journal = BatchJournal(journal_path)
+        try:
+            batch = journal.get_batch()
+            return batch is not None and batch.signed_tx is not None
+        finally:
+            journal.close()
+
+    def _set_aside_invalid(self, unsigned_certs_dir, ids):
+        """
+        Moves the certificates that are invalid to failed_dir. Propagates errors that stop them from being validated.
+        :return: their ids
+        """
+        certificates = collections.OrderedDict(
+            (certificate_id, helpers.CertificateMetadata(certificate_id, unsigned_certs_dir, None, unsigned_certs_dir,
+                                                         self.blockchain_certificates_dir))
+            for certificate_id in ids)
+        errors = self.certificate_batch_handler.new_batch(certificates).get_validation_errors()
+        for certificate_id, error in errors.items():
+            self._mark_failed([certificate_id], error)
+            file_name = certificate_id + helpers.JSON_EXT
+            os.replace(os.path.join(unsigned_certs_dir, file_name), os.path.join(self.failed_dir, file_name))
+        return list(errors)
+
+    def _mark_failed(self, ids, error):
+        with self.condition:
+            for certificate_id in ids:
+                self.failed[certificate_id] = error
+
+    def _is_batch_ready(self):
+        if not self.pending:
+            return False
+        if self.stopping or len(self.pending) >= self.batch_size:
+            return True
+        first_accepted = next(iter(self.pending.values()))
+        return time.monotonic() - first_accepted >= self.window_seconds
+
+    def _get_wait_seconds(self):
+        if not self.pending:
+            return None
+        first_accepted = next(iter(self.pending.values()))
+        return max(0, self.window_seconds - (time.monotonic() - first_accepted))
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/certificates':
+            return self._respond(404, {'error': 'Not found'})
+        certificate_id = parse_qs(url.query).get('id', [None])[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            certificate_id = self.server.issuance_daemon.submit(body, certificate_id)
+        except KeyError as e:
+            return self._respond(409, {'error': e.args[0]})
+        except ValueError as e:
+            return self._respond(400, {'error': str(e)})
+        self._respond(202, {'id': certificate_id})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.rstrip('/') == '/providers':
+            return self._respond(200, health_registry.get_stats())
+        prefix = '/certificates/'
+        if not path.startswith(prefix):
+            return self._respond(404, {'error': 'Not found'})
+        status, document = self.server.issuance_daemon.get_status(path[len(prefix):])
+        self._respond(status, document if document is not None else {'error': 'Not found'})
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+    def _respond(self, status, document):
+        body = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DaemonHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, issuance_daemon):
+        super().__init__(server_address, DaemonRequestHandler)
+        self.issuance_daemon = issuance_daemon
+
+
+def _write_atomically(file_name, content):
+    temp_file_name = os.path.join(os.path.dirname(file_name), '.' + os.path.basename(file_name))
+    with open(temp_file_name, 'w') as temp_file:
+        temp_file.write(content)
+    os.replace(temp_file_name, file_name)
+
+
+def serve(app_config, certificate_batch_handler, transaction_handler):
+    """
+    Runs the daemon until interrupted
+    :return:
+    """
+    anchor_workers = app_config.anchor_workers
+    if anchor_workers > 1 and not transaction_handler.supports_concurrent_transactions():
+        logging.warning('Issuing one batch at a time: transactions on %s cannot be issued concurrently unless '
+                        'utxo_pool_size is set', app_config.chain.name)
+        anchor_workers = 1
+    issuance_daemon = IssuanceDaemon(app_config, certificate_batch_handler, transaction_handler,
+                                     batch_size=app_config.batch_size or DEFAULT_BATCH_SIZE,
+                                     window_seconds=app_config.batch_window_seconds,
+                                     spool_dir=app_config.spool_dir,
+                                     anchor_workers=anchor_workers)
+    from cert_issuer.issue_certificates import create_signing_session
+
+    # the batches join the daemon's signing session, so the key is loaded once while the daemon runs
+    with create_signing_session(app_config, certificate_batch_handler):
+        issuance_daemon.start()
+        server = DaemonHTTPServer((app_config.daemon_host, app_config.daemon_port), issuance_daemon)
+        logging.info('Accepting certificates on http://%s:%d/certificates', app_config.daemon_host,
+                     server.server_address[1])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            logging.info('Issuing the certificates already accepted before stopping')
+            issuance_daemon.stop()
+
+
+def daemon_main(args=None):
+    from cert_issuer import config
+    from cert_issuer.issue_certificates import create_handlers
+
+    app_config = config.get_config()
+    certificate_batch_handler, transaction_handler = create_handlers(app_config)
+    serve(app_config, certificate_batch_handler, transaction_handler)
+
+
+if __name__ == '__main__':
+    daemon_main()
@@ -0,0 +1,182 @@
+"""
+JSON-LD document loader that resolves @context URLs from an in-memory LRU and an on-disk, content-addressed cache, so
+normalization resolves each context once per process and, once the cache is populated, never touches the network.
+
+On-disk layout (safe to share between worker processes, and to copy to an offline machine):
+    <cache_dir>/objects/<sha256 of document>.json   document contents
+    <cache_dir>/urls/<sha256 of url>                sha256 of the document the url resolves to
+
+A directory of contexts can be imported with preload_directory. It must contain a manifest.json mapping each URL to a
+file name in that directory, e.g. {"https://w3id.org/blockcerts/v2": "blockcerts-v2.json"}.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from cert_schema.jsonld_helpers import PRELOADED_CONTEXTS, jsonld_document_loader, to_loader_response
+
+from cert_issuer.errors import DocumentNotCachedError
+
+DEFAULT_MAX_ENTRIES = 100
+MANIFEST_FILE_NAME = 'manifest.json'
+OBJECTS_DIR = 'objects'
+URLS_DIR = 'urls'
+
+
+def sha256_hex(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class CachingDocumentLoader(object):
+    """
+    Callable usable as pyld's documentLoader, which pyld 1.0 and later call with the url and their options. Contexts
+    are looked up in memory, then in cache_dir, then in the contexts bundled with cert_schema, and only then fetched
+    from the network (unless offline). Fetched contexts are written to cache_dir. Thread-safe, so one loader can be
+    shared by concurrent batches.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=DEFAULT_MAX_ENTRIES, offline=False,
+                 network_loader=jsonld_document_loader):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.offline = offline
+        self.network_loader = network_loader
+        self.documents = collections.OrderedDict()
+        self.stats = collections.Counter()
+        # guards documents and stats
+        self.lock = threading.Lock()
+
+    def __call__(self, url, options=None):
+        with self.lock:
+            document = self.documents.get(url)
+            if document is not None:
+                self.documents.move_to_end(url)
+                self.stats['memory_hits'] += 1
+        if document is not None:
+            return to_loader_response(document, url)
+
+        document = self._read_from_disk(url)
+        if document is not None:
+            self._count('disk_hits')
+        elif url in PRELOADED_CONTEXTS:
+            document = PRELOADED_CONTEXTS[url]
+            self._count('preloaded_hits')
+        else:
+            self._count('misses')
+            if self.offline:
+                raise DocumentNotCachedError('JSON-LD document {} is not cached and the loader is offline'.format(url))
+            logging.info('Fetching JSON-LD document %s', url)
+            # options are only passed on when given, since some network loaders, e.g. cert_schema's, only take a url
+            if options is None:
+                document = self.network_loader(url)['document']
+            else:
+                document = self.network_loader(url, options)['document']
+            if not isinstance(document, dict) and not isinstance(document, list):
+                document = json.loads(document)
+            self._write_to_disk(url, document)
+
+        self._remember(url, document)
+        return to_loader_response(document, url)
+
+    def __deepcopy__(self, memo):
+        # pyld deep copies its options, and the copy has to share the caches and counters
+        return self
+
+    def __getstate__(self):
+        # the lock is recreated in the process that unpickles the loader, e.g. a worker process
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add_document(self, url, document):
+        """
+        Caches the document for url, in memory and, if configured, on disk.
+        :param url:
+        :param document: parsed JSON
+        :return:
+        """
+        self._write_to_disk(url, document)
+        self._remember(url, document)
+
+    def preload_directory(self, directory):
+        """
+        Imports the documents listed in directory's manifest.json.
+        :param directory:
+        :return: number of documents imported
+        """
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        for url, file_name in manifest.items():
+            with open(os.path.join(directory, file_name)) as document_file:
+                self.add_document(url, json.load(document_file))
+        logging.info('Preloaded %d JSON-LD documents from %s', len(manifest), directory)
+        return len(manifest)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _remember(self, url, document):
+        with self.lock:
+            self.documents[url] = document
+            self.documents.move_to_end(url)
+            while len(self.documents) > self.max_entries:
+                self.documents.popitem(last=False)
+
+    def _read_from_disk(self, url):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, URLS_DIR, sha256_hex(url))) as url_file:
+                content_hash = url_file.read().strip()
+            with open(os.path.join(self.cache_dir, OBJECTS_DIR, content_hash + '.json')) as object_file:
+                content = object_file.read()
+        except FileNotFoundError:
+            return None
+        if sha256_hex(content) != content_hash:
+            logging.warning('Ignoring corrupt cache entry for JSON-LD document %s', url)
+            return None
+        return json.loads(content)
+
+    def _write_to_disk(self, url, document):
+        if not self.cache_dir:
+            return
+        content = json.dumps(document, sort_keys=True)
+        content_hash = sha256_hex(content)
+        _write_atomically(os.path.join(self.cache_dir, OBJECTS_DIR), content_hash + '.json', content)
+        _write_atomically(os.path.join(self.cache_dir, URLS_DIR), sha256_hex(url), content_hash)
+
+
+def _write_atomically(directory, file_name, content):
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as temp_file:
+        temp_file.write(content)
+    os.replace(temp_path, os.path.join(directory, file_name))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fetch JSON-LD documents into a cache directory, e.g. on an online '
+                                                 'machine before copying the cache to an offline one.')
+    parser.add_argument('--cache_dir', required=True)
+    parser.add_argument('urls', nargs='+')
+    args = parser.parse_args()
+
+    loader = CachingDocumentLoader(cache_dir=args.cache_dir)
+    for document_url in args.urls:
+        loader(document_url)
+    print(loader.get_stats())
@@ -14,6 +14,13 @@ class ConnectorError(Error):
     pass
 
 
+class JsonRpcError(ConnectorError):
+    """
+    A node answered a JSON-RPC call with an error
+    """
+    pass
+
+
 class UnverifiedSignatureError(Error):
     """
     The signature in the certificate does not match the issuer's address
@@ -63,8 +70,37 @@ class BroadcastError(Error):
     pass
 
 
+class TransactionRejectedError(BroadcastError):
+    """
+    The transaction was refused as invalid, e.g. because its inputs or nonce were used by another transaction, rather
+    than failing to reach the network
+    """
+    pass
+
+
 class UnrecognizedChainError(Error):
     """
     Didn't recognize chain
     """
     pass
+
+
+class DocumentNotCachedError(Error):
+    """
+    A JSON-LD document is not cached and the document loader is offline
+    """
+    pass
+
+
+class JournalMismatchError(Error):
+    """
+    The batch journal in the work directory does not match the batch being issued
+    """
+    pass
+
+
+class SecretManagerError(Error):
+    """
+    The secret manager's backend, e.g. a signing agent or PKCS#11 token, could not be used
+    """
+    pass
@@ -0,0 +1,120 @@
+"""
+Fee rates estimated from the network for a confirmation target, instead of the configured satoshi_per_byte and
+gas_price, so that transactions neither overpay when blocks are empty nor wait many blocks when they are full.
+
+Estimates are cached for cache_seconds. If no estimate can be had, the last one is used, or the configured rate if
+there was none, and the providers are asked again after FAILURE_CACHE_SECONDS. Estimates are capped at max_rate.
+"""
+import logging
+import math
+import threading
+import time
+from abc import abstractmethod
+
+DEFAULT_CACHE_SECONDS = 300
+# a failed estimate is not retried for this long
+FAILURE_CACHE_SECONDS = 60
+
+# Bitcoin nodes do not relay transactions paying less than 1 satoshi per byte
+MIN_SATOSHI_PER_BYTE = 1
+
+# eth_gasPrice is the node's suggestion for a transaction to be mined soon; it is scaled by these factors to meet a
+# confirmation target in blocks. Targets beyond the last one use the last factor.
+GAS_PRICE_MULTIPLIERS = ((1, 1.25), (3, 1.1), (6, 1.0), (None, 0.9))
+
+
+class FeeOracle(object):
+    def __init__(self, fallback_rate, target_blocks, max_rate=None, min_rate=0, cache_seconds=DEFAULT_CACHE_SECONDS,
+                 clock=time.monotonic):
+        """
+        :param fallback_rate: rate used until an estimate is available
+        :param target_blocks: number of blocks the transaction should be confirmed within
+        :param max_rate: estimates above this are capped; no cap if None
+        :param min_rate: estimates below this are raised to it
+        :param cache_seconds: how long an estimate is used before it is estimated again
+        :param clock: returns the current time in seconds
+        """
+        self.fallback_rate = fallback_rate
+        self.target_blocks = target_blocks
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.cache_seconds = cache_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.rate = None
+        self.expires_at = None
+        self.estimate_count = 0
+
+    def get_fee_rate(self):
+        """
+        :return: fee rate for the confirmation target, estimating it if the cached one expired
+        """
+        with self.lock:
+            now = self.clock()
+            if self.expires_at is None or now >= self.expires_at:
+                self.estimate_count += 1
+                try:
+                    rate = self.estimate_fee_rate()
+                    self.rate = self.clamp(int(math.ceil(rate)))
+                    self.expires_at = now + self.cache_seconds
+                    logging.info('Estimated a fee rate of %d for confirmation within %d blocks', self.rate,
+                                 self.target_blocks)
+                except Exception as e:
+                    logging.warning('Could not estimate the fee rate, using %s: %s',
+                                    'the last estimate' if self.rate is not None else 'the configured rate', e)
+                    self.expires_at = now + FAILURE_CACHE_SECONDS
+            return self.rate if self.rate is not None else self.fallback_rate
+
+    def clamp(self, rate):
+        rate = max(rate, self.min_rate)
+        if self.max_rate:
+            rate = min(rate, self.max_rate)
+        return rate
+
+    @abstractmethod
+    def estimate_fee_rate(self):
+        """
+        :return: estimated fee rate, uncapped
+        """
+        pass
+
+
+class BitcoinFeeOracle(FeeOracle):
+    """
+    Fee rate in satoshis per byte, from estimatesmartfee or the providers' equivalents
+    """
+
+    def __init__(self, connector, fallback_rate, target_blocks, max_rate=None, cache_seconds=DEFAULT_CACHE_SECONDS,
+                 clock=time.monotonic):
+        """
+        :param connector: provides estimate_fee(target_blocks), in satoshis per byte
+        """
+        super().__init__(fallback_rate, target_blocks, max_rate=max_rate, min_rate=MIN_SATOSHI_PER_BYTE,
+                         cache_seconds=cache_seconds, clock=clock)
+        self.connector = connector
+
+    def estimate_fee_rate(self):
+        return self.connector.estimate_fee(self.target_blocks)
+
+
+class EthereumFeeOracle(FeeOracle):
+    """
+    Gas price in wei, from eth_gasPrice scaled by GAS_PRICE_MULTIPLIERS
+    """
+
+    def __init__(self, connector, fallback_rate, target_blocks, max_rate=None, cache_seconds=DEFAULT_CACHE_SECONDS,
+                 clock=time.monotonic):
+        """
+        :param connector: provides get_gas_price(), in wei
+        """
+        super().__init__(fallback_rate, target_blocks, max_rate=max_rate, cache_seconds=cache_seconds, clock=clock)
+        self.connector = connector
+
+    def estimate_fee_rate(self):
+        return self.connector.get_gas_price() * get_gas_price_multiplier(self.target_blocks)
+
+
+def get_gas_price_multiplier(target_blocks):
+    for max_target_blocks, multiplier in GAS_PRICE_MULTIPLIERS:
+        if max_target_blocks is None or target_blocks <= max_target_blocks:
+            return multiplier
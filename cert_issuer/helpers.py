@@ -1,7 +1,14 @@
 import collections
 import logging
+import multiprocessing
 import os
 import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import glob2
 from pycoin.serialize import b2h, h2b
@@ -16,6 +23,20 @@ UNSIGNED_CERTIFICATES_DIR = 'unsigned_certificates'
 SIGNED_CERTIFICATES_DIR = 'signed_certificates'
 BLOCKCHAIN_CERTIFICATES_DIR = 'blockchain_certificates'
 JSON_EXT = '.json'
+BATCH_UIDS_FILE = 'batch_uids.txt'
+
+# How files are staged into the work dir, and published from it into the output dirs
+STAGING_COPY = 'copy'
+STAGING_HARDLINK = 'hardlink'
+STAGING_REFLINK = 'reflink'
+STAGING_AUTO = 'auto'
+STAGING_STRATEGIES = [STAGING_COPY, STAGING_HARDLINK, STAGING_REFLINK, STAGING_AUTO]
+
+# ioctl request cloning a file's extents (linux/fs.h); supported by btrfs, xfs and others
+FICLONE = 0x40049409
+
+# Modules the forkserver imports once, so the worker processes forked from it start with them loaded
+WORKER_PRELOAD = ['cert_issuer.certificate_handler', 'cert_issuer.certificate_signer']
 
 
 class CertificateMetadata(object):
@@ -27,17 +48,259 @@ class CertificateMetadata(object):
             self.signed_cert_file_name = os.path.join(signed_certs_dir, uid + file_extension)
         self.blockchain_cert_file_name = os.path.join(blockcerts_dir, uid + file_extension)
         self.final_blockchain_cert_file_name = os.path.join(final_blockcerts_dir, uid + file_extension)
+        # parsed certificate, kept between preparing the certificate and adding its proof
+        self.certificate_json = None
+        # instrumentation: how many times the certificate was read from disk and normalized
+        self.read_count = 0
+        self.normalize_count = 0
+
+
+class CertificateMetadataStream(object):
+    """
+    Stands in for the OrderedDict of CertificateMetadata returned by prepare_issuance_batch without holding the batch in
+    memory. The uids are spooled to a file in insertion order, and items() re-creates the metadata one certificate at a
+    time on every pass, so every pass sees the certificates in the same order.
+    """
+
+    def __init__(self, uids_file_name, count, unsigned_certs_dir, signed_certs_dir, blockcerts_dir,
+                 final_blockcerts_dir, file_extension=JSON_EXT):
+        self.uids_file_name = uids_file_name
+        self.count = count
+        self.unsigned_certs_dir = unsigned_certs_dir
+        self.signed_certs_dir = signed_certs_dir
+        self.blockcerts_dir = blockcerts_dir
+        self.final_blockcerts_dir = final_blockcerts_dir
+        self.file_extension = file_extension
+
+    def __len__(self):
+        return self.count
+
+    def __setitem__(self, uid, certificate_metadata):
+        # metadata is re-created on each pass, so there is nothing to update
+        pass
+
+    def items(self):
+        with open(self.uids_file_name) as uids_file:
+            for line in uids_file:
+                uid = line.rstrip('\n')
+                yield uid, CertificateMetadata(uid=uid,
+                                               unsigned_certs_dir=self.unsigned_certs_dir,
+                                               signed_certs_dir=self.signed_certs_dir,
+                                               blockcerts_dir=self.blockcerts_dir,
+                                               final_blockcerts_dir=self.final_blockcerts_dir,
+                                               file_extension=self.file_extension)
+
+
+class CertificateBatchPartition(object):
+    """
+    Part of a batch, taken from an iterator over the whole batch's certificates as the partition is first iterated,
+    until a limit is reached. Later passes iterate the certificates taken, so the partition can stand in for the
+    OrderedDict of CertificateMetadata returned by prepare_issuance_batch.
+
+    A partition always takes at least one certificate. Limits of 0 are ignored.
+    """
+
+    def __init__(self, source, max_count=0, max_bytes=0, max_seconds=0):
+        """
+        :param source: PeekableIterator of (uid, CertificateMetadata), shared with the partitions that follow
+        :param max_count: maximum number of certificates
+        :param max_bytes: maximum total size of the unsigned certificates
+        :param max_seconds: stop taking certificates once this long has passed since the first was taken
+        """
+        self.source = source
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.certificates = collections.OrderedDict()
+        self.complete = False
+        self.total_bytes = 0
+        self.started = None
+
+    def __len__(self):
+        self.take_all()
+        return len(self.certificates)
+
+    def __setitem__(self, uid, certificate_metadata):
+        self.certificates[uid] = certificate_metadata
+
+    def keys(self):
+        return [uid for uid, _ in self.items()]
+
+    def items(self):
+        if self.complete:
+            yield from self.certificates.items()
+            return
+        # items taken by an earlier, unfinished pass come first
+        yield from list(self.certificates.items())
+        item = self._take()
+        while item is not None:
+            yield item
+            item = self._take()
+
+    def take_all(self):
+        while self._take() is not None:
+            pass
+
+    def _take(self):
+        if self.complete:
+            return None
+        if self.certificates and self._is_full():
+            self.complete = True
+            return None
+        item = self.source.next(None)
+        if item is None:
+            self.complete = True
+            return None
+        uid, metadata = item
+        if self.max_bytes:
+            self.total_bytes += os.path.getsize(metadata.unsigned_cert_file_name)
+        if self.started is None:
+            self.started = time.monotonic()
+        self.certificates[uid] = metadata
+        return item
+
+    def _is_full(self):
+        if self.max_count and len(self.certificates) >= self.max_count:
+            return True
+        if self.max_seconds and time.monotonic() - self.started >= self.max_seconds:
+            return True
+        if self.max_bytes:
+            item = self.source.peek(None)
+            if item is not None and self.total_bytes + os.path.getsize(item[1].unsigned_cert_file_name) > \
+                    self.max_bytes:
+                return True
+        return False
+
+
+class PeekableIterator(object):
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.pending = []
+
+    def peek(self, default):
+        if not self.pending:
+            self.pending.append(next(self.iterator, default))
+        return self.pending[0]
+
+    def next(self, default):
+        if self.pending:
+            return self.pending.pop()
+        return next(self.iterator, default)
+
+
+def partition_batch(certificates_metadata, max_count=0, max_bytes=0, max_seconds=0, recorded_counts=()):
+    """
+    Splits a batch into CertificateBatchPartitions. Each partition is only started once the one before it has taken all
+    its certificates.
+    :param certificates_metadata: as returned by prepare_issuance_batch or prepare_streaming_issuance_batch
+    :param max_count: maximum number of certificates per partition
+    :param max_bytes: maximum total size of the unsigned certificates in a partition
+    :param max_seconds: maximum time a partition takes certificates for, i.e. the time spent preparing it
+    :param recorded_counts: sizes of the first partitions, e.g. as recorded by an interrupted run; the limits apply
+    to the partitions after them
+    :return: generator of partitions; a single batch without limits is returned as is
+    """
+    if not (max_count or max_bytes or max_seconds) and len(recorded_counts) <= 1:
+        yield certificates_metadata
+        return
+
+    source = PeekableIterator(certificates_metadata.items())
+    recorded_counts = list(recorded_counts)
+    while source.peek(None) is not None:
+        if recorded_counts:
+            partition = CertificateBatchPartition(source, max_count=recorded_counts.pop(0))
+        else:
+            partition = CertificateBatchPartition(source, max_count, max_bytes, max_seconds)
+        yield partition
+        partition.take_all()
+
+
+class FileStager(object):
+    """
+    Callable with the signature of shutil.copy2 that places a file at a destination using the configured strategy:
+    - copy: copy the contents and metadata
+    - hardlink: link the destination to the same inode; both names must be on the same filesystem
+    - reflink: clone the file's extents, so the copy shares storage until either file is modified (Linux, on
+      filesystems supporting FICLONE)
+    - auto: reflink, falling back to hardlink and then copy. The first strategy that fails is not tried again.
+
+    Staged files are only ever read, and outputs are written to new files, so a hardlinked input or output is never
+    modified through the other name.
+    """
+
+    def __init__(self, strategy=STAGING_COPY):
+        if strategy not in STAGING_STRATEGIES:
+            raise ValueError('Unknown staging strategy {}'.format(strategy))
+        if strategy == STAGING_AUTO:
+            self.strategies = [STAGING_REFLINK, STAGING_HARDLINK, STAGING_COPY]
+        else:
+            self.strategies = [strategy]
+
+    def __call__(self, src, dst):
+        while True:
+            strategy = self.strategies[0]
+            try:
+                if strategy == STAGING_HARDLINK:
+                    os.link(src, dst)
+                elif strategy == STAGING_REFLINK:
+                    _reflink(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+                return dst
+            except OSError as e:
+                if len(self.strategies) == 1:
+                    raise
+                logging.info('Staging with %s is not supported (%s), falling back to %s', strategy, e,
+                             self.strategies[1])
+                self.strategies.pop(0)
+
+    def publish(self, src, dst):
+        """
+        Places src at dst atomically: the file is staged under a temporary name in dst's directory and renamed over
+        dst, so readers of dst never see a partially written file.
+        :param src:
+        :param dst:
+        :return:
+        """
+        directory, file_name = os.path.split(dst)
+        temp_path = os.path.join(directory, '.{}.{}.tmp'.format(file_name, os.getpid()))
+        if os.path.lexists(temp_path):
+            # left behind by an interrupted process
+            os.remove(temp_path)
+        try:
+            self(src, temp_path)
+            os.replace(temp_path, dst)
+        finally:
+            # the rename is a no-op if dst is already a hardlink to src, leaving the temporary name behind
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
 
 
 def prepare_issuance_batch(unsigned_certs_dir, signed_certs_dir, blockchain_certs_dir, work_dir,
-                           file_extension=JSON_EXT):
+                           file_extension=JSON_EXT, staging=STAGING_COPY, resume=False):
     """
-    Prepares file system for issuing a batch of certificates. Copies inputs to work_dir, and ensures
+    Prepares file system for issuing a batch of certificates. Stages inputs in work_dir, and ensures
     that all output dirs required for processing the batch exist.
     :param unsigned_certs_dir: input certificates
     :param signed_certs_dir: output dir
     :param blockchain_certs_dir: output dir
     :param work_dir: work dir
+    :param staging: how inputs are placed in work_dir; one of STAGING_STRATEGIES
+    :param resume: continue an interrupted batch with the inputs and outputs already in work_dir, instead of cleaning
+    it up and staging the inputs again
     :return:
     """
 
@@ -48,19 +311,22 @@ def prepare_issuance_batch(unsigned_certs_dir, signed_certs_dir, blockchain_cert
     os.makedirs(blockchain_certs_dir, exist_ok=True)
     os.makedirs(signed_certs_dir, exist_ok=True)
 
-    # ensure previous processing state, if any, is cleaned up
-    for item in os.listdir(work_dir):
-        file_path = os.path.join(work_dir, item)
-        if os.path.isdir(file_path):
-            shutil.rmtree(file_path)
-
     # define work subdirs
     unsigned_certs_work_dir = os.path.join(work_dir, UNSIGNED_CERTIFICATES_DIR)
     signed_certs_work_dir = os.path.join(work_dir, SIGNED_CERTIFICATES_DIR)
     blockchain_certs_work_dir = os.path.join(work_dir, BLOCKCHAIN_CERTIFICATES_DIR)
 
-    # copy input certs to unsigned certs work subdir and create output subdirs
-    shutil.copytree(unsigned_certs_dir, unsigned_certs_work_dir)
+    if not resume:
+        # ensure previous processing state, if any, is cleaned up
+        for item in os.listdir(work_dir):
+            file_path = os.path.join(work_dir, item)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+
+        # stage input certs in unsigned certs work subdir
+        shutil.copytree(unsigned_certs_dir, unsigned_certs_work_dir, copy_function=FileStager(staging))
+
+    # create output subdirs
     os.makedirs(signed_certs_work_dir, exist_ok=True)
     os.makedirs(blockchain_certs_work_dir, exist_ok=True)
 
@@ -86,11 +352,104 @@ def prepare_issuance_batch(unsigned_certs_dir, signed_certs_dir, blockchain_cert
     return cert_info
 
 
-def copy_output(certificates_metadata):
+def prepare_streaming_issuance_batch(unsigned_certs_dir, signed_certs_dir, blockchain_certs_dir, work_dir,
+                                     file_extension=JSON_EXT, resume=False):
+    """
+    Streaming equivalent of prepare_issuance_batch. Certificates are read from unsigned_certs_dir in place rather than
+    copied to work_dir, and only their uids are written (to a file in work_dir) while discovering the batch. The batch
+    is in directory listing order rather than sorted, which would need all uids in memory.
+    :param unsigned_certs_dir: input certificates
+    :param signed_certs_dir: output dir
+    :param blockchain_certs_dir: output dir
+    :param work_dir: work dir
+    :param resume: continue an interrupted batch with the uids and outputs already in work_dir
+    :return: CertificateMetadataStream
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(blockchain_certs_dir, exist_ok=True)
+    os.makedirs(signed_certs_dir, exist_ok=True)
+
+    if not resume:
+        for item in os.listdir(work_dir):
+            file_path = os.path.join(work_dir, item)
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+
+    signed_certs_work_dir = os.path.join(work_dir, SIGNED_CERTIFICATES_DIR)
+    blockchain_certs_work_dir = os.path.join(work_dir, BLOCKCHAIN_CERTIFICATES_DIR)
+    os.makedirs(signed_certs_work_dir, exist_ok=True)
+    os.makedirs(blockchain_certs_work_dir, exist_ok=True)
+
+    uids_file_name = os.path.join(work_dir, BATCH_UIDS_FILE)
+    count = 0
+    if resume:
+        with open(uids_file_name) as uids_file:
+            for _ in uids_file:
+                count += 1
+    else:
+        with open(uids_file_name, 'w') as uids_file:
+            for name in _iter_file_names(unsigned_certs_dir):
+                if name.endswith(file_extension):
+                    uids_file.write(name[:-len(file_extension)] + '\n')
+                    count += 1
+
+    if count == 0:
+        logging.warning('No certificates to process')
+        raise NoCertificatesFoundError('No certificates to process')
+
+    logging.info('Processing %d certificates', count)
+    return CertificateMetadataStream(uids_file_name, count,
+                                     unsigned_certs_dir=unsigned_certs_dir,
+                                     signed_certs_dir=signed_certs_work_dir,
+                                     blockcerts_dir=blockchain_certs_work_dir,
+                                     final_blockcerts_dir=blockchain_certs_dir,
+                                     file_extension=file_extension)
+
+
+def _iter_file_names(directory):
+    """
+    Yields the names of the files in directory as they are read, rather than listing them all first, where os.scandir
+    is available. On Python 3.4 the directory is listed with os.listdir.
+    """
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:
+        for name in os.listdir(directory):
+            if os.path.isfile(os.path.join(directory, name)):
+                yield name
+        return
+    for entry in scandir(directory):
+        # the entry's type comes with the listing, so unlike isfile this usually needs no stat
+        if entry.is_file():
+            yield entry.name
+
+
+def copy_output(certificates_metadata, staging=STAGING_COPY):
+    """
+    Publishes the blockchain certificates from the work dir to their final location. Each file is replaced atomically.
+    :param certificates_metadata:
+    :param staging: how outputs are placed in the final dir; one of STAGING_STRATEGIES
+    :return:
+    """
+    stager = FileStager(staging)
     for _, metadata in certificates_metadata.items():
         from_file = metadata.blockchain_cert_file_name
         to_file = metadata.final_blockchain_cert_file_name
-        shutil.copy2(from_file, to_file)
+        stager.publish(from_file, to_file)
+
+
+def get_process_context():
+    """
+    Returns the multiprocessing context worker pools are started from. Pools are started while other threads are
+    running, e.g. the background hashing of issue_batches or the daemon's batch threads, and a process forked from a
+    threaded one can inherit locks those threads held. So workers are forked from a forkserver, which has no other
+    threads, or spawned where there is no forkserver.
+    :return:
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(WORKER_PRELOAD)
+    return context
 
 
 def to_pycoin_chain(chain):
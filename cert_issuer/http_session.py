@@ -0,0 +1,113 @@
+"""
+Pooled HTTP session shared by the connectors, so that balance checks, nonce lookups and broadcasts to the same provider
+reuse kept-alive connections instead of paying for a TCP and TLS handshake on every call.
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# hosts with a connection pool, and connections kept alive per host; a broadcast opens one per provider at once
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_SIZE = 10
+# retries of requests that failed to connect, or of idempotent requests answered with RETRY_STATUSES
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_TIMEOUT = 30
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session with a connection pool per host, a retry and backoff policy, a default timeout, and counters of
+    how often connections are reused
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, timeout=DEFAULT_TIMEOUT):
+        """
+        :param pool_size: connections kept alive per host
+        :param max_retries: retries of a request, with exponential backoff
+        :param backoff_factor: the n-th retry waits backoff_factor * 2 ** (n - 1) seconds
+        :param timeout: default timeout of a request, in seconds
+        """
+        super().__init__()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=pool_size, max_retries=retry)
+        # count the connections the pools open; every other request reuses one
+        adapter.poolmanager.pool_classes_by_scheme = {
+            scheme: type('Counting' + pool_class.__name__, (pool_class,),
+                         {'_new_conn': _counting_new_conn(pool_class, self._count_connection)})
+            for scheme, pool_class in adapter.poolmanager.pool_classes_by_scheme.items()}
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        with self.lock:
+            self.request_count += 1
+        return super().request(method, url, **kwargs)
+
+    def get_metrics(self):
+        """
+        :return: dict of the number of requests, connections opened, and requests that reused a connection
+        """
+        with self.lock:
+            return {'requests': self.request_count,
+                    'connections': self.connection_count,
+                    'reused_connections': max(0, self.request_count - self.connection_count)}
+
+    def _count_connection(self):
+        with self.lock:
+            self.connection_count += 1
+
+
+def _counting_new_conn(pool_class, count_connection):
+    def _new_conn(pool):
+        count_connection()
+        return pool_class._new_conn(pool)
+
+    return _new_conn
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    :return: the shared PooledSession, created with the defaults if configure has not been called
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = PooledSession()
+        return _session
+
+
+def configure(pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    """
+    Replaces the shared session with one using these settings
+    :return: the new shared PooledSession
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = PooledSession(pool_size=pool_size, max_retries=max_retries, backoff_factor=backoff_factor)
+        return _session
+
+
+def log_metrics():
+    metrics = get_session().get_metrics()
+    if metrics['requests']:
+        logging.info('HTTP: %d requests over %d connections (%d reused)', metrics['requests'],
+                     metrics['connections'], metrics['reused_connections'])
@@ -1,15 +1,28 @@
 import logging
+import os
+import shutil
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from cert_schema import Chain
-from cert_issuer import helpers
+from cert_schema import BlockchainType, Chain
+from cert_issuer import coin_selection, helpers, http_session
+from cert_issuer.batch_journal import BatchJournal, JOURNAL_FILE_NAME
 from cert_issuer import signer as signer_helper
-from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateV2Handler
-from cert_issuer.connectors import BitcoinServiceProviderConnector, EthereumServiceProviderConnector
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateV2Handler, SuperRootBatchHandler
+from cert_issuer.certificate_signer import CertificateSigner
+from cert_issuer.document_loader import CachingDocumentLoader
+from cert_issuer.errors import NoCertificatesFoundError
+from cert_issuer.fee_oracle import BitcoinFeeOracle, EthereumFeeOracle
 from cert_issuer.issuer import Issuer
-from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+from cert_issuer.merkle_tree_generator import merkle_tree_generators
 from cert_issuer.transaction_handler import BitcoinTransactionHandler, EthereumTransactionHandler, MockTransactionHandler
 from cert_issuer.tx_utils import BitcoinTransactionCostConstants, EthereumTransactionCostConstants
+from cert_issuer.utxo_cache import UtxoCache
+from cert_issuer.utxo_pool import UtxoPool, get_default_output_value
+
+# Subdirectory of the work dir holding each tenant's work dir
+TENANTS_DIR = 'tenants'
 
 if sys.version_info.major < 3:
     sys.stderr.write('Sorry, Python 3.x required by this script.\n')
@@ -22,49 +35,334 @@ def issue(app_config, certificate_batch_handler, transaction_handler):
     blockchain_certificates_dir = app_config.blockchain_certificates_dir
     work_dir = app_config.work_dir
 
-    certificates_metadata = helpers.prepare_issuance_batch(unsigned_certs_dir, signed_certs_dir,
-                                                           blockchain_certificates_dir, work_dir)
-    num_certificates = len(certificates_metadata)
-    if num_certificates < 1:
-        logging.warning('No certificates to process')
-        return None
+    # an interrupted batch is resumed from the journal in the work dir
+    os.makedirs(work_dir, exist_ok=True)
+    journal = BatchJournal(os.path.join(work_dir, JOURNAL_FILE_NAME))
+    resume = journal.can_resume()
+    if resume:
+        logging.info('Resuming the interrupted batch in work path=%s', work_dir)
+    else:
+        journal.reset()
+
+    try:
+        with create_signing_session(app_config, certificate_batch_handler):
+            if app_config.tenants:
+                tx_id = issue_tenants(app_config, certificate_batch_handler, transaction_handler, journal, resume)
+                journal.mark_completed()
+                logging.info('Your Blockchain Certificates are in %s', blockchain_certificates_dir)
+                return tx_id
+
+            certificates_metadata = _prepare_issuance_batch(app_config, unsigned_certs_dir, signed_certs_dir,
+                                                            blockchain_certificates_dir, work_dir, resume)
+            num_certificates = len(certificates_metadata)
+            if num_certificates < 1:
+                logging.warning('No certificates to process')
+                return None
+
+            logging.info('Processing %d certificates under work path=%s', num_certificates, work_dir)
+            batches = helpers.partition_batch(certificates_metadata,
+                                              max_count=app_config.batch_size,
+                                              max_bytes=app_config.batch_max_bytes,
+                                              max_seconds=app_config.batch_max_seconds,
+                                              recorded_counts=journal.get_batch_sizes() if resume else ())
+            if app_config.sign_ahead:
+                tx_id = issue_batches_signed_ahead(app_config, certificate_batch_handler, transaction_handler, batches,
+                                                   journal)
+            else:
+                tx_id = issue_batches(app_config, certificate_batch_handler, transaction_handler, batches, journal)
+            journal.mark_completed()
+    finally:
+        journal.close()
+
+    logging.info('Your Blockchain Certificates are in %s', blockchain_certificates_dir)
+    http_session.log_metrics()
+    return tx_id
+
+
+def issue_batches(app_config, certificate_batch_handler, transaction_handler, batches, journal):
+    """
+    Issues each batch in its own transaction. The next batch is validated and hashed in the background while a batch
+    is broadcast and its proofs are written.
+    :param app_config:
+    :param certificate_batch_handler: used as the template for each batch's handler
+    :param transaction_handler:
+    :param batches: iterable of batches, as returned by helpers.partition_batch
+    :param journal: BatchJournal
+    :return: txid of the last batch
+    """
+    tx_id = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        batches = enumerate(batches)
+        pending = _start_batch(executor, certificate_batch_handler, batches, journal)
+        while pending:
+            batch_index, batch_handler, hashed = pending
+            hash_seconds = hashed.result() if hashed else 0
+            batch_journal = journal.for_batch(batch_index)
+            if hashed is None and batch_journal.get_batch().completed:
+                logging.info('Batch %d was issued before the interruption', batch_index)
+                pending = _start_batch(executor, certificate_batch_handler, batches, journal)
+                continue
 
-    logging.info('Processing %d certificates under work path=%s', num_certificates, work_dir)
-    certificate_batch_handler.set_certificates_in_batch(certificates_metadata)
+            # start on the next batch before issuing this one
+            pending = _start_batch(executor, certificate_batch_handler, batches, journal)
 
+            batch = batch_journal.get_batch()
+            if batch is None or batch.txid is None:
+                # a journaled transaction has already been paid for
+                transaction_handler.ensure_balance()
+            issuer = Issuer(
+                certificate_batch_handler=batch_handler,
+                transaction_handler=transaction_handler,
+                max_retry=app_config.max_retry,
+                journal=batch_journal)
+            tx_id = issuer.issue(app_config.chain)
+
+            start = time.perf_counter()
+            helpers.copy_output(batch_handler.certificates_to_issue, staging=app_config.staging)
+            batch_journal.mark_batch_completed()
+            timings = issuer.timings
+            logging.info('Batch %d: %d certificates, txid %s. Hashing %.2fs, signing %.2fs, broadcast %.2fs, '
+                         'proofs %.2fs, output %.2fs', batch_index, len(batch_handler.certificates_to_issue), tx_id,
+                         hash_seconds, timings['prepare'], timings['broadcast'], timings['proofs'],
+                         time.perf_counter() - start)
+    return tx_id
+
+
+def issue_batches_signed_ahead(app_config, certificate_batch_handler, transaction_handler, batches, journal):
+    """
+    Prepares every batch, signs the transactions of all of them in one key window, then broadcasts them in batch
+    order. The signed transactions are recorded in the journal before any is broadcast, so if the run is interrupted,
+    the next one broadcasts them rather than signing again. If a batch's transaction is rejected and signed again, the
+    batches after it are signed again too, since their transactions may spend its change.
+    :param app_config:
+    :param certificate_batch_handler: used as the template for each batch's handler
+    :param transaction_handler:
+    :param batches: iterable of batches, as returned by helpers.partition_batch
+    :param journal: BatchJournal
+    :return: txid of the last batch
+    """
+    issuers = []
+    for batch_index, certificates_to_issue in enumerate(batches):
+        batch_journal = journal.for_batch(batch_index)
+        batch = batch_journal.get_batch()
+        if batch is not None and batch.completed:
+            logging.info('Batch %d was issued before the interruption', batch_index)
+            continue
+        issuer = Issuer(
+            certificate_batch_handler=certificate_batch_handler.new_batch(certificates_to_issue),
+            transaction_handler=transaction_handler,
+            max_retry=app_config.max_retry,
+            journal=batch_journal)
+        issuer.prepare(app_config.chain)
+        issuers.append((batch_index, issuer))
+
+    _sign_ahead(transaction_handler, [issuer for _, issuer in issuers if issuer.needs_transaction()])
+
+    tx_id = None
+    for position, (batch_index, issuer) in enumerate(issuers):
+        tx_id = issuer.issue(app_config.chain)
+        if issuer.replaced_signed_transaction:
+            # the transactions signed after the one that was replaced spend its change, which will never exist. Those an
+            # interrupted run broadcast are kept, since they may be on the network; they are replaced once rejected
+            later = [later_issuer for _, later_issuer in issuers[position + 1:]
+                     if later_issuer.batch.txid is None and later_issuer.batch.expected_txid is None]
+            logging.warning('Batch %d was signed again; signing the %d batches after it again', batch_index,
+                            len(later))
+            transaction_handler.discard_signed_transactions([later_issuer.batch.signed_tx for later_issuer in later
+                                                             if later_issuer.batch.signed_tx is not None])
+            _sign_ahead(transaction_handler, later)
+        start = time.perf_counter()
+        helpers.copy_output(issuer.certificate_batch_handler.certificates_to_issue, staging=app_config.staging)
+        issuer.journal.mark_batch_completed()
+        timings = issuer.timings
+        logging.info('Batch %d: %d certificates, txid %s. Preparing %.2fs, broadcast %.2fs, proofs %.2fs, output %.2fs',
+                     batch_index, len(issuer.certificate_batch_handler.certificates_to_issue), tx_id,
+                     timings['prepare'], timings['broadcast'], timings['proofs'], time.perf_counter() - start)
+    return tx_id
+
+
+def _sign_ahead(transaction_handler, issuers):
+    """
+    Signs the transactions of the issuers' prepared batches in one key window, and records them in their journals
+    """
+    if not issuers:
+        return
     transaction_handler.ensure_balance()
+    start = time.perf_counter()
+    signed_txs = transaction_handler.create_signed_transactions([issuer.blockchain_bytes for issuer in issuers])
+    for issuer, signed_tx in zip(issuers, signed_txs):
+        issuer.record_signed_transaction(signed_tx)
+    logging.info('Signed the transactions of %d batches in %.2fs', len(issuers), time.perf_counter() - start)
+
+
+def issue_tenants(app_config, certificate_batch_handler, transaction_handler, journal, resume):
+    """
+    Issues the certificates of every tenant, i.e. each subdirectory of unsigned_certificates_dir, in one transaction.
+    Each tenant's certificates get their own Merkle tree, and the trees' roots are anchored under a super-root. Outputs
+    go to the tenant's subdirectory of blockchain_certificates_dir. Tenants without certificates are skipped.
+    :return: txid
+    """
+    if app_config.batch_size or app_config.batch_max_bytes or app_config.batch_max_seconds:
+        logging.warning('Batch limits do not apply when issuing for tenants; all tenants are issued in one batch')
 
+    tenants_work_dir = os.path.join(app_config.work_dir, TENANTS_DIR)
+    if not resume and os.path.isdir(tenants_work_dir):
+        shutil.rmtree(tenants_work_dir)
+
+    unsigned_certs_dir = app_config.unsigned_certificates_dir
+    tenants = sorted(name for name in os.listdir(unsigned_certs_dir)
+                     if os.path.isdir(os.path.join(unsigned_certs_dir, name)))
+    if not tenants:
+        raise NoCertificatesFoundError('No tenant directories in {}'.format(unsigned_certs_dir))
+
+    tenants_metadata = []
+    for tenant in tenants:
+        try:
+            certificates_metadata = _prepare_issuance_batch(
+                app_config, os.path.join(unsigned_certs_dir, tenant),
+                os.path.join(app_config.signed_certificates_dir, tenant),
+                os.path.join(app_config.blockchain_certificates_dir, tenant), os.path.join(tenants_work_dir, tenant),
+                resume)
+        except NoCertificatesFoundError:
+            certificates_metadata = None
+        if not certificates_metadata:
+            # a tenant without certificates has no Merkle root to anchor
+            logging.warning('Skipping tenant %s, which has no certificates', tenant)
+            continue
+        logging.info('Processing %d certificates for tenant %s', len(certificates_metadata), tenant)
+        tenants_metadata.append(certificates_metadata)
+    if not tenants_metadata:
+        raise NoCertificatesFoundError('No certificates in the tenant directories of {}'.format(unsigned_certs_dir))
+
+    batch_journal = journal.for_batch(0)
+    batch = batch_journal.get_batch()
+    if batch is None or batch.txid is None:
+        # a journaled transaction has already been paid for
+        transaction_handler.ensure_balance()
+
+    batch_handlers = [certificate_batch_handler.new_batch(certificates_metadata)
+                      for certificates_metadata in tenants_metadata]
     issuer = Issuer(
-        certificate_batch_handler=certificate_batch_handler,
+        certificate_batch_handler=SuperRootBatchHandler(batch_handlers),
         transaction_handler=transaction_handler,
-        max_retry=app_config.max_retry)
+        max_retry=app_config.max_retry,
+        journal=batch_journal)
     tx_id = issuer.issue(app_config.chain)
 
-    helpers.copy_output(certificates_metadata)
-
-    logging.info('Your Blockchain Certificates are in %s', blockchain_certificates_dir)
+    for certificates_metadata in tenants_metadata:
+        helpers.copy_output(certificates_metadata, staging=app_config.staging)
+    batch_journal.mark_batch_completed()
     return tx_id
 
 
-def main(app_config):
+def create_signing_session(app_config, certificate_batch_handler):
+    """
+    The key is loaded once for the run, when it is first needed. In safe mode the network must be off while the key is
+    loaded, and on to broadcast, so the key is still loaded for each transaction, but not for phases that sign nothing.
+    :return: SigningSession
+    """
+    return signer_helper.SigningSession(certificate_batch_handler.secret_manager, keep_open=not app_config.safe_mode)
+
+
+def _prepare_issuance_batch(app_config, unsigned_certs_dir, signed_certs_dir, blockchain_certificates_dir, work_dir,
+                            resume):
+    if app_config.streaming:
+        return helpers.prepare_streaming_issuance_batch(unsigned_certs_dir, signed_certs_dir,
+                                                        blockchain_certificates_dir, work_dir, resume=resume)
+    return helpers.prepare_issuance_batch(unsigned_certs_dir, signed_certs_dir, blockchain_certificates_dir, work_dir,
+                                          staging=app_config.staging, resume=resume)
+
+
+def _start_batch(executor, certificate_batch_handler, batches, journal):
+    """
+    Takes the next batch, and unless the journal already records it, starts hashing it on the executor
+    :return: (batch index, batch handler, future of the seconds spent hashing or None), or None if there are no more
+    batches
+    """
+    batch_index, certificates_to_issue = next(batches, (None, None))
+    if certificates_to_issue is None:
+        return None
+    batch_handler = certificate_batch_handler.new_batch(certificates_to_issue)
+    if journal.for_batch(batch_index).get_batch() is not None:
+        # resumed from the journal instead
+        return batch_index, batch_handler, None
+
+    def hash_batch():
+        start = time.perf_counter()
+        batch_handler.hash_batch()
+        return time.perf_counter() - start
+
+    return batch_index, batch_handler, executor.submit(hash_batch)
+
+
+def create_handlers(app_config):
+    """
+    Builds the certificate batch handler and transaction handler for the configured chain
+    :param app_config:
+    :return: (certificate_batch_handler, transaction_handler)
+    """
     issuing_address = app_config.issuing_address
     chain = app_config.chain
+    http_session.configure(pool_size=app_config.http_pool_size, max_retries=app_config.http_max_retries,
+                           backoff_factor=app_config.http_backoff_factor)
     secret_manager = signer_helper.initialize_signer(app_config)
+    document_loader = CachingDocumentLoader(cache_dir=app_config.jsonld_cache_dir, offline=app_config.jsonld_offline)
+    if app_config.jsonld_preload_dir:
+        document_loader.preload_directory(app_config.jsonld_preload_dir)
+    certificate_signer = None
+    if app_config.certificate_signatures:
+        if chain == Chain.mockchain:
+            logging.warning('Certificates are not signed on the mockchain, which has no issuing key')
+        else:
+            certificate_signer = CertificateSigner(workers=app_config.workers)
     certificate_batch_handler = CertificateBatchHandler(secret_manager=secret_manager,
-                                                        certificate_handler=CertificateV2Handler(),
-                                                        merkle_tree=MerkleTreeGenerator())
+                                                        certificate_handler=CertificateV2Handler(document_loader),
+                                                        merkle_tree=merkle_tree_generators[app_config.merkle_tree](),
+                                                        workers=app_config.workers,
+                                                        certificate_signer=certificate_signer)
+    # the connectors, and the libraries they use, are only imported for the selected chain
     if chain == Chain.mockchain:
         transaction_handler = MockTransactionHandler()
-    # ethereum chains
-    elif chain == Chain.ethereum_mainnet or chain == Chain.ethereum_ropsten or chain == Chain.ethereum_testnet:
-        cost_constants = EthereumTransactionCostConstants(app_config.gas_price, app_config.gas_limit)
-        connector = EthereumServiceProviderConnector(chain, app_config.api_token)
+    elif chain.blockchain_type == BlockchainType.ethereum:
+        from cert_issuer.connectors import EthereumServiceProviderConnector
+
+        connector = EthereumServiceProviderConnector(chain, app_config.api_token, rpc_url=app_config.ethereum_rpc_url)
+        oracle = None
+        if app_config.fee_target_blocks:
+            oracle = EthereumFeeOracle(connector, app_config.gas_price, app_config.fee_target_blocks,
+                                       max_rate=app_config.max_gas_price, cache_seconds=app_config.fee_cache_seconds)
+        cost_constants = EthereumTransactionCostConstants(app_config.gas_price, app_config.gas_limit, fee_oracle=oracle)
         transaction_handler = EthereumTransactionHandler(connector, cost_constants, secret_manager, issuing_address=issuing_address)
     else:
-        cost_constants = BitcoinTransactionCostConstants(app_config.tx_fee, app_config.dust_threshold, app_config.satoshi_per_byte)
+        from cert_issuer.connectors import BitcoinServiceProviderConnector
+
         connector = BitcoinServiceProviderConnector(chain, app_config.bitcoind)
+        oracle = None
+        if app_config.fee_target_blocks:
+            oracle = BitcoinFeeOracle(connector, app_config.satoshi_per_byte, app_config.fee_target_blocks,
+                                      max_rate=app_config.max_satoshi_per_byte,
+                                      cache_seconds=app_config.fee_cache_seconds)
+        cost_constants = BitcoinTransactionCostConstants(app_config.tx_fee, app_config.dust_threshold, app_config.satoshi_per_byte,
+                                                         fee_oracle=oracle)
+        coin_selector = coin_selection.create_coin_selector(app_config.coin_selection,
+                                                            app_config.max_consolidation_inputs)
+        cache = UtxoCache(connector, issuing_address)
+        pool = None
+        if app_config.utxo_pool_size:
+            pool = UtxoPool(cache,
+                            app_config.utxo_pool_output_value or get_default_output_value(cost_constants),
+                            app_config.utxo_pool_size,
+                            refill_threshold=app_config.utxo_pool_refill_threshold,
+                            # in safe mode a background thread would be left waiting for the network to be off
+                            background_refill=not app_config.safe_mode)
         transaction_handler = BitcoinTransactionHandler(connector, cost_constants, secret_manager,
-                                                        issuing_address=issuing_address)
+                                                        issuing_address=issuing_address, utxo_cache=cache,
+                                                        coin_selector=coin_selector, utxo_pool=pool)
+    return certificate_batch_handler, transaction_handler
+
+
+def main(app_config):
+    certificate_batch_handler, transaction_handler = create_handlers(app_config)
     return issue(app_config, certificate_batch_handler, transaction_handler)
 
 
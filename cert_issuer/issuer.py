@@ -2,23 +2,40 @@
 Base class for building blockchain transactions to issue Blockchain Certificates.
 """
 import logging
+import time
 
-from cert_issuer.errors import BroadcastError
+from pycoin.serialize import b2h
+
+from cert_issuer.errors import BroadcastError, ConnectorError, JournalMismatchError, TransactionRejectedError
 
 MAX_TX_RETRIES = 5
 
 
 class Issuer:
-    def __init__(self, certificate_batch_handler, transaction_handler, max_retry=MAX_TX_RETRIES):
+    def __init__(self, certificate_batch_handler, transaction_handler, max_retry=MAX_TX_RETRIES, journal=None):
+        """
+        :param journal: optional batch_journal.BatchJournal. Progress is recorded in it, and a batch it records as
+        incomplete is resumed rather than prepared and paid for again.
+        """
         self.certificate_batch_handler = certificate_batch_handler
         self.transaction_handler = transaction_handler
         self.max_retry = max_retry
+        self.journal = journal
+        # seconds spent on each step of issue_with_journal
+        self.timings = {}
+        # set by prepare
+        self.batch = None
+        self.blockchain_bytes = None
+        # set by issue_with_journal if the recorded transaction was rejected, and another was signed instead
+        self.replaced_signed_transaction = False
 
     def issue(self, chain):
         """
         Issue the certificates on the blockchain
         :return:
         """
+        if self.journal:
+            return self.issue_with_journal(chain)
 
         blockchain_bytes = self.certificate_batch_handler.prepare_batch()
 
@@ -34,3 +51,120 @@ class Issuer:
                     attempt_number)
         logging.error('All attempts to broadcast failed. Try rerunning issuer.')
         raise BroadcastError('All attempts to broadcast failed. Try rerunning issuer.')
+
+    def prepare(self, chain):
+        """
+        Prepares the batch and records it in the journal, or resumes it from the journal, without creating its
+        transaction. issue_with_journal calls this unless it has been called already.
+        :return: byte array to put on the blockchain
+        """
+        start = time.perf_counter()
+        batch = self.journal.get_batch()
+        if batch is None:
+            blockchain_bytes = self.certificate_batch_handler.prepare_batch()
+            self.journal.record_batch(chain.name, self.certificate_batch_handler.get_leaves(), b2h(blockchain_bytes))
+            batch = self.journal.get_batch()
+        else:
+            if batch.chain != chain.name:
+                raise JournalMismatchError('The journaled batch was issued on {}, not {}'.format(batch.chain, chain.name))
+            logging.info('Resuming batch with merkle root %s from the journal', batch.merkle_root)
+            blockchain_bytes = self.certificate_batch_handler.resume_batch(self.journal.iter_leaves())
+            if b2h(blockchain_bytes) != batch.merkle_root:
+                raise JournalMismatchError('The merkle root of the certificates does not match the journal')
+        self.batch = batch
+        self.blockchain_bytes = blockchain_bytes
+        self.timings['prepare'] = time.perf_counter() - start
+        return blockchain_bytes
+
+    def needs_transaction(self):
+        """
+        :return: True if the prepared batch has no signed transaction recorded in the journal
+        """
+        return self.batch.signed_tx is None and self.batch.txid is None
+
+    def record_signed_transaction(self, signed_tx):
+        """
+        Records a transaction signed for the prepared batch, e.g. together with other batches' transactions, which
+        issue_with_journal broadcasts instead of creating one
+        :param signed_tx: hex encoded, as returned by the transaction handler's create_signed_transactions
+        :return:
+        """
+        self.journal.record_signed_transaction(signed_tx)
+        self.batch = self.journal.get_batch()
+
+    def issue_with_journal(self, chain):
+        """
+        Issue the certificates on the blockchain, recording each step in the journal and skipping the steps it records
+        as done
+        :return:
+        """
+        if self.batch is None:
+            self.prepare(chain)
+        batch = self.batch
+        blockchain_bytes = self.blockchain_bytes
+        prepared = time.perf_counter()
+
+        txid = batch.txid
+        signed_tx = batch.signed_tx
+        # once the signed transaction has been broadcast, it may be on the network even if the broadcast failed
+        broadcast_attempted = batch.expected_txid is not None
+        attempt_number = 0
+        while txid is None:
+            if signed_tx is None:
+                signed_tx = self.transaction_handler.create_signed_transaction(blockchain_bytes)
+                self.journal.record_signed_transaction(signed_tx)
+                broadcast_attempted = False
+            expected_txid = self.transaction_handler.get_txid(signed_tx)
+            may_be_sent = broadcast_attempted
+            if not broadcast_attempted:
+                self.journal.record_expected_txid(expected_txid)
+                broadcast_attempted = True
+            try:
+                # a transaction signed by an interrupted run, or whose broadcast failed, is broadcast again rather than
+                # paid for twice
+                txid = self.transaction_handler.broadcast_signed_transaction(signed_tx)
+            except TransactionRejectedError:
+                if may_be_sent and self._is_transaction_known(expected_txid):
+                    logging.info('Transaction %s was rejected, as an earlier broadcast of it reached the network',
+                                 expected_txid)
+                    txid = expected_txid
+                else:
+                    attempt_number += 1
+                    self._check_attempts(attempt_number, expected_txid)
+                    logging.warning('Transaction %s was rejected. Trying to recreate transaction. This is attempt '
+                                    'number %d', expected_txid, attempt_number)
+                    signed_tx = None
+                    self.replaced_signed_transaction = True
+                    continue
+            except BroadcastError:
+                attempt_number += 1
+                self._check_attempts(attempt_number, expected_txid)
+                logging.warning('Failed broadcast reattempts. Broadcasting transaction %s again. This is attempt '
+                                'number %d', expected_txid, attempt_number)
+                continue
+            self.journal.record_txid(txid)
+            logging.info('Broadcast transaction with txid %s', txid)
+
+        broadcast = time.perf_counter()
+        self.timings['broadcast'] = broadcast - prepared
+
+        if batch.proofs_written:
+            logging.info('Resuming proofs after %d certificates', batch.proofs_written)
+        self.certificate_batch_handler.finish_batch(txid, chain, start_index=batch.proofs_written,
+                                                    checkpoint=self.journal.record_proofs_written)
+        self.timings['proofs'] = time.perf_counter() - broadcast
+        return txid
+
+    def _check_attempts(self, attempt_number, txid):
+        if attempt_number >= self.max_retry:
+            # the journal keeps the transaction, so the next run broadcasts it again rather than signing another
+            error_message = 'All attempts to broadcast transaction {} failed. Try rerunning issuer.'.format(txid)
+            logging.error(error_message)
+            raise BroadcastError(error_message)
+
+    def _is_transaction_known(self, txid):
+        try:
+            return self.transaction_handler.is_transaction_known(txid)
+        except ConnectorError as e:
+            raise BroadcastError('Transaction {} was rejected, and could not be looked up to check whether an earlier '
+                                 'broadcast of it reached the network: {}. Try rerunning issuer.'.format(txid, e))
@@ -0,0 +1,166 @@
+"""
+Append-only Merkle accumulator over SHA-256 digests, for trees that keep growing while their roots are anchored.
+
+Leaves are appended like incrementing a binary counter: each level holds the complete nodes built so far, and adding a
+leaf hashes one new node per trailing zero bit of the new leaf count, so O(log n) at most and O(1) amortized. The last
+node of each level whose bit is set in the leaf count has no parent yet; these are the peaks, and the root combines
+them from the smallest up:
+
+    root = H(peak_0 + H(peak_1 + ... H(peak_k-2 + peak_k-1)))
+
+This is the tree MerkleTree builds, promoting the odd node at the end of a level, so for the same leaves the roots and
+proofs are identical, and the proofs are ordinary MerkleProof2017 proofs. Nodes never change once built, so the root
+and proofs of any earlier leaf count, e.g. that of an anchored snapshot, can still be computed after more leaves are
+added.
+"""
+import collections
+import hashlib
+
+from cert_issuer.merkle_tree import DIGEST_SIZE, LEFT, RIGHT
+
+# The leaf count and root of the accumulator at some point, e.g. when the root was anchored
+Snapshot = collections.namedtuple('Snapshot', ['leaf_count', 'root'])
+
+
+class MerkleAccumulator(object):
+    def __init__(self):
+        self.levels = [bytearray()]
+        self.leaf_count = 0
+
+    def add_leaf(self, digest):
+        """
+        Add a 32-byte leaf digest, and the nodes it completes
+        :param digest: raw (not hex encoded) SHA-256 digest
+        :return:
+        """
+        if len(digest) != DIGEST_SIZE:
+            raise ValueError('Merkle tree leaves must be {} byte digests'.format(DIGEST_SIZE))
+        levels = self.levels
+        levels[0] += digest
+        self.leaf_count += 1
+        count = self.leaf_count
+        height = 0
+        while count & 1 == 0:
+            # the last two nodes of this level are complete siblings
+            if height + 1 == len(levels):
+                levels.append(bytearray())
+            level = levels[height]
+            levels[height + 1] += hashlib.sha256(level[-2 * DIGEST_SIZE:]).digest()
+            height += 1
+            count >>= 1
+
+    def get_leaf_count(self):
+        return self.leaf_count
+
+    def get_leaf(self, index):
+        return self._get_node(0, index)
+
+    def get_merkle_root(self, leaf_count=None):
+        """
+        :param leaf_count: number of leaves the tree had, default all of them
+        :return: root digest, or None if the tree had no leaves
+        """
+        peaks = self._get_peaks(leaf_count)
+        if not peaks:
+            return None
+        return self._bag(peaks)
+
+    def snapshot(self):
+        """
+        :return: Snapshot of the leaves added so far
+        """
+        return Snapshot(self.leaf_count, self.get_merkle_root())
+
+    def get_proof(self, index, leaf_count=None):
+        """
+        Returns the sibling path from the leaf at index to the root the tree had with leaf_count leaves, in the format
+        of MerkleTree.get_proof
+        :param index: leaf index
+        :param leaf_count: number of leaves the tree had, default all of them
+        :return: proof, or None if index is out of range
+        """
+        peaks = self._get_peaks(leaf_count)
+        leaf_start = 0
+        for position, (height, _) in enumerate(peaks):
+            if leaf_start <= index < leaf_start + (1 << height):
+                node = index
+                proof = []
+                for level in range(0, height):
+                    proof.append((LEFT if node & 1 else RIGHT, self._get_node(level, node ^ 1)))
+                    node >>= 1
+                return proof + self._get_peak_suffixes(peaks)[position]
+            leaf_start += 1 << height
+        return None
+
+    def iter_proofs(self, leaf_count=None, encode=None):
+        """
+        Returns a generator of proofs for every leaf of the tree with leaf_count leaves, in insertion order, in the
+        format of get_proof. Siblings are looked up (and encoded) once for the leaves that share them.
+        :param leaf_count: number of leaves the tree had, default all of them
+        :param encode: optional function applied once to each sibling digest, e.g. b2h
+        :return:
+        """
+        peaks = self._get_peaks(leaf_count)
+        suffixes = self._get_peak_suffixes(peaks, encode)
+        cached_siblings = [None] * len(self.levels)
+        cached_entries = [None] * len(self.levels)
+        leaf_start = 0
+        for (height, _), suffix in zip(peaks, suffixes):
+            for leaf_index in range(leaf_start, leaf_start + (1 << height)):
+                proof = []
+                node = leaf_index
+                for level in range(0, height):
+                    sibling = node ^ 1
+                    if cached_siblings[level] != sibling:
+                        entry = (LEFT if node & 1 else RIGHT, self._get_node(level, sibling))
+                        if encode is not None:
+                            entry = (entry[0], encode(entry[1]))
+                        cached_siblings[level] = sibling
+                        cached_entries[level] = entry
+                    proof.append(cached_entries[level])
+                    node >>= 1
+                yield proof + suffix
+            leaf_start += 1 << height
+
+    def _get_peaks(self, leaf_count):
+        """
+        :return: list of (height, index) of the peaks, from the highest, i.e. leftmost
+        """
+        if leaf_count is None:
+            leaf_count = self.leaf_count
+        if leaf_count < 0 or leaf_count > self.leaf_count:
+            raise ValueError('The tree has never had {} leaves'.format(leaf_count))
+        return [(height, (leaf_count >> height) - 1) for height in reversed(range(0, leaf_count.bit_length()))
+                if leaf_count >> height & 1]
+
+    def _get_peak_suffixes(self, peaks, encode=None):
+        """
+        :return: for each peak, the proof entries from the peak to the root: the bagged smaller peaks to its right,
+        then each larger peak to its left
+        """
+        suffixes = []
+        right_bag = None
+        for position in reversed(range(0, len(peaks))):
+            suffix = []
+            if right_bag is not None:
+                suffix.append((RIGHT, right_bag))
+            for height, index in reversed(peaks[:position]):
+                suffix.append((LEFT, self._get_node(height, index)))
+            if encode is not None:
+                suffix = [(side, encode(digest)) for side, digest in suffix]
+            suffixes.append(suffix)
+            peak = self._get_node(*peaks[position])
+            right_bag = peak if right_bag is None else hashlib.sha256(peak + right_bag).digest()
+        suffixes.reverse()
+        return suffixes
+
+    def _bag(self, peaks):
+        root = None
+        for height, index in reversed(peaks):
+            peak = self._get_node(height, index)
+            root = peak if root is None else hashlib.sha256(peak + root).digest()
+        return root
+
+    def _get_node(self, level, index):
+        start = index * DIGEST_SIZE
+        return bytes(self.levels[level][start:start + DIGEST_SIZE])
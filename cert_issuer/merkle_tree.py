@@ -0,0 +1,177 @@
+"""
+Array-backed Merkle tree over SHA-256 digests.
+
+Leaves and internal nodes are kept as contiguous 32-byte digests in a single preallocated buffer, laid out level by
+level from the leaves up to the root. An odd node at the end of a level is promoted to the next level unchanged, which
+is the same construction chainpoint's MerkleTools uses, so roots and proofs are identical to the ones it produced.
+"""
+import hashlib
+
+DIGEST_SIZE = 32
+
+LEFT = 'left'
+RIGHT = 'right'
+
+
+class MerkleTree(object):
+    def __init__(self):
+        self.reset_tree()
+
+    def reset_tree(self):
+        self.leaves = bytearray()
+        self.nodes = None
+        self.level_offsets = None
+        self.level_sizes = None
+
+    def add_leaf(self, digest):
+        """
+        Add a 32-byte leaf digest. Adding a leaf invalidates a tree that has already been made.
+        :param digest: raw (not hex encoded) SHA-256 digest
+        :return:
+        """
+        if len(digest) != DIGEST_SIZE:
+            raise ValueError('Merkle tree leaves must be {} byte digests'.format(DIGEST_SIZE))
+        if self.nodes is not None:
+            # the leaves live at the start of the node buffer once the tree has been made
+            self.leaves = self.nodes[:self.get_leaf_count() * DIGEST_SIZE]
+            self.nodes = None
+        self.leaves += digest
+
+    def get_leaf_count(self):
+        if self.nodes is not None:
+            return self.level_sizes[0]
+        return len(self.leaves) // DIGEST_SIZE
+
+    def get_leaf(self, index):
+        return self._get_node(0, index)
+
+    def is_ready(self):
+        return self.nodes is not None
+
+    def make_tree(self):
+        """
+        Builds all levels bottom-up in one pass into a buffer sized for the whole tree.
+        :return:
+        """
+        leaf_count = self.get_leaf_count()
+        if self.nodes is not None or leaf_count == 0:
+            return
+
+        level_sizes = [leaf_count]
+        while level_sizes[-1] > 1:
+            level_sizes.append((level_sizes[-1] + 1) // 2)
+        level_offsets = [0]
+        for size in level_sizes[:-1]:
+            level_offsets.append(level_offsets[-1] + size)
+
+        nodes = bytearray((level_offsets[-1] + 1) * DIGEST_SIZE)
+        nodes[:len(self.leaves)] = self.leaves
+        self.leaves = bytearray()
+
+        view = memoryview(nodes)
+        sha256 = hashlib.sha256
+        for level in range(0, len(level_sizes) - 1):
+            size = level_sizes[level]
+            source = level_offsets[level] * DIGEST_SIZE
+            target = level_offsets[level + 1] * DIGEST_SIZE
+            end = source + (size - size % 2) * DIGEST_SIZE
+            for pair_start in range(source, end, 2 * DIGEST_SIZE):
+                nodes[target:target + DIGEST_SIZE] = sha256(view[pair_start:pair_start + 2 * DIGEST_SIZE]).digest()
+                target += DIGEST_SIZE
+            if size % 2 == 1:
+                # promote the odd node at the end of the level
+                nodes[target:target + DIGEST_SIZE] = view[end:end + DIGEST_SIZE]
+        view.release()
+
+        self.nodes = nodes
+        self.level_offsets = level_offsets
+        self.level_sizes = level_sizes
+
+    def get_merkle_root(self):
+        """
+        :return: root digest, or None if the tree has not been made
+        """
+        if self.nodes is None:
+            return None
+        return self._get_node(len(self.level_sizes) - 1, 0)
+
+    def get_proof(self, index):
+        """
+        Returns the sibling path from the leaf at index to the root, as a list of (position, digest) tuples where
+        position is 'left' or 'right'. Levels where the node is promoted contribute no entry.
+        :param index: leaf index
+        :return: proof, or None if the tree has not been made or index is out of range
+        """
+        if self.nodes is None or index < 0 or index >= self.level_sizes[0]:
+            return None
+        nodes = self.nodes
+        proof = []
+        for offset, size in zip(self.level_offsets[:-1], self.level_sizes[:-1]):
+            if index & 1:
+                start = (offset + index - 1) * DIGEST_SIZE
+                proof.append((LEFT, bytes(nodes[start:start + DIGEST_SIZE])))
+            elif index + 1 < size:
+                start = (offset + index + 1) * DIGEST_SIZE
+                proof.append((RIGHT, bytes(nodes[start:start + DIGEST_SIZE])))
+            index >>= 1
+        return proof
+
+    def iter_proofs(self, encode=None):
+        """
+        Returns a generator of proofs for every leaf in insertion order, in the same format as get_proof.
+
+        Consecutive leaves share all but the lowest levels of their sibling path, so a sibling is only looked up (and
+        encoded) when the node's index at that level changes.
+        :param encode: optional function applied once to each sibling digest, e.g. b2h
+        :return:
+        """
+        if self.nodes is None:
+            return
+        levels = list(zip(self.level_offsets[:-1], self.level_sizes[:-1]))
+        cached_indexes = [None] * len(levels)
+        cached_entries = [None] * len(levels)
+        nodes = self.nodes
+        for leaf_index in range(0, self.level_sizes[0]):
+            proof = []
+            index = leaf_index
+            for level, (offset, size) in enumerate(levels):
+                if cached_indexes[level] != index:
+                    entry = None
+                    if index & 1:
+                        start = (offset + index - 1) * DIGEST_SIZE
+                        entry = (LEFT, bytes(nodes[start:start + DIGEST_SIZE]))
+                    elif index + 1 < size:
+                        start = (offset + index + 1) * DIGEST_SIZE
+                        entry = (RIGHT, bytes(nodes[start:start + DIGEST_SIZE]))
+                    if entry is not None and encode is not None:
+                        entry = (entry[0], encode(entry[1]))
+                    cached_indexes[level] = index
+                    cached_entries[level] = entry
+                if cached_entries[level] is not None:
+                    proof.append(cached_entries[level])
+                index >>= 1
+            yield proof
+
+    def _get_node(self, level, index):
+        if self.nodes is None:
+            start = index * DIGEST_SIZE
+            return bytes(self.leaves[start:start + DIGEST_SIZE])
+        start = (self.level_offsets[level] + index) * DIGEST_SIZE
+        return bytes(self.nodes[start:start + DIGEST_SIZE])
+
+
+def validate_proof(proof, target_hash, merkle_root):
+    """
+    Checks a proof as returned by MerkleTree.get_proof
+    :param proof: list of (position, digest) tuples
+    :param target_hash: leaf digest
+    :param merkle_root: root digest
+    :return: True if the proof leads from target_hash to merkle_root
+    """
+    proof_hash = target_hash
+    for position, sibling in proof:
+        if position == LEFT:
+            proof_hash = hashlib.sha256(sibling + proof_hash).digest()
+        else:
+            proof_hash = hashlib.sha256(proof_hash + sibling).digest()
+    return proof_hash == merkle_root
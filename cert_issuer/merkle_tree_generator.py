@@ -1,9 +1,10 @@
 import hashlib
 
-from chainpoint.chainpoint import MerkleTools
-from pycoin.serialize import h2b
+from pycoin.serialize import b2h
 
 from cert_schema import Chain
+from cert_issuer.merkle_accumulator import MerkleAccumulator
+from cert_issuer.merkle_tree import MerkleTree
 
 
 def hash_byte_array(data):
@@ -19,18 +20,38 @@ def ensure_string(value):
 
 class MerkleTreeGenerator(object):
     def __init__(self):
-        self.tree = MerkleTools(hash_type='sha256')
+        self.tree = MerkleTree()
+        # set by anchor_under when the root is anchored through a super-root rather than directly
+        self.root_proof = []
+        self.anchored_root = None
 
     def populate(self, node_generator):
         """
         Populate Merkle Tree with data from node_generator. This requires that node_generator yield byte[] elements.
-        Hashes, computes hex digest, and adds it to the Merkle Tree
+        Hashes each element and adds the digest to the Merkle Tree
         :param node_generator:
         :return:
         """
         for data in node_generator:
-            hashed = hash_byte_array(data)
-            self.tree.add_leaf(hashed)
+            self.tree.add_leaf(hashlib.sha256(data).digest())
+
+    def populate_leaf_digests(self, digest_generator):
+        """
+        Populate Merkle Tree with leaf digests, e.g. recorded by get_leaf_digests in an earlier run, without hashing them
+        again
+        :param digest_generator: yields 32-byte SHA-256 digests
+        :return:
+        """
+        for digest in digest_generator:
+            self.tree.add_leaf(digest)
+
+    def get_leaf_digests(self):
+        """
+        Returns a generator of the leaf digests in insertion order
+        :return:
+        """
+        for index in range(0, self.tree.get_leaf_count()):
+            yield self.tree.get_leaf(index)
 
     def get_blockchain_data(self):
         """
@@ -38,8 +59,7 @@ class MerkleTreeGenerator(object):
         :return:
         """
         self.tree.make_tree()
-        merkle_root = self.tree.get_merkle_root()
-        return h2b(ensure_string(merkle_root))
+        return self.tree.get_merkle_root()
 
     def get_proof_generator(self, tx_id, chain=Chain.bitcoin_mainnet):
         """
@@ -48,18 +68,15 @@ class MerkleTreeGenerator(object):
         :param tx_id: blockchain transaction id
         :return:
         """
-        root = ensure_string(self.tree.get_merkle_root())
-        node_count = len(self.tree.leaves)
-        for index in range(0, node_count):
-            proof = self.tree.get_proof(index)
-            proof2 = []
-
-            for p in proof:
-                dict2 = dict()
-                for key, value in p.items():
-                    dict2[key] = ensure_string(value)
-                proof2.append(dict2)
-            target_hash = ensure_string(self.tree.get_leaf(index))
+        return self._generate_proofs(self.tree.get_merkle_root(), self.tree.iter_proofs(encode=b2h), tx_id,
+                                     chain)
+
+    def _generate_proofs(self, root, proofs, tx_id, chain, first_index=0):
+        root = b2h(self.anchored_root or root)
+        root_proof = [{position: b2h(sibling)} for position, sibling in self.root_proof]
+        for index, proof in enumerate(proofs, first_index):
+            proof2 = [{position: sibling} for position, sibling in proof] + root_proof
+            target_hash = b2h(self.tree.get_leaf(index))
             merkle_proof = {
                 "type": ['MerkleProof2017', 'Extension'],
                 "merkleRoot": root,
@@ -72,6 +89,100 @@ class MerkleTreeGenerator(object):
                 }]}
             yield merkle_proof
 
+    def anchor_under(self, root_proof, anchored_root):
+        """
+        Extends the proofs returned by get_proof_generator through this tree's root to anchored_root, for a tree whose
+        root is a leaf of another tree that is anchored instead
+        :param root_proof: proof of this tree's root in the other tree, as returned by MerkleTree.get_proof
+        :param anchored_root: root digest of the other tree
+        :return:
+        """
+        self.root_proof = root_proof
+        self.anchored_root = anchored_root
+
+
+class AccumulatorTreeGenerator(MerkleTreeGenerator):
+    """
+    MerkleTreeGenerator over a MerkleAccumulator, for trees that keep growing. Leaves are hashed into the tree as they
+    are added, and get_blockchain_data anchors a snapshot of the leaves added so far in O(log n), instead of building
+    the tree. Leaves added after a snapshot are anchored by a later one. Roots and proofs are the same as
+    MerkleTreeGenerator's.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tree = MerkleAccumulator()
+        self.snapshot = None
+
+    def get_blockchain_data(self):
+        """
+        Snapshot the tree and return its root, the byte array to issue on blockchain
+        :return:
+        """
+        self.snapshot = self.tree.snapshot()
+        return self.snapshot.root
+
+    def get_proof_generator(self, tx_id, chain=Chain.bitcoin_mainnet, snapshot=None):
+        """
+        Returns a generator (1-time iterator) of proofs, in insertion order, of the leaves in a snapshot.
+
+        :param tx_id: blockchain transaction id
+        :param snapshot: the Snapshot the transaction anchored, default the last one taken by get_blockchain_data
+        :return:
+        """
+        snapshot = snapshot or self.snapshot
+        return self._generate_proofs(snapshot.root, self.tree.iter_proofs(snapshot.leaf_count, encode=b2h),
+                                     tx_id, chain)
+
+    def get_proof(self, index, tx_id, chain=Chain.bitcoin_mainnet, snapshot=None):
+        """
+        Returns the proof of one leaf in a snapshot, e.g. of a certificate issued some time ago, in O(log n)
+        :param index: leaf index
+        :param tx_id: blockchain transaction id
+        :param snapshot: the Snapshot the transaction anchored, default the last one taken by get_blockchain_data
+        :return: MerkleProof2017, or None if the leaf is not in the snapshot
+        """
+        snapshot = snapshot or self.snapshot
+        proof = self.tree.get_proof(index, snapshot.leaf_count)
+        if proof is None:
+            return None
+        proof = [(position, b2h(sibling)) for position, sibling in proof]
+        return next(self._generate_proofs(snapshot.root, [proof], tx_id, chain, first_index=index))
+
+
+# Merkle tree generators, selected with the merkle_tree option
+merkle_tree_generators = {
+    'array': MerkleTreeGenerator,
+    'accumulator': AccumulatorTreeGenerator,
+}
+
+
+class SuperRootGenerator(object):
+    """
+    Combines the roots of several MerkleTreeGenerators, e.g. one per tenant, into a super-root, so all of their
+    certificates are anchored by a single transaction. Each tree's root is a leaf of the super-root's tree, and each
+    tree's proofs are extended to the super-root, so the certificates verify against the anchored value like any other
+    MerkleProof2017.
+    """
+
+    def __init__(self, tree_generators):
+        self.tree_generators = tree_generators
+        self.tree = MerkleTree()
+
+    def get_blockchain_data(self):
+        """
+        Finalize the trees and return the super-root to issue on blockchain
+        :return:
+        """
+        self.tree.reset_tree()
+        for tree_generator in self.tree_generators:
+            self.tree.add_leaf(tree_generator.get_blockchain_data())
+        self.tree.make_tree()
+        super_root = self.tree.get_merkle_root()
+        for index, tree_generator in enumerate(self.tree_generators):
+            tree_generator.anchor_under(self.tree.get_proof(index), super_root)
+        return super_root
+
 
 def to_source_id(txid, chain):
 
@@ -0,0 +1,138 @@
+"""
+Local nonce and balance bookkeeping for an Ethereum issuing address, so that each transaction does not look up the
+nonce and balance from the providers, and several transactions can be in flight at once.
+
+Nonces are reserved in increasing order, and a nonce whose transaction was never broadcast is handed out again before
+any new one, so the sequence has no gaps. Each broadcast debits its maximum cost from the cached balance. The state is
+reconciled with the chain on first use, after an error, and once the cached balance is older than max_age_seconds:
+transactions mined since are forgotten, our transactions no longer pending are taken to be dropped, and their nonces
+are reused.
+"""
+import logging
+import threading
+import time
+
+# a fetched balance is trusted for this long before it is fetched again
+DEFAULT_MAX_AGE_SECONDS = 600
+
+
+class NonceManager(object):
+    def __init__(self, connector, address, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, clock=time.monotonic):
+        """
+        :param connector: provides get_account_state(address), returning a connectors.AccountState
+        :param address: address whose transactions are sent
+        :param max_age_seconds: how long a fetched balance is used before the state is reconciled again
+        :param clock: returns the current time in seconds
+        """
+        self.connector = connector
+        self.address = address
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.fetched_at = None
+        self.balance = None
+        # the network's gas price in wei, when last reconciled
+        self.gas_price = None
+        # the nonce the next new transaction gets
+        self.next_nonce = None
+        # nonces handed out whose transactions are not yet broadcast
+        self.reserved = set()
+        # nonces handed out whose transactions were never broadcast, to be handed out again first
+        self.released = set()
+        # nonce -> (maximum cost, time sent), for our broadcast transactions not yet mined
+        self.pending = {}
+        self.reconcile_count = 0
+
+    def reserve(self):
+        """
+        :return: a nonce for a new transaction, reconciling with the chain first if needed
+        """
+        with self.lock:
+            if self.next_nonce is None:
+                self._reconcile()
+            if self.released:
+                nonce = min(self.released)
+                self.released.remove(nonce)
+            else:
+                nonce = self.next_nonce
+                self.next_nonce += 1
+            self.reserved.add(nonce)
+            return nonce
+
+    def release(self, nonce):
+        """
+        Hands a reserved nonce out again, e.g. after its transaction could not be signed or broadcast
+        """
+        with self.lock:
+            if nonce not in self.reserved:
+                return
+            self.reserved.remove(nonce)
+            self.released.add(nonce)
+            if self.next_nonce is None:
+                # invalidated: the next reconcile works out which nonces are free
+                return
+            # released nonces at the end of the sequence are simply handed out next
+            while self.next_nonce - 1 in self.released:
+                self.next_nonce -= 1
+                self.released.remove(self.next_nonce)
+
+    def record_sent(self, nonce, cost):
+        """
+        Records a broadcast transaction, debiting its cost from the balance. Recording the same nonce again has no
+        effect.
+        :param cost: maximum cost of the transaction in wei
+        """
+        with self.lock:
+            if nonce in self.pending:
+                return
+            self.reserved.discard(nonce)
+            self.released.discard(nonce)
+            if self.next_nonce is not None and nonce >= self.next_nonce:
+                # a transaction signed before a restart; the nonces it skips are reused
+                self.released.update(range(self.next_nonce, nonce))
+                self.next_nonce = nonce + 1
+            self.pending[nonce] = (cost, self.clock())
+            if self.balance is not None:
+                self.balance -= cost
+
+    def get_balance(self, refresh=False):
+        """
+        :param refresh: reconcile even if the cached balance is recent enough
+        :return: balance in wei, less the cost of our transactions not yet mined
+        """
+        with self.lock:
+            if refresh or self.fetched_at is None or self.clock() - self.fetched_at >= self.max_age_seconds:
+                self._reconcile()
+            return self.balance
+
+    def get_pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    def invalidate(self):
+        """
+        Reconciles with the chain before the next nonce is handed out. Use when a transaction is rejected.
+        """
+        with self.lock:
+            self.fetched_at = None
+            self.next_nonce = None
+
+    def _reconcile(self):
+        started_at = self.clock()
+        account_state = self.connector.get_account_state(self.address)
+        mined_nonce, pending_nonce = account_state.nonce, account_state.pending_nonce
+        self.gas_price = account_state.gas_price
+        self.reconcile_count += 1
+
+        # transactions below mined_nonce were mined; ours at or above pending_nonce were dropped, unless they were sent
+        # while the chain was being queried
+        for nonce in list(self.pending):
+            _, sent_at = self.pending[nonce]
+            if nonce < mined_nonce or (nonce >= pending_nonce and sent_at < started_at):
+                del self.pending[nonce]
+        self.balance = account_state.balance - sum(cost for cost, _ in self.pending.values())
+        self.next_nonce = max([pending_nonce] + [nonce + 1 for nonce in self.reserved | set(self.pending)])
+        self.released = set(range(pending_nonce, self.next_nonce)) - self.reserved - set(self.pending)
+        self.fetched_at = self.clock()
+        logging.debug('Reconciled nonces of %s: mined %d, pending %d, next %d', self.address, mined_nonce,
+                      pending_nonce, self.next_nonce)
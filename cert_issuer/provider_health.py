@@ -0,0 +1,136 @@
+"""
+Health tracking of the blockchain API providers, used by the connectors to route reads.
+
+For every provider, the latency and error rate of its calls are tracked as exponentially weighted moving averages.
+Reads go to the healthy provider with the best score first, so a dead or slow provider does not add its timeout to
+every call. After FAILURE_THRESHOLD consecutive failures a provider's circuit opens and it is ranked after every
+provider whose circuit is closed, so it is only tried if they all fail; once OPEN_SECONDS have passed, it is ranked by
+its score again, and the next read that succeeds on it closes the circuit.
+"""
+import logging
+import threading
+import time
+
+# weight of the latest call in the moving averages
+EWMA_ALPHA = 0.3
+# how much a provider's error rate inflates its score
+ERROR_PENALTY = 10
+FAILURE_THRESHOLD = 3
+OPEN_SECONDS = 60
+
+
+class ProviderHealth(object):
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record(self, latency, succeeded, now):
+        self.calls += 1
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+        self.error_rate = EWMA_ALPHA * (0.0 if succeeded else 1.0) + (1 - EWMA_ALPHA) * self.error_rate
+        if succeeded:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                logging.warning('Provider %s failed %d times in a row; trying it last for %ds', self.name,
+                                self.consecutive_failures, OPEN_SECONDS)
+            # a failed trial keeps the circuit open for another OPEN_SECONDS
+            self.opened_at = now
+
+    def is_available(self, now):
+        return self.opened_at is None or now - self.opened_at >= OPEN_SECONDS
+
+    def get_score(self):
+        """
+        :return: expected cost of a call; providers that have not been called yet come first
+        """
+        if self.latency is None:
+            return -1
+        return self.latency * (1 + ERROR_PENALTY * self.error_rate)
+
+    def get_stats(self, now):
+        return {'provider': self.name,
+                'latency': self.latency,
+                'error_rate': self.error_rate,
+                'calls': self.calls,
+                'failures': self.failures,
+                'circuit_open': not self.is_available(now)}
+
+
+class ProviderHealthRegistry(object):
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: returns the current time in seconds
+        """
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.health = {}
+
+    def get_health(self, provider):
+        with self.lock:
+            if provider not in self.health:
+                self.health[provider] = ProviderHealth(get_provider_name(provider))
+            return self.health[provider]
+
+    def rank(self, providers):
+        """
+        Orders the providers by their score, healthy ones first. Providers with an open circuit are still returned,
+        last, so a read is attempted even if every provider has been failing.
+        :param providers:
+        :return: list of providers
+        """
+        now = self.clock()
+        healths = [self.get_health(provider) for provider in providers]
+        with self.lock:
+            keys = [(not health.is_available(now), health.get_score(), index)
+                    for index, health in enumerate(healths)]
+        return [providers[index] for _, _, index in sorted(keys)]
+
+    def call(self, provider, method, *args):
+        """
+        Calls the provider's method, recording its latency and whether it raised
+        :return: what the method returns
+        """
+        health = self.get_health(provider)
+        start = self.clock()
+        try:
+            result = method(*args)
+        except Exception:
+            self._record(health, start, False)
+            raise
+        self._record(health, start, True)
+        return result
+
+    def get_stats(self):
+        """
+        :return: list of dicts with each provider's latency and error rate averages, call and failure counts, and
+        whether its circuit is open
+        """
+        now = self.clock()
+        with self.lock:
+            return [health.get_stats(now) for health in self.health.values()]
+
+    def _record(self, health, start, succeeded):
+        now = self.clock()
+        with self.lock:
+            health.record(now - start, succeeded, now)
+
+
+def get_provider_name(provider):
+    url = getattr(provider, 'base_url', None) or getattr(provider, 'url', None)
+    network_path = getattr(provider, 'network_path', None)
+    name = type(provider).__name__
+    return '{}({})'.format(name, url or network_path) if url or network_path else name
+
+
+# health of the providers, shared by the connectors
+health_registry = ProviderHealthRegistry()
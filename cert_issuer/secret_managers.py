@@ -0,0 +1,375 @@
+"""
+Secret managers, selected with the secret_manager option:
+
+file      the WIF in usb_name/key_file is read each time the secret manager is started (FileSecretManager)
+memory    the WIF in usb_name/key_file is read once, when the issuer starts, and kept in memory. For test and mock runs
+agent     a signing agent, listening on signing_agent_socket, signs. The agent loads the key once, for its lifetime,
+          so the issuer never reads it. Run it with cert-issuer-signing-agent and the same configuration
+pkcs11    a secp256k1 key on a PKCS#11 token, e.g. an HSM or SoftHSM, signs. The key never leaves the token. Requires
+          python-pkcs11
+
+More backends are added to secret_manager_factories, as functions of (signer, app_config).
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from abc import abstractmethod
+
+from cert_issuer import signer as signer_helper
+from cert_issuer.errors import SecretManagerError, UnableToSignTxError
+from cert_issuer.signer import SecretManager
+
+DEFAULT_AGENT_TIMEOUT_SECONDS = 30
+
+
+class InMemorySecretManager(SecretManager):
+    """
+    Holds the key for the life of the process; starting and stopping does nothing
+    """
+
+    def __init__(self, signer, wif):
+        super().__init__(signer)
+        self.wif = wif
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class ExternalKeySecretManager(SecretManager):
+    """
+    Base for secret managers whose key signs digests but cannot be read, e.g. a key on a hardware token. Transactions
+    are signed with the signer's sign_transaction_with_key.
+    """
+
+    @abstractmethod
+    def sign_digest(self, digest):
+        """
+        :param digest: 32 bytes
+        :return: ECDSA signature (r, s) on secp256k1
+        """
+        pass
+
+    @abstractmethod
+    def get_public_pair(self):
+        """
+        :return: public key as (x, y)
+        """
+        pass
+
+    def sign_message(self, message_to_sign):
+        raise UnableToSignTxError('Messages cannot be signed with a key outside the issuer')
+
+    def sign_transaction(self, transaction_to_sign):
+        return self.signer.sign_transaction_with_key(self, transaction_to_sign)
+
+    def sign_transactions(self, transactions_to_sign):
+        for transaction_to_sign in transactions_to_sign:
+            yield self.sign_transaction(transaction_to_sign)
+
+    def get_signing_key(self):
+        return self
+
+
+class Pkcs11SecretManager(ExternalKeySecretManager):
+    """
+    Signs with an EC key pair on a PKCS#11 token, found by its label. The token session is opened when the secret
+    manager is started and closed when it is stopped.
+    """
+
+    def __init__(self, signer, library_path, token_label, key_label, pin=None):
+        """
+        :param library_path: the token's PKCS#11 module, e.g. /usr/lib/softhsm/libsofthsm2.so
+        :param token_label:
+        :param key_label: label of the private and public key objects
+        :param pin: user PIN, if the token needs a login
+        """
+        super().__init__(signer)
+        self.library_path = library_path
+        self.token_label = token_label
+        self.key_label = key_label
+        self.pin = pin
+        self.session = None
+        self.private_key = None
+        self.public_pair = None
+
+    def start(self):
+        if self.session is not None:
+            return
+        try:
+            import pkcs11
+            from pkcs11 import Attribute, KeyType, ObjectClass
+        except ImportError:
+            raise SecretManagerError('python-pkcs11 is required for secret_manager=pkcs11')
+        from pycoin.encoding import sec_to_public_pair
+
+        try:
+            token = pkcs11.lib(self.library_path).get_token(token_label=self.token_label)
+            self.session = token.open(user_pin=self.pin)
+            self.private_key = self.session.get_key(object_class=ObjectClass.PRIVATE_KEY, key_type=KeyType.EC,
+                                                    label=self.key_label)
+            public_key = self.session.get_key(object_class=ObjectClass.PUBLIC_KEY, key_type=KeyType.EC,
+                                              label=self.key_label)
+        except pkcs11.PKCS11Error as e:
+            self.stop()
+            raise SecretManagerError('Cannot use key {} on token {}: {!r}'.format(self.key_label, self.token_label, e))
+        self.public_pair = sec_to_public_pair(decode_ec_point(public_key[Attribute.EC_POINT]))
+
+    def stop(self):
+        if self.session is not None:
+            self.session.close()
+        self.session = None
+        self.private_key = None
+
+    def sign_digest(self, digest):
+        from pkcs11 import Mechanism
+
+        signature = self.private_key.sign(digest, mechanism=Mechanism.ECDSA)
+        return int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:], 'big')
+
+    def get_public_pair(self):
+        return self.public_pair
+
+
+def decode_ec_point(ec_point):
+    """
+    :param ec_point: CKA_EC_POINT, which tokens return either DER encoded as an OCTET STRING, or bare
+    :return: the SEC encoded point
+    """
+    if len(ec_point) > 2 and ec_point[0] == 0x04 and ec_point[1] == len(ec_point) - 2:
+        return bytes(ec_point[2:])
+    return bytes(ec_point)
+
+
+class SigningAgentSecretManager(SecretManager):
+    """
+    Asks a SigningAgent to sign, over a Unix socket. The connection is opened when the secret manager is started and
+    closed when it is stopped. The signer encodes the transactions for the agent.
+    """
+
+    def __init__(self, signer, socket_path, timeout=DEFAULT_AGENT_TIMEOUT_SECONDS):
+        super().__init__(signer)
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection = None
+        self.stream = None
+
+    def start(self):
+        with self.lock:
+            if self.connection is not None:
+                return
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            try:
+                connection.connect(self.socket_path)
+            except OSError as e:
+                connection.close()
+                raise SecretManagerError('Cannot connect to the signing agent at {}: {}'.format(self.socket_path, e))
+            self.connection = connection
+            self.stream = connection.makefile('rwb')
+
+    def stop(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.stream.close()
+            self.connection.close()
+            self.connection = None
+            self.stream = None
+
+    def sign_message(self, message_to_sign):
+        return self.call('sign_message', message_to_sign)
+
+    def sign_transaction(self, transaction_to_sign):
+        signed_transaction = self.call('sign_transaction', self.signer.encode_transaction(transaction_to_sign))
+        return self.signer.decode_signed_transaction(signed_transaction)
+
+    def sign_transactions(self, transactions_to_sign):
+        for transaction_to_sign in transactions_to_sign:
+            yield self.sign_transaction(transaction_to_sign)
+
+    def get_signing_key(self):
+        return self
+
+    def sign_digest(self, digest):
+        from pycoin.serialize import b2h
+
+        r, s = self.call('sign_digest', b2h(digest))
+        return r, s
+
+    def get_public_pair(self):
+        x, y = self.call('get_public_pair', None)
+        return x, y
+
+    def call(self, method, params):
+        """
+        :return: the agent's result
+        """
+        with self.lock:
+            if self.connection is None:
+                raise SecretManagerError('The secret manager is not started')
+            try:
+                self.stream.write(json.dumps({'method': method, 'params': params}).encode('utf-8') + b'\n')
+                self.stream.flush()
+                line = self.stream.readline()
+            except OSError as e:
+                raise SecretManagerError('The signing agent did not respond: {}'.format(e))
+        if not line:
+            raise SecretManagerError('The signing agent closed the connection')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise UnableToSignTxError('The signing agent could not sign: {}'.format(response['error']))
+        return response['result']
+
+
+class SigningAgent(object):
+    """
+    Signs for SigningAgentSecretManagers connecting to a Unix socket, with the key of another secret manager, which
+    is started once and kept started until the agent stops. Only the agent's user can connect to the socket.
+
+    Requests and responses are JSON objects, one per line:
+        {"method": "sign_transaction", "params": <transaction, as encoded by the signer>}
+        {"method": "sign_message", "params": <message>}
+        {"method": "sign_digest", "params": <32-byte digest, in hex>}, answered with [r, s]
+        {"method": "get_public_pair", "params": null}, answered with [x, y]
+    answered with {"result": ...} or {"error": <message>}.
+    """
+
+    def __init__(self, secret_manager, socket_path):
+        self.secret_manager = secret_manager
+        self.socket_path = socket_path
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.signature_count = 0
+
+    def start(self):
+        self.secret_manager.start()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        # the socket is created accessible to the agent's user only
+        umask = os.umask(0o177)
+        try:
+            self.server = AgentServer(self.socket_path, self)
+        finally:
+            os.umask(umask)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='signing-agent', daemon=True)
+        self.thread.start()
+        logging.info('Signing agent listening on %s', self.socket_path)
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            os.remove(self.socket_path)
+        self.secret_manager.stop()
+
+    def handle(self, request):
+        """
+        :param request: decoded request
+        :return: response
+        """
+        try:
+            method = request['method']
+            signer = self.secret_manager.signer
+            with self.lock:
+                if method == 'sign_transaction':
+                    signed_transaction = self.secret_manager.sign_transaction(
+                        signer.decode_transaction(request['params']))
+                    if isinstance(signed_transaction, dict):
+                        # EthereumSigner returns its errors
+                        raise UnableToSignTxError(str(signed_transaction['message']))
+                    result = signer.encode_signed_transaction(signed_transaction)
+                elif method == 'sign_message':
+                    result = self.secret_manager.sign_message(request['params'])
+                elif method == 'sign_digest':
+                    from pycoin.serialize import h2b
+
+                    result = self.secret_manager.get_signing_key().sign_digest(h2b(request['params']))
+                elif method == 'get_public_pair':
+                    return {'result': self.secret_manager.get_signing_key().get_public_pair()}
+                else:
+                    return {'error': 'Unknown method {}'.format(method)}
+                self.signature_count += 1
+            return {'result': result}
+        except Exception as e:
+            logging.warning('Signing agent request failed: %s', e)
+            return {'error': str(e)}
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.agent.handle(json.loads(line.decode('utf-8')))
+            except ValueError as e:
+                response = {'error': 'Invalid request: {}'.format(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, agent):
+        self.agent = agent
+        super().__init__(socket_path, AgentRequestHandler)
+
+
+def create_in_memory_secret_manager(signer, app_config):
+    path_to_secret = os.path.join(app_config.usb_name, app_config.key_file)
+    return InMemorySecretManager(signer, signer_helper.import_key(path_to_secret))
+
+
+def create_signing_agent_secret_manager(signer, app_config):
+    return SigningAgentSecretManager(signer, app_config.signing_agent_socket)
+
+
+def create_pkcs11_secret_manager(signer, app_config):
+    return Pkcs11SecretManager(signer, app_config.pkcs11_library, app_config.pkcs11_token_label,
+                               app_config.pkcs11_key_label, pin=app_config.pkcs11_pin)
+
+
+secret_manager_factories = {
+    'file': signer_helper.create_file_secret_manager,
+    'memory': create_in_memory_secret_manager,
+    'agent': create_signing_agent_secret_manager,
+    'pkcs11': create_pkcs11_secret_manager,
+}
+
+
+def signing_agent_main(args=None):
+    """
+    Runs a signing agent for the configured chain and key until interrupted. The agent signs with the secret manager
+    the configuration selects, or with the key file if that is the agent itself.
+    """
+    from cert_issuer import config
+
+    app_config = config.get_config()
+    if app_config.safe_mode:
+        # the agent holds the key while the issuers it signs for are online
+        raise SecretManagerError('The signing agent keeps the key loaded while the issuer is online; run it with '
+                                 'no_safe_mode')
+    if app_config.secret_manager == 'agent':
+        app_config.secret_manager = 'file'
+    agent = SigningAgent(signer_helper.initialize_signer(app_config), app_config.signing_agent_socket)
+    agent.start()
+    try:
+        agent.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.stop()
+        logging.info('Signing agent stopped after %d signatures', agent.signature_count)
+
+
+if __name__ == '__main__':
+    signing_agent_main()
@@ -1,24 +1,18 @@
 import json
 import logging
 import os
+import threading
 import time
 from abc import abstractmethod
 
 import requests
-from bitcoin.signmessage import BitcoinMessage, SignMessage
-from bitcoin.signmessage import VerifyMessage
-from bitcoin.wallet import CBitcoinSecret
-from pycoin.encoding import wif_to_secret_exponent
-from pycoin.networks import wif_prefix_for_netcode
-from pycoin.tx.pay_to import build_hash160_lookup
 
 from cert_schema import BlockchainType, Chain, UnknownChainError
 from cert_issuer.errors import UnverifiedSignatureError, UnableToSignTxError
 from cert_issuer import helpers
 
-from ethereum import transactions
-from ethereum.utils import encode_hex
-import rlp
+# The Bitcoin and Ethereum libraries are imported by the signers that use them, so a run only loads the selected
+# chain's dependencies.
 
 
 def import_key(secrets_file_path):
@@ -59,7 +53,11 @@ def check_internet_on(secrets_file_path):
 
 
 def initialize_signer(app_config):
-    path_to_secret = os.path.join(app_config.usb_name, app_config.key_file)
+    """
+    :return: the secret manager selected by app_config.secret_manager, for the chain's signer
+    """
+    # imported here, since the backends import this module
+    from cert_issuer.secret_managers import secret_manager_factories
 
     if app_config.chain.blockchain_type == BlockchainType.bitcoin:
         signer = BitcoinSigner(bitcoin_chain=app_config.chain)
@@ -69,9 +67,13 @@ def initialize_signer(app_config):
         signer = None
     else:
         raise UnknownChainError(app_config.chain)
-    secret_manager = FileSecretManager(signer=signer, path_to_secret=path_to_secret,
-                                       safe_mode=app_config.safe_mode, issuing_address=app_config.issuing_address)
-    return secret_manager
+    return secret_manager_factories[app_config.secret_manager](signer, app_config)
+
+
+def create_file_secret_manager(signer, app_config):
+    path_to_secret = os.path.join(app_config.usb_name, app_config.key_file)
+    return FileSecretManager(signer=signer, path_to_secret=path_to_secret, safe_mode=app_config.safe_mode,
+                             issuing_address=app_config.issuing_address)
 
 
 class Signer(object):
@@ -90,22 +92,132 @@ class Signer(object):
     def sign_transaction(self, wif, transaction_to_sign):
         pass
 
+    def sign_transactions(self, wif, transactions_to_sign):
+        """
+        Signs each transaction, lazily: the next transaction is taken from transactions_to_sign only once the previous
+        signed one has been consumed, so a transaction may spend the change of the one before it.
+        :param wif:
+        :param transactions_to_sign: iterable of transactions
+        :return: generator of signed transactions
+        """
+        for transaction_to_sign in transactions_to_sign:
+            yield self.sign_transaction(wif, transaction_to_sign)
+
+    @abstractmethod
+    def sign_transaction_with_key(self, key, transaction_to_sign):
+        """
+        Signs with a key that signs digests without revealing the private key, e.g. on a PKCS#11 token
+        :param key: provides sign_digest(digest), returning (r, s), and get_public_pair(), returning (x, y)
+        :param transaction_to_sign:
+        :return: signed transaction, as sign_transaction returns it
+        """
+        pass
+
+    @abstractmethod
+    def get_signing_key(self, wif):
+        """
+        :return: the key as a certificate_signer.SigningKey, to sign certificates with
+        """
+        pass
+
+    @abstractmethod
+    def encode_transaction(self, transaction):
+        """
+        :return: string encoding of an unsigned transaction, e.g. to send it to a signing agent
+        """
+        pass
+
+    @abstractmethod
+    def decode_transaction(self, encoded_transaction):
+        pass
+
+    def encode_signed_transaction(self, signed_transaction):
+        return signed_transaction
+
+    def decode_signed_transaction(self, encoded_transaction):
+        return encoded_transaction
+
 
 class BitcoinSigner(Signer):
     def __init__(self, bitcoin_chain):
+        from pycoin.networks import wif_prefix_for_netcode
+
         self.bitcoin_chain = bitcoin_chain
         self.allowable_wif_prefixes = wif_prefix_for_netcode(helpers.to_pycoin_chain(bitcoin_chain))
 
     def sign_message(self, wif, message_to_sign):
+        from bitcoin.signmessage import BitcoinMessage, SignMessage
+        from bitcoin.wallet import CBitcoinSecret
+
         secret_key = CBitcoinSecret(wif)
         message = BitcoinMessage(message_to_sign)
         signature = SignMessage(secret_key, message)
         return str(signature, 'utf-8')
 
     def sign_transaction(self, wif, transaction_to_sign):
+        return self._sign_with_lookup(self._build_lookup(wif), transaction_to_sign)
+
+    def sign_transactions(self, wif, transactions_to_sign):
+        # the key is decoded and its public key hash computed once for all the transactions
+        lookup = self._build_lookup(wif)
+        for transaction_to_sign in transactions_to_sign:
+            yield self._sign_with_lookup(lookup, transaction_to_sign)
+
+    def _build_lookup(self, wif):
+        from pycoin.encoding import wif_to_secret_exponent
+        from pycoin.tx.pay_to import build_hash160_lookup
+
         secret_exponent = wif_to_secret_exponent(wif, self.allowable_wif_prefixes)
-        lookup = build_hash160_lookup([secret_exponent])
-        signed_transaction = transaction_to_sign.sign(lookup)
+        return build_hash160_lookup([secret_exponent])
+
+    def get_signing_key(self, wif):
+        from pycoin.encoding import wif_to_secret_exponent
+        from cert_issuer.certificate_signer import SigningKey
+
+        return SigningKey(wif_to_secret_exponent(wif, self.allowable_wif_prefixes))
+
+    def sign_transaction_with_key(self, key, transaction_to_sign):
+        from pycoin.ecdsa import generator_secp256k1
+        from pycoin.encoding import hash160, public_pair_to_sec, to_bytes_32
+        from pycoin.tx.script import der, tools
+
+        order = generator_secp256k1.order()
+        hash_type = transaction_to_sign.SIGHASH_ALL
+        public_pair = key.get_public_pair()
+        secs = [public_pair_to_sec(public_pair, compressed=compressed) for compressed in [True, False]]
+        for index, tx_in in enumerate(transaction_to_sign.txs_in):
+            unspent_script = transaction_to_sign.unspents[index].script
+            # the output pays to the hash of either encoding of the public key
+            sec = next((sec for sec in secs if hash160(sec) in unspent_script), None)
+            if sec is None:
+                continue
+            signature_hash = transaction_to_sign.signature_hash(unspent_script, index, hash_type)
+            r, s = key.sign_digest(to_bytes_32(signature_hash))
+            # low S, as pycoin signs, so the signature is standard
+            if s + s > order:
+                s = order - s
+            tx_in.script = tools.bin_script([der.sigencode_der(r, s) + bytes([hash_type]), sec])
+        return self._check_signed(transaction_to_sign)
+
+    def encode_transaction(self, transaction):
+        # the unspents are needed to sign
+        return transaction.as_hex(include_unspents=True)
+
+    def decode_transaction(self, encoded_transaction):
+        from pycoin.tx.Tx import Tx
+
+        return Tx.from_hex(encoded_transaction)
+
+    def encode_signed_transaction(self, signed_transaction):
+        return signed_transaction.as_hex()
+
+    def decode_signed_transaction(self, encoded_transaction):
+        return self.decode_transaction(encoded_transaction)
+
+    def _sign_with_lookup(self, lookup, transaction_to_sign):
+        return self._check_signed(transaction_to_sign.sign(lookup))
+
+    def _check_signed(self, signed_transaction):
         # Because signing failures silently continue, first check that the inputs are signed
         for input in signed_transaction.txs_in:
             if len(input.script) == 0:
@@ -130,7 +242,10 @@ class EthereumSigner(Signer):
     
     def sign_transaction(self, wif, transaction_to_sign):
         ##try to sign the transaction.
-        
+        from ethereum import transactions
+        from ethereum.utils import encode_hex
+        import rlp
+
         if isinstance(transaction_to_sign, transactions.Transaction):
             try:
                 raw_tx = rlp.encode(transaction_to_sign.sign(wif, self.netcode))
@@ -140,6 +255,52 @@ class EthereumSigner(Signer):
                 return { 'error':True, 'message':msg }
         else:
             raise UnableToSignTxError('You are trying to sign a non transaction type')
+
+    def sign_transaction_with_key(self, key, transaction_to_sign):
+        from ethereum import transactions, utils
+        import rlp
+
+        if not isinstance(transaction_to_sign, transactions.Transaction):
+            raise UnableToSignTxError('You are trying to sign a non transaction type')
+        # the hash Transaction.sign signs, with replay protection if there is a netcode
+        if self.netcode is None:
+            raw_hash = utils.sha3(rlp.encode(transactions.unsigned_tx_from_tx(transaction_to_sign),
+                                             transactions.UnsignedTransaction))
+        else:
+            raw_hash = utils.sha3(rlp.encode(
+                rlp.infer_sedes(transaction_to_sign).serialize(transaction_to_sign)[:-3] + [self.netcode, b'', b'']))
+        r, s = key.sign_digest(raw_hash)
+        if s + s > transactions.secpk1n:
+            s = transactions.secpk1n - s
+
+        # the recovery id is not returned by the key, so it is found by recovering the public key
+        x, y = key.get_public_pair()
+        public_key = utils.encode_int32(x) + utils.encode_int32(y)
+        v = next((v for v in [27, 28] if utils.ecrecover_to_pub(raw_hash, v, r, s) == public_key), None)
+        if v is None:
+            raise UnableToSignTxError('The signature does not match the public key')
+        if self.netcode is not None:
+            v += 8 + self.netcode * 2
+        return utils.encode_hex(rlp.encode(transaction_to_sign.copy(v=v, r=r, s=s)))
+
+    def get_signing_key(self, wif):
+        from cert_issuer.certificate_signer import SigningKey
+
+        # the key file holds the private key in hex
+        return SigningKey(int(wif, 16))
+
+    def encode_transaction(self, transaction):
+        from ethereum.utils import encode_hex
+        import rlp
+
+        return encode_hex(rlp.encode(transaction))
+
+    def decode_transaction(self, encoded_transaction):
+        from ethereum import transactions
+        from ethereum.utils import decode_hex
+        import rlp
+
+        return rlp.decode(decode_hex(encoded_transaction), transactions.Transaction)
        
 class SecretManager(object):
     def __init__(self, signer):
@@ -160,6 +321,19 @@ class SecretManager(object):
     def sign_transaction(self, transaction_to_sign):
         return self.signer.sign_transaction(self.wif, transaction_to_sign)
 
+    def sign_transactions(self, transactions_to_sign):
+        """
+        See Signer.sign_transactions. Consume the generator before the secret manager is stopped.
+        """
+        return self.signer.sign_transactions(self.wif, transactions_to_sign)
+
+    def get_signing_key(self):
+        """
+        :return: the key to sign certificates with, while the secret manager is started. Provides sign_digest and
+        get_public_pair, as ExternalKeySecretManager does
+        """
+        return self.signer.get_signing_key(self.wif)
+
 
 class FileSecretManager(SecretManager):
     def __init__(self, signer, path_to_secret, safe_mode=True, issuing_address=None):
@@ -189,17 +363,136 @@ class FileSecretManager(SecretManager):
 
 
 class FinalizableSigner(object):
+    """
+    Starts the secret manager for the signatures made in the with block, and stops it after. Inside a SigningSession
+    for the same secret manager, the session's key window is used instead.
+    """
+
     def __init__(self, secret_manager):
         self.secret_manager = secret_manager
+        self.session = None
 
     def __enter__(self):
         logging.info('Starting finalizable signer')
-        self.secret_manager.start()
+        self.session = get_signing_session(self.secret_manager)
+        if self.session:
+            self.session.open()
+        else:
+            self.secret_manager.start()
         return self.secret_manager
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         logging.info('Stopping finalizable signer')
-        self.secret_manager.stop()
+        if self.session:
+            self.session.release()
+        else:
+            self.secret_manager.stop()
+
+
+# signing sessions in progress, by id of their secret manager
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_signing_session(secret_manager):
+    """
+    :return: the SigningSession in progress for the secret manager, or None
+    """
+    with _sessions_lock:
+        return _sessions.get(id(secret_manager))
+
+
+class SigningSession(object):
+    """
+    Groups the signing of a run into as few key windows as possible. The secret manager is started when something is
+    first signed in the session, not when the session begins, so a session in which nothing is signed never loads the
+    key or waits for the air gap. With keep_open, it is stopped when the session ends; otherwise when nothing is being
+    signed, since in safe mode the network is needed between signatures, e.g. to broadcast.
+
+    A session entered while another is in progress for the same secret manager joins it.
+    """
+
+    def __init__(self, secret_manager, keep_open=True, clock=time.perf_counter):
+        """
+        :param secret_manager: SecretManager whose start and stop are grouped
+        :param keep_open: keep the key window open between signatures, until the session ends
+        :param clock: returns the current time in seconds
+        """
+        self.secret_manager = secret_manager
+        self.keep_open = keep_open
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.outer = None
+        self.started = False
+        # FinalizableSigners using the window at the moment
+        self.users = 0
+        self.windows = 0
+        self.phases = 0
+        # seconds spent starting and stopping the secret manager, i.e. loading the key and waiting for the air gap
+        self.wait_seconds = 0
+
+    def __enter__(self):
+        with _sessions_lock:
+            self.outer = _sessions.get(id(self.secret_manager))
+            if self.outer is None:
+                _sessions[id(self.secret_manager)] = self
+        return self.outer or self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.outer is not None:
+            return
+        with _sessions_lock:
+            del _sessions[id(self.secret_manager)]
+        self.close()
+        if self.phases:
+            logging.info('Signing session: %d signing phases in %d key windows, %.1fs starting and stopping the '
+                         'secret manager', self.phases, self.windows, self.wait_seconds)
+
+    def open(self):
+        """
+        Starts the secret manager, unless the window is already open
+        """
+        with self.lock:
+            self.phases += 1
+            self.users += 1
+            if not self.started:
+                start = self.clock()
+                try:
+                    self.secret_manager.start()
+                except Exception:
+                    self.users -= 1
+                    raise
+                finally:
+                    self.wait_seconds += self.clock() - start
+                self.started = True
+                self.windows += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            if not self.keep_open and not self.users:
+                self._stop()
+
+    def close(self):
+        """
+        Stops the secret manager if it is started; the next signature starts it again
+        """
+        with self.lock:
+            self._stop()
+
+    def get_stats(self):
+        with self.lock:
+            return {'phases': self.phases, 'windows': self.windows, 'wait_seconds': self.wait_seconds}
+
+    def _stop(self):
+        if not self.started:
+            return
+        start = self.clock()
+        self.started = False
+        try:
+            self.secret_manager.stop()
+        finally:
+            self.wait_seconds += self.clock() - start
 
 
 def verify_message(address, message, signature):
@@ -210,6 +503,8 @@ def verify_message(address, message, signature):
     :param signature: signature being tested
     :return:
     """
+    from bitcoin.signmessage import BitcoinMessage, VerifyMessage
+
     bitcoin_message = BitcoinMessage(message)
     verified = VerifyMessage(address, bitcoin_message, signature)
     return verified
@@ -1,12 +1,14 @@
 import logging
-import random
+import threading
 from abc import abstractmethod
 
 from pycoin.serialize import b2h
 
-from cert_issuer import tx_utils
-from cert_issuer.errors import InsufficientFundsError
+from cert_issuer import coin_selection, tx_utils, utxo_pool
+from cert_issuer.errors import InsufficientFundsError, TransactionRejectedError
+from cert_issuer.nonce_manager import NonceManager
 from cert_issuer.signer import FinalizableSigner
+from cert_issuer.utxo_cache import UtxoCache, get_outpoint
 
 # Estimate fees assuming worst case 3 inputs
 ESTIMATE_NUM_INPUTS = 3
@@ -25,6 +27,66 @@ class TransactionHandler(object):
     def issue_transaction(self, blockchain_bytes):
         pass
 
+    @abstractmethod
+    def create_signed_transaction(self, blockchain_bytes):
+        """
+        First half of issue_transaction: creates, signs and verifies the transaction without broadcasting it
+        :param blockchain_bytes:
+        :return: signed transaction, hex encoded
+        """
+        pass
+
+    def create_signed_transactions(self, blockchain_bytes_list):
+        """
+        Creates and signs a transaction for each of blockchain_bytes_list, without broadcasting them. Handlers that can
+        sign them all in one key window override this. If one cannot be signed, none are returned.
+        :param blockchain_bytes_list: list of blockchain bytes, in the order the transactions are broadcast
+        :return: list of signed transactions, hex encoded
+        """
+        return [self.create_signed_transaction(blockchain_bytes) for blockchain_bytes in blockchain_bytes_list]
+
+    def discard_signed_transactions(self, signed_hextxs):
+        """
+        Gives back what create_signed_transactions reserved for transactions that will not be broadcast, e.g. because
+        they spend the change of an earlier one that was rejected
+        :param signed_hextxs: as returned by create_signed_transactions
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def broadcast_signed_transaction(self, signed_hextx):
+        """
+        Second half of issue_transaction. Broadcasting the same signed transaction again does not spend more. Raises
+        TransactionRejectedError if the transaction was refused, and gives back what it reserved; any other
+        BroadcastError means it may have been sent, and it stays reserved so it can be broadcast again.
+        :param signed_hextx: as returned by create_signed_transaction
+        :return: txid
+        """
+        pass
+
+    @abstractmethod
+    def get_txid(self, signed_hextx):
+        """
+        :param signed_hextx: as returned by create_signed_transaction
+        :return: the txid broadcast_signed_transaction returns for it, known before it is broadcast
+        """
+        pass
+
+    @abstractmethod
+    def is_transaction_known(self, txid):
+        """
+        :return: True if the transaction is pending or mined, e.g. because a broadcast that seemed to fail reached the
+        network
+        """
+        pass
+
+    def supports_concurrent_transactions(self):
+        """
+        :return: True if transactions for several batches may be created and broadcast at the same time
+        """
+        return False
+
 
 class TransactionCreator(object):
     @abstractmethod
@@ -32,7 +94,7 @@ class TransactionCreator(object):
         pass
 
     @abstractmethod
-    def create_transaction(self, tx_cost_constants, issuing_address, inputs, op_return_value):
+    def create_transaction(self, tx_cost_constants, issuing_address, inputs, op_return_value, fee=None):
         pass
 
 
@@ -41,8 +103,13 @@ class TransactionV2Creator(TransactionCreator):
         total = tx_utils.calculate_tx_fee(tx_cost_constants, num_inputs, V2_NUM_OUTPUTS)
         return total
 
-    def create_transaction(self, tx_cost_constants, issuing_address, inputs, op_return_value):
-        fee = tx_utils.calculate_tx_fee(tx_cost_constants, len(inputs), V2_NUM_OUTPUTS)
+    def create_transaction(self, tx_cost_constants, issuing_address, inputs, op_return_value, fee=None):
+        """
+        :param fee: satoshis, as decided by coin selection; calculated for a change output if None. The inputs' value
+        left after the fee is sent back to issuing_address as change.
+        """
+        if fee is None:
+            fee = tx_utils.calculate_tx_fee(tx_cost_constants, len(inputs), V2_NUM_OUTPUTS)
         transaction = tx_utils.create_trx(
             op_return_value,
             fee,
@@ -72,66 +139,222 @@ class EthereumTransactionCreator(object):
 
 class BitcoinTransactionHandler(TransactionHandler):
     def __init__(self, connector, tx_cost_constants, secret_manager, issuing_address, prepared_inputs=None,
-                 transaction_creator=TransactionV2Creator()):
+                 transaction_creator=TransactionV2Creator(), utxo_cache=None, coin_selector=None, utxo_pool=None):
+        """
+        :param utxo_cache: UtxoCache of issuing_address; one is created if None
+        :param coin_selector: coin_selection.CoinSelector; branch and bound if None
+        :param utxo_pool: optional utxo_pool.UtxoPool on the same cache. If set, each transaction spends a pool output
+        of its own, so transactions can be created and broadcast concurrently.
+        """
         self.connector = connector
         self.tx_cost_constants = tx_cost_constants
         self.secret_manager = secret_manager
         self.issuing_address = issuing_address
         self.prepared_inputs = prepared_inputs
         self.transaction_creator = transaction_creator
+        self.utxo_cache = utxo_cache or UtxoCache(connector, issuing_address)
+        self.coin_selector = coin_selector or coin_selection.create_coin_selector()
+        self.utxo_pool = utxo_pool
+        # the secret manager is only unlocked for one signature at a time
+        self.signing_lock = threading.Lock()
+        self.refill_lock = threading.Lock()
+
+    def supports_concurrent_transactions(self):
+        return self.utxo_pool is not None
 
     def ensure_balance(self):
+        # estimate the fee rate once per batch, before anything is priced
+        self.tx_cost_constants.update_fee_rate()
         # ensure the issuing address has sufficient balance
-        balance = self.connector.get_balance(self.issuing_address)
-
-        transaction_cost = self.transaction_creator.estimate_cost_for_certificate_batch(self.tx_cost_constants)
-        logging.info('Total cost will be %d satoshis', transaction_cost)
-
-        if transaction_cost > balance:
+        if self.utxo_pool:
+            if not self.utxo_pool.get_available_count() or (not self.utxo_pool.background_refill and
+                                                            self.utxo_pool.needs_refill()):
+                self.refill_pool()
+            if not self.utxo_pool.get_available_count():
+                error_message = 'The UTXO pool is empty; please add funds to the address {}'.format(
+                    self.issuing_address)
+                logging.error(error_message)
+                raise InsufficientFundsError(error_message)
+            return
+        selection = self.select_inputs()
+        logging.info('Total cost will be %d satoshis', selection.fee)
+
+    def select_inputs(self, offline=False):
+        """
+        Selects the cached unspent outputs to spend, fetching them again if they cannot cover the transaction, e.g. if
+        the address was funded since they were fetched
+        :param offline: select from the cached outputs only, without fetching them or refilling the pool
+        :return: coin_selection.Selection
+        """
+        if self.utxo_pool:
+            return self.select_pool_input(refill=not offline)
+        spendables = self.utxo_cache.get_spendables(offline=offline)
+        selection = self.coin_selector.select(spendables, self.tx_cost_constants)
+        if not selection and not offline:
+            spendables = self.utxo_cache.get_spendables(refresh=True)
+            selection = self.coin_selector.select(spendables, self.tx_cost_constants)
+
+        if not selection:
+            balance = sum(s.coin_value for s in spendables)
+            # one more output has to cover the fee for spending all of them
+            transaction_cost = tx_utils.calculate_tx_fee(self.tx_cost_constants, len(spendables) + 1, 0)
             error_message = 'Please add {} satoshis to the address {}'.format(
-                transaction_cost - balance, self.issuing_address)
+                int(transaction_cost - balance), self.issuing_address)
+            logging.error(error_message)
+            raise InsufficientFundsError(error_message)
+        return selection
+
+    def select_pool_input(self, refill=True):
+        """
+        Reserves a pool output for a transaction, refilling the pool first if it is empty
+        :param refill: if False, an empty pool is not refilled
+        :return: coin_selection.Selection spending the pool output alone
+        """
+        spendable = self.utxo_pool.acquire()
+        if spendable is None and refill:
+            logging.warning('The UTXO pool is empty; refilling it before issuing')
+            self.refill_pool()
+            spendable = self.utxo_pool.acquire()
+        if spendable is None:
+            error_message = 'The UTXO pool is empty; please add funds to the address {}'.format(self.issuing_address)
             logging.error(error_message)
             raise InsufficientFundsError(error_message)
+        selection = coin_selection.create_selection(self.tx_cost_constants, [spendable])
+        if selection is None:
+            self.utxo_pool.release([get_outpoint(spendable)])
+            raise InsufficientFundsError('UTXO pool outputs of {} satoshis do not cover the fee'.format(
+                spendable.coin_value))
+        return selection
+
+    def refill_pool(self):
+        """
+        Splits the outputs at the address that are not pool outputs into pool outputs, topping the pool up to its size
+        :return: txid of the split transaction, or None if the pool is full or there are no funds to split
+        """
+        with self.refill_lock:
+            num_outputs = self.utxo_pool.size - self.utxo_pool.get_available_count()
+            if num_outputs < 1:
+                return None
+            spendables = [s for s in self.utxo_cache.get_spendables() if not self.utxo_pool.is_pool_output(s)]
+            inputs, num_outputs = utxo_pool.select_split_inputs(spendables, self.tx_cost_constants, num_outputs,
+                                                                self.utxo_pool.output_value)
+            if not inputs:
+                logging.warning('No funds at address %s to refill the UTXO pool', self.issuing_address)
+                return None
+            tx = utxo_pool.create_split_transaction(self.tx_cost_constants, self.issuing_address, inputs, num_outputs,
+                                                    self.utxo_pool.output_value)
+            prepared_tx = tx_utils.prepare_tx_for_signing(b2h(tx.serialize()), inputs)
+            txid = self.broadcast_transaction(self.sign_transaction(prepared_tx))
+            self.utxo_pool.refills += 1
+            logging.info('Refilled the UTXO pool with %d outputs of %d satoshis in transaction %s', num_outputs,
+                         self.utxo_pool.output_value, txid)
+            return txid
 
     def issue_transaction(self, blockchain_bytes):
         op_return_value = b2h(blockchain_bytes)
         prepared_tx = self.create_transaction(blockchain_bytes)
-        signed_tx = self.sign_transaction(prepared_tx)
-        self.verify_transaction(signed_tx, op_return_value)
-        txid = self.broadcast_transaction(signed_tx)
+        signed_tx = self._sign_and_verify(prepared_tx, op_return_value)
+        try:
+            txid = self.broadcast_transaction(signed_tx)
+        except TransactionRejectedError:
+            raise
+        except Exception:
+            # Issuer.issue retries with a new transaction rather than this one
+            self.discard_signed_transactions([signed_tx.as_hex()])
+            raise
         #this logging is already done in issuer
         #logging.info('Broadcast transaction with txid %s', txid)
         return txid
 
-    def create_transaction(self, op_return_bytes):
+    def create_signed_transaction(self, blockchain_bytes):
+        op_return_value = b2h(blockchain_bytes)
+        prepared_tx = self.create_transaction(blockchain_bytes)
+        signed_tx = self._sign_and_verify(prepared_tx, op_return_value)
+        return signed_tx.as_hex()
+
+    def create_signed_transactions(self, blockchain_bytes_list):
+        """
+        Creates and signs the transactions in one key window, with the key decoded once. Each transaction spends the
+        change of the one before it, or a pool output of its own. The unspent outputs are not fetched while the key
+        window is open, so call ensure_balance first.
+        """
+        prepared_txs = []
+        signed_txs = []
+
+        def prepare_transactions():
+            for blockchain_bytes in blockchain_bytes_list:
+                prepared_tx = self.create_transaction(blockchain_bytes, offline=True)
+                prepared_txs.append(prepared_tx)
+                yield prepared_tx
+
+        try:
+            with self.signing_lock, FinalizableSigner(self.secret_manager) as signer:
+                # the next transaction is only created once this one's change is recorded
+                for index, signed_tx in enumerate(signer.sign_transactions(prepare_transactions())):
+                    self.verify_transaction(signed_tx, b2h(blockchain_bytes_list[index]))
+                    self.utxo_cache.record_transaction(signed_tx)
+                    signed_txs.append(signed_tx)
+        except Exception:
+            for signed_tx in signed_txs:
+                self.utxo_cache.discard_transaction(signed_tx)
+            for prepared_tx in prepared_txs:
+                self._release_inputs(prepared_tx)
+            raise
+        logging.info('Signed %d transactions', len(signed_txs))
+        return [signed_tx.as_hex() for signed_tx in signed_txs]
+
+    def discard_signed_transactions(self, signed_hextxs):
+        from pycoin.tx.Tx import Tx
+
+        for signed_hextx in signed_hextxs:
+            signed_tx = Tx.from_hex(signed_hextx)
+            self.utxo_cache.discard_transaction(signed_tx)
+            self._release_inputs(signed_tx)
+
+    def _sign_and_verify(self, prepared_tx, op_return_value):
+        try:
+            signed_tx = self.sign_transaction(prepared_tx)
+            self.verify_transaction(signed_tx, op_return_value)
+        except Exception:
+            self._release_inputs(prepared_tx)
+            raise
+        return signed_tx
+
+    def _release_inputs(self, tx):
+        if self.utxo_pool:
+            self.utxo_pool.release((bytes(tx_in.previous_hash), tx_in.previous_index) for tx_in in tx.txs_in)
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        from pycoin.tx.Tx import Tx
+
+        return self.broadcast_transaction(Tx.from_hex(signed_hextx))
+
+    def get_txid(self, signed_hextx):
+        from pycoin.tx.Tx import Tx
+
+        return Tx.from_hex(signed_hextx).id()
+
+    def is_transaction_known(self, txid):
+        return self.connector.is_transaction_known(txid)
+
+    def create_transaction(self, op_return_bytes, offline=False):
         if self.prepared_inputs:
             inputs = self.prepared_inputs
+            fee = None
         else:
-            spendables = self.connector.get_unspent_outputs(self.issuing_address)
-            if not spendables:
-                error_message = 'No money to spend at address {}'.format(self.issuing_address)
-                logging.error(error_message)
-                raise InsufficientFundsError(error_message)
-
-            cost = self.transaction_creator.estimate_cost_for_certificate_batch(self.tx_cost_constants)
-            current_total = 0
-            inputs = []
-            random.shuffle(spendables)
-            for s in spendables:
-                inputs.append(s)
-                current_total += s.coin_value
-                if current_total > cost:
-                    break
+            selection = self.select_inputs(offline=offline)
+            inputs = selection.inputs
+            fee = selection.fee
 
         tx = self.transaction_creator.create_transaction(self.tx_cost_constants, self.issuing_address, inputs,
-                                                         op_return_bytes)
+                                                         op_return_bytes, fee=fee)
         hex_tx = b2h(tx.serialize())
         logging.info('Unsigned hextx=%s', hex_tx)
         prepared_tx = tx_utils.prepare_tx_for_signing(hex_tx, inputs)
         return prepared_tx
 
     def sign_transaction(self, prepared_tx):
-        with FinalizableSigner(self.secret_manager) as signer:
+        with self.signing_lock, FinalizableSigner(self.secret_manager) as signer:
             signed_tx = signer.sign_transaction(prepared_tx)
 
         # log the actual byte count
@@ -148,12 +371,44 @@ class BitcoinTransactionHandler(TransactionHandler):
         tx_utils.verify_transaction(signed_hextx, op_return_value)
 
     def broadcast_transaction(self, signed_tx):
-        tx_id = self.connector.broadcast_tx(signed_tx)
+        try:
+            tx_id = self.connector.broadcast_tx(signed_tx)
+        except TransactionRejectedError:
+            # a transaction signed ahead was recorded as spending its inputs; they are unspent again. It may also have
+            # spent outputs the cache wrongly held to be unspent
+            self.utxo_cache.discard_transaction(signed_tx)
+            self.utxo_cache.invalidate()
+            self._release_inputs(signed_tx)
+            raise
+        except Exception:
+            # the transaction may have been sent, so its inputs stay reserved for broadcasting it again
+            self.utxo_cache.invalidate()
+            raise
+        if tx_id:
+            # spend the inputs and keep the change locally, so the next transaction does not need to fetch them
+            self.utxo_cache.record_transaction(signed_tx)
+            self._start_refill_if_low()
         return tx_id
 
+    def _start_refill_if_low(self):
+        if not self.utxo_pool or not self.utxo_pool.background_refill or self.refill_lock.locked() or \
+                not self.utxo_pool.needs_refill():
+            return
+        threading.Thread(target=self._refill_pool_logging_errors, name='utxo-pool-refill', daemon=True).start()
+
+    def _refill_pool_logging_errors(self):
+        try:
+            self.refill_pool()
+        except Exception as e:
+            logging.error('Refilling the UTXO pool failed: %s', e, exc_info=True)
+
 class EthereumTransactionHandler(TransactionHandler):
     def __init__(self, connector, tx_cost_constants, secret_manager, issuing_address, prepared_inputs=None,
-                 transaction_creator=EthereumTransactionCreator()):
+                 transaction_creator=EthereumTransactionCreator(), nonce_manager=None):
+        """
+        :param nonce_manager: NonceManager of issuing_address; one is created if None. Nonces are reserved from it, so
+        transactions can be created and broadcast concurrently.
+        """
         self.connector=connector
         self.tx_cost_constants=tx_cost_constants
         self.secret_manager=secret_manager
@@ -161,16 +416,27 @@ class EthereumTransactionHandler(TransactionHandler):
         #input transactions are not needed for Ether
         self.prepared_inputs=prepared_inputs
         self.transaction_creator=transaction_creator
+        self.nonce_manager = nonce_manager or NonceManager(connector, issuing_address)
+        # the secret manager is only unlocked for one signature at a time
+        self.signing_lock = threading.Lock()
 
-    def ensure_balance(self):
-        #testing etherscan api wrapper
-        self.balance = self.connector.get_balance(self.issuing_address)
+    def supports_concurrent_transactions(self):
+        return True
 
-        #for now transaction cost will be a constant: (25000 gas estimate times 20Gwei gasprice) from tx_utils
-        #can later be calculated inside EthereumTransaction_creator
+    def ensure_balance(self):
+        #transaction cost is the gas limit times the configured gas price, or the one estimated by the fee oracle
+        self.tx_cost_constants.update_fee_rate()
         transaction_cost = self.tx_cost_constants.get_recommended_max_cost()
         logging.info('Total cost will be %d wei', transaction_cost)
 
+        # the cached balance is debited for each transaction sent; fetch it again in case the address was funded
+        self.balance = self.nonce_manager.get_balance()
+        if transaction_cost > self.balance:
+            self.balance = self.nonce_manager.get_balance(refresh=True)
+        gas_price = self.nonce_manager.gas_price
+        if gas_price and self.tx_cost_constants.get_gas_price() < gas_price:
+            logging.warning('The gas price of %d wei is below the network\'s %d wei; the transaction may be slow to '
+                            'confirm', self.tx_cost_constants.get_gas_price(), gas_price)
         if transaction_cost > self.balance:
             error_message = 'Please add {} wei to the address {}'.format(
                 transaction_cost - self.balance, self.issuing_address)
@@ -180,19 +446,78 @@ class EthereumTransactionHandler(TransactionHandler):
     def issue_transaction(self, blockchain_bytes):
         etherDataField = b2h(blockchain_bytes)
         prepared_tx = self.create_transaction(blockchain_bytes)
-        signed_tx = self.sign_transaction(prepared_tx)
-        self.verify_transaction(signed_tx, etherDataField)
-        txid = self.broadcast_transaction(signed_tx)
+        signed_tx = self._sign_and_verify(prepared_tx, etherDataField)
+        try:
+            txid = self.broadcast_transaction(signed_tx)
+        except TransactionRejectedError:
+            raise
+        except Exception:
+            # Issuer.issue retries with a new transaction rather than this one
+            self.discard_signed_transactions([signed_tx])
+            raise
         return txid
 
+    def create_signed_transaction(self, blockchain_bytes):
+        etherDataField = b2h(blockchain_bytes)
+        prepared_tx = self.create_transaction(blockchain_bytes)
+        signed_tx = self._sign_and_verify(prepared_tx, etherDataField)
+        # signed Ethereum transactions are already hex encoded
+        return signed_tx
+
+    def create_signed_transactions(self, blockchain_bytes_list):
+        """
+        Creates the transactions, with consecutive nonces, then signs them in one key window. Call ensure_balance
+        first.
+        """
+        prepared_txs = []
+        try:
+            for blockchain_bytes in blockchain_bytes_list:
+                prepared_txs.append(self.create_transaction(blockchain_bytes))
+            with self.signing_lock, FinalizableSigner(self.secret_manager) as signer:
+                signed_txs = list(signer.sign_transactions(prepared_txs))
+            for signed_tx, blockchain_bytes in zip(signed_txs, blockchain_bytes_list):
+                self.verify_transaction(signed_tx, b2h(blockchain_bytes))
+        except Exception:
+            for prepared_tx in prepared_txs:
+                self.nonce_manager.release(prepared_tx.nonce)
+            raise
+        logging.info('Signed %d transactions', len(signed_txs))
+        return signed_txs
+
+    def discard_signed_transactions(self, signed_hextxs):
+        for signed_hextx in signed_hextxs:
+            self.nonce_manager.release(tx_utils.get_eth_transaction_nonce(signed_hextx))
+
+    def _sign_and_verify(self, prepared_tx, etherDataField):
+        try:
+            signed_tx = self.sign_transaction(prepared_tx)
+            self.verify_transaction(signed_tx, etherDataField)
+        except Exception:
+            self.nonce_manager.release(prepared_tx.nonce)
+            raise
+        return signed_tx
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        return self.broadcast_transaction(signed_hextx)
+
+    def get_txid(self, signed_hextx):
+        return tx_utils.get_eth_transaction_hash(signed_hextx)
+
+    def is_transaction_known(self, txid):
+        return self.connector.is_transaction_known(txid)
+
     def create_transaction(self, blockchain_bytes):
         if self.balance:
             ##it is assumed here that the address has sufficient funds, as the ensure_balance has just been checked
-            nonce = self.connector.get_address_nonce(self.issuing_address)
+            nonce = self.nonce_manager.reserve()
             #Transactions in the first iteration will be send to burn address
             toaddress = '0xdeaddeaddeaddeaddeaddeaddeaddeaddeaddead'
-            tx = self.transaction_creator.create_transaction(self.tx_cost_constants, self.issuing_address, nonce, toaddress, blockchain_bytes)
-            
+            try:
+                tx = self.transaction_creator.create_transaction(self.tx_cost_constants, self.issuing_address, nonce, toaddress, blockchain_bytes)
+            except Exception:
+                self.nonce_manager.release(nonce)
+                raise
+
             prepared_tx = tx
             return prepared_tx
         else:
@@ -200,14 +525,26 @@ class EthereumTransactionHandler(TransactionHandler):
 
     def sign_transaction(self, prepared_tx):
         ##stubbed from BitcoinTransactionHandler
-        with FinalizableSigner(self.secret_manager) as signer:
+        with self.signing_lock, FinalizableSigner(self.secret_manager) as signer:
             signed_tx = signer.sign_transaction(prepared_tx)
 
         logging.info('signed Ethereum trx = %s', signed_tx)
         return signed_tx
 
     def broadcast_transaction(self, signed_tx):
-        txid = self.connector.broadcast_tx(signed_tx)
+        nonce = tx_utils.get_eth_transaction_nonce(signed_tx)
+        try:
+            txid = self.connector.broadcast_tx(signed_tx)
+        except TransactionRejectedError:
+            # the nonce may have been used by a transaction we do not know about; look it up before the next one
+            self.nonce_manager.release(nonce)
+            self.nonce_manager.invalidate()
+            raise
+        except Exception:
+            # the transaction may have been sent, so its nonce stays reserved for broadcasting it again
+            self.nonce_manager.invalidate()
+            raise
+        self.nonce_manager.record_sent(nonce, self.tx_cost_constants.get_recommended_max_cost())
         return txid
 
     def verify_transaction(self, signed_tx, etherDataField):
@@ -219,3 +556,18 @@ class MockTransactionHandler(TransactionHandler):
 
     def issue_transaction(self, op_return_bytes):
         return 'This has not been issued on a blockchain and is for testing only'
+
+    def create_signed_transaction(self, op_return_bytes):
+        return ''
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        return 'This has not been issued on a blockchain and is for testing only'
+
+    def get_txid(self, signed_hextx):
+        return 'This has not been issued on a blockchain and is for testing only'
+
+    def is_transaction_known(self, txid):
+        return False
+
+    def supports_concurrent_transactions(self):
+        return True
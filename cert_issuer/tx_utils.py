@@ -9,11 +9,6 @@ Helpers for bitcoin transactions, including:
 import io
 import logging
 
-from bitcoin.core import CScript, CMutableTransaction, CMutableTxOut, CTxIn, COutPoint
-from bitcoin.core.script import OP_RETURN
-from bitcoin.wallet import CBitcoinAddress
-from pycoin.tx.Tx import Tx, TxOut
-
 from cert_issuer.errors import UnverifiedTransactionError
 
 
@@ -27,15 +22,25 @@ COIN = 100000000  # satoshis in 1 btc
 
 
 class EthereumTransactionCostConstants(object):
-    def __init__(self, recommended_gas_price=20000000000, recommended_gas_limit=25000):
+    def __init__(self, recommended_gas_price=20000000000, recommended_gas_limit=25000, fee_oracle=None):
+        """
+        :param fee_oracle: optional fee_oracle.EthereumFeeOracle; update_fee_rate sets the gas price from it
+        """
         self.recommended_gas_price = recommended_gas_price
         self.recommended_gas_limit = recommended_gas_limit
+        self.fee_oracle = fee_oracle
         logging.info('Set cost constants to recommended_gas_price=%f, recommended_gas_limit=%f',
                      self.recommended_gas_price, self.recommended_gas_limit)
-        
+
+    def update_fee_rate(self):
+        """
+        Sets the gas price to the fee oracle's estimate, if there is an oracle
+        """
+        if self.fee_oracle:
+            self.recommended_gas_price = self.fee_oracle.get_fee_rate()
+
     """
-    The below methods currently only use the supplied gasprice/limit.
-    These values can also be better estimated via a call to the Ethereum blockchain.
+    The below methods use the supplied gasprice/limit, or the gas price estimated by the fee oracle.
     """
     def get_recommended_max_cost(self):
         return self.recommended_gas_price * self.recommended_gas_limit
@@ -48,13 +53,25 @@ class EthereumTransactionCostConstants(object):
 
 
 class BitcoinTransactionCostConstants(object):
-    def __init__(self, recommended_tx_fee=0.0006, min_per_output=0.0000275, satoshi_per_byte=250):
+    def __init__(self, recommended_tx_fee=0.0006, min_per_output=0.0000275, satoshi_per_byte=250, fee_oracle=None):
+        """
+        :param fee_oracle: optional fee_oracle.BitcoinFeeOracle; update_fee_rate sets satoshi_per_byte from it
+        """
         self.recommended_tx_fee = recommended_tx_fee
         self.min_per_output = min_per_output
         self.satoshi_per_byte = satoshi_per_byte
+        self.fee_oracle = fee_oracle
         logging.info('Set cost constants to recommended_tx_fee=%f,min_per_output=%f,satoshi_per_byte=%d',
                      self.recommended_tx_fee, self.min_per_output, self.satoshi_per_byte)
 
+    def update_fee_rate(self):
+        """
+        Sets satoshi_per_byte to the fee oracle's estimate, if there is an oracle. It is not changed otherwise, so the
+        fees of a transaction are all calculated at the same rate.
+        """
+        if self.fee_oracle:
+            self.satoshi_per_byte = self.fee_oracle.get_fee_rate()
+
     def get_minimum_output_coin(self):
         return self.min_per_output * COIN
 
@@ -65,14 +82,17 @@ class BitcoinTransactionCostConstants(object):
 def create_trx(op_return_val, issuing_transaction_fee, issuing_address, tx_outs, tx_inputs):
     """
 
-    :param op_return_val:
+    :param op_return_val: None for a transaction without an OP_RETURN output
     :param issuing_transaction_fee:
     :param issuing_address:
     :param tx_outs:
     :param tx_input:
     :return:
     """
-    cert_out = CMutableTxOut(0, CScript([OP_RETURN, op_return_val]))
+    # imported here, like the other Bitcoin library imports, so Ethereum and mock runs do not load them
+    from bitcoin.core import CScript, CMutableTransaction, CMutableTxOut, CTxIn, COutPoint
+    from bitcoin.core.script import OP_RETURN
+
     tx_ins = []
     value_in = 0
     for tx_input in tx_inputs:
@@ -84,7 +104,8 @@ def create_trx(op_return_val, issuing_transaction_fee, issuing_address, tx_outs,
     if amount > 0:
         change_out = create_transaction_output(issuing_address, amount)
         tx_outs = tx_outs + [change_out]
-    tx_outs = tx_outs + [cert_out]
+    if op_return_val is not None:
+        tx_outs = tx_outs + [CMutableTxOut(0, CScript([OP_RETURN, op_return_val]))]
     transaction = CMutableTransaction(tx_ins, tx_outs)
     return transaction
 
@@ -125,6 +146,9 @@ def create_transaction_output(address, output_value):
     :param output_value:
     :return:
     """
+    from bitcoin.core import CMutableTxOut
+    from bitcoin.wallet import CBitcoinAddress
+
     bitcoin_address = CBitcoinAddress(address)
     tx_out = CMutableTxOut(output_value, bitcoin_address.to_scriptPubKey())
     return tx_out
@@ -138,6 +162,8 @@ def get_byte_count(signed_tx):
 
 
 def prepare_tx_for_signing(hex_tx, tx_inputs):
+    from pycoin.tx.Tx import Tx, TxOut
+
     logging.info('Preparing tx for signing')
     transaction = Tx.from_hex(hex_tx)
     unspents = [TxOut(coin_value=tx_input.coin_value, script=tx_input.script) for tx_input in tx_inputs]
@@ -200,6 +226,30 @@ def create_Ethereum_trx(issuing_address, nonce, to_address, blockchain_bytes, ga
     tx = Transaction(nonce=nonce, gasprice=gasprice, startgas=gaslimit, to=to_address, value=value, data=blockchain_bytes)
     return tx
 
+def get_eth_transaction_nonce(signed_hextx):
+    """
+    :param signed_hextx: RLP encoded transaction, as hex
+    :return: the transaction's nonce
+    """
+    import rlp
+    from pycoin.serialize import h2b
+
+    if signed_hextx.startswith('0x'):
+        signed_hextx = signed_hextx[2:]
+    return rlp.sedes.big_endian_int.deserialize(rlp.decode(h2b(signed_hextx))[0])
+
+def get_eth_transaction_hash(signed_hextx):
+    """
+    :param signed_hextx: RLP encoded transaction, as hex
+    :return: the transaction's hash, as the nodes return it when it is broadcast
+    """
+    from ethereum.utils import sha3
+    from pycoin.serialize import b2h, h2b
+
+    if signed_hextx.startswith('0x'):
+        signed_hextx = signed_hextx[2:]
+    return '0x' + b2h(sha3(h2b(signed_hextx)))
+
 def verify_eth_transaction(signed_hextx, ethDataField):
     """
     Verify ethDataField field in transaction
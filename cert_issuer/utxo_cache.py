@@ -0,0 +1,126 @@
+"""
+Local copy of the issuing address's unspent outputs, so that back-to-back batches do not each fetch the UTXO set from
+the providers for ensure_balance and again for create_transaction.
+
+Outputs spent by our own transactions are removed as soon as the transaction is broadcast, and its change output is
+added, so the next batch can chain off the unconfirmed change without asking the providers. The set is fetched again
+when it is older than max_age_seconds, or when it cannot cover a transaction. A fetch is merged with what the cache
+knows: outputs our broadcasts spent stay spent, and our change stays available, until the providers catch up.
+"""
+import logging
+import threading
+import time
+
+# a fetched UTXO set is trusted for this long before it is fetched again
+DEFAULT_MAX_AGE_SECONDS = 600
+# our own change that providers have not reported after this long is dropped, in case its transaction was dropped
+UNCONFIRMED_TTL_SECONDS = 3600
+
+
+def get_outpoint(spendable):
+    return bytes(spendable.tx_hash), spendable.tx_out_index
+
+
+class UtxoCache(object):
+    def __init__(self, connector, address, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, clock=time.monotonic):
+        """
+        :param connector: provides get_unspent_outputs(address)
+        :param address: address whose outputs are cached
+        :param max_age_seconds: how long a fetched UTXO set is used before it is fetched again
+        :param clock: returns the current time in seconds
+        """
+        self.connector = connector
+        self.address = address
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.fetched_at = None
+        # outpoint -> Spendable, as last fetched
+        self.confirmed = {}
+        # outpoint -> (Spendable, time added), for change of our own transactions not yet reported by providers
+        self.unconfirmed = {}
+        # outpoint -> time spent, for outputs spent by our own transactions
+        self.spent = {}
+        self.fetch_count = 0
+
+    def get_spendables(self, refresh=False, offline=False):
+        """
+        :param refresh: fetch the UTXO set even if the cached one is recent enough
+        :param offline: never fetch, however old the cached set is, e.g. while the network is off for signing
+        :return: list of unspent outputs, fetching them if needed
+        """
+        with self.lock:
+            if not offline and (refresh or self.fetched_at is None or
+                                self.clock() - self.fetched_at >= self.max_age_seconds):
+                self._fetch()
+            spendables = [s for outpoint, s in self.confirmed.items() if outpoint not in self.spent]
+            spendables.extend(s for outpoint, (s, _) in self.unconfirmed.items() if outpoint not in self.spent)
+            return spendables
+
+    def get_balance(self, refresh=False):
+        return sum(s.coin_value for s in self.get_spendables(refresh))
+
+    def record_transaction(self, tx):
+        """
+        Records a transaction we broadcast: its inputs are spent, and its outputs paying back to the spent outputs'
+        script, i.e. our change, are available. Recording the same transaction again has no effect.
+        :param tx: pycoin Tx
+        :return:
+        """
+        from pycoin.tx.Spendable import Spendable
+
+        with self.lock:
+            now = self.clock()
+            spent_scripts = set()
+            for tx_in in tx.txs_in:
+                outpoint = (bytes(tx_in.previous_hash), tx_in.previous_index)
+                self.spent.setdefault(outpoint, now)
+                spent = self.confirmed.get(outpoint) or self.unconfirmed.get(outpoint, (None,))[0]
+                if spent is not None:
+                    spent_scripts.add(bytes(spent.script))
+            tx_hash = tx.hash()
+            for index, tx_out in enumerate(tx.txs_out):
+                if bytes(tx_out.script) in spent_scripts and tx_out.coin_value > 0:
+                    outpoint = (bytes(tx_hash), index)
+                    if outpoint not in self.unconfirmed and outpoint not in self.confirmed:
+                        self.unconfirmed[outpoint] = (Spendable(tx_out.coin_value, tx_out.script, tx_hash, index), now)
+
+    def discard_transaction(self, tx):
+        """
+        Undoes record_transaction for a transaction that will not be broadcast: its inputs are unspent again, and its
+        change is no longer available
+        :param tx: pycoin Tx
+        :return:
+        """
+        with self.lock:
+            for tx_in in tx.txs_in:
+                self.spent.pop((bytes(tx_in.previous_hash), tx_in.previous_index), None)
+            tx_hash = bytes(tx.hash())
+            for index in range(0, len(tx.txs_out)):
+                self.unconfirmed.pop((tx_hash, index), None)
+
+    def invalidate(self):
+        """
+        Forgets the fetched UTXO set, so the next read fetches it. Use when a transaction built from the cache is
+        rejected.
+        """
+        with self.lock:
+            self.fetched_at = None
+            self.unconfirmed.clear()
+
+    def _fetch(self):
+        spendables = self.connector.get_unspent_outputs(self.address) or []
+        self.fetch_count += 1
+        now = self.clock()
+        self.fetched_at = now
+        self.confirmed = dict((get_outpoint(s), s) for s in spendables)
+        for outpoint in list(self.unconfirmed):
+            _, added_at = self.unconfirmed[outpoint]
+            if outpoint in self.confirmed or now - added_at >= UNCONFIRMED_TTL_SECONDS:
+                del self.unconfirmed[outpoint]
+        # a spent output the providers no longer report has been seen spent by them
+        known = set(self.confirmed) | set(self.unconfirmed)
+        for outpoint in list(self.spent):
+            if outpoint not in known:
+                del self.spent[outpoint]
+        logging.debug('Fetched %d unspent outputs for %s', len(spendables), self.address)
@@ -0,0 +1,163 @@
+"""
+Pool of equal-valued unspent outputs at the issuing address, so that batches issued at the same time each spend an
+output of their own, rather than each spending the change of the one before. Transactions that do not depend on each
+other can be broadcast in parallel, and one that is slow to propagate does not hold up the others.
+
+The pool is filled by a split transaction, which fans other outputs at the address out into outputs of output_value.
+Pool outputs are recognized by their value. Each issuing transaction reserves one, and is paid from it alone; its
+change is left out of the pool and funds later refills. Once fewer than refill_threshold pool outputs are left, a
+refill is started in the background, or, without background_refill, done before the next batch.
+
+To fill the pool before issuing:
+    python -m cert_issuer.utxo_pool -c conf.ini --utxo_pool_size 20
+"""
+import logging
+import math
+import threading
+
+from cert_issuer import coin_selection, tx_utils
+from cert_issuer.errors import InsufficientFundsError
+from cert_issuer.utxo_cache import get_outpoint
+
+
+def get_split_fee(tx_cost_constants, num_inputs, num_outputs):
+    """
+    :return: fee for a transaction without OP_RETURN output, with the same floor as tx_utils.calculate_tx_fee
+    """
+    tx_size = tx_utils.calculate_raw_tx_size(num_inputs, num_outputs)
+    tx_fee = max(tx_cost_constants.satoshi_per_byte * tx_size, tx_cost_constants.get_recommended_fee_coin())
+    return int(math.ceil(tx_fee))
+
+
+def get_default_output_value(tx_cost_constants):
+    """
+    :return: twice the fee of an issuing transaction with one input, so its change is worth spending in a refill
+    """
+    return 2 * coin_selection.get_fee(tx_cost_constants, 1, True)
+
+
+def select_split_inputs(spendables, tx_cost_constants, num_outputs, output_value):
+    """
+    Spends the largest outputs first, until they cover num_outputs pool outputs. If all of them do not, as many pool
+    outputs as they cover are created instead.
+    :return: (inputs, number of pool outputs)
+    """
+    inputs = []
+    value = 0
+    for s in sorted(spendables, key=lambda s: s.coin_value, reverse=True):
+        inputs.append(s)
+        value += s.coin_value
+        if value >= num_outputs * output_value + get_split_fee(tx_cost_constants, len(inputs), num_outputs):
+            return inputs, num_outputs
+    while num_outputs > 0 and value < num_outputs * output_value + get_split_fee(tx_cost_constants, len(inputs),
+                                                                                 num_outputs):
+        num_outputs -= 1
+    return (inputs, num_outputs) if num_outputs else ([], 0)
+
+
+def create_split_transaction(tx_cost_constants, issuing_address, inputs, num_outputs, output_value):
+    """
+    :param inputs: Spendables covering the outputs and the fee
+    :return: unsigned transaction sending num_outputs outputs of output_value to issuing_address, and what is left
+    after the fee back to it as change
+    """
+    value = sum(s.coin_value for s in inputs)
+    change = value - num_outputs * output_value - get_split_fee(tx_cost_constants, len(inputs), num_outputs + 1)
+    if value < num_outputs * output_value + get_split_fee(tx_cost_constants, len(inputs), num_outputs):
+        raise InsufficientFundsError('{} satoshis do not cover {} outputs of {} satoshis'.format(
+            value, num_outputs, output_value))
+
+    tx_outs = [tx_utils.create_transaction_output(issuing_address, output_value) for _ in range(0, num_outputs)]
+    if change >= tx_cost_constants.get_minimum_output_coin():
+        tx_outs.append(tx_utils.create_transaction_output(issuing_address, change))
+    # create_trx sends whatever the fee leaves of the inputs back as change, without counting tx_outs, so it is
+    # given the whole value; the change output is added here instead
+    return tx_utils.create_trx(None, value, issuing_address, tx_outs, inputs)
+
+
+class UtxoPool(object):
+    def __init__(self, utxo_cache, output_value, size, refill_threshold=None, background_refill=True):
+        """
+        :param utxo_cache: UtxoCache of the issuing address
+        :param output_value: value in satoshis of each pool output
+        :param size: number of pool outputs a refill tops the pool up to
+        :param refill_threshold: a refill is due once fewer pool outputs are available; a quarter of size by default
+        :param background_refill: if False, a refill that is due is done by ensure_balance, before the next batch,
+        rather than in a background thread. Needed in safe mode, where signing waits for the network to be turned off
+        """
+        self.utxo_cache = utxo_cache
+        self.output_value = output_value
+        self.size = size
+        self.refill_threshold = refill_threshold or max(1, size // 4)
+        self.background_refill = background_refill
+        self.lock = threading.Lock()
+        # outpoints of the pool outputs reserved by transactions being created or broadcast
+        self.reserved = set()
+        self.acquired = 0
+        self.refills = 0
+
+    def is_pool_output(self, spendable):
+        return spendable.coin_value == self.output_value
+
+    def acquire(self):
+        """
+        Reserves a pool output, until it is released or spent
+        :return: Spendable, or None if the pool is empty
+        """
+        spendables = self.utxo_cache.get_spendables()
+        with self.lock:
+            available = [s for s in spendables if self.is_pool_output(s)]
+            # outputs spent since they were reserved are no longer listed
+            self.reserved.intersection_update(get_outpoint(s) for s in available)
+            for s in available:
+                if get_outpoint(s) not in self.reserved:
+                    self.reserved.add(get_outpoint(s))
+                    self.acquired += 1
+                    return s
+        return None
+
+    def release(self, outpoints):
+        """
+        Makes pool outputs available again, e.g. after the transaction spending them failed
+        :param outpoints: (tx_hash, tx_out_index) tuples; those that are not reserved are ignored
+        """
+        with self.lock:
+            self.reserved.difference_update(outpoints)
+
+    def get_available_count(self):
+        spendables = self.utxo_cache.get_spendables()
+        with self.lock:
+            return sum(1 for s in spendables if self.is_pool_output(s) and get_outpoint(s) not in self.reserved)
+
+    def needs_refill(self):
+        return self.get_available_count() < self.refill_threshold
+
+    def get_stats(self):
+        return {'available': self.get_available_count(),
+                'reserved': len(self.reserved),
+                'size': self.size,
+                'output_value': self.output_value,
+                'acquired': self.acquired,
+                'refills': self.refills}
+
+
+def main():
+    from cert_issuer import config
+    from cert_issuer.issue_certificates import create_handlers
+    from cert_issuer.transaction_handler import BitcoinTransactionHandler
+
+    app_config = config.get_config()
+    if not app_config.utxo_pool_size:
+        raise ValueError('Set utxo_pool_size to the number of pool outputs to create')
+    _, transaction_handler = create_handlers(app_config)
+    if not isinstance(transaction_handler, BitcoinTransactionHandler):
+        raise ValueError('The UTXO pool is only used on Bitcoin chains')
+    txid = transaction_handler.refill_pool()
+    logging.info('Pool: %s', transaction_handler.utxo_pool.get_stats())
+    if txid is None:
+        logging.warning('The pool was not refilled')
+    return txid
+
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,8 @@ setup(
     entry_points={
         'console_scripts': [
             'cert-issuer = cert_issuer.__main__:cert_issuer_main',
+            'cert-issuer-daemon = cert_issuer.daemon:daemon_main',
+            'cert-issuer-signing-agent = cert_issuer.secret_managers:signing_agent_main',
         ]
     }
 )
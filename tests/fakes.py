@@ -0,0 +1,10 @@
+class FakeClock(object):
+    """
+    Stands in for time.monotonic; tests move time forward by setting now
+    """
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,209 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from cert_schema import Chain
+
+from cert_issuer.batch_journal import BatchJournal
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateHandler
+from cert_issuer.errors import BroadcastError, JournalMismatchError, TransactionRejectedError
+from cert_issuer.helpers import CertificateMetadata
+from cert_issuer.issuer import Issuer
+from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+
+
+class Interrupted(Exception):
+    pass
+
+
+class RecordingCertificateHandler(CertificateHandler):
+    def __init__(self, fail_at_proof=None):
+        self.prepared = []
+        self.proofs = []
+        self.fail_at_proof = fail_at_proof
+
+    def validate_certificate(self, certificate_metadata):
+        pass
+
+    def sign_certificate(self, signer, certificate_metadata):
+        pass
+
+    def get_byte_array_to_issue(self, certificate_metadata):
+        self.prepared.append(certificate_metadata.uid)
+        return certificate_metadata.uid.encode('utf-8')
+
+    def add_proof(self, certificate_metadata, merkle_proof):
+        if len(self.proofs) == self.fail_at_proof:
+            raise Interrupted()
+        self.proofs.append((certificate_metadata.uid, merkle_proof['targetHash']))
+
+
+class RecordingTransactionHandler(object):
+    def __init__(self, fail_broadcast=False, failures=(), known=()):
+        """
+        :param failures: exceptions the first broadcasts raise, in order
+        :param known: txids is_transaction_known finds
+        """
+        self.created = 0
+        self.broadcast = []
+        self.fail_broadcast = fail_broadcast
+        self.failures = list(failures)
+        self.known = known
+
+    def create_signed_transaction(self, blockchain_bytes):
+        self.created += 1
+        return 'signed' + str(self.created)
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        self.broadcast.append(signed_hextx)
+        if self.fail_broadcast:
+            raise Interrupted()
+        if self.failures:
+            raise self.failures.pop(0)
+        return self.get_txid(signed_hextx)
+
+    def get_txid(self, signed_hextx):
+        return 'txid_' + signed_hextx
+
+    def is_transaction_known(self, txid):
+        return txid in self.known
+
+
+class TestBatchJournal(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.work_dir, 'journal.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def issue(self, certificate_handler, transaction_handler, uids=None):
+        certificates_to_issue = collections.OrderedDict()
+        for uid in uids or [str(num) for num in range(0, 7)]:
+            certificates_to_issue[uid] = CertificateMetadata(uid, 'unsigned', None, 'blockcerts', 'final')
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                            certificate_handler=certificate_handler,
+                                                            merkle_tree=MerkleTreeGenerator())
+        certificate_batch_handler.set_certificates_in_batch(certificates_to_issue)
+        journal = BatchJournal(self.journal_path)
+        try:
+            issuer = Issuer(certificate_batch_handler, transaction_handler, journal=journal)
+            return issuer.issue(Chain.bitcoin_testnet)
+        finally:
+            journal.close()
+
+    def get_batch(self):
+        journal = BatchJournal(self.journal_path)
+        try:
+            return journal.get_batch()
+        finally:
+            journal.close()
+
+    def test_records_batch(self):
+        txid = self.issue(RecordingCertificateHandler(), RecordingTransactionHandler())
+        self.assertEqual(txid, 'txid_signed1')
+        batch = self.get_batch()
+        self.assertEqual(batch.chain, 'bitcoin_testnet')
+        self.assertEqual(batch.signed_tx, 'signed1')
+        self.assertEqual(batch.txid, 'txid_signed1')
+        self.assertEqual(batch.proofs_written, 7)
+        self.assertFalse(batch.completed)
+
+        journal = BatchJournal(self.journal_path)
+        self.assertEqual([uid for uid, _ in journal.iter_leaves()], [str(num) for num in range(0, 7)])
+        self.assertTrue(journal.can_resume())
+        journal.mark_completed()
+        self.assertFalse(journal.can_resume())
+        journal.close()
+
+    def test_resume_after_interrupted_broadcast(self):
+        with self.assertRaises(Interrupted):
+            self.issue(RecordingCertificateHandler(), RecordingTransactionHandler(fail_broadcast=True))
+
+        certificate_handler = RecordingCertificateHandler()
+        transaction_handler = RecordingTransactionHandler()
+        txid = self.issue(certificate_handler, transaction_handler)
+
+        # the certificates are not normalized again, and the transaction signed before the interruption is broadcast
+        self.assertEqual(certificate_handler.prepared, [])
+        self.assertEqual(transaction_handler.created, 0)
+        self.assertEqual(transaction_handler.broadcast, ['signed1'])
+        self.assertEqual(txid, 'txid_signed1')
+        self.assertEqual(len(certificate_handler.proofs), 7)
+
+    def test_records_expected_txid_before_broadcast(self):
+        with self.assertRaises(Interrupted):
+            self.issue(RecordingCertificateHandler(), RecordingTransactionHandler(fail_broadcast=True))
+        batch = self.get_batch()
+        self.assertEqual(batch.signed_tx, 'signed1')
+        self.assertEqual(batch.expected_txid, 'txid_signed1')
+        self.assertIsNone(batch.txid)
+
+    def test_broadcasts_same_transaction_after_failure(self):
+        transaction_handler = RecordingTransactionHandler(failures=[BroadcastError('timed out')] * 2)
+        txid = self.issue(RecordingCertificateHandler(), transaction_handler)
+        self.assertEqual(txid, 'txid_signed1')
+        self.assertEqual(transaction_handler.created, 1)
+        self.assertEqual(transaction_handler.broadcast, ['signed1'] * 3)
+
+    def test_keeps_transaction_when_broadcasts_fail(self):
+        with self.assertRaises(BroadcastError):
+            self.issue(RecordingCertificateHandler(),
+                       RecordingTransactionHandler(failures=[BroadcastError('timed out')] * 5))
+
+        transaction_handler = RecordingTransactionHandler()
+        self.assertEqual(self.issue(RecordingCertificateHandler(), transaction_handler), 'txid_signed1')
+        self.assertEqual(transaction_handler.created, 0)
+
+    def test_signs_again_after_rejection(self):
+        transaction_handler = RecordingTransactionHandler(failures=[TransactionRejectedError('spent')])
+        txid = self.issue(RecordingCertificateHandler(), transaction_handler)
+        self.assertEqual(txid, 'txid_signed2')
+        self.assertEqual(transaction_handler.broadcast, ['signed1', 'signed2'])
+        self.assertEqual(self.get_batch().signed_tx, 'signed2')
+
+    def test_rejection_after_failed_broadcast_that_reached_network(self):
+        transaction_handler = RecordingTransactionHandler(
+            failures=[BroadcastError('timed out'), TransactionRejectedError('already spent')], known=['txid_signed1'])
+        txid = self.issue(RecordingCertificateHandler(), transaction_handler)
+        self.assertEqual(txid, 'txid_signed1')
+        self.assertEqual(transaction_handler.created, 1)
+
+    def test_rejection_after_failed_broadcast_that_did_not_reach_network(self):
+        transaction_handler = RecordingTransactionHandler(
+            failures=[BroadcastError('timed out'), TransactionRejectedError('already spent')])
+        txid = self.issue(RecordingCertificateHandler(), transaction_handler)
+        self.assertEqual(txid, 'txid_signed2')
+        self.assertEqual(transaction_handler.broadcast, ['signed1', 'signed1', 'signed2'])
+
+    @mock.patch('cert_issuer.certificate_handler.CHECKPOINT_INTERVAL', 2)
+    def test_resume_after_interrupted_proofs(self):
+        first_handler = RecordingCertificateHandler(fail_at_proof=5)
+        with self.assertRaises(Interrupted):
+            self.issue(first_handler, RecordingTransactionHandler())
+        self.assertEqual(self.get_batch().proofs_written, 4)
+
+        certificate_handler = RecordingCertificateHandler()
+        transaction_handler = RecordingTransactionHandler()
+        self.issue(certificate_handler, transaction_handler)
+
+        self.assertEqual(transaction_handler.broadcast, [])
+        self.assertEqual([uid for uid, _ in certificate_handler.proofs], ['4', '5', '6'])
+        # the certificate written after the last checkpoint is written again, with the same proof
+        self.assertEqual(certificate_handler.proofs[0], first_handler.proofs[4])
+        self.assertEqual(self.get_batch().proofs_written, 7)
+
+    def test_resume_with_different_certificates(self):
+        with self.assertRaises(Interrupted):
+            self.issue(RecordingCertificateHandler(), RecordingTransactionHandler(fail_broadcast=True))
+
+        with self.assertRaises(JournalMismatchError):
+            self.issue(RecordingCertificateHandler(), RecordingTransactionHandler(), uids=['0', '1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,19 @@
+import collections
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 import mock
 from pycoin.serialize import b2h
 
-from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateHandler
+from cert_schema import BlockcertValidationError, Chain
+
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateHandler, CertificateV2Handler
+from cert_issuer.certificate_signer import CertificateSigner, verify_certificate_signature
+from cert_issuer.errors import DocumentNotCachedError
+from cert_issuer.helpers import CertificateMetadata
 from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
 
 
@@ -21,6 +31,136 @@ class TestCertificateHandler(unittest.TestCase):
         certificate_batch_handler.set_certificates_in_batch(certificates_to_issue)
         result = certificate_batch_handler.prepare_batch()
         self.assertEqual(b2h(result), '0932f1d2e98219f7d7452801e2b64ebd9e5c005539db12d9b1ddabe7834d9044')
+        secret_manager.start.assert_called_once_with()
+
+    def test_prepare_batch_without_signing(self):
+        secret_manager = mock.Mock()
+        certificate_handler = DummyCertificateHandler()
+        certificate_handler.needs_signer = lambda: False
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=secret_manager,
+                                                            certificate_handler=certificate_handler,
+                                                            merkle_tree=MerkleTreeGenerator())
+        certificate_batch_handler.set_certificates_in_batch({'1': mock.Mock(), '2': mock.Mock()})
+        certificate_batch_handler.prepare_batch()
+        secret_manager.start.assert_not_called()
+
+    def test_prepare_batch_with_workers(self):
+        roots = []
+        for workers in [1, 3]:
+            certificates_to_issue = collections.OrderedDict()
+            for num in range(0, 50):
+                uid = str(num)
+                certificates_to_issue[uid] = CertificateMetadata(uid, 'unsigned', None, 'blockcerts', 'final')
+
+            certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                                certificate_handler=UidCertificateHandler(),
+                                                                merkle_tree=MerkleTreeGenerator(),
+                                                                workers=workers)
+            certificate_batch_handler.set_certificates_in_batch(certificates_to_issue)
+            roots.append(certificate_batch_handler.prepare_batch())
+            self.assertIsNone(certificate_batch_handler.pool)
+
+        self.assertEqual(roots[0], roots[1])
+
+    def test_get_validation_errors(self):
+        for workers in [1, 2]:
+            certificates_to_issue = collections.OrderedDict()
+            for uid in ['cert0', 'bad1', 'cert2', 'bad3']:
+                certificates_to_issue[uid] = CertificateMetadata(uid, 'unsigned', None, 'blockcerts', 'final')
+            certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                                certificate_handler=UidCertificateHandler(),
+                                                                merkle_tree=MerkleTreeGenerator(),
+                                                                workers=workers)
+            certificate_batch_handler.set_certificates_in_batch(certificates_to_issue)
+            self.assertEqual(certificate_batch_handler.get_validation_errors(),
+                             {'bad1': 'Invalid certificate bad1', 'bad3': 'Invalid certificate bad3'})
+
+    def test_get_validation_errors_propagates_other_errors(self):
+        certificates_to_issue = collections.OrderedDict()
+        for uid in ['bad0', 'uncached1']:
+            certificates_to_issue[uid] = CertificateMetadata(uid, 'unsigned', None, 'blockcerts', 'final')
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                            certificate_handler=UidCertificateHandler(),
+                                                            merkle_tree=MerkleTreeGenerator())
+        certificate_batch_handler.set_certificates_in_batch(certificates_to_issue)
+        # a certificate whose context cannot be loaded is not known to be invalid
+        with self.assertRaises(DocumentNotCachedError):
+            certificate_batch_handler.get_validation_errors()
+
+
+EXAMPLE_CERTIFICATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples',
+                                        'data-testnet', 'unsigned_certificates')
+
+
+@mock.patch('cert_issuer.certificate_handler.validate_v2')
+class TestCertificateV2Handler(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.certificates_to_issue = collections.OrderedDict()
+        for file_name in sorted(os.listdir(EXAMPLE_CERTIFICATES_DIR)):
+            uid = os.path.splitext(file_name)[0]
+            shutil.copy(os.path.join(EXAMPLE_CERTIFICATES_DIR, file_name), self.work_dir)
+            self.certificates_to_issue[uid] = CertificateMetadata(uid, self.work_dir, None, self.work_dir,
+                                                                  self.work_dir, file_extension='.json')
+            self.certificates_to_issue[uid].blockchain_cert_file_name += '.out'
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_prepare_certificate_matches_separate_passes(self, mock_validate):
+        certificate_handler = CertificateV2Handler()
+        for _, metadata in self.certificates_to_issue.items():
+            certificate_handler.validate_certificate(metadata)
+            expected = certificate_handler.get_byte_array_to_issue(metadata)
+            self.assertEqual(certificate_handler.prepare_certificate(metadata), expected)
+
+    def test_batch_reads_and_normalizes_once(self, mock_validate):
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                            certificate_handler=CertificateV2Handler(),
+                                                            merkle_tree=MerkleTreeGenerator())
+        certificate_batch_handler.set_certificates_in_batch(self.certificates_to_issue)
+        certificate_batch_handler.prepare_batch()
+        certificate_batch_handler.finish_batch('txid', Chain.bitcoin_testnet)
+
+        self.assertEqual(mock_validate.call_count, len(self.certificates_to_issue))
+        for _, metadata in self.certificates_to_issue.items():
+            self.assertEqual(metadata.read_count, 1)
+            self.assertEqual(metadata.normalize_count, 1)
+            self.assertIsNone(metadata.certificate_json)
+            with open(metadata.blockchain_cert_file_name) as blockchain_cert:
+                self.assertEqual(json.load(blockchain_cert)['signature']['anchors'][0]['sourceId'], 'txid')
+
+    def test_issued_certificate_keeps_its_context(self, mock_validate):
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                            certificate_handler=CertificateV2Handler(),
+                                                            merkle_tree=MerkleTreeGenerator())
+        certificate_batch_handler.set_certificates_in_batch(self.certificates_to_issue)
+        certificate_batch_handler.prepare_batch()
+        certificate_batch_handler.finish_batch('txid', Chain.bitcoin_testnet)
+
+        for _, metadata in self.certificates_to_issue.items():
+            with open(metadata.unsigned_cert_file_name) as unsigned_cert:
+                expected = json.load(unsigned_cert)['@context']
+            with open(metadata.blockchain_cert_file_name) as blockchain_cert:
+                self.assertEqual(json.load(blockchain_cert)['@context'], expected)
+
+    def test_batch_with_certificate_signatures(self, mock_validate):
+        from pycoin.key import Key
+        from cert_issuer.secret_managers import InMemorySecretManager
+        from cert_issuer.signer import BitcoinSigner
+
+        key = Key(secret_exponent=0x1234567, netcode='XTN')
+        secret_manager = InMemorySecretManager(BitcoinSigner(Chain.bitcoin_testnet), key.wif())
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=secret_manager,
+                                                            certificate_handler=CertificateV2Handler(),
+                                                            merkle_tree=MerkleTreeGenerator(),
+                                                            certificate_signer=CertificateSigner(workers=2))
+        certificate_batch_handler.set_certificates_in_batch(self.certificates_to_issue)
+        certificate_batch_handler.prepare_batch()
+        certificate_batch_handler.finish_batch('txid', Chain.bitcoin_testnet)
+
+        for uid, metadata in self.certificates_to_issue.items():
+            verify_certificate_signature(uid, metadata.blockchain_cert_file_name, key.address())
 
 
 class DummyCertificateHandler(CertificateHandler):
@@ -41,5 +181,20 @@ class DummyCertificateHandler(CertificateHandler):
         pass
 
 
+class UidCertificateHandler(DummyCertificateHandler):
+    """
+    Stateless, so it gives the same bytes whichever worker process handles a certificate
+    """
+
+    def validate_certificate(self, certificate_metadata):
+        if certificate_metadata.uid.startswith('bad'):
+            raise BlockcertValidationError('Invalid certificate {}'.format(certificate_metadata.uid))
+        if certificate_metadata.uid.startswith('uncached'):
+            raise DocumentNotCachedError('No context for certificate {}'.format(certificate_metadata.uid))
+
+    def get_byte_array_to_issue(self, certificate_metadata):
+        return certificate_metadata.uid.encode('utf-8')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from pycoin import ecdsa
+from pycoin.key import Key
+from pycoin.serialize import b2h, h2b
+
+from cert_issuer.certificate_signer import CertificateSigner, SigningKey, decode_base64url, encode_base64url, \
+    load_native_backend, verify_certificate_signature, verify_jws
+from cert_issuer.errors import UnverifiedSignatureError
+
+SECRET_EXPONENT = 0x1234567
+
+TARGET_HASHES = ['{:064x}'.format(number) for number in range(1, 21)]
+
+
+class HighSKey(object):
+    """
+    Signs digests with high S, as a token may
+    """
+
+    def sign_digest(self, digest):
+        r, s = ecdsa.sign(ecdsa.generator_secp256k1, SECRET_EXPONENT, int.from_bytes(digest, 'big'))
+        return r, max(s, ecdsa.generator_secp256k1.order() - s)
+
+    def get_public_pair(self):
+        return ecdsa.public_pair_for_secret_exponent(ecdsa.generator_secp256k1, SECRET_EXPONENT)
+
+
+def sign(key, workers=1):
+    signatures = CertificateSigner(workers=workers).sign_batch(key, [h2b(h) for h in TARGET_HASHES])
+    return [signatures.get_jws(index) for index in range(0, len(signatures))]
+
+
+class TestCertificateSigner(unittest.TestCase):
+    def setUp(self):
+        self.key = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN')
+
+    def test_signatures_verify(self):
+        for jws_list in [sign(SigningKey(SECRET_EXPONENT, native=False)), sign(HighSKey())]:
+            for target_hash, jws in zip(TARGET_HASHES, jws_list):
+                verify_jws(jws, target_hash, self.key.address())
+                verify_jws(jws, target_hash, self.key.address(use_uncompressed=True))
+
+    @unittest.skipIf(load_native_backend() is None, 'coincurve is not installed')
+    def test_native_matches_python(self):
+        # both sign deterministically (RFC 6979), with low S
+        self.assertEqual(sign(SigningKey(SECRET_EXPONENT, native=True)),
+                         sign(SigningKey(SECRET_EXPONENT, native=False)))
+
+    def test_workers_match_serial(self):
+        key = SigningKey(SECRET_EXPONENT)
+        self.assertEqual(sign(key, workers=3), sign(key))
+        key.sign_digest(b'\x01' * 32)
+        self.assertEqual(pickle.loads(pickle.dumps(key)).secret_exponent, SECRET_EXPONENT)
+
+    def test_ethereum_address(self):
+        from ethereum import utils
+
+        address = '0x' + b2h(utils.privtoaddr(SECRET_EXPONENT))
+        jws = sign(SigningKey(SECRET_EXPONENT))[0]
+        verify_jws(jws, TARGET_HASHES[0], address)
+        verify_jws(jws, TARGET_HASHES[0], address.upper().replace('0X', '0x'))
+
+    def test_rejects(self):
+        jws = sign(SigningKey(SECRET_EXPONENT))[0]
+        other_address = Key(secret_exponent=SECRET_EXPONENT + 1, netcode='XTN').address()
+        encoded_header, _, encoded_signature = jws.split('.')
+        header = json.loads(decode_base64url(encoded_header).decode('utf-8'))
+        header['alg'] = 'ES256'
+        other_header = encode_base64url(json.dumps(header).encode('utf-8'))
+        for jws, target_hash, address in [(jws, TARGET_HASHES[1], self.key.address()),
+                                          (jws, TARGET_HASHES[0], other_address),
+                                          (jws, TARGET_HASHES[0], 'not an address'),
+                                          (other_header + '..' + encoded_signature, TARGET_HASHES[0],
+                                           self.key.address()),
+                                          (encoded_header + '.' + TARGET_HASHES[0] + '.' + encoded_signature,
+                                           TARGET_HASHES[0], self.key.address()),
+                                          ('not a jws', TARGET_HASHES[0], self.key.address())]:
+            with self.assertRaises(UnverifiedSignatureError):
+                verify_jws(jws, target_hash, address)
+
+    def test_verify_certificate_signature(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        file_name = os.path.join(base_dir, 'cert.json')
+        with open(file_name, 'w') as f:
+            json.dump({'signature': {'targetHash': TARGET_HASHES[0]}}, f)
+        with self.assertRaises(UnverifiedSignatureError):
+            verify_certificate_signature('1', file_name, self.key.address())
+
+        with open(file_name, 'w') as f:
+            json.dump({'signature': {'targetHash': TARGET_HASHES[0], 'jws': sign(SigningKey(SECRET_EXPONENT))[0]}}, f)
+        verify_certificate_signature('1', file_name, self.key.address())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import random
+import unittest
+
+from pycoin.tx.Spendable import Spendable
+
+from cert_issuer import coin_selection
+from cert_issuer.coin_selection import (BranchAndBoundSelector, KnapsackSelector, LargestFirstSelector,
+                                        create_coin_selector, get_fee)
+from cert_issuer.tx_utils import BitcoinTransactionCostConstants
+
+SCRIPT = b'\x76\xa9\x14' + b'\x01' * 20 + b'\x88\xac'
+
+
+def spendables(*coin_values):
+    return [Spendable(coin_value, SCRIPT, bytes([index % 256]) * 32, index)
+            for index, coin_value in enumerate(coin_values)]
+
+
+def values(selection):
+    return sorted(s.coin_value for s in selection.inputs)
+
+
+class TestCoinSelection(unittest.TestCase):
+    def setUp(self):
+        # 10 satoshi per byte and no fee floor: an input costs 1490, a change output 340, and a transaction without
+        # change 1490 * inputs + 530
+        self.tx_cost_constants = BitcoinTransactionCostConstants(recommended_tx_fee=0, satoshi_per_byte=10)
+
+    def test_branch_and_bound_finds_inputs_without_change(self):
+        selection = BranchAndBoundSelector().select(spendables(100000, 1600, 1910), self.tx_cost_constants)
+        self.assertEqual(values(selection), [1600, 1910])
+        self.assertEqual(selection.fee, get_fee(self.tx_cost_constants, 2, False))
+        self.assertEqual(selection.change, 0)
+
+    def test_branch_and_bound_excess_is_bounded_by_cost_of_change(self):
+        # 2020 would be exact for one input; a change output would cost 340 now and 1490 to spend
+        self.assertEqual(values(BranchAndBoundSelector().select(spendables(100000, 3850), self.tx_cost_constants)),
+                         [3850])
+        self.assertIsNone(BranchAndBoundSelector().select(spendables(100000, 3851), self.tx_cost_constants))
+
+    def test_falls_back_to_change(self):
+        selection = create_coin_selector().select(spendables(100000, 50000), self.tx_cost_constants)
+        self.assertEqual(values(selection), [50000])
+        self.assertEqual(selection.fee, get_fee(self.tx_cost_constants, 1, True))
+        self.assertEqual(selection.change, 50000 - selection.fee)
+
+    def test_knapsack_prefers_smallest_sufficient_total(self):
+        selection = KnapsackSelector(rng=random.Random(1)).select(spendables(100000, 4000, 3000, 2500),
+                                                                  self.tx_cost_constants)
+        # two inputs need 1490 * 2 + 870 in fees plus 2750 change
+        self.assertEqual(values(selection), [3000, 4000])
+
+    def test_insufficient_funds(self):
+        for name in coin_selection.COIN_SELECTORS:
+            self.assertIsNone(create_coin_selector(name).select(spendables(1000, 1500), self.tx_cost_constants))
+        self.assertIsNone(create_coin_selector().select([], self.tx_cost_constants))
+
+    def test_dust_change_goes_to_fee(self):
+        selection = LargestFirstSelector().select(spendables(4000), self.tx_cost_constants)
+        self.assertEqual((selection.fee, selection.change), (4000, 0))
+
+    def test_consolidates_small_outputs_while_free(self):
+        # below the recommended fee floor, more inputs do not cost more
+        tx_cost_constants = BitcoinTransactionCostConstants(recommended_tx_fee=0.0006, satoshi_per_byte=10)
+        selector = LargestFirstSelector(max_consolidation_inputs=2)
+        selection = selector.select(spendables(100000, 5000, 3000, 2000), tx_cost_constants)
+        self.assertEqual(values(selection), [2000, 3000, 100000])
+        self.assertEqual((selection.fee, selection.change), (60000, 45000))
+
+        # at 10 satoshi per byte without the floor, an output worth less than 1490 costs more than it adds
+        selection = selector.select(spendables(100000, 1000), self.tx_cost_constants)
+        self.assertEqual(values(selection), [100000])
+
+    def test_selections_are_consistent(self):
+        rng = random.Random(0)
+        for _ in range(0, 50):
+            coin_values = [int(rng.lognormvariate(9, 2)) + 1 for _ in range(0, rng.randint(1, 30))]
+            for name in coin_selection.COIN_SELECTORS:
+                selection = create_coin_selector(name, max_consolidation_inputs=3).select(spendables(*coin_values),
+                                                                                          self.tx_cost_constants)
+                if selection is None:
+                    self.assertLess(sum(coin_values), get_fee(self.tx_cost_constants, len(coin_values), False))
+                    continue
+                num_inputs = len(selection.inputs)
+                self.assertEqual(selection.fee + selection.change, selection.get_value())
+                if selection.change:
+                    self.assertEqual(selection.fee, get_fee(self.tx_cost_constants, num_inputs, True))
+                    self.assertGreaterEqual(selection.change, self.tx_cost_constants.get_minimum_output_coin())
+                else:
+                    self.assertGreaterEqual(selection.fee, get_fee(self.tx_cost_constants, num_inputs, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,25 @@
+import json
+import socketserver
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 from bitcoin import SelectParams
 from bitcoin.core import COutPoint, lx, x, CScript
 from bitcoin.core.script import OP_EQUALVERIFY, OP_CHECKSIG, OP_DUP, OP_HASH160
 from bitcoin.wallet import P2PKHBitcoinAddress
-from mock import patch
+from mock import Mock, patch
 from pycoin.serialize import b2h
 
-from cert_issuer.connectors import BitcoindConnector
+from cert_schema import Chain
+
+from cert_issuer import connectors
+from cert_issuer.connectors import AccountState, BitcoindConnector, BitcoinServiceProviderConnector, \
+    BlockExplorerBroadcaster, EthereumJsonRpcProvider, EthereumServiceProviderConnector, EtherscanBroadcaster
+from cert_issuer.errors import BroadcastError, ConnectorError, TransactionRejectedError
+from cert_issuer.http_session import PooledSession
+from cert_issuer.provider_health import ProviderHealthRegistry
 
 TESTNET_TX = '010000000137e6a590428144e64cf008beb6e3193efee5a1a4ddfbbd48d10a12025b88c23c00000000fd5d0100473044022024959a1439e7e364c32f012a7e46dfa2d8cfa036ccdf230e9b3642fb9cdd4341022048292d0dbed226fadeae36b20627b50a3351456f164cae2923dba897995843c701483045022100e6dbcfb4ae35322e5c05688a6afcb144ab347654c217c9a3b2e963c2447418e702205cb639b549c7a9eace7d59ff2ce7c23167d60a214e6c9c011ce93317063850de014cc95241048aa0d470b7a9328889c84ef0291ed30346986e22558e80c3ae06199391eae21308a00cdcfb34febc0ea9c80dfd16b01f26c7ec67593cb8ab474aca8fa1d7029d4104cf54956634c4d0bdaf00e6b1871c089b7a892d0fecc077f03b91e8d4d146861b0a4fdd237891a9819c878984d4b123f6fe92d9bbc05873a1bb4fe510145bf369410471843c33b2971e4944c73d4500abd6f61f7edf9ec919c408cbe12a6c9132d2cb8ebed8253322760d5ec6081165e0ab68900683de503f1544f03816d47fec699a53aeffffffff09d29e91010000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f8727ed19190000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f874eda33320000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f879db467640000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f87a43d23030000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f87497b46060000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f87d29e91010000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f8793f68c0c0000000017a9145629021f7668d4ec310ac5e99701a6d6cf95eb8f8716400e00000000001976a9146efcf883b4b6f9997be9a0600f6c095fe2bd2d9288ac00000000'
 MAINNET_TX = '0100000001ce379123234bc9662f3f00f2a9c59d5420fc9f9d5e1fd8881b8666e8c9def133000000006a473044022032d2d9c2a67d90eb5ea32d9a5e935b46080d4c62a1d53265555c78775e8f6f2102205c3469593995b9b76f8d24aa4285a50b72ca71661ca021cd219883f1a8f14abe012103704cf7aa5e4152639617d0b3f8bcd302e231bbda13b468cba1b12aa7be14f3b3ffffffff07be0a0000000000001976a91464799d48941b0fbfdb4a7ee6340840fb2eb5c2c388acbe0a0000000000001976a914c615ecb52f6e877df0621f4b36bdb25410ec22c388acbe0a0000000000001976a9144e9862ff1c4041b7d083fe30cf5f68f7bedb321b88acbe0a0000000000001976a914413df7bf4a41f2e8a1366fcf7352885e6c88964b88acbe0a0000000000001976a914fabc1ff527531581b4a4c58f13bd088e274122bc88acbb810000000000001976a914fcbe34aa288a91eab1f0fe93353997ec6aa3594088ac0000000000000000226a2068f3ede17fdb67ffd4a5164b5687a71f9fbb68da803b803935720f2aa38f772800000000'
@@ -76,5 +88,218 @@ class TestConnectors(unittest.TestCase):
         #    self.assertEquals(balance, 49005500)
 
 
+class StubBroadcastHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = json.dumps({'txid': self.server.tx_id}).encode('utf-8')
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubBroadcastServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for a BlockExplorer style broadcast API, answering after latency seconds with the given status
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0, status=200, tx_id='txid'):
+        super().__init__(('127.0.0.1', 0), StubBroadcastHandler)
+        self.latency = latency
+        self.status = status
+        self.tx_id = tx_id
+        self.requests = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def get_broadcaster(self):
+        return BlockExplorerBroadcaster('http://127.0.0.1:{}'.format(self.server_address[1]))
+
+
+class StubEthereumNodeHandler(BaseHTTPRequestHandler):
+    # keeps connections alive between requests, like a node's JSON-RPC server
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        batch = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        self.server.requests.append([call['method'] for call in batch])
+        # answered in reverse order, which the JSON-RPC spec allows
+        body = json.dumps([self.server.answer(call) for call in reversed(batch)]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubEthereumNode(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for an Ethereum node's JSON-RPC endpoint, for one address with 2 mined and 1 pending transactions
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubEthereumNodeHandler)
+        self.requests = []
+        self.connections = 0
+        self.results = {'eth_getBalance': hex(10 ** 18), 'eth_gasPrice': hex(20 * 10 ** 9),
+                        'eth_sendRawTransaction': '0x' + 'ab' * 32}
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def answer(self, call):
+        if call['method'] == 'eth_getTransactionCount':
+            result = hex(3) if call['params'][1] == 'pending' else hex(2)
+        elif call['method'] in self.results:
+            result = self.results[call['method']]
+        else:
+            return {'jsonrpc': '2.0', 'id': call['id'], 'error': {'code': -32601, 'message': 'method not found'}}
+        if isinstance(result, dict):
+            return {'jsonrpc': '2.0', 'id': call['id'], 'error': result}
+        return {'jsonrpc': '2.0', 'id': call['id'], 'result': result}
+
+
+class TestEthereumJsonRpcProvider(unittest.TestCase):
+    def setUp(self):
+        self.node = StubEthereumNode()
+        self.addCleanup(self.node.server_close)
+        self.addCleanup(self.node.shutdown)
+        self.session = PooledSession()
+        self.session.trust_env = False
+        self.addCleanup(self.session.close)
+        self.provider = EthereumJsonRpcProvider(self.node.url, session=self.session)
+
+    def test_account_state_is_one_batch_request(self):
+        state = self.provider.get_account_state('0xaddress', None)
+        self.assertEqual(state, AccountState(balance=10 ** 18, nonce=2, pending_nonce=3, gas_price=20 * 10 ** 9))
+        self.assertEqual(self.node.requests, [['eth_getBalance', 'eth_getTransactionCount', 'eth_getTransactionCount',
+                                               'eth_gasPrice']])
+
+    def test_reuses_connection(self):
+        for _ in range(0, 3):
+            self.provider.get_account_state('0xaddress', None)
+        self.provider.broadcast_tx('f844', None)
+        self.assertEqual(len(self.node.requests), 4)
+        self.assertEqual(self.node.connections, 1)
+        self.assertEqual(self.session.get_metrics()['reused_connections'], 3)
+
+    def test_errors(self):
+        self.node.results['eth_sendRawTransaction'] = {'code': -32000, 'message': 'nonce too low'}
+        with self.assertRaises(TransactionRejectedError):
+            self.provider.broadcast_tx('0xf844', None)
+        del self.node.results['eth_gasPrice']
+        with self.assertRaises(ConnectorError):
+            self.provider.get_account_state('0xaddress', None)
+
+    def test_transaction_lookup(self):
+        connector = EthereumServiceProviderConnector(Chain.ethereum_ropsten, None, rpc_url=self.node.url,
+                                                     health=ProviderHealthRegistry())
+        with patch.dict(connectors.connectors, {(Chain.ethereum_ropsten, self.node.url): [self.provider]}):
+            with self.assertRaises(ConnectorError):
+                connector.is_transaction_known('0x' + 'ab' * 32)
+            self.node.results['eth_getTransactionByHash'] = None
+            self.assertFalse(connector.is_transaction_known('0x' + 'ab' * 32))
+
+    def test_connector_uses_node(self):
+        connector = EthereumServiceProviderConnector(Chain.ethereum_ropsten, None, rpc_url=self.node.url,
+                                                     health=ProviderHealthRegistry())
+        with patch.dict(connectors.connectors, {(Chain.ethereum_ropsten, self.node.url): [self.provider]}):
+            self.assertEqual(connector.get_account_state('0xaddress').pending_nonce, 3)
+            self.assertEqual(connector.get_address_nonce('0xaddress', pending=True), 3)
+            self.assertEqual(connector.broadcast_tx('f844'), '0x' + 'ab' * 32)
+        self.assertEqual(self.node.requests[-1], ['eth_sendRawTransaction'])
+
+
+class TestEtherscanBroadcaster(unittest.TestCase):
+    def test_appends_api_token(self):
+        session = Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.json.return_value = {'result': '0x5'}
+        self.assertEqual(EtherscanBroadcaster('https://api.example', session=session).get_address_nonce(
+            '0xaddress', 'token', 'pending'), 5)
+        self.assertEqual(session.get.call_args[0][0], 'https://api.example?module=proxy&action=eth_getTransactionCount'
+                                                      '&address=0xaddress&tag=pending&apikey=token')
+
+
+class StubTx(object):
+    def stream(self, f):
+        f.write(b'tx')
+
+
+@patch('cert_issuer.connectors.BROADCAST_RETRY_INTERVAL', 0)
+class TestConcurrentBroadcast(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def broadcast(self, *servers):
+        self.servers.extend(servers)
+        providers = [server.get_broadcaster() for server in servers]
+        with patch('cert_issuer.connectors.get_providers_for_chain', return_value=providers):
+            start = time.perf_counter()
+            tx_id = BitcoinServiceProviderConnector.broadcast_tx_with_chain(StubTx(), Chain.bitcoin_testnet)
+            return tx_id, time.perf_counter() - start
+
+    def test_returns_first_success(self):
+        slow = StubBroadcastServer(latency=2)
+        fast = StubBroadcastServer(latency=0.05)
+        tx_id, elapsed = self.broadcast(slow, fast)
+        self.assertEqual(tx_id, 'txid')
+        self.assertLess(elapsed, 1)
+        self.assertEqual(slow.requests, 1)
+
+    def test_ignores_failing_providers(self):
+        tx_id, _ = self.broadcast(StubBroadcastServer(status=500), StubBroadcastServer(latency=0.1))
+        self.assertEqual(tx_id, 'txid')
+
+    def test_retries_when_all_providers_fail(self):
+        failing = StubBroadcastServer(status=500)
+        with self.assertRaises(BroadcastError):
+            self.broadcast(failing)
+        self.assertEqual(failing.requests, connectors.MAX_BROADCAST_ATTEMPTS)
+
+    def test_does_not_retry_rejected_transaction(self):
+        rejecting = StubBroadcastServer(status=400)
+        with self.assertRaises(TransactionRejectedError):
+            self.broadcast(rejecting, StubBroadcastServer(status=400))
+        self.assertEqual(rejecting.requests, 1)
+
+    def test_rejected_by_some_providers_may_have_been_sent(self):
+        rejecting = StubBroadcastServer(status=400)
+        with self.assertRaises(BroadcastError) as context:
+            self.broadcast(rejecting, StubBroadcastServer(status=500))
+        self.assertNotIsInstance(context.exception, TransactionRejectedError)
+        self.assertEqual(rejecting.requests, connectors.MAX_BROADCAST_ATTEMPTS)
+
+    @patch('cert_issuer.connectors.BROADCAST_TIMEOUT', 0.1)
+    def test_times_out_slow_providers(self):
+        with self.assertRaises(BroadcastError):
+            self.broadcast(StubBroadcastServer(latency=1))
+
+    def test_logs_conflicting_txids(self):
+        with self.assertLogs(level='ERROR') as logs:
+            tx_id, _ = self.broadcast(StubBroadcastServer(tx_id='txid1'),
+                                      StubBroadcastServer(latency=0.2, tx_id='txid2'))
+            time.sleep(0.5)
+        self.assertEqual(tx_id, 'txid1')
+        self.assertIn('conflicting tx_ids=txid1 and txid2', logs.output[0])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from urllib.request import Request, urlopen
+
+import mock
+
+from cert_schema import BlockcertValidationError, Chain
+
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateHandler
+from cert_issuer.daemon import DaemonHTTPServer, IssuanceDaemon
+from cert_issuer.errors import ConnectorError, DocumentNotCachedError
+from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+from cert_issuer.transaction_handler import MockTransactionHandler
+
+
+class ProofWritingCertificateHandler(CertificateHandler):
+    def validate_certificate(self, certificate_metadata):
+        with open(certificate_metadata.unsigned_cert_file_name) as cert_file:
+            invalid = json.load(cert_file).get('invalid')
+        if invalid:
+            raise BlockcertValidationError(invalid if isinstance(invalid, str) else 'Invalid certificate')
+
+    def sign_certificate(self, signer, certificate_metadata):
+        pass
+
+    def get_byte_array_to_issue(self, certificate_metadata):
+        return certificate_metadata.uid.encode('utf-8')
+
+    def add_proof(self, certificate_metadata, merkle_proof):
+        with open(certificate_metadata.blockchain_cert_file_name, 'w') as out_file:
+            json.dump(merkle_proof, out_file)
+
+
+class UncachedContextCertificateHandler(ProofWritingCertificateHandler):
+    """
+    Fails to load the certificates' context the first failures times, as when fetching it times out
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = 0
+
+    def validate_certificate(self, certificate_metadata):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise DocumentNotCachedError('Timed out')
+        super().validate_certificate(certificate_metadata)
+
+
+class CountingTransactionHandler(MockTransactionHandler):
+    def __init__(self):
+        self.broadcast = 0
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        self.broadcast += 1
+        return 'txid{}'.format(self.broadcast)
+
+
+class FailingTransactionHandler(CountingTransactionHandler):
+    """
+    Fails to check the balance the first failures times, as when a provider times out
+    """
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    def ensure_balance(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectorError('Timed out')
+
+
+class ConcurrentTransactionHandler(CountingTransactionHandler):
+    def __init__(self, parties):
+        super().__init__()
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        # only returns once the other batches are being broadcast too
+        self.barrier.wait()
+        return super().broadcast_signed_transaction(signed_hextx)
+
+
+class TestIssuanceDaemon(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.app_config = argparse.Namespace(
+            unsigned_certificates_dir=None,
+            signed_certificates_dir=None,
+            blockchain_certificates_dir=os.path.join(self.base_dir, 'blockchain'),
+            work_dir=os.path.join(self.base_dir, 'work'),
+            streaming=False,
+            tenants=False,
+            staging='copy',
+            batch_size=0,
+            batch_max_bytes=0,
+            batch_max_seconds=0,
+            max_retry=1,
+            safe_mode=False,
+            chain=Chain.bitcoin_testnet)
+        self.transaction_handler = CountingTransactionHandler()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def create_daemon(self, batch_size=2, window_seconds=60, spool_dir=None, anchor_workers=1,
+                      certificate_handler=None):
+        certificate_batch_handler = CertificateBatchHandler(
+            secret_manager=mock.Mock(), certificate_handler=certificate_handler or ProofWritingCertificateHandler(),
+            merkle_tree=MerkleTreeGenerator())
+        return IssuanceDaemon(self.app_config, certificate_batch_handler, self.transaction_handler,
+                              batch_size=batch_size, window_seconds=window_seconds, spool_dir=spool_dir,
+                              anchor_workers=anchor_workers)
+
+    def wait_for_status(self, issuance_daemon, certificate_id, status=200):
+        deadline = time.monotonic() + 10
+        while issuance_daemon.get_status(certificate_id)[0] != status:
+            self.assertLess(time.monotonic(), deadline, 'Timed out waiting for ' + certificate_id)
+            time.sleep(0.01)
+        return issuance_daemon.get_status(certificate_id)[1]
+
+    def wait_for_attempts(self, attempts):
+        deadline = time.monotonic() + 10
+        while self.transaction_handler.attempts < attempts:
+            self.assertLess(time.monotonic(), deadline, 'Timed out waiting for attempt {}'.format(attempts))
+            time.sleep(0.01)
+
+    def test_issues_full_batches(self):
+        issuance_daemon = self.create_daemon(batch_size=2)
+        issuance_daemon.start()
+        for num in range(0, 4):
+            issuance_daemon.submit({'num': num}, 'cert{}'.format(num))
+        txids = [self.wait_for_status(issuance_daemon, 'cert{}'.format(num))['anchors'][0]['sourceId']
+                 for num in range(0, 4)]
+        issuance_daemon.stop()
+        self.assertEqual(txids, ['txid1', 'txid1', 'txid2', 'txid2'])
+        self.assertEqual(os.listdir(issuance_daemon.intake_dir), [])
+        self.assertEqual([name for name in os.listdir(issuance_daemon.daemon_dir) if name.startswith('batch_')], [])
+
+    def test_issues_partial_batch_after_window(self):
+        issuance_daemon = self.create_daemon(batch_size=100, window_seconds=0.05)
+        issuance_daemon.start()
+        certificate_id = issuance_daemon.submit({})
+        self.assertEqual(issuance_daemon.get_status(certificate_id)[0], 202)
+        self.wait_for_status(issuance_daemon, certificate_id)
+        issuance_daemon.stop()
+        self.assertEqual(self.transaction_handler.broadcast, 1)
+
+    def test_anchor_workers_issue_batches_concurrently(self):
+        self.transaction_handler = ConcurrentTransactionHandler(2)
+        issuance_daemon = self.create_daemon(batch_size=1, anchor_workers=2)
+        issuance_daemon.start()
+        issuance_daemon.submit({}, 'cert0')
+        issuance_daemon.submit({}, 'cert1')
+        txids = sorted(self.wait_for_status(issuance_daemon, certificate_id)['anchors'][0]['sourceId']
+                       for certificate_id in ['cert0', 'cert1'])
+        issuance_daemon.stop()
+        self.assertEqual(txids, ['txid1', 'txid2'])
+
+    def test_stop_issues_accepted_certificates(self):
+        issuance_daemon = self.create_daemon(batch_size=100)
+        issuance_daemon.start()
+        issuance_daemon.submit({}, 'cert0')
+        issuance_daemon.stop()
+        self.assertEqual(issuance_daemon.get_status('cert0')[0], 200)
+
+    def test_rejects_invalid_and_duplicate_submissions(self):
+        issuance_daemon = self.create_daemon()
+        issuance_daemon.start()
+        with self.assertRaises(ValueError):
+            issuance_daemon.submit({}, '../cert0')
+        with self.assertRaises(ValueError):
+            issuance_daemon.submit(b'[]')
+        issuance_daemon.submit({}, 'cert0')
+        with self.assertRaises(KeyError):
+            issuance_daemon.submit({}, 'cert0')
+        issuance_daemon.stop()
+        self.assertEqual(issuance_daemon.get_status('unknown'), (404, None))
+
+    def test_sets_aside_invalid_certificates(self):
+        issuance_daemon = self.create_daemon(batch_size=3)
+        issuance_daemon.start()
+        issuance_daemon.submit({}, 'cert0')
+        issuance_daemon.submit({'invalid': True}, 'bad')
+        issuance_daemon.submit({}, 'cert1')
+        self.wait_for_status(issuance_daemon, 'cert0')
+        self.wait_for_status(issuance_daemon, 'cert1')
+        issuance_daemon.stop()
+        status, document = issuance_daemon.get_status('bad')
+        self.assertEqual(status, 500)
+        self.assertEqual(document['error'], 'Invalid certificate')
+        self.assertEqual(os.listdir(issuance_daemon.failed_dir), ['bad.json'])
+        self.assertEqual(self.transaction_handler.broadcast, 1)
+
+    def test_all_invalid_certificates_keep_their_errors(self):
+        issuance_daemon = self.create_daemon(batch_size=2)
+        issuance_daemon.start()
+        issuance_daemon.submit({'invalid': 'Missing issuer'}, 'bad0')
+        issuance_daemon.submit({'invalid': 'Missing recipient'}, 'bad1')
+        issuance_daemon.stop()
+        self.assertEqual(issuance_daemon.get_status('bad0')[1]['error'], 'Missing issuer')
+        self.assertEqual(issuance_daemon.get_status('bad1')[1]['error'], 'Missing recipient')
+        self.assertEqual(sorted(os.listdir(issuance_daemon.failed_dir)), ['bad0.json', 'bad1.json'])
+        self.assertEqual([name for name in os.listdir(issuance_daemon.daemon_dir) if name.startswith('batch_')], [])
+
+    @mock.patch('cert_issuer.daemon.RETRY_INITIAL_SECONDS', 0.01)
+    def test_retries_batch_after_transient_failure(self):
+        self.transaction_handler = FailingTransactionHandler(failures=2)
+        issuance_daemon = self.create_daemon(batch_size=2)
+        issuance_daemon.start()
+        issuance_daemon.submit({}, 'cert0')
+        issuance_daemon.submit({'invalid': True}, 'bad')
+        self.wait_for_status(issuance_daemon, 'cert0')
+        issuance_daemon.stop()
+        self.assertEqual(self.transaction_handler.attempts, 3)
+        self.assertEqual(self.transaction_handler.broadcast, 1)
+        self.assertEqual(os.listdir(issuance_daemon.failed_dir), ['bad.json'])
+
+    @mock.patch('cert_issuer.daemon.RETRY_INITIAL_SECONDS', 0.01)
+    def test_keeps_certificates_that_could_not_be_validated(self):
+        # the batch and the check for invalid certificates both fail to load the context
+        certificate_handler = UncachedContextCertificateHandler(failures=2)
+        issuance_daemon = self.create_daemon(batch_size=1, certificate_handler=certificate_handler)
+        issuance_daemon.start()
+        issuance_daemon.submit({}, 'cert0')
+        self.wait_for_status(issuance_daemon, 'cert0')
+        issuance_daemon.stop()
+        self.assertEqual(certificate_handler.attempts, 3)
+        self.assertEqual(os.listdir(issuance_daemon.failed_dir), [])
+        self.assertEqual(self.transaction_handler.broadcast, 1)
+
+    def test_keeps_failing_batch_when_stopped(self):
+        self.transaction_handler = FailingTransactionHandler(failures=1)
+        issuance_daemon = self.create_daemon(batch_size=1)
+        issuance_daemon.start()
+        issuance_daemon.submit({}, 'cert0')
+        self.wait_for_attempts(1)
+        issuance_daemon.stop()
+        status, document = issuance_daemon.get_status('cert0')
+        self.assertEqual(status, 500)
+        self.assertIn('retried when the daemon restarts', document['error'])
+        self.assertEqual(os.listdir(issuance_daemon.failed_dir), [])
+
+        # the kept batch is issued once the daemon restarts
+        issuance_daemon = self.create_daemon(batch_size=1)
+        issuance_daemon.start()
+        issuance_daemon.stop()
+        self.assertEqual(issuance_daemon.get_status('cert0')[0], 200)
+
+    def test_accepts_certificates_while_resuming(self):
+        self.transaction_handler = FailingTransactionHandler(failures=2)
+        first_daemon = self.create_daemon(batch_size=1)
+        first_daemon.start()
+        first_daemon.submit({}, 'cert0')
+        self.wait_for_attempts(1)
+        first_daemon.stop()
+
+        # the kept batch fails again when it is resumed, and waits to be retried while cert1 is accepted
+        issuance_daemon = self.create_daemon(batch_size=1)
+        issuance_daemon.start()
+        self.assertEqual(issuance_daemon.get_status('cert0')[0], 202)
+        issuance_daemon.submit({}, 'cert1')
+        self.wait_for_attempts(2)
+        self.assertEqual(issuance_daemon.get_status('cert1')[0], 202)
+        issuance_daemon.stop()
+        self.assertEqual(issuance_daemon.get_status('cert0')[0], 500)
+        self.assertEqual(issuance_daemon.get_status('cert1')[0], 200)
+
+    def test_requeues_accepted_certificates_on_start(self):
+        first_daemon = self.create_daemon()
+        os.makedirs(first_daemon.intake_dir)
+        first_daemon.submit({}, 'cert0')
+
+        issuance_daemon = self.create_daemon()
+        issuance_daemon.start()
+        issuance_daemon.stop()
+        self.assertEqual(issuance_daemon.get_status('cert0')[0], 200)
+
+    def test_spool_dir(self):
+        spool_dir = os.path.join(self.base_dir, 'spool')
+        issuance_daemon = self.create_daemon(batch_size=1, spool_dir=spool_dir)
+        with mock.patch('cert_issuer.daemon.SPOOL_POLL_SECONDS', 0.01):
+            issuance_daemon.start()
+            with open(os.path.join(spool_dir, '.cert0.json'), 'w') as spool_file:
+                spool_file.write('{}')
+            os.rename(os.path.join(spool_dir, '.cert0.json'), os.path.join(spool_dir, 'cert0.json'))
+            self.wait_for_status(issuance_daemon, 'cert0')
+            issuance_daemon.stop()
+        self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_http_api(self):
+        issuance_daemon = self.create_daemon(batch_size=1)
+        issuance_daemon.start()
+        server = DaemonHTTPServer(('127.0.0.1', 0), issuance_daemon)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = 'http://127.0.0.1:{}/certificates'.format(server.server_address[1])
+        try:
+            request = Request(base_url + '?id=cert0', data=b'{}', headers={'Content-Type': 'application/json'})
+            with urlopen(request) as response:
+                self.assertEqual(response.status, 202)
+                self.assertEqual(json.loads(response.read().decode('utf-8')), {'id': 'cert0'})
+            self.wait_for_status(issuance_daemon, 'cert0')
+            with urlopen(base_url + '/cert0') as response:
+                self.assertEqual(response.status, 200)
+                self.assertEqual(json.loads(response.read().decode('utf-8'))['anchors'][0]['sourceId'], 'txid1')
+            with urlopen('http://127.0.0.1:{}/providers'.format(server.server_address[1])) as response:
+                self.assertIsInstance(json.loads(response.read().decode('utf-8')), list)
+        finally:
+            server.shutdown()
+            server.server_close()
+            issuance_daemon.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import collections
+import json
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from cert_issuer.certificate_handler import CertificateV2Handler
+from cert_issuer.document_loader import CachingDocumentLoader
+from cert_issuer.errors import DocumentNotCachedError
+from cert_issuer.helpers import CertificateMetadata
+
+EXAMPLE_CERTIFICATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples',
+                                        'data-testnet', 'unsigned_certificates')
+
+EXTRA_CONTEXT_URL = 'https://example.org/extra/context.json'
+EXTRA_CONTEXT = {'@context': {'extraField': 'https://example.org/extra#extraField'}}
+
+
+def no_network(*args, **kwargs):
+    raise OSError('network access is disabled in this test')
+
+
+class TestCachingDocumentLoader(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.base_dir, 'cache')
+        self.preload_dir = os.path.join(self.base_dir, 'preload')
+        os.makedirs(self.preload_dir)
+        with open(os.path.join(self.preload_dir, 'manifest.json'), 'w') as manifest_file:
+            json.dump({EXTRA_CONTEXT_URL: 'extra.json'}, manifest_file)
+        with open(os.path.join(self.preload_dir, 'extra.json'), 'w') as context_file:
+            json.dump(EXTRA_CONTEXT, context_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def write_certificates(self):
+        certificates_to_issue = collections.OrderedDict()
+        for file_name in sorted(os.listdir(EXAMPLE_CERTIFICATES_DIR)):
+            uid = os.path.splitext(file_name)[0]
+            with open(os.path.join(EXAMPLE_CERTIFICATES_DIR, file_name)) as cert_file:
+                certificate_json = json.load(cert_file)
+            certificate_json['@context'].append(EXTRA_CONTEXT_URL)
+            certificate_json['extraField'] = 'extra value'
+            with open(os.path.join(self.base_dir, file_name), 'w') as cert_file:
+                json.dump(certificate_json, cert_file)
+            certificates_to_issue[uid] = CertificateMetadata(uid, self.base_dir, None, self.base_dir, self.base_dir)
+        return certificates_to_issue
+
+    @mock.patch('socket.getaddrinfo', no_network)
+    @mock.patch.object(socket.socket, 'connect', no_network)
+    def test_normalize_batch_offline(self):
+        loader = CachingDocumentLoader(cache_dir=self.cache_dir, offline=True)
+        loader.preload_directory(self.preload_dir)
+
+        # a fresh process only has the disk cache
+        loader = CachingDocumentLoader(cache_dir=self.cache_dir, offline=True)
+        certificate_handler = CertificateV2Handler(loader)
+        for _, metadata in self.write_certificates().items():
+            normalized = certificate_handler.get_byte_array_to_issue(metadata)
+            self.assertIn(b'<https://example.org/extra#extraField> "extra value"', normalized)
+
+        stats = loader.get_stats()
+        self.assertEqual(stats['disk_hits'], 1)
+        self.assertEqual(stats.get('misses', 0), 0)
+        self.assertGreater(stats['memory_hits'], 0)
+
+    def test_offline_miss(self):
+        loader = CachingDocumentLoader(offline=True)
+        with self.assertRaises(DocumentNotCachedError):
+            loader(EXTRA_CONTEXT_URL)
+        self.assertEqual(loader.get_stats()['misses'], 1)
+
+    def test_fetched_documents_are_cached(self):
+        network_loader = mock.Mock(return_value={'document': json.dumps(EXTRA_CONTEXT)})
+        loader = CachingDocumentLoader(cache_dir=self.cache_dir, network_loader=network_loader)
+        self.assertEqual(loader(EXTRA_CONTEXT_URL)['document'], EXTRA_CONTEXT)
+        self.assertEqual(loader(EXTRA_CONTEXT_URL)['document'], EXTRA_CONTEXT)
+        network_loader.assert_called_once_with(EXTRA_CONTEXT_URL)
+
+        loader = CachingDocumentLoader(cache_dir=self.cache_dir, offline=True)
+        self.assertEqual(loader(EXTRA_CONTEXT_URL)['document'], EXTRA_CONTEXT)
+
+    def test_called_with_options(self):
+        # pyld 1.0 and later pass their options to the document loader
+        network_loader = mock.Mock(return_value={'document': EXTRA_CONTEXT})
+        loader = CachingDocumentLoader(network_loader=network_loader)
+        options = {'headers': {}}
+        self.assertEqual(loader(EXTRA_CONTEXT_URL, options)['document'], EXTRA_CONTEXT)
+        self.assertEqual(loader(EXTRA_CONTEXT_URL, options)['document'], EXTRA_CONTEXT)
+        network_loader.assert_called_once_with(EXTRA_CONTEXT_URL, options)
+
+    def test_lru_eviction(self):
+        loader = CachingDocumentLoader(max_entries=2)
+        for num in range(0, 3):
+            loader.add_document('https://example.org/{}'.format(num), {'@context': {}})
+        self.assertEqual(list(loader.documents.keys()), ['https://example.org/1', 'https://example.org/2'])
+
+    def test_shared_between_threads(self):
+        # with one entry, every thread's lookup races another thread's eviction
+        loader = CachingDocumentLoader(cache_dir=self.cache_dir, max_entries=1)
+        urls = ['https://example.org/{}'.format(num) for num in range(0, 4)]
+        for url in urls:
+            loader.add_document(url, {'@context': {}})
+        errors = []
+
+        def load():
+            try:
+                for _ in range(0, 2000):
+                    for url in urls:
+                        loader(url)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load) for _ in range(0, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(loader.get_stats().values()), 4 * 2000 * len(urls))
+
+    def test_pickle(self):
+        loader = CachingDocumentLoader(cache_dir=self.cache_dir)
+        loader.add_document(EXTRA_CONTEXT_URL, EXTRA_CONTEXT)
+        unpickled = pickle.loads(pickle.dumps(loader))
+        self.assertEqual(unpickled(EXTRA_CONTEXT_URL)['document'], EXTRA_CONTEXT)
+        self.assertEqual(unpickled.get_stats(), {'memory_hits': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
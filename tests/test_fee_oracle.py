@@ -0,0 +1,104 @@
+import unittest
+
+import mock
+
+from cert_issuer import fee_oracle
+from cert_issuer.connectors import BitcoindConnector, MempoolSpaceFeeEstimator
+from cert_issuer.errors import ConnectorError
+from cert_issuer.fee_oracle import BitcoinFeeOracle, EthereumFeeOracle
+from cert_issuer.tx_utils import BitcoinTransactionCostConstants, EthereumTransactionCostConstants
+from tests.fakes import FakeClock
+
+
+class StandInConnector(object):
+    def __init__(self, fee_rate):
+        self.fee_rate = fee_rate
+        self.calls = []
+
+    def estimate_fee(self, target_blocks):
+        self.calls.append(target_blocks)
+        if isinstance(self.fee_rate, Exception):
+            raise self.fee_rate
+        return self.fee_rate
+
+    def get_gas_price(self):
+        self.calls.append(None)
+        return self.fee_rate
+
+
+class TestFeeOracle(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.connector = StandInConnector(12.2)
+        self.oracle = BitcoinFeeOracle(self.connector, 250, 3, max_rate=100, cache_seconds=300, clock=self.clock)
+
+    def test_estimates_are_cached(self):
+        self.assertEqual(self.oracle.get_fee_rate(), 13)
+        self.connector.fee_rate = 20
+        self.clock.now = 299
+        self.assertEqual(self.oracle.get_fee_rate(), 13)
+        self.clock.now = 300
+        self.assertEqual(self.oracle.get_fee_rate(), 20)
+        self.assertEqual(self.connector.calls, [3, 3])
+
+    def test_estimates_are_capped(self):
+        self.connector.fee_rate = 500
+        self.assertEqual(self.oracle.get_fee_rate(), 100)
+        self.clock.now = 300
+        self.connector.fee_rate = 0.1
+        self.assertEqual(self.oracle.get_fee_rate(), fee_oracle.MIN_SATOSHI_PER_BYTE)
+
+    def test_falls_back_when_estimates_fail(self):
+        self.connector.fee_rate = ConnectorError('no provider')
+        self.assertEqual(self.oracle.get_fee_rate(), 250)
+        self.connector.fee_rate = 12
+        self.assertEqual(self.oracle.get_fee_rate(), 250)
+        self.clock.now = fee_oracle.FAILURE_CACHE_SECONDS
+        self.assertEqual(self.oracle.get_fee_rate(), 12)
+        # the last estimate is kept while estimates fail
+        self.connector.fee_rate = ConnectorError('no provider')
+        self.clock.now += 300
+        self.assertEqual(self.oracle.get_fee_rate(), 12)
+
+    def test_gas_price_follows_confirmation_target(self):
+        connector = StandInConnector(20 * 10 ** 9)
+        self.assertEqual(EthereumFeeOracle(connector, 10 ** 9, 1).get_fee_rate(), 25 * 10 ** 9)
+        self.assertEqual(EthereumFeeOracle(connector, 10 ** 9, 6).get_fee_rate(), 20 * 10 ** 9)
+        self.assertEqual(EthereumFeeOracle(connector, 10 ** 9, 50, max_rate=15 * 10 ** 9).get_fee_rate(),
+                         15 * 10 ** 9)
+
+    def test_cost_constants_take_rate_from_oracle(self):
+        cost_constants = BitcoinTransactionCostConstants(satoshi_per_byte=250, fee_oracle=self.oracle)
+        self.assertEqual(cost_constants.satoshi_per_byte, 250)
+        cost_constants.update_fee_rate()
+        self.assertEqual(cost_constants.satoshi_per_byte, 13)
+
+        cost_constants = EthereumTransactionCostConstants(10 ** 9, 25000,
+                                                          fee_oracle=EthereumFeeOracle(StandInConnector(2 * 10 ** 9),
+                                                                                       10 ** 9, 6))
+        cost_constants.update_fee_rate()
+        self.assertEqual(cost_constants.get_recommended_max_cost(), 2 * 10 ** 9 * 25000)
+
+
+class TestFeeEstimators(unittest.TestCase):
+    def test_mempool_space_rate_by_target(self):
+        session = mock.Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.json.return_value = {'fastestFee': 40, 'halfHourFee': 30, 'hourFee': 20,
+                                                      'economyFee': 5, 'minimumFee': 1}
+        estimator = MempoolSpaceFeeEstimator('https://mempool.example/api', session=session)
+        self.assertEqual([estimator.estimate_fee(target) for target in [1, 2, 6, 144]], [40, 30, 20, 5])
+        session.get.assert_called_with('https://mempool.example/api/v1/fees/recommended')
+
+    def test_bitcoind_estimatesmartfee(self):
+        with mock.patch('bitcoin.rpc.Proxy') as proxy:
+            proxy.return_value.call.return_value = {'feerate': 0.00012, 'blocks': 3}
+            self.assertAlmostEqual(BitcoindConnector('XTN').estimate_fee(3), 12)
+            proxy.return_value.call.assert_called_with('estimatesmartfee', 3)
+            proxy.return_value.call.return_value = {'errors': ['Insufficient data or no feerate found'], 'blocks': 0}
+            with self.assertRaises(ConnectorError):
+                BitcoindConnector('XTN').estimate_fee(3)
+
+
+if __name__ == '__main__':
+    unittest.main()
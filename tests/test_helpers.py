@@ -0,0 +1,179 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from cert_issuer import helpers
+from cert_issuer.errors import NoCertificatesFoundError
+
+
+class TestHelpers(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.unsigned_certs_dir = os.path.join(self.base_dir, 'unsigned')
+        self.signed_certs_dir = os.path.join(self.base_dir, 'signed')
+        self.blockchain_certs_dir = os.path.join(self.base_dir, 'blockchain')
+        self.work_dir = os.path.join(self.base_dir, 'work')
+        os.makedirs(self.unsigned_certs_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def write_certificates(self, count):
+        for num in range(0, count):
+            with open(os.path.join(self.unsigned_certs_dir, 'cert{}.json'.format(num)), 'w') as cert_file:
+                cert_file.write('{}')
+        with open(os.path.join(self.unsigned_certs_dir, 'ignored.txt'), 'w') as other_file:
+            other_file.write('not a certificate')
+
+    def test_prepare_streaming_issuance_batch(self):
+        self.write_certificates(5)
+        stream = helpers.prepare_streaming_issuance_batch(self.unsigned_certs_dir, self.signed_certs_dir,
+                                                          self.blockchain_certs_dir, self.work_dir)
+        self.assertEqual(len(stream), 5)
+
+        first_pass = [uid for uid, _ in stream.items()]
+        second_pass = [uid for uid, _ in stream.items()]
+        self.assertEqual(first_pass, second_pass)
+        self.assertEqual(sorted(first_pass), ['cert{}'.format(num) for num in range(0, 5)])
+
+        uid, metadata = next(stream.items())
+        self.assertEqual(metadata.unsigned_cert_file_name, os.path.join(self.unsigned_certs_dir, uid + '.json'))
+        self.assertEqual(metadata.blockchain_cert_file_name,
+                         os.path.join(self.work_dir, helpers.BLOCKCHAIN_CERTIFICATES_DIR, uid + '.json'))
+        self.assertEqual(metadata.final_blockchain_cert_file_name,
+                         os.path.join(self.blockchain_certs_dir, uid + '.json'))
+
+        # inputs are read in place
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir, helpers.UNSIGNED_CERTIFICATES_DIR)))
+
+    def test_iter_file_names(self):
+        self.write_certificates(2)
+        os.makedirs(os.path.join(self.unsigned_certs_dir, 'subdir.json'))
+        for scandir in set([getattr(os, 'scandir', None), None]):
+            # None stands in for Python 3.4, which has no os.scandir
+            with mock.patch.object(os, 'scandir', scandir, create=True):
+                names = sorted(helpers._iter_file_names(self.unsigned_certs_dir))
+            self.assertEqual(names, ['cert0.json', 'cert1.json', 'ignored.txt'])
+
+    def test_prepare_streaming_issuance_batch_empty(self):
+        with self.assertRaises(NoCertificatesFoundError):
+            helpers.prepare_streaming_issuance_batch(self.unsigned_certs_dir, self.signed_certs_dir,
+                                                     self.blockchain_certs_dir, self.work_dir)
+
+    def test_prepare_issuance_batch_hardlink(self):
+        self.write_certificates(3)
+        certificates_metadata = helpers.prepare_issuance_batch(self.unsigned_certs_dir, self.signed_certs_dir,
+                                                               self.blockchain_certs_dir, self.work_dir,
+                                                               staging=helpers.STAGING_HARDLINK)
+        self.assertEqual(list(certificates_metadata.keys()), ['cert0', 'cert1', 'cert2'])
+        for uid, metadata in certificates_metadata.items():
+            self.assertTrue(os.path.samefile(metadata.unsigned_cert_file_name,
+                                             os.path.join(self.unsigned_certs_dir, uid + '.json')))
+
+    def test_prepare_issuance_batch_copy(self):
+        self.write_certificates(3)
+        certificates_metadata = helpers.prepare_issuance_batch(self.unsigned_certs_dir, self.signed_certs_dir,
+                                                               self.blockchain_certs_dir, self.work_dir)
+        for uid, metadata in certificates_metadata.items():
+            self.assertFalse(os.path.samefile(metadata.unsigned_cert_file_name,
+                                              os.path.join(self.unsigned_certs_dir, uid + '.json')))
+
+    def test_file_stager_auto_falls_back(self):
+        self.write_certificates(1)
+        stager = helpers.FileStager(helpers.STAGING_AUTO)
+        src = os.path.join(self.unsigned_certs_dir, 'cert0.json')
+        with mock.patch('cert_issuer.helpers._reflink', side_effect=OSError('not supported')) as reflink:
+            stager(src, os.path.join(self.base_dir, 'first.json'))
+            stager(src, os.path.join(self.base_dir, 'second.json'))
+        # reflink is only attempted once, and hardlinks are used from then on
+        self.assertEqual(reflink.call_count, 1)
+        self.assertTrue(os.path.samefile(src, os.path.join(self.base_dir, 'second.json')))
+
+    def test_file_stager_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            helpers.FileStager('symlink')
+
+    def test_copy_output_replaces_atomically(self):
+        self.write_certificates(2)
+        certificates_metadata = helpers.prepare_issuance_batch(self.unsigned_certs_dir, self.signed_certs_dir,
+                                                               self.blockchain_certs_dir, self.work_dir)
+        for _, metadata in certificates_metadata.items():
+            with open(metadata.blockchain_cert_file_name, 'w') as cert_file:
+                cert_file.write('issued')
+        # a previous output for the same certificate is replaced
+        with open(os.path.join(self.blockchain_certs_dir, 'cert0.json'), 'w') as previous_file:
+            previous_file.write('previous')
+
+        # reflink alone is left out, since it depends on the filesystem
+        for staging in [helpers.STAGING_COPY, helpers.STAGING_HARDLINK, helpers.STAGING_AUTO]:
+            helpers.copy_output(certificates_metadata, staging=staging)
+            self.assertEqual(sorted(os.listdir(self.blockchain_certs_dir)), ['cert0.json', 'cert1.json'])
+            for _, metadata in certificates_metadata.items():
+                with open(metadata.final_blockchain_cert_file_name) as cert_file:
+                    self.assertEqual(cert_file.read(), 'issued')
+
+    def make_batch(self, sizes):
+        certificates_metadata = collections.OrderedDict()
+        for num, size in enumerate(sizes):
+            uid = 'cert{}'.format(num)
+            with open(os.path.join(self.unsigned_certs_dir, uid + '.json'), 'w') as cert_file:
+                cert_file.write('x' * size)
+            certificates_metadata[uid] = helpers.CertificateMetadata(uid, self.unsigned_certs_dir, None,
+                                                                     self.blockchain_certs_dir, self.blockchain_certs_dir)
+        return certificates_metadata
+
+    def get_partitions(self, batches):
+        return [[uid for uid, _ in batch.items()] for batch in batches]
+
+    def test_partition_batch_by_count(self):
+        certificates_metadata = self.make_batch([1] * 7)
+        batches = list(helpers.partition_batch(certificates_metadata, max_count=3))
+        self.assertEqual(self.get_partitions(batches), [['cert0', 'cert1', 'cert2'], ['cert3', 'cert4', 'cert5'],
+                                                        ['cert6']])
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+
+    def test_partition_batch_by_bytes(self):
+        certificates_metadata = self.make_batch([4, 4, 3, 10, 1])
+        batches = helpers.partition_batch(certificates_metadata, max_bytes=8)
+        # a certificate over the limit gets a batch of its own
+        self.assertEqual(self.get_partitions(batches), [['cert0', 'cert1'], ['cert2'], ['cert3'], ['cert4']])
+
+    def test_partition_batch_recorded_counts(self):
+        certificates_metadata = self.make_batch([1] * 7)
+        batches = helpers.partition_batch(certificates_metadata, max_count=3, recorded_counts=[2, 4])
+        self.assertEqual(self.get_partitions(batches), [['cert0', 'cert1'], ['cert2', 'cert3', 'cert4', 'cert5'],
+                                                        ['cert6']])
+
+    @mock.patch('cert_issuer.helpers.time.monotonic', side_effect=[0, 2, 6, 10, 11, 12])
+    def test_partition_batch_by_time(self, mock_monotonic):
+        certificates_metadata = self.make_batch([1] * 4)
+        batches = helpers.partition_batch(certificates_metadata, max_seconds=5)
+        self.assertEqual(self.get_partitions(batches), [['cert0', 'cert1'], ['cert2', 'cert3']])
+
+    def test_partition_batch_without_limits(self):
+        certificates_metadata = self.make_batch([1] * 3)
+        self.assertEqual(list(helpers.partition_batch(certificates_metadata)), [certificates_metadata])
+
+    def test_partition_is_taken_lazily(self):
+        certificates_metadata = self.make_batch([1] * 5)
+        batches = helpers.partition_batch(certificates_metadata, max_count=3)
+        first = next(batches)
+        items = first.items()
+        self.assertEqual(next(items)[0], 'cert0')
+        self.assertEqual(len(first.certificates), 1)
+        # a second pass sees the certificates taken so far, then takes the rest
+        self.assertEqual([uid for uid, _ in first.items()], ['cert0', 'cert1', 'cert2'])
+        self.assertEqual([uid for uid, _ in next(batches).items()], ['cert3', 'cert4'])
+
+    def test_worker_processes_are_not_forked_from_threads(self):
+        self.assertIn(helpers.get_process_context().get_start_method(), ['forkserver', 'spawn'])
+        with mock.patch('multiprocessing.get_all_start_methods', return_value=['spawn']):
+            self.assertEqual(helpers.get_process_context().get_start_method(), 'spawn')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import socketserver
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from cert_issuer import http_session
+from cert_issuer.connectors import BlockExplorerBroadcaster
+from cert_issuer.http_session import PooledSession
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond()
+
+    def respond(self):
+        self.server.requests += 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = json.dumps({'txid': 'txid'}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KeepAliveServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, statuses=()):
+        super().__init__(('127.0.0.1', 0), KeepAliveHandler)
+        self.statuses = list(statuses)
+        self.requests = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class StubTx(object):
+    def stream(self, f):
+        f.write(b'tx')
+
+
+class TestPooledSession(unittest.TestCase):
+    def setUp(self):
+        self.server = KeepAliveServer(statuses=[503, 503])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connections(self):
+        self.server.statuses = []
+        session = PooledSession()
+        for _ in range(0, 5):
+            self.assertEqual(session.get(self.server.url).status_code, 200)
+        self.assertEqual(session.get_metrics(), {'requests': 5, 'connections': 1, 'reused_connections': 4})
+
+    def test_retries_with_backoff(self):
+        session = PooledSession(max_retries=3, backoff_factor=0)
+        self.assertEqual(session.get(self.server.url).status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_returns_last_response_when_retries_run_out(self):
+        session = PooledSession(max_retries=1, backoff_factor=0)
+        self.assertEqual(session.get(self.server.url).status_code, 503)
+
+    def test_connectors_use_shared_session(self):
+        self.server.statuses = []
+        session = http_session.configure(pool_size=2, max_retries=0, backoff_factor=0)
+        self.assertIs(http_session.get_session(), session)
+        broadcaster = BlockExplorerBroadcaster(self.server.url)
+        self.assertEqual(broadcaster.broadcast_tx(StubTx()), 'txid')
+        self.assertEqual(broadcaster.broadcast_tx(StubTx()), 'txid')
+        self.assertEqual(session.get_metrics()['reused_connections'], 1)
+
+    def test_connectors_use_injected_session(self):
+        self.server.statuses = []
+        session = PooledSession()
+        BlockExplorerBroadcaster(self.server.url, session=session).broadcast_tx(StubTx())
+        self.assertEqual(session.get_metrics()['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
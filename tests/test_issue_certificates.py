@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from cert_schema import Chain
+
+from cert_issuer import issue_certificates
+from cert_issuer.batch_journal import BatchJournal, JOURNAL_FILE_NAME
+from cert_issuer.certificate_handler import CertificateBatchHandler, CertificateHandler
+from cert_issuer.errors import NoCertificatesFoundError, TransactionRejectedError
+from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+from cert_issuer.transaction_handler import MockTransactionHandler
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ProofWritingCertificateHandler(CertificateHandler):
+    def __init__(self):
+        self.prepared = []
+
+    def validate_certificate(self, certificate_metadata):
+        pass
+
+    def sign_certificate(self, signer, certificate_metadata):
+        pass
+
+    def get_byte_array_to_issue(self, certificate_metadata):
+        self.prepared.append(certificate_metadata.uid)
+        return certificate_metadata.uid.encode('utf-8')
+
+    def add_proof(self, certificate_metadata, merkle_proof):
+        with open(certificate_metadata.blockchain_cert_file_name, 'w') as out_file:
+            json.dump(merkle_proof, out_file)
+
+
+class CountingTransactionHandler(MockTransactionHandler):
+    def __init__(self, fail_at_broadcast=None, reject=()):
+        """
+        :param reject: signed transactions whose broadcast is rejected
+        """
+        self.broadcast = 0
+        self.fail_at_broadcast = fail_at_broadcast
+        self.reject = set(reject)
+        self.signatures = 0
+        self.events = []
+
+    def create_signed_transaction(self, op_return_bytes):
+        return 'signed'
+
+    def create_signed_transactions(self, blockchain_bytes_list):
+        self.events.append('sign {}'.format(len(blockchain_bytes_list)))
+        self.signatures += len(blockchain_bytes_list)
+        return ['signed{}'.format(number) for number in range(self.signatures - len(blockchain_bytes_list),
+                                                              self.signatures)]
+
+    def discard_signed_transactions(self, signed_hextxs):
+        self.events.append('discard {}'.format(' '.join(signed_hextxs)))
+
+    def broadcast_signed_transaction(self, signed_hextx):
+        if self.broadcast == self.fail_at_broadcast:
+            raise Interrupted()
+        if signed_hextx in self.reject:
+            self.events.append('reject {}'.format(signed_hextx))
+            raise TransactionRejectedError('rejected')
+        self.events.append('broadcast {}'.format(signed_hextx))
+        self.broadcast += 1
+        return 'txid{}'.format(self.broadcast)
+
+
+class TestIssueCertificates(unittest.TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.app_config = argparse.Namespace(
+            unsigned_certificates_dir=os.path.join(self.base_dir, 'unsigned'),
+            signed_certificates_dir=os.path.join(self.base_dir, 'signed'),
+            blockchain_certificates_dir=os.path.join(self.base_dir, 'blockchain'),
+            work_dir=os.path.join(self.base_dir, 'work'),
+            streaming=False,
+            tenants=False,
+            sign_ahead=False,
+            staging='copy',
+            batch_size=3,
+            batch_max_bytes=0,
+            batch_max_seconds=0,
+            max_retry=1,
+            safe_mode=False,
+            chain=Chain.bitcoin_testnet)
+        os.makedirs(self.app_config.unsigned_certificates_dir)
+        for num in range(0, 7):
+            with open(os.path.join(self.app_config.unsigned_certificates_dir, 'cert{}.json'.format(num)), 'w') as f:
+                f.write('{}')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def issue(self, certificate_handler, transaction_handler):
+        certificate_batch_handler = CertificateBatchHandler(secret_manager=mock.Mock(),
+                                                            certificate_handler=certificate_handler,
+                                                            merkle_tree=MerkleTreeGenerator())
+        return issue_certificates.issue(self.app_config, certificate_batch_handler, transaction_handler)
+
+    def get_txids(self):
+        txids = {}
+        for num in range(0, 7):
+            with open(os.path.join(self.app_config.blockchain_certificates_dir, 'cert{}.json'.format(num))) as f:
+                txids['cert{}'.format(num)] = json.load(f)['anchors'][0]['sourceId']
+        return txids
+
+    def test_issue_in_batches(self):
+        transaction_handler = CountingTransactionHandler()
+        tx_id = self.issue(ProofWritingCertificateHandler(), transaction_handler)
+        self.assertEqual(tx_id, 'txid3')
+        self.assertEqual(transaction_handler.broadcast, 3)
+        self.assertEqual(self.get_txids(), {'cert0': 'txid1', 'cert1': 'txid1', 'cert2': 'txid1',
+                                            'cert3': 'txid2', 'cert4': 'txid2', 'cert5': 'txid2',
+                                            'cert6': 'txid3'})
+
+        journal = BatchJournal(os.path.join(self.app_config.work_dir, JOURNAL_FILE_NAME))
+        self.assertEqual(journal.get_batch_sizes(), [3, 3, 1])
+        self.assertFalse(journal.can_resume())
+        journal.close()
+
+    def test_resume_batches(self):
+        with self.assertRaises(Interrupted):
+            self.issue(ProofWritingCertificateHandler(), CountingTransactionHandler(fail_at_broadcast=1))
+
+        # batch size changes do not apply to batches already recorded
+        self.app_config.batch_size = 2
+        certificate_handler = ProofWritingCertificateHandler()
+        transaction_handler = CountingTransactionHandler()
+        self.issue(certificate_handler, transaction_handler)
+
+        # the first batch was issued, and the second prepared, before the interruption
+        self.assertEqual(certificate_handler.prepared, ['cert6'])
+        self.assertEqual(transaction_handler.broadcast, 2)
+        self.assertEqual(self.get_txids(), {'cert0': 'txid1', 'cert1': 'txid1', 'cert2': 'txid1',
+                                            'cert3': 'txid1', 'cert4': 'txid1', 'cert5': 'txid1',
+                                            'cert6': 'txid2'})
+
+    def test_sign_ahead(self):
+        self.app_config.sign_ahead = True
+        transaction_handler = CountingTransactionHandler(fail_at_broadcast=1)
+        with self.assertRaises(Interrupted):
+            self.issue(ProofWritingCertificateHandler(), transaction_handler)
+        self.assertEqual(transaction_handler.events, ['sign 3', 'broadcast signed0'])
+
+        # the transactions signed before the interruption are broadcast, without signing again
+        certificate_handler = ProofWritingCertificateHandler()
+        transaction_handler = CountingTransactionHandler()
+        tx_id = self.issue(certificate_handler, transaction_handler)
+        self.assertEqual(tx_id, 'txid2')
+        self.assertEqual(certificate_handler.prepared, [])
+        self.assertEqual(transaction_handler.events, ['broadcast signed1', 'broadcast signed2'])
+        self.assertEqual(self.get_txids(), {'cert0': 'txid1', 'cert1': 'txid1', 'cert2': 'txid1',
+                                            'cert3': 'txid1', 'cert4': 'txid1', 'cert5': 'txid1',
+                                            'cert6': 'txid2'})
+
+    def test_sign_ahead_after_rejected_broadcast(self):
+        self.app_config.sign_ahead = True
+        self.app_config.max_retry = 2
+        transaction_handler = CountingTransactionHandler(reject=['signed0'])
+        tx_id = self.issue(ProofWritingCertificateHandler(), transaction_handler)
+        self.assertEqual(tx_id, 'txid3')
+        # the batches after the one signed again are signed again, rather than spending change that does not exist
+        self.assertEqual(transaction_handler.events, ['sign 3', 'reject signed0', 'broadcast signed',
+                                                      'discard signed1 signed2', 'sign 2', 'broadcast signed3',
+                                                      'broadcast signed4'])
+
+    def test_issue_tenants(self):
+        self.app_config.tenants = True
+        self.app_config.batch_size = 0
+        for tenant in ['tenant_a', 'tenant_b']:
+            tenant_dir = os.path.join(self.app_config.unsigned_certificates_dir, tenant)
+            os.makedirs(tenant_dir)
+            for num in range(0, 3):
+                with open(os.path.join(tenant_dir, '{}_{}.json'.format(tenant, num)), 'w') as f:
+                    f.write('{}')
+
+        transaction_handler = CountingTransactionHandler()
+        tx_id = self.issue(ProofWritingCertificateHandler(), transaction_handler)
+        self.assertEqual(tx_id, 'txid1')
+        self.assertEqual(transaction_handler.broadcast, 1)
+
+        merkle_roots = set()
+        for tenant in ['tenant_a', 'tenant_b']:
+            tenant_dir = os.path.join(self.app_config.blockchain_certificates_dir, tenant)
+            self.assertEqual(len(os.listdir(tenant_dir)), 3)
+            for file_name in os.listdir(tenant_dir):
+                with open(os.path.join(tenant_dir, file_name)) as f:
+                    merkle_proof = json.load(f)
+                self.assertEqual(merkle_proof['anchors'][0]['sourceId'], 'txid1')
+                merkle_roots.add(merkle_proof['merkleRoot'])
+        self.assertEqual(len(merkle_roots), 1)
+
+    def test_issue_tenants_skips_empty_tenant(self):
+        self.app_config.tenants = True
+        self.app_config.batch_size = 0
+        for streaming in [False, True]:
+            self.app_config.streaming = streaming
+            unsigned_dir = self.app_config.unsigned_certificates_dir
+            shutil.rmtree(unsigned_dir, ignore_errors=True)
+            os.makedirs(os.path.join(unsigned_dir, 'tenant_a'))
+            os.makedirs(os.path.join(unsigned_dir, 'tenant_b'))
+            with open(os.path.join(unsigned_dir, 'tenant_b', 'cert0.json'), 'w') as f:
+                f.write('{}')
+
+            transaction_handler = CountingTransactionHandler()
+            self.assertEqual(self.issue(ProofWritingCertificateHandler(), transaction_handler), 'txid1')
+            self.assertEqual(os.listdir(os.path.join(self.app_config.blockchain_certificates_dir, 'tenant_b')),
+                             ['cert0.json'])
+
+    def test_issue_tenants_without_certificates(self):
+        self.app_config.tenants = True
+        os.makedirs(os.path.join(self.app_config.unsigned_certificates_dir, 'tenant_a'))
+        with self.assertRaises(NoCertificatesFoundError):
+            self.issue(ProofWritingCertificateHandler(), CountingTransactionHandler())
+
+
+class TestCreateHandlers(unittest.TestCase):
+    def test_mockchain_does_not_import_other_chains(self):
+        # run in a fresh interpreter, since other tests import every chain's libraries
+        script = '\n'.join([
+            'import argparse, sys',
+            'from cert_schema import Chain',
+            'from cert_issuer.issue_certificates import create_handlers',
+            'create_handlers(argparse.Namespace(chain=Chain.mockchain, issuing_address="", usb_name="", key_file="",',
+            '                                   safe_mode=False, secret_manager="file", jsonld_cache_dir=None,',
+            '                                   jsonld_preload_dir=None, certificate_signatures=False, merkle_tree="array",',
+            '                                   jsonld_offline=False, workers=1, http_pool_size=10,',
+            '                                   http_max_retries=3, http_backoff_factor=0.5))',
+            'print(" ".join(sorted(sys.modules)))'])
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', script], cwd=root_dir,
+                                         universal_newlines=True)
+        modules = set(output.split())
+        self.assertIn('cert_issuer.issue_certificates', modules)
+        for module in ['ethereum', 'rlp', 'bitcoin.signmessage', 'bitcoin.rpc', 'pycoin.services', 'pycoin.tx.Tx']:
+            self.assertNotIn(module, modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
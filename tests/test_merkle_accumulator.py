@@ -0,0 +1,65 @@
+import hashlib
+import unittest
+
+from pycoin.serialize import b2h
+
+from cert_issuer.merkle_accumulator import MerkleAccumulator, Snapshot
+from cert_issuer.merkle_tree import MerkleTree, validate_proof
+
+
+def get_leaf(num):
+    return hashlib.sha256(str(num).encode('utf-8')).digest()
+
+
+def make_accumulator(leaf_count):
+    accumulator = MerkleAccumulator()
+    for num in range(0, leaf_count):
+        accumulator.add_leaf(get_leaf(num))
+    return accumulator
+
+
+class TestMerkleAccumulator(unittest.TestCase):
+    def test_matches_merkle_tree(self):
+        accumulator = MerkleAccumulator()
+        tree = MerkleTree()
+        for num in range(0, 70):
+            accumulator.add_leaf(get_leaf(num))
+            tree.add_leaf(get_leaf(num))
+            tree.make_tree()
+            self.assertEqual(accumulator.get_merkle_root(), tree.get_merkle_root())
+            self.assertEqual(list(accumulator.iter_proofs(encode=b2h)), list(tree.iter_proofs(encode=b2h)))
+            self.assertEqual([accumulator.get_proof(index) for index in range(0, num + 1)],
+                             [tree.get_proof(index) for index in range(0, num + 1)])
+
+    def test_snapshot_proofs_after_more_leaves(self):
+        accumulator = make_accumulator(13)
+        snapshot = accumulator.snapshot()
+        self.assertEqual(snapshot, Snapshot(13, make_accumulator(13).get_merkle_root()))
+        for num in range(13, 40):
+            accumulator.add_leaf(get_leaf(num))
+
+        self.assertEqual(accumulator.get_merkle_root(snapshot.leaf_count), snapshot.root)
+        proofs = list(accumulator.iter_proofs(snapshot.leaf_count))
+        self.assertEqual(len(proofs), 13)
+        for index, proof in enumerate(proofs):
+            self.assertEqual(accumulator.get_proof(index, snapshot.leaf_count), proof)
+            self.assertTrue(validate_proof(proof, get_leaf(index), snapshot.root))
+        self.assertIsNone(accumulator.get_proof(13, snapshot.leaf_count))
+        self.assertTrue(validate_proof(accumulator.get_proof(13), get_leaf(13), accumulator.get_merkle_root()))
+
+    def test_empty(self):
+        accumulator = MerkleAccumulator()
+        self.assertIsNone(accumulator.get_merkle_root())
+        self.assertEqual(list(accumulator.iter_proofs()), [])
+        self.assertIsNone(accumulator.get_proof(0))
+
+    def test_rejects(self):
+        accumulator = make_accumulator(3)
+        with self.assertRaises(ValueError):
+            accumulator.add_leaf(b'not a digest')
+        with self.assertRaises(ValueError):
+            accumulator.get_merkle_root(4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import hashlib
+import unittest
+
+from pycoin.serialize import b2h
+
+from cert_issuer.merkle_tree import MerkleTree, validate_proof
+
+
+def get_leaf(num):
+    return hashlib.sha256(str(num).encode('utf-8')).digest()
+
+
+def make_tree(leaf_count):
+    tree = MerkleTree()
+    for num in range(0, leaf_count):
+        tree.add_leaf(get_leaf(num))
+    tree.make_tree()
+    return tree
+
+
+class TestMerkleTree(unittest.TestCase):
+    def test_single_leaf(self):
+        tree = make_tree(1)
+        self.assertEqual(tree.get_merkle_root(), get_leaf(0))
+        self.assertEqual(tree.get_proof(0), [])
+
+    def test_odd_node_is_promoted(self):
+        tree = make_tree(5)
+        self.assertEqual(b2h(tree.get_merkle_root()),
+                         'ea030edba0761730b75f565d17f9c40ee2b10633c3f4a696197832a6e67edf47')
+        proof = tree.get_proof(4)
+        self.assertEqual(len(proof), 1)
+        self.assertEqual(proof[0][0], 'left')
+        self.assertEqual(b2h(proof[0][1]), 'c478fead0c89b79540638f844c8819d9a4281763af9272c7f3968776b6052345')
+
+    def test_proofs_validate(self):
+        for leaf_count in range(1, 40):
+            tree = make_tree(leaf_count)
+            root = tree.get_merkle_root()
+            for index in range(0, leaf_count):
+                self.assertTrue(validate_proof(tree.get_proof(index), tree.get_leaf(index), root))
+
+    def test_iter_proofs_matches_get_proof(self):
+        for leaf_count in range(1, 40):
+            tree = make_tree(leaf_count)
+            proofs = list(tree.iter_proofs())
+            self.assertEqual(len(proofs), leaf_count)
+            for index, proof in enumerate(proofs):
+                self.assertEqual(proof, tree.get_proof(index))
+
+    def test_not_ready(self):
+        tree = MerkleTree()
+        tree.add_leaf(get_leaf(0))
+        self.assertIsNone(tree.get_merkle_root())
+        self.assertIsNone(tree.get_proof(0))
+
+    def test_add_leaf_after_make_tree(self):
+        tree = make_tree(4)
+        tree.add_leaf(get_leaf(4))
+        self.assertIsNone(tree.get_merkle_root())
+        tree.make_tree()
+        self.assertEqual(tree.get_merkle_root(), make_tree(5).get_merkle_root())
+
+    def test_rejects_non_digest(self):
+        tree = MerkleTree()
+        with self.assertRaises(ValueError):
+            tree.add_leaf(b'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
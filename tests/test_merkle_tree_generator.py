@@ -1,9 +1,10 @@
 import unittest
 
-from pycoin.serialize import b2h
+from pycoin.serialize import b2h, h2b
 
 from cert_schema import Chain
-from cert_issuer.merkle_tree_generator import MerkleTreeGenerator
+from cert_issuer.merkle_tree import LEFT, validate_proof
+from cert_issuer.merkle_tree_generator import AccumulatorTreeGenerator, MerkleTreeGenerator, SuperRootGenerator
 
 
 def get_test_data_generator():
@@ -62,6 +63,69 @@ class TestMerkleTreeGenerator(unittest.TestCase):
         self.assertEqual(p1, p1_expected)
         self.assertEqual(p3, p3_expected)
 
+    def test_super_root(self):
+        tree_generators = []
+        for size in [3, 1, 5]:
+            merkle_tree_generator = MerkleTreeGenerator()
+            merkle_tree_generator.populate(str(num).encode('utf-8') + b'-' + str(size).encode('utf-8')
+                                           for num in range(0, size))
+            tree_generators.append(merkle_tree_generator)
+        super_root = SuperRootGenerator(tree_generators).get_blockchain_data()
+
+        for merkle_tree_generator in tree_generators:
+            for merkle_proof in merkle_tree_generator.get_proof_generator('txid', Chain.bitcoin_mainnet):
+                self.assertEqual(merkle_proof['merkleRoot'], b2h(super_root))
+                proof = [(position, h2b(sibling)) for entry in merkle_proof['proof']
+                         for position, sibling in entry.items()]
+                self.assertTrue(validate_proof(proof, h2b(merkle_proof['targetHash']), super_root))
+
+        # the last tree's root is promoted once, then paired with the parent of the other two trees' roots
+        last_proof = next(tree_generators[2].get_proof_generator('txid', Chain.bitcoin_mainnet))['proof']
+        self.assertEqual(list(last_proof[-1].keys()), [LEFT])
+
+    def test_super_root_of_one_tree(self):
+        merkle_tree_generator = MerkleTreeGenerator()
+        merkle_tree_generator.populate(get_test_data_generator())
+        super_root = SuperRootGenerator([merkle_tree_generator]).get_blockchain_data()
+        self.assertEqual(b2h(super_root), '0932f1d2e98219f7d7452801e2b64ebd9e5c005539db12d9b1ddabe7834d9044')
+        proof = next(merkle_tree_generator.get_proof_generator('txid', Chain.bitcoin_mainnet))['proof']
+        self.assertEqual(len(proof), 2)
+
+
+class TestAccumulatorTreeGenerator(unittest.TestCase):
+    def test_same_proofs_as_merkle_tree_generator(self):
+        proofs = []
+        for merkle_tree_generator in [MerkleTreeGenerator(), AccumulatorTreeGenerator()]:
+            merkle_tree_generator.populate(str(num).encode('utf-8') for num in range(0, 11))
+            merkle_tree_generator.get_blockchain_data()
+            proofs.append(list(merkle_tree_generator.get_proof_generator('txid', Chain.bitcoin_testnet)))
+        self.assertEqual(proofs[0], proofs[1])
+
+    def test_snapshots(self):
+        merkle_tree_generator = AccumulatorTreeGenerator()
+        merkle_tree_generator.populate(get_test_data_generator())
+        self.assertEqual(b2h(merkle_tree_generator.get_blockchain_data()),
+                         '0932f1d2e98219f7d7452801e2b64ebd9e5c005539db12d9b1ddabe7834d9044')
+        first_snapshot = merkle_tree_generator.snapshot
+        merkle_tree_generator.populate([b'4', b'5'])
+        second_root = merkle_tree_generator.get_blockchain_data()
+
+        first_proofs = list(merkle_tree_generator.get_proof_generator('tx1', Chain.bitcoin_testnet,
+                                                                      snapshot=first_snapshot))
+        self.assertEqual(len(first_proofs), 3)
+        self.assertEqual(merkle_tree_generator.get_proof(2, 'tx1', Chain.bitcoin_testnet, snapshot=first_snapshot),
+                         first_proofs[2])
+        self.assertIsNone(merkle_tree_generator.get_proof(3, 'tx1', Chain.bitcoin_testnet, snapshot=first_snapshot))
+
+        second_proofs = list(merkle_tree_generator.get_proof_generator('tx2', Chain.bitcoin_testnet))
+        self.assertEqual(len(second_proofs), 5)
+        for merkle_proof in second_proofs:
+            self.assertEqual(merkle_proof['merkleRoot'], b2h(second_root))
+            proof = [(position, h2b(sibling)) for entry in merkle_proof['proof']
+                     for position, sibling in entry.items()]
+            self.assertTrue(validate_proof(proof, h2b(merkle_proof['targetHash']), second_root))
+        self.assertEqual(merkle_tree_generator.get_proof(4, 'tx2', Chain.bitcoin_testnet), second_proofs[4])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,245 @@
+import json
+import socketserver
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import mock
+import requests
+import rlp
+from cert_schema import Chain
+from pycoin.serialize import b2h
+
+from cert_issuer import tx_utils
+from cert_issuer.connectors import AccountState, EthereumServiceProviderConnector, EtherscanBroadcaster
+from cert_issuer.errors import TransactionRejectedError
+from cert_issuer.nonce_manager import NonceManager
+from cert_issuer.provider_health import ProviderHealthRegistry
+from cert_issuer.transaction_handler import EthereumTransactionHandler
+from cert_issuer.tx_utils import EthereumTransactionCostConstants
+from tests.fakes import FakeClock
+
+ADDRESS = '0x3b0f13c8d8b8d7fb8b9a1e1c0b7d9a2c6f4e5d21'
+GAS_PRICE = 20000000000
+GAS_LIMIT = 25000
+MAX_COST = GAS_PRICE * GAS_LIMIT
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInConnector(object):
+    def __init__(self, balance, mined_nonce=0, pending_nonce=None):
+        self.balance = balance
+        self.mined_nonce = mined_nonce
+        self.pending_nonce = mined_nonce if pending_nonce is None else pending_nonce
+        self.calls = 0
+
+    def get_account_state(self, address):
+        self.calls += 1
+        return AccountState(self.balance, self.mined_nonce, self.pending_nonce, GAS_PRICE)
+
+
+class TestNonceManager(unittest.TestCase):
+    def setUp(self):
+        self.connector = StandInConnector(10 * MAX_COST, mined_nonce=5, pending_nonce=7)
+        self.clock = FakeClock()
+        self.nonce_manager = NonceManager(self.connector, ADDRESS, max_age_seconds=60, clock=self.clock)
+
+    def test_reserves_after_pending_transactions(self):
+        self.assertEqual([self.nonce_manager.reserve() for _ in range(0, 3)], [7, 8, 9])
+        self.assertEqual(self.connector.calls, 1)
+
+    def test_released_nonces_are_reused_first(self):
+        nonces = [self.nonce_manager.reserve() for _ in range(0, 3)]
+        self.nonce_manager.release(nonces[0])
+        self.assertEqual(self.nonce_manager.reserve(), 7)
+        # released at the end of the sequence, so handed out as the next new nonce
+        self.nonce_manager.release(nonces[2])
+        self.assertEqual(self.nonce_manager.next_nonce, 9)
+        self.assertEqual(self.nonce_manager.reserve(), 9)
+
+    def test_release_after_invalidate(self):
+        nonces = [self.nonce_manager.reserve() for _ in range(0, 2)]
+        self.nonce_manager.record_sent(nonces[0], MAX_COST)
+        # another transaction's broadcast was rejected, then this one could not be signed
+        self.nonce_manager.invalidate()
+        self.nonce_manager.release(nonces[1])
+        self.assertEqual(self.nonce_manager.reserve(), 8)
+
+    def test_record_sent_debits_balance(self):
+        self.assertEqual(self.nonce_manager.get_balance(), 10 * MAX_COST)
+        nonce = self.nonce_manager.reserve()
+        self.nonce_manager.record_sent(nonce, MAX_COST)
+        self.nonce_manager.record_sent(nonce, MAX_COST)
+        self.assertEqual(self.nonce_manager.get_balance(), 9 * MAX_COST)
+        self.assertEqual(self.nonce_manager.get_pending_count(), 1)
+
+    def test_reconcile_forgets_mined_and_reuses_dropped_nonces(self):
+        for _ in range(0, 3):
+            self.nonce_manager.record_sent(self.nonce_manager.reserve(), MAX_COST)
+        # 7 was mined and paid for, 8 is still pending and 9 was dropped
+        self.connector.mined_nonce, self.connector.pending_nonce = 8, 9
+        self.connector.balance -= MAX_COST
+        self.clock.now = 60
+        self.assertEqual(self.nonce_manager.get_balance(), 8 * MAX_COST)
+        self.assertEqual(sorted(self.nonce_manager.pending), [8])
+        self.assertEqual(self.nonce_manager.reserve(), 9)
+
+    def test_reconcile_keeps_gap_below_reserved_nonce(self):
+        nonces = [self.nonce_manager.reserve() for _ in range(0, 3)]
+        self.nonce_manager.record_sent(nonces[0], MAX_COST)
+        self.nonce_manager.record_sent(nonces[2], MAX_COST)
+        # 9 was dropped, and 8 is still being signed
+        self.connector.pending_nonce = 8
+        self.clock.now = 1
+        self.nonce_manager.invalidate()
+        self.assertEqual(self.nonce_manager.reserve(), 9)
+        self.assertEqual(self.nonce_manager.reserve(), 10)
+
+    def test_record_sent_of_transaction_signed_before_restart(self):
+        self.assertEqual(self.nonce_manager.reserve(), 7)
+        self.nonce_manager.record_sent(9, MAX_COST)
+        self.assertEqual([self.nonce_manager.reserve() for _ in range(0, 2)], [8, 10])
+
+
+class FakeEtherscan(object):
+    """
+    Serves the Etherscan API calls the Ethereum connector makes, for one address. Like a node, it accepts transactions
+    with nonces above the pending ones, and counts them as pending once the nonces below them are filled.
+    """
+
+    def __init__(self, balance):
+        self.balance = balance
+        self.mined_nonce = 0
+        # nonce -> maximum cost, for the transactions not yet mined
+        self.mempool = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond(parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                params = parse_qs(urlparse(self.path).query)
+                params.update(parse_qs(body))
+                self.respond(params)
+
+            def respond(self, params):
+                response = fake.handle(dict((key, values[0]) for key, values in params.items()))
+                body = json.dumps(response).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/api'.format(self.server.server_address[1])
+
+    def get_pending_nonce(self):
+        nonce = self.mined_nonce
+        while nonce in self.mempool:
+            nonce += 1
+        return nonce
+
+    def handle(self, params):
+        with self.lock:
+            self.requests.append(params['action'])
+            if params['action'] == 'balance':
+                return {'status': '1', 'message': 'OK', 'result': str(self.balance)}
+            if params['action'] == 'eth_getTransactionCount':
+                nonce = self.get_pending_nonce() if params['tag'] == 'pending' else self.mined_nonce
+                return {'jsonrpc': '2.0', 'id': 1, 'result': hex(nonce)}
+            if params['action'] == 'eth_gasPrice':
+                return {'jsonrpc': '2.0', 'id': 1, 'result': hex(GAS_PRICE)}
+            if params['action'] == 'eth_sendRawTransaction':
+                return self.send_raw_transaction(params['hex'])
+        raise ValueError(params)
+
+    def send_raw_transaction(self, raw_tx):
+        nonce = tx_utils.get_eth_transaction_nonce(raw_tx)
+        if nonce < self.mined_nonce or nonce in self.mempool:
+            return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': 'nonce too low'}}
+        self.mempool[nonce] = MAX_COST
+        return {'jsonrpc': '2.0', 'id': 1, 'result': '0x{:064x}'.format(nonce)}
+
+    def mine(self):
+        with self.lock:
+            while self.mined_nonce in self.mempool:
+                self.balance -= self.mempool.pop(self.mined_nonce)
+                self.mined_nonce += 1
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestEthereumTransactionHandlerNonces(unittest.TestCase):
+    def setUp(self):
+        self.etherscan = FakeEtherscan(10 * MAX_COST)
+        self.addCleanup(self.etherscan.stop)
+        session = requests.Session()
+        session.trust_env = False
+        self.addCleanup(session.close)
+        patcher = mock.patch('cert_issuer.connectors.get_providers_for_chain',
+                             return_value=[EtherscanBroadcaster(self.etherscan.url, session=session)])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        connector = EthereumServiceProviderConnector(Chain.ethereum_ropsten, None, health=ProviderHealthRegistry())
+        secret_manager = mock.Mock()
+        # the ethereum library's signing is not needed to check the nonces; the fake accepts unsigned transactions
+        secret_manager.sign_transaction.side_effect = lambda tx: b2h(rlp.encode(tx))
+        self.transaction_handler = EthereumTransactionHandler(connector,
+                                                              EthereumTransactionCostConstants(GAS_PRICE, GAS_LIMIT),
+                                                              secret_manager, ADDRESS)
+
+    def test_concurrent_transactions_get_distinct_nonces(self):
+        self.transaction_handler.ensure_balance()
+        txids = []
+        threads = [threading.Thread(target=lambda number=number: txids.append(
+            self.transaction_handler.issue_transaction(bytes([number]) * 32))) for number in range(0, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.transaction_handler.ensure_balance()
+
+        self.assertEqual(sorted(txids), ['0x{:064x}'.format(nonce) for nonce in range(0, 5)])
+        self.assertEqual(self.etherscan.get_pending_nonce(), 5)
+        self.assertEqual(self.transaction_handler.nonce_manager.get_balance(), 5 * MAX_COST)
+        # one lookup of the balance and nonces for all the transactions
+        self.assertEqual(self.etherscan.requests.count('balance'), 1)
+        self.assertEqual(self.etherscan.requests.count('eth_getTransactionCount'), 2)
+
+    def test_rejected_nonce_is_looked_up_again(self):
+        self.transaction_handler.ensure_balance()
+        # another wallet with the same key sends a transaction first
+        self.etherscan.send_raw_transaction(b2h(rlp.encode(tx_utils.create_Ethereum_trx(
+            ADDRESS, 0, ADDRESS, b'\x00' * 32, GAS_PRICE, GAS_LIMIT))))
+        with self.assertRaises(TransactionRejectedError):
+            self.transaction_handler.issue_transaction(b'\x01' * 32)
+        self.assertEqual(self.transaction_handler.issue_transaction(b'\x01' * 32), '0x{:064x}'.format(1))
+
+    def test_insufficient_balance_is_fetched_again(self):
+        self.etherscan.balance = MAX_COST
+        self.transaction_handler.ensure_balance()
+        self.transaction_handler.issue_transaction(b'\x01' * 32)
+        self.etherscan.mine()
+        self.etherscan.balance += MAX_COST
+        self.transaction_handler.ensure_balance()
+        self.assertEqual(self.transaction_handler.balance, MAX_COST)
+
+
+if __name__ == '__main__':
+    unittest.main()
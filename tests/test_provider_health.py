@@ -0,0 +1,133 @@
+import time
+import unittest
+
+from mock import patch
+
+from cert_schema import Chain
+
+from cert_issuer import provider_health
+from cert_issuer.connectors import BitcoinServiceProviderConnector, EthereumServiceProviderConnector
+from cert_issuer.provider_health import ProviderHealthRegistry
+from tests.fakes import FakeClock
+
+
+class StandInProvider(object):
+    """
+    Stands in for an API provider that answers after latency seconds, or fails
+    """
+
+    def __init__(self, name, latency=0, fail=False):
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    def spendables_for_address(self, address):
+        return self.answer()
+
+    def get_balance(self, address, api_token):
+        return self.answer()
+
+    def answer(self):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise Exception('{} is down'.format(self.name))
+        return self.name
+
+
+class TestProviderHealthRegistry(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.health = ProviderHealthRegistry(clock=self.clock)
+
+    def call(self, provider, latency=0, succeed=True):
+        def method():
+            self.clock.now += latency
+            if not succeed:
+                raise Exception('failed')
+
+        try:
+            self.health.call(provider, method)
+        except Exception:
+            pass
+
+    def test_ranks_untried_then_fastest(self):
+        slow, fast, untried = StandInProvider('slow'), StandInProvider('fast'), StandInProvider('untried')
+        self.call(slow, latency=2)
+        self.call(fast, latency=0.1)
+        self.assertEqual(self.health.rank([slow, fast, untried]), [untried, fast, slow])
+
+    def test_errors_worsen_score(self):
+        flaky, steady = StandInProvider('flaky'), StandInProvider('steady')
+        self.call(flaky, latency=0.1)
+        self.call(flaky, latency=0.1, succeed=False)
+        self.call(steady, latency=0.3)
+        self.assertEqual(self.health.rank([flaky, steady]), [steady, flaky])
+
+    def test_circuit_breaker(self):
+        failing, other = StandInProvider('failing'), StandInProvider('other')
+        self.call(other, latency=5)
+        for _ in range(0, provider_health.FAILURE_THRESHOLD):
+            self.call(failing, latency=0.1, succeed=False)
+        self.assertEqual(self.health.rank([failing, other]), [other, failing])
+        self.assertTrue(self.health.get_health(failing).get_stats(self.clock.now)['circuit_open'])
+
+        # half-open: tried again after OPEN_SECONDS, and a failed trial opens the circuit again
+        self.clock.now += provider_health.OPEN_SECONDS
+        self.assertEqual(self.health.rank([failing, other])[0], failing)
+        self.call(failing, succeed=False)
+        self.assertEqual(self.health.rank([failing, other]), [other, failing])
+
+        # a successful trial closes it
+        self.clock.now += provider_health.OPEN_SECONDS
+        self.call(failing, latency=0.1)
+        self.assertFalse(self.health.get_health(failing).get_stats(self.clock.now)['circuit_open'])
+
+    def test_stats(self):
+        provider = StandInProvider('provider')
+        self.call(provider, latency=1)
+        self.call(provider, latency=2, succeed=False)
+        stats = self.health.get_stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['provider'], 'StandInProvider')
+        self.assertEqual(stats[0]['calls'], 2)
+        self.assertEqual(stats[0]['failures'], 1)
+        self.assertAlmostEqual(stats[0]['latency'], 1.3)
+        self.assertAlmostEqual(stats[0]['error_rate'], 0.3)
+        self.assertFalse(stats[0]['circuit_open'])
+
+
+class TestConnectorRouting(unittest.TestCase):
+    def test_bitcoin_reads_go_to_fastest_healthy_provider(self):
+        dead = StandInProvider('dead', latency=0.05, fail=True)
+        slow = StandInProvider('slow', latency=0.05)
+        fast = StandInProvider('fast')
+        connector = BitcoinServiceProviderConnector(Chain.bitcoin_testnet, health=ProviderHealthRegistry())
+        with patch('cert_issuer.connectors.get_providers_for_chain', return_value=[dead, slow, fast]):
+            results = [connector.spendables_for_address('address') for _ in range(0, 10)]
+        self.assertEqual(results, ['slow', 'fast'] + ['fast'] * 8)
+        # dead is tried once, fails, and is ranked last from then on
+        self.assertEqual(dead.calls, 1)
+        self.assertEqual(slow.calls, 1)
+
+    def test_ethereum_reads_skip_open_circuits(self):
+        dead = StandInProvider('dead', fail=True)
+        alive = StandInProvider('alive', latency=0.01)
+        health = ProviderHealthRegistry()
+        connector = EthereumServiceProviderConnector(Chain.ethereum_ropsten, None, health=health)
+        with patch('cert_issuer.connectors.get_providers_for_chain', return_value=[dead, alive]):
+            dead.fail = False
+            self.assertEqual(connector.get_balance('address'), 'dead')
+            dead.fail = True
+            for _ in range(0, provider_health.FAILURE_THRESHOLD):
+                # fails on dead, then falls back to alive
+                health.get_health(alive).latency = 1
+                self.assertEqual(connector.get_balance('address'), 'alive')
+            calls = dead.calls
+            self.assertEqual(connector.get_balance('address'), 'alive')
+        self.assertEqual(dead.calls, calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import argparse
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from bitcoin import SelectParams
+from cert_schema import Chain
+from pycoin import ecdsa
+from pycoin.key import Key
+from pycoin.serialize import b2h
+from pycoin.tx.Spendable import Spendable
+
+from cert_issuer import tx_utils
+from cert_issuer.errors import SecretManagerError, UnableToSignTxError
+from cert_issuer.secret_managers import ExternalKeySecretManager, InMemorySecretManager, Pkcs11SecretManager, \
+    SigningAgent, SigningAgentSecretManager
+from cert_issuer.signer import BitcoinSigner, EthereumSigner, FinalizableSigner, initialize_signer
+
+SECRET_EXPONENT = 0x1234567
+
+
+class SoftwareKey(ExternalKeySecretManager):
+    """
+    Signs digests with a secret exponent, as a token would
+    """
+
+    def __init__(self, signer, secret_exponent):
+        super().__init__(signer)
+        self.secret_exponent = secret_exponent
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def sign_digest(self, digest):
+        return ecdsa.sign(ecdsa.generator_secp256k1, self.secret_exponent, int.from_bytes(digest, 'big'))
+
+    def get_public_pair(self):
+        return ecdsa.public_pair_for_secret_exponent(ecdsa.generator_secp256k1, self.secret_exponent)
+
+
+def create_bitcoin_transaction(key, compressed=True):
+    address = key.address(use_uncompressed=not compressed)
+    script = bytes(tx_utils.create_transaction_output(address, 0).scriptPubKey)
+    inputs = [Spendable(100000, script, bytes([number]) * 32, 0) for number in range(1, 3)]
+    tx = tx_utils.create_trx(b'\x01' * 32, 10000, address, [], inputs)
+    return tx_utils.prepare_tx_for_signing(b2h(tx.serialize()), inputs)
+
+
+class TestExternalKey(unittest.TestCase):
+    def setUp(self):
+        SelectParams('testnet')
+        self.key = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN')
+        self.signer = BitcoinSigner(Chain.bitcoin_testnet)
+
+    def test_bitcoin_signature_matches_signing_with_wif(self):
+        for compressed in [True, False]:
+            wif = self.key.wif(use_uncompressed=not compressed)
+            expected = self.signer.sign_transaction(wif, create_bitcoin_transaction(self.key, compressed))
+            signed = SoftwareKey(self.signer, SECRET_EXPONENT).sign_transaction(
+                create_bitcoin_transaction(self.key, compressed))
+            self.assertEqual(signed.bad_signature_count(), 0)
+            self.assertEqual(signed.as_hex(), expected.as_hex())
+
+    def test_other_key_does_not_sign(self):
+        with self.assertRaises(UnableToSignTxError):
+            SoftwareKey(self.signer, SECRET_EXPONENT + 1).sign_transaction(create_bitcoin_transaction(self.key))
+
+    def test_ethereum_signature_recovers_sender(self):
+        from ethereum import transactions, utils
+        import rlp
+
+        for chain, network_id in [(Chain.ethereum_mainnet, 1), (Chain.ethereum_ropsten, 3)]:
+            tx = transactions.Transaction(7, 20000000000, 25000, b'\xde\xad' * 10, 0, b'\x01' * 32)
+            signed_hex = SoftwareKey(EthereumSigner(chain), SECRET_EXPONENT).sign_transaction(tx)
+            signed = rlp.decode(utils.decode_hex(signed_hex), transactions.Transaction)
+            self.assertEqual(signed.network_id, network_id)
+            self.assertEqual(signed.sender, utils.privtoaddr(SECRET_EXPONENT))
+            self.assertLessEqual(signed.s * 2, transactions.secpk1n)
+
+
+class TestSigningAgent(unittest.TestCase):
+    def setUp(self):
+        SelectParams('testnet')
+        self.key = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN')
+        self.signer = BitcoinSigner(Chain.bitcoin_testnet)
+        self.base_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.base_dir, 'agent.sock')
+        self.agent = SigningAgent(InMemorySecretManager(self.signer, self.key.wif()), self.socket_path)
+        self.agent.start()
+
+    def tearDown(self):
+        self.agent.stop()
+        shutil.rmtree(self.base_dir)
+
+    def test_signs_over_socket(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+        expected = self.signer.sign_transaction(self.key.wif(), create_bitcoin_transaction(self.key))
+        secret_manager = SigningAgentSecretManager(self.signer, self.socket_path)
+        secret_manager.start()
+        try:
+            signed = list(secret_manager.sign_transactions([create_bitcoin_transaction(self.key)] * 2))
+        finally:
+            secret_manager.stop()
+        self.assertEqual([tx.as_hex() for tx in signed], [expected.as_hex()] * 2)
+        self.assertEqual(self.agent.signature_count, 2)
+
+    def test_signs_certificates_over_socket(self):
+        from cert_issuer.certificate_signer import CertificateSigner, verify_jws
+
+        secret_manager = SigningAgentSecretManager(self.signer, self.socket_path)
+        with FinalizableSigner(secret_manager) as started:
+            signatures = CertificateSigner(workers=2).sign_batch(started.get_signing_key(), [b'\x01' * 32])
+        verify_jws(signatures.get_jws(0), '01' * 32, self.key.address())
+        self.assertEqual(self.agent.signature_count, 1)
+
+    def test_agent_errors(self):
+        secret_manager = SigningAgentSecretManager(BitcoinSigner(Chain.bitcoin_testnet), self.socket_path)
+        with self.assertRaises(SecretManagerError):
+            secret_manager.call('sign_transaction', '00')
+        secret_manager.start()
+        try:
+            with self.assertRaises(UnableToSignTxError):
+                secret_manager.call('sign_transaction', 'not a transaction')
+        finally:
+            secret_manager.stop()
+
+        secret_manager = SigningAgentSecretManager(self.signer, os.path.join(self.base_dir, 'missing.sock'))
+        with self.assertRaises(SecretManagerError):
+            secret_manager.start()
+
+
+class TestInitializeSigner(unittest.TestCase):
+    def test_memory_reads_key_once(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        key = Key(secret_exponent=SECRET_EXPONENT, netcode='XTN')
+        with open(os.path.join(base_dir, 'pk_issuer.txt'), 'w') as f:
+            f.write(key.wif() + '\n')
+        app_config = argparse.Namespace(chain=Chain.bitcoin_testnet, usb_name=base_dir, key_file='pk_issuer.txt',
+                                        safe_mode=True, issuing_address=key.address(), secret_manager='memory')
+        secret_manager = initialize_signer(app_config)
+        self.assertIsInstance(secret_manager, InMemorySecretManager)
+
+        os.remove(os.path.join(base_dir, 'pk_issuer.txt'))
+        SelectParams('testnet')
+        with FinalizableSigner(secret_manager) as signer:
+            self.assertEqual(signer.sign_transaction(create_bitcoin_transaction(key)).bad_signature_count(), 0)
+
+
+@unittest.skipUnless(os.environ.get('PKCS11_MODULE'), 'PKCS11_MODULE is not set, e.g. to SoftHSM\'s libsofthsm2.so')
+class TestPkcs11(unittest.TestCase):
+    """
+    Runs against a token, e.g. set up with softhsm2-util --init-token --free --label cert-issuer --pin 1234 --so-pin
+    1234, and PKCS11_MODULE, PKCS11_TOKEN_LABEL and PKCS11_PIN set accordingly
+    """
+
+    def test_signs_with_key_on_token(self):
+        import pkcs11
+        from pkcs11 import Attribute, KeyType
+        from pkcs11.util.ec import encode_named_curve_parameters
+
+        token_label = os.environ.get('PKCS11_TOKEN_LABEL', 'cert-issuer')
+        pin = os.environ.get('PKCS11_PIN', '1234')
+        token = pkcs11.lib(os.environ['PKCS11_MODULE']).get_token(token_label=token_label)
+        with token.open(rw=True, user_pin=pin) as session:
+            parameters = session.create_domain_parameters(
+                KeyType.EC, {Attribute.EC_PARAMS: encode_named_curve_parameters('secp256k1')}, local=True)
+            parameters.generate_keypair(store=True, label='test-issuing-key')
+
+        SelectParams('testnet')
+        secret_manager = Pkcs11SecretManager(BitcoinSigner(Chain.bitcoin_testnet), os.environ['PKCS11_MODULE'],
+                                             token_label, 'test-issuing-key', pin=pin)
+        secret_manager.start()
+        try:
+            key = Key(public_pair=secret_manager.get_public_pair(), netcode='XTN')
+            signed = secret_manager.sign_transaction(create_bitcoin_transaction(key))
+        finally:
+            secret_manager.stop()
+        self.assertEqual(signed.bad_signature_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
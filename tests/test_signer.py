@@ -1,7 +1,8 @@
 import unittest
 from unittest import mock
 
-from cert_issuer.signer import FinalizableSigner
+from cert_issuer.signer import FinalizableSigner, SigningSession, get_signing_session
+from tests.fakes import FakeClock
 
 
 class TestSigner(unittest.TestCase):
@@ -14,5 +15,67 @@ class TestSigner(unittest.TestCase):
         mock_sm.stop.assert_called()
 
 
+class TestSigningSession(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.secret_manager = mock.Mock()
+        # each start and stop waits 10 seconds, as for the air gap check
+        self.secret_manager.start.side_effect = self.wait
+        self.secret_manager.stop.side_effect = self.wait
+
+    def wait(self):
+        self.clock.now += 10
+
+    def test_key_is_loaded_once_per_session(self):
+        with SigningSession(self.secret_manager, clock=self.clock) as session:
+            self.secret_manager.start.assert_not_called()
+            for _ in range(0, 3):
+                with FinalizableSigner(self.secret_manager):
+                    pass
+            self.assertEqual(self.secret_manager.start.call_count, 1)
+            self.secret_manager.stop.assert_not_called()
+        self.assertEqual(self.secret_manager.stop.call_count, 1)
+        self.assertEqual(session.get_stats(), {'phases': 3, 'windows': 1, 'wait_seconds': 20})
+        self.assertIsNone(get_signing_session(self.secret_manager))
+
+    def test_nothing_signed_never_loads_key(self):
+        with SigningSession(self.secret_manager, clock=self.clock):
+            pass
+        self.secret_manager.start.assert_not_called()
+        self.secret_manager.stop.assert_not_called()
+
+    def test_window_closes_between_signatures_unless_kept_open(self):
+        with SigningSession(self.secret_manager, keep_open=False, clock=self.clock) as session:
+            for _ in range(0, 2):
+                with FinalizableSigner(self.secret_manager):
+                    with FinalizableSigner(self.secret_manager):
+                        pass
+                    self.secret_manager.stop.assert_has_calls([mock.call()] * (session.windows - 1))
+        self.assertEqual(session.get_stats(), {'phases': 4, 'windows': 2, 'wait_seconds': 40})
+
+    def test_nested_session_joins_outer(self):
+        with SigningSession(self.secret_manager, clock=self.clock) as outer:
+            with SigningSession(self.secret_manager, clock=self.clock) as inner:
+                self.assertIs(inner, outer)
+                with FinalizableSigner(self.secret_manager):
+                    pass
+            self.secret_manager.stop.assert_not_called()
+            with FinalizableSigner(self.secret_manager):
+                pass
+        self.assertEqual(self.secret_manager.start.call_count, 1)
+        self.assertEqual(self.secret_manager.stop.call_count, 1)
+
+    def test_failed_start_is_retried(self):
+        self.secret_manager.start.side_effect = [Exception('network is on'), None]
+        with SigningSession(self.secret_manager, clock=self.clock) as session:
+            with self.assertRaises(Exception):
+                with FinalizableSigner(self.secret_manager):
+                    pass
+            with FinalizableSigner(self.secret_manager):
+                pass
+        self.assertEqual(session.windows, 1)
+        self.assertEqual(self.secret_manager.stop.call_count, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
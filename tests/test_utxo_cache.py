@@ -0,0 +1,228 @@
+import unittest
+
+import mock
+from bitcoin import SelectParams
+from cert_schema import Chain
+from pycoin.key import Key
+from pycoin.tx.Spendable import Spendable
+from pycoin.tx.Tx import Tx
+from pycoin.tx.TxIn import TxIn
+from pycoin.tx.TxOut import TxOut
+
+from cert_issuer import tx_utils, utxo_cache
+from cert_issuer.errors import BroadcastError, InsufficientFundsError, TransactionRejectedError
+from cert_issuer.signer import BitcoinSigner, SecretManager
+from cert_issuer.transaction_handler import BitcoinTransactionHandler
+from cert_issuer.tx_utils import BitcoinTransactionCostConstants
+from cert_issuer.utxo_cache import UtxoCache
+from tests.fakes import FakeClock
+
+SCRIPT = b'\x76\xa9\x14' + b'\x01' * 20 + b'\x88\xac'
+OTHER_SCRIPT = b'\x76\xa9\x14' + b'\x02' * 20 + b'\x88\xac'
+
+
+class CountingConnector(object):
+    def __init__(self, spendables):
+        self.spendables = spendables
+        self.calls = 0
+
+    def get_unspent_outputs(self, address):
+        self.calls += 1
+        return list(self.spendables) or None
+
+
+def spendable(coin_value, tx_hash_byte, index=0):
+    return Spendable(coin_value, SCRIPT, bytes([tx_hash_byte]) * 32, index)
+
+
+def spend(spendables, change):
+    txs_in = [TxIn(s.tx_hash, s.tx_out_index) for s in spendables]
+    return Tx(1, txs_in, [TxOut(0, b'\x6a\x20' + b'\x00' * 32), TxOut(change, SCRIPT)])
+
+
+class TestUtxoCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.funding = [spendable(10000, 1), spendable(20000, 2)]
+        self.connector = CountingConnector(self.funding)
+        self.cache = UtxoCache(self.connector, 'address', max_age_seconds=600, clock=self.clock)
+
+    def test_fetches_once_until_stale(self):
+        self.assertEqual(self.cache.get_balance(), 30000)
+        self.assertEqual(self.cache.get_balance(), 30000)
+        self.assertEqual(self.connector.calls, 1)
+        self.clock.now += 600
+        self.cache.get_spendables()
+        self.assertEqual(self.connector.calls, 2)
+        self.cache.get_spendables(refresh=True)
+        self.assertEqual(self.connector.calls, 3)
+
+    def test_chains_off_unconfirmed_change(self):
+        self.cache.get_spendables()
+        tx = spend([self.funding[0]], 9000)
+        self.cache.record_transaction(tx)
+        self.cache.record_transaction(tx)
+        spendables = self.cache.get_spendables()
+        self.assertEqual(sorted(s.coin_value for s in spendables), [9000, 20000])
+        change = [s for s in spendables if s.coin_value == 9000][0]
+        self.assertEqual((change.tx_hash, change.tx_out_index), (tx.hash(), 1))
+
+        next_tx = spend([change], 8000)
+        self.cache.record_transaction(next_tx)
+        self.assertEqual(sorted(s.coin_value for s in self.cache.get_spendables()), [8000, 20000])
+        self.assertEqual(self.connector.calls, 1)
+
+    def test_ignores_outputs_to_other_scripts(self):
+        self.cache.get_spendables()
+        tx = spend([self.funding[0]], 9000)
+        tx.txs_out[1].script = OTHER_SCRIPT
+        self.cache.record_transaction(tx)
+        self.assertEqual([s.coin_value for s in self.cache.get_spendables()], [20000])
+
+    def test_refresh_merges_local_spends(self):
+        self.cache.get_spendables()
+        tx = spend([self.funding[0]], 9000)
+        self.cache.record_transaction(tx)
+
+        # providers have not seen the transaction yet
+        self.assertEqual(sorted(s.coin_value for s in self.cache.get_spendables(refresh=True)), [9000, 20000])
+
+        # providers have seen it
+        change = Spendable(9000, SCRIPT, tx.hash(), 1)
+        self.connector.spendables = [self.funding[1], change]
+        self.assertEqual(sorted(s.coin_value for s in self.cache.get_spendables(refresh=True)), [9000, 20000])
+        self.assertEqual(self.cache.spent, {})
+        self.assertEqual(self.cache.unconfirmed, {})
+
+    def test_discard_transaction(self):
+        self.cache.get_spendables()
+        tx = spend([self.funding[0]], 9000)
+        self.cache.record_transaction(tx)
+        self.cache.discard_transaction(tx)
+        self.assertEqual(sorted(s.coin_value for s in self.cache.get_spendables()), [10000, 20000])
+
+    def test_offline_does_not_fetch(self):
+        self.cache.get_spendables()
+        self.clock.now += 600
+        self.assertEqual(self.cache.get_balance(), 30000)
+        self.assertEqual(len(self.cache.get_spendables(offline=True)), 2)
+        self.assertEqual(self.connector.calls, 2)
+        self.clock.now += 600
+        self.cache.get_spendables(offline=True)
+        self.assertEqual(self.connector.calls, 2)
+
+    def test_drops_change_never_reported(self):
+        self.cache.get_spendables()
+        self.cache.record_transaction(spend([self.funding[0]], 9000))
+        self.clock.now += utxo_cache.UNCONFIRMED_TTL_SECONDS
+        self.assertEqual([s.coin_value for s in self.cache.get_spendables()], [20000])
+
+
+class TestBitcoinTransactionHandlerCache(unittest.TestCase):
+    def setUp(self):
+        self.connector = CountingConnector([spendable(100000, 1), spendable(200000, 2)])
+        self.transaction_creator = mock.Mock()
+        self.transaction_creator.create_transaction.return_value.serialize.return_value = b'tx'
+        self.transaction_handler = BitcoinTransactionHandler(self.connector, BitcoinTransactionCostConstants(),
+                                                             mock.Mock(), 'address',
+                                                             transaction_creator=self.transaction_creator)
+
+    def test_one_fetch_per_batch_sequence(self):
+        with mock.patch('cert_issuer.transaction_handler.tx_utils'):
+            for _ in range(0, 5):
+                self.transaction_handler.ensure_balance()
+                self.transaction_handler.create_transaction(b'root')
+        self.assertEqual(self.connector.calls, 1)
+
+    def test_refetches_when_cache_cannot_cover_cost(self):
+        self.connector.spendables = [spendable(10000, 1)]
+        with self.assertRaises(InsufficientFundsError):
+            self.transaction_handler.ensure_balance()
+        self.assertEqual(self.connector.calls, 2)
+        self.connector.spendables.append(spendable(100000, 3))
+        self.transaction_handler.ensure_balance()
+        self.assertEqual(self.connector.calls, 3)
+
+    def test_records_broadcast_transactions(self):
+        self.connector.broadcast_tx = mock.Mock(return_value='txid')
+        self.transaction_handler.ensure_balance()
+        tx = spend([self.connector.spendables[0]], 40000)
+        self.assertEqual(self.transaction_handler.broadcast_signed_transaction(tx.as_hex()), 'txid')
+        self.assertEqual(self.transaction_handler.utxo_cache.get_balance(), 240000)
+        self.assertEqual(self.connector.calls, 1)
+
+
+class KeyInMemory(SecretManager):
+    def __init__(self, signer, wif):
+        super().__init__(signer)
+        self.key = wif
+        self.starts = 0
+
+    def start(self):
+        self.starts += 1
+        self.wif = self.key
+
+    def stop(self):
+        self.wif = None
+
+
+class TestSigningAhead(unittest.TestCase):
+    def setUp(self):
+        SelectParams('testnet')
+        key = Key(secret_exponent=0x1234567, netcode='XTN')
+        script = bytes(tx_utils.create_transaction_output(key.address(), 0).scriptPubKey)
+        self.connector = CountingConnector([Spendable(1000000, script, b'\x01' * 32, 0)])
+        self.secret_manager = KeyInMemory(BitcoinSigner(Chain.bitcoin_testnet), key.wif())
+        self.transaction_handler = BitcoinTransactionHandler(
+            self.connector, BitcoinTransactionCostConstants(recommended_tx_fee=0, satoshi_per_byte=10),
+            self.secret_manager, key.address())
+
+    def test_signs_chained_transactions_in_one_window(self):
+        self.transaction_handler.ensure_balance()
+        with mock.patch.object(BitcoinSigner, '_build_lookup', wraps=self.secret_manager.signer._build_lookup) as build:
+            signed = self.transaction_handler.create_signed_transactions([bytes([n]) * 32 for n in range(0, 3)])
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(self.secret_manager.starts, 1)
+
+        txs = [Tx.from_hex(signed_hextx) for signed_hextx in signed]
+        self.assertEqual(txs[0].txs_in[0].previous_hash, b'\x01' * 32)
+        for previous_tx, tx in zip(txs, txs[1:]):
+            self.assertEqual([(tx_in.previous_hash, tx_in.previous_index) for tx_in in tx.txs_in],
+                             [(previous_tx.hash(), 0)])
+        # nothing is fetched while the key window is open
+        self.assertEqual(self.connector.calls, 1)
+
+    def test_failed_signature_discards_the_others(self):
+        self.transaction_handler.ensure_balance()
+        with mock.patch('cert_issuer.transaction_handler.tx_utils.verify_transaction',
+                        side_effect=[None, Exception('mismatch')]):
+            with self.assertRaises(Exception):
+                self.transaction_handler.create_signed_transactions([b'\x00' * 32, b'\x01' * 32])
+        self.assertEqual([s.coin_value for s in self.transaction_handler.utxo_cache.get_spendables()], [1000000])
+
+    def test_rejected_broadcast_unspends_inputs(self):
+        self.transaction_handler.ensure_balance()
+        signed = self.transaction_handler.create_signed_transactions([b'\x00' * 32, b'\x01' * 32])
+        self.connector.broadcast_tx = mock.Mock(side_effect=TransactionRejectedError('rejected'))
+        with self.assertRaises(TransactionRejectedError):
+            self.transaction_handler.broadcast_signed_transaction(signed[0])
+        self.transaction_handler.discard_signed_transactions(signed[1:])
+        self.assertEqual([s.coin_value for s in self.transaction_handler.utxo_cache.get_spendables(refresh=True)],
+                         [1000000])
+        self.assertEqual(self.transaction_handler.utxo_cache.spent, {})
+        # the batch is signed again from the funded output
+        self.transaction_handler.ensure_balance()
+        resigned = Tx.from_hex(self.transaction_handler.create_signed_transaction(b'\x00' * 32))
+        self.assertEqual(resigned.txs_in[0].previous_hash, b'\x01' * 32)
+
+    def test_failed_broadcast_keeps_inputs_spent(self):
+        self.transaction_handler.ensure_balance()
+        signed = self.transaction_handler.create_signed_transactions([b'\x00' * 32])
+        self.connector.broadcast_tx = mock.Mock(side_effect=BroadcastError('timed out'))
+        with self.assertRaises(BroadcastError):
+            self.transaction_handler.broadcast_signed_transaction(signed[0])
+        # the transaction may have been sent, so its input is not spent by another
+        self.assertEqual(list(self.transaction_handler.utxo_cache.spent), [(b'\x01' * 32, 0)])
+
+if __name__ == '__main__':
+    unittest.main()
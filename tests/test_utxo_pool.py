@@ -0,0 +1,157 @@
+import threading
+import time
+import unittest
+
+import mock
+from bitcoin import SelectParams
+from pycoin.tx.Spendable import Spendable
+
+from cert_issuer import tx_utils, utxo_pool
+from cert_issuer.errors import InsufficientFundsError
+from cert_issuer.transaction_handler import BitcoinTransactionHandler
+from cert_issuer.tx_utils import BitcoinTransactionCostConstants
+from cert_issuer.utxo_cache import UtxoCache
+from cert_issuer.utxo_pool import UtxoPool
+
+ADDRESS = 'mgAqW5ZCnEp7fjvpj8RUL3WxsBy8rcDcCi'
+POOL_VALUE = 100000
+
+
+class FakeConnector(object):
+    def __init__(self, spendables):
+        self.spendables = spendables
+        self.fetches = 0
+        self.broadcast = []
+
+    def get_unspent_outputs(self, address):
+        self.fetches += 1
+        return list(self.spendables)
+
+    def broadcast_tx(self, tx):
+        self.broadcast.append(tx)
+        return tx.id()
+
+
+class TestUtxoPool(unittest.TestCase):
+    def setUp(self):
+        SelectParams('testnet')
+        self.script = bytes(tx_utils.create_transaction_output(ADDRESS, 0).scriptPubKey)
+        # 10 satoshi per byte, without the recommended fee floor
+        self.tx_cost_constants = BitcoinTransactionCostConstants(recommended_tx_fee=0, satoshi_per_byte=10)
+
+    def spendable(self, coin_value, number):
+        return Spendable(coin_value, self.script, bytes([number]) * 32, 0)
+
+    def test_create_split_transaction(self):
+        inputs = [self.spendable(1000000, 1)]
+        tx = utxo_pool.create_split_transaction(self.tx_cost_constants, ADDRESS, inputs, 5, POOL_VALUE)
+        values = [tx_out.nValue for tx_out in tx.vout]
+        # one input and six outputs: 149 + 6 * 34 + 10 bytes
+        self.assertEqual(values, [POOL_VALUE] * 5 + [1000000 - 5 * POOL_VALUE - 3630])
+        self.assertTrue(all(bytes(tx_out.scriptPubKey) == self.script for tx_out in tx.vout))
+
+        with self.assertRaises(InsufficientFundsError):
+            utxo_pool.create_split_transaction(self.tx_cost_constants, ADDRESS, inputs, 10, POOL_VALUE)
+
+    def test_select_split_inputs_creates_what_funds_allow(self):
+        spendables = [self.spendable(150000, 1), self.spendable(250000, 2), self.spendable(1000, 3)]
+        inputs, num_outputs = utxo_pool.select_split_inputs(spendables, self.tx_cost_constants, 3, POOL_VALUE)
+        self.assertEqual(([s.coin_value for s in inputs], num_outputs), ([250000, 150000], 3))
+        inputs, num_outputs = utxo_pool.select_split_inputs(spendables, self.tx_cost_constants, 10, POOL_VALUE)
+        self.assertEqual((len(inputs), num_outputs), (3, 3))
+        self.assertEqual(utxo_pool.select_split_inputs(spendables[2:], self.tx_cost_constants, 1, POOL_VALUE),
+                         ([], 0))
+
+    def test_acquire_reserves_distinct_outputs(self):
+        connector = FakeConnector([self.spendable(POOL_VALUE, number) for number in range(0, 8)] +
+                                  [self.spendable(500000, 100)])
+        pool = UtxoPool(UtxoCache(connector, ADDRESS), POOL_VALUE, 8)
+        acquired = []
+        threads = [threading.Thread(target=lambda: acquired.append(pool.acquire())) for _ in range(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(s.tx_hash for s in acquired)), 8)
+        self.assertIsNone(pool.acquire())
+        self.assertTrue(pool.needs_refill())
+
+        pool.release([(acquired[0].tx_hash, 0)])
+        self.assertEqual(pool.acquire().tx_hash, acquired[0].tx_hash)
+        self.assertEqual(pool.get_stats()['acquired'], 9)
+
+
+class TestPooledTransactionHandler(unittest.TestCase):
+    def setUp(self):
+        SelectParams('testnet')
+        script = bytes(tx_utils.create_transaction_output(ADDRESS, 0).scriptPubKey)
+        self.connector = FakeConnector([Spendable(2000000, script, b'\x01' * 32, 0)])
+        tx_cost_constants = BitcoinTransactionCostConstants(recommended_tx_fee=0, satoshi_per_byte=10)
+        cache = UtxoCache(self.connector, ADDRESS)
+        self.pool = UtxoPool(cache, POOL_VALUE, 4, refill_threshold=2)
+        self.transaction_handler = BitcoinTransactionHandler(self.connector, tx_cost_constants, mock.Mock(), ADDRESS,
+                                                             utxo_cache=cache, utxo_pool=self.pool)
+        # the transactions are broadcast unsigned to the fake connector
+        patcher = mock.patch.object(BitcoinTransactionHandler, 'sign_transaction', lambda handler, tx: tx)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for_refills(self, refills):
+        deadline = time.monotonic() + 5
+        while self.pool.refills < refills or self.transaction_handler.refill_lock.locked():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_batches_spend_independent_pool_outputs(self):
+        self.transaction_handler.ensure_balance()
+        self.assertEqual(self.pool.refills, 1)
+        self.assertEqual(self.pool.get_available_count(), 4)
+
+        signed = []
+        threads = [threading.Thread(target=lambda number=number: signed.append(
+            self.transaction_handler.create_signed_transaction(bytes([number]) * 32))) for number in range(0, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for signed_hextx in signed:
+            self.transaction_handler.broadcast_signed_transaction(signed_hextx)
+
+        split_tx = self.connector.broadcast[0]
+        spent = [(tx.txs_in[0].previous_hash, tx.txs_in[0].previous_index) for tx in self.connector.broadcast[1:4]]
+        self.assertTrue(all(len(tx.txs_in) == 1 for tx in self.connector.broadcast[1:4]))
+        self.assertEqual(len(set(spent)), 3)
+        self.assertTrue(all(previous_hash == split_tx.hash() for previous_hash, _ in spent))
+
+        # one pool output is left, below the threshold, so the pool is refilled from the split's change
+        self.wait_for_refills(2)
+        refill_tx = self.connector.broadcast[4]
+        self.assertEqual([tx_in.previous_hash for tx_in in refill_tx.txs_in], [split_tx.hash()])
+        self.assertEqual(self.pool.get_available_count(), 4)
+        self.assertEqual(self.connector.fetches, 1)
+
+    def test_refill_before_next_batch_without_background_refill(self):
+        self.pool.background_refill = False
+        self.transaction_handler.ensure_balance()
+        for number in range(0, 3):
+            self.transaction_handler.broadcast_signed_transaction(
+                self.transaction_handler.create_signed_transaction(bytes([number]) * 32))
+        self.assertEqual(self.pool.refills, 1)
+        self.assertFalse(any(thread.name == 'utxo-pool-refill' for thread in threading.enumerate()))
+
+        self.transaction_handler.ensure_balance()
+        self.assertEqual(self.pool.refills, 2)
+        self.assertEqual(self.pool.get_available_count(), 4)
+
+    def test_failed_broadcast_releases_pool_output(self):
+        self.transaction_handler.ensure_balance()
+        signed_hextx = self.transaction_handler.create_signed_transaction(b'\x00' * 32)
+        self.assertEqual(self.pool.get_available_count(), 3)
+        with mock.patch.object(self.connector, 'broadcast_tx', side_effect=Exception('rejected')):
+            with self.assertRaises(Exception):
+                self.transaction_handler.broadcast_signed_transaction(signed_hextx)
+        self.assertEqual(len(self.pool.reserved), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()